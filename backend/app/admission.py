@@ -0,0 +1,232 @@
+# app/admission.py
+
+import asyncio
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.metrics import CallbackGauge, Counter, Labels, registry
+
+# Long-lived routes (long-polls and streams) and probes are not limited,
+# they would hold a slot for minutes or be refused under load
+UNLIMITED_ROUTES = frozenset(
+    {
+        "/healthchecker",
+        "/readiness",
+        "/changes",
+        "/availability/stream",
+    }
+)
+
+
+def route_class(
+    method: str,
+    path: str,
+    prefix: str = "/api/v1",
+) -> Optional[str]:
+    """
+    Get the class of a request, which decides its concurrency limit:
+    `checkout` (creating carts), `pricing` (price calculations) or
+    `reads` (the other GET requests of the API).
+
+    Args:
+        method (str): The method of the request.
+        path (str): The path of the request.
+        prefix (str): The prefix of the API routes.
+
+    Returns:
+        Optional[str]: The class, None for requests that are not limited.
+    """
+    if not path.startswith(prefix):
+        return None
+    route: str = path.removeprefix(prefix).rstrip("/")
+
+    if method == "POST" and route == "/carts":
+        return "checkout"
+    if method == "POST" and route == "/calculate-price":
+        return "pricing"
+    if method in ("GET", "HEAD") and route not in UNLIMITED_ROUTES:
+        return "reads"
+
+    return None
+
+
+class AdmissionLimiter:
+    """
+    Admits at most `limit` requests at a time. The next `queue_size`
+    ones wait for a slot, first come first served, for `queue_timeout`
+    seconds at most; the others are refused at once.
+
+    A released slot is handed over to the first waiting request, so a
+    request arriving later cannot take it first. It is used from the
+    event loop only, so it takes no lock.
+
+    Args:
+        limit (int): The requests admitted at a time.
+        queue_size (int): The requests waiting for a slot.
+        queue_timeout (float): Seconds a request waits for a slot.
+
+    Attributes:
+        active (int): The requests admitted and not finished.
+    """
+
+    def __init__(
+        self,
+        limit: int,
+        queue_size: int,
+        queue_timeout: float,
+    ) -> None:
+        self.limit: int = limit
+        self.queue_size: int = queue_size
+        self.queue_timeout: float = queue_timeout
+        self.active: int = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> bool:
+        """
+        Wait for a slot.
+
+        Returns:
+            bool: True once admitted, False if the request is refused.
+        """
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return True
+        if len(self._waiters) >= self.queue_size or self.queue_timeout <= 0:
+            return False
+
+        loop = asyncio.get_running_loop()
+        waiter: asyncio.Future = loop.create_future()
+        self._waiters.append(waiter)
+
+        def expire() -> None:
+            if not waiter.done():
+                waiter.set_result(False)
+                self._waiters.remove(waiter)
+
+        timer = loop.call_later(self.queue_timeout, expire)
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            # The client left, or the server is stopping
+            if waiter.cancelled():
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+            elif waiter.result():
+                self.release()
+            raise
+        finally:
+            timer.cancel()
+
+    def release(self) -> None:
+        """
+        Free a slot, handing it over to the first waiting request.
+
+        Returns:
+            None
+        """
+        while self._waiters:
+            waiter: asyncio.Future = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+
+        self.active -= 1
+
+
+_limiters: Dict[str, AdmissionLimiter] = {}
+
+
+def _admission_requests() -> Dict[Labels, float]:
+    values: Dict[Labels, float] = {}
+    for name, limiter in _limiters.items():
+        values[(name, "active")] = float(limiter.active)
+        values[(name, "queued")] = float(limiter.queued)
+        values[(name, "limit")] = float(limiter.limit)
+
+    return values
+
+
+registry.register(
+    CallbackGauge(
+        "admission_requests",
+        "Requests admitted and waiting for a slot, per class of routes.",
+        _admission_requests,
+        labelnames=("class", "state"),
+    )
+)
+ADMISSION_REJECTED: Counter = registry.register(
+    Counter(
+        "admission_rejected_total",
+        "Requests refused because their class of routes was saturated.",
+        labelnames=("class",),
+    )
+)
+
+
+class AdmissionMiddleware:
+    """
+    Limit the requests handled at a time per class of routes (see
+    `route_class`), so a burst of checkouts cannot take every worker
+    thread and database connection from the catalog reads.
+
+    Requests over the limit wait in a bounded queue; when it is full, or
+    the wait times out, they get a `503` with a `Retry-After` header
+    right away instead of timing out later.
+
+    Args:
+        app (ASGIApp): The application.
+        limiters (Dict[str, AdmissionLimiter]): The limiter of each class,
+            classes without one are not limited.
+        retry_after (int): Seconds the refused clients should wait.
+        prefix (str): The prefix of the API routes.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        limiters: Dict[str, AdmissionLimiter],
+        retry_after: int = 1,
+        prefix: str = "/api/v1",
+    ) -> None:
+        self.app: ASGIApp = app
+        self.limiters: Dict[str, AdmissionLimiter] = limiters
+        self.retry_after: int = retry_after
+        self.prefix: str = prefix
+        _limiters.clear()
+        _limiters.update(limiters)
+
+    async def __call__(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+    ) -> None:
+        name: Optional[str] = None
+        if scope["type"] == "http":
+            name = route_class(scope["method"], scope["path"], self.prefix)
+        limiter: Optional[AdmissionLimiter] = self.limiters.get(name or "")
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not await limiter.acquire():
+            ADMISSION_REJECTED.inc(name)
+            response = JSONResponse(
+                {"detail": f"Too many {name} requests, retry later."},
+                status_code=503,
+                headers={"Retry-After": str(self.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
@@ -0,0 +1,471 @@
+# app/api/availability.py
+
+import asyncio
+import contextvars
+import logging
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    FrozenSet,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+from uuid import UUID
+
+import orjson
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Engine
+from sqlmodel import Session, col, select
+
+from app.api.changes import UPSERT, change_notifier, read_changes
+from app.api.models import PartVariant, Product, ProductPart
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Changes read from the log at once by the broadcaster
+READ_LIMIT = 1000
+
+# Comment lines keep idle connections open through proxies
+KEEPALIVE_FRAME = b": keepalive\n\n"
+
+
+class AvailabilityUpdate(NamedTuple):
+    """
+    The availability of a product or a variant after a write.
+
+    Attributes:
+        seq (int): The position of the write in the change log.
+        kind (str): "products" or "variants".
+        id (UUID): The ID of the product or variant.
+        product_id (UUID): The product it belongs to.
+        is_available (bool): Whether it is available.
+        stock_quantity (int): The quantity in stock.
+    """
+
+    seq: int
+    kind: str
+    id: UUID
+    product_id: UUID
+    is_available: bool
+    stock_quantity: int
+
+
+def availability_frame(batch: Dict[str, Dict[str, Any]]) -> bytes:
+    """
+    Encode a batch of availabilities as a Server-Sent Event.
+
+    Args:
+        batch (Dict[str, Dict[str, Any]]): The `products` and `variants`
+            availabilities, by ID.
+
+    Returns:
+        bytes: The event.
+    """
+    return b"event: availability\ndata: " + orjson.dumps(batch) + b"\n\n"
+
+
+def read_availability(
+    session: Session,
+    product_ids: FrozenSet[UUID],
+) -> Optional[Tuple[int, Dict[str, Dict[str, Any]]]]:
+    """
+    Read the current availability of products and their variants from the
+    database, the first event sent to a subscriber, with the position of
+    the change log it is up to date with.
+
+    The position is read first: the changes up to it were committed with
+    their rows, which the next reads see. Later changes may show as well,
+    they are sent again once the subscriber follows the log from there.
+
+    Args:
+        session (Session): The database session.
+        product_ids (FrozenSet[UUID]): The products.
+
+    Returns:
+        Optional[Tuple[int, Dict[str, Dict[str, Any]]]]: The position and
+            the `products` and `variants` availabilities by ID, None if a
+            product is not found.
+    """
+    position, _ = read_changes(session, None, 0)
+    try:
+        products: List[Tuple[UUID, bool, int]] = list(
+            session.exec(
+                select(
+                    Product.id,
+                    Product.is_available,
+                    Product.stock_quantity,
+                ).where(col(Product.id).in_(product_ids))
+            ).all()
+        )
+        if len(products) != len(product_ids):
+            return None
+        variants: List[Tuple[UUID, UUID, bool, int]] = list(
+            session.exec(
+                select(
+                    PartVariant.id,
+                    ProductPart.product_id,
+                    PartVariant.is_available,
+                    PartVariant.stock_quantity,
+                )
+                .join(ProductPart)
+                .where(col(ProductPart.product_id).in_(product_ids))
+            ).all()
+        )
+    finally:
+        session.rollback()
+
+    batch: Dict[str, Dict[str, Any]] = {"products": {}, "variants": {}}
+    for product_id, is_available, stock_quantity in products:
+        batch["products"][str(product_id)] = {
+            "is_available": is_available,
+            "stock_quantity": stock_quantity,
+        }
+    for variant_id, product_id, is_available, stock_quantity in variants:
+        batch["variants"][str(variant_id)] = {
+            "product_id": str(product_id),
+            "is_available": is_available,
+            "stock_quantity": stock_quantity,
+        }
+
+    return position, batch
+
+
+class Subscriber:
+    """
+    A client of the broadcaster: the products it follows, the first event
+    it is sent and the updates not sent yet, the latest one per product
+    or variant.
+
+    Updates are skipped when they are older than the last one of their
+    product or variant (the log is read again to catch up), or when they
+    do not change the availability the client last got.
+
+    Args:
+        product_ids (FrozenSet[UUID]): The products followed.
+        snapshot (Optional[Dict[str, Dict[str, Any]]]): The first event,
+            see `read_availability`.
+        since (int): The position of the change log the snapshot is up to
+            date with.
+
+    Attributes:
+        product_ids (FrozenSet[UUID]): The products followed.
+        snapshot (Dict[str, Dict[str, Any]]): The first event.
+        since (int): The position the updates are followed from.
+        pending (Dict[str, Dict[str, Any]]): The updates to send.
+        ready (asyncio.Event): Set when there are updates to send.
+    """
+
+    __slots__ = (
+        "product_ids",
+        "snapshot",
+        "since",
+        "pending",
+        "ready",
+        "_latest",
+    )
+
+    def __init__(
+        self,
+        product_ids: FrozenSet[UUID],
+        snapshot: Optional[Dict[str, Dict[str, Any]]] = None,
+        since: int = 0,
+    ) -> None:
+        self.product_ids: FrozenSet[UUID] = product_ids
+        self.snapshot: Dict[str, Dict[str, Any]] = snapshot or {
+            "products": {},
+            "variants": {},
+        }
+        self.since: int = since
+        self.pending: Dict[str, Dict[str, Any]] = {
+            "products": {},
+            "variants": {},
+        }
+        self.ready: asyncio.Event = asyncio.Event()
+        # The position and the availability last sent of each ID
+        self._latest: Dict[str, Tuple[int, bool, int]] = {
+            row_id: (since, row["is_available"], row["stock_quantity"])
+            for rows in self.snapshot.values()
+            for row_id, row in rows.items()
+        }
+
+    def add(self, update: AvailabilityUpdate) -> None:
+        row_id: str = str(update.id)
+        latest: Optional[Tuple[int, bool, int]] = self._latest.get(row_id)
+        if update.seq <= (latest[0] if latest else self.since):
+            return
+        self._latest[row_id] = (
+            update.seq,
+            update.is_available,
+            update.stock_quantity,
+        )
+        if latest is not None and latest[1:] == (
+            update.is_available,
+            update.stock_quantity,
+        ):
+            return
+
+        fields: Dict[str, Any] = {
+            "is_available": update.is_available,
+            "stock_quantity": update.stock_quantity,
+        }
+        if update.kind == "variants":
+            fields = {"product_id": str(update.product_id), **fields}
+        # A newer update replaces the pending one
+        self.pending[update.kind][row_id] = fields
+        self.ready.set()
+
+    def drain(self) -> Dict[str, Dict[str, Any]]:
+        batch: Dict[str, Dict[str, Any]] = self.pending
+        self.pending = {"products": {}, "variants": {}}
+        self.ready.clear()
+
+        return batch
+
+
+class AvailabilityBroadcaster:
+    """
+    Push the stock and availability changes of products, and of their
+    variants, to the subscribers following them.
+
+    A single task per worker follows the change log (woken by the writes
+    of this worker, polling for those of the others) and fans the changes
+    out to the subscribers of each product. A subscriber joins at the
+    position of its snapshot, and the changes the task read past it are
+    read again for it alone. Subscribers cost an event and their last
+    values while idle, and the updates made while one is waiting to be
+    sent are merged (the latest value wins) and sent together after
+    `coalesce` seconds. The task runs while there are subscribers.
+
+    Args:
+        engine (Engine): The database engine the change log is read from.
+        poll_interval (float): Seconds between two reads of the log.
+        coalesce (float): Seconds updates are gathered before being sent.
+        keepalive (float): Seconds of silence before a keepalive comment.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        poll_interval: float = 1.0,
+        coalesce: float = 0.1,
+        keepalive: float = 15.0,
+    ) -> None:
+        self.engine: Engine = engine
+        self.poll_interval: float = poll_interval
+        self.coalesce: float = coalesce
+        self.keepalive: float = keepalive
+        self._subscribers: Dict[UUID, Set[Subscriber]] = {}
+        # The position of the change log the task has published up to
+        self._position: Optional[int] = None
+        self._task: Optional["asyncio.Task[None]"] = None
+        self._started: Optional[asyncio.Event] = None
+
+    @property
+    def subscriber_count(self) -> int:
+        return len({s for subs in self._subscribers.values() for s in subs})
+
+    async def subscribe(
+        self,
+        product_ids: FrozenSet[UUID],
+        snapshot: Optional[Dict[str, Dict[str, Any]]] = None,
+        since: int = 0,
+    ) -> Subscriber:
+        """
+        Follow products from a position of the change log, starting the
+        change log task if needed.
+
+        Returns once the subscriber has caught up with the task, so no
+        update made after `since` is missed (unless the log cannot be
+        read).
+
+        Args:
+            product_ids (FrozenSet[UUID]): The products to follow.
+            snapshot (Optional[Dict[str, Dict[str, Any]]]): Their current
+                availability, see `read_availability`.
+            since (int): The position of the change log of the snapshot.
+
+        Returns:
+            Subscriber: The subscriber, to pass to `events`.
+        """
+        subscriber = Subscriber(product_ids, snapshot, since)
+        for product_id in product_ids:
+            self._subscribers.setdefault(product_id, set()).add(subscriber)
+
+        loop = asyncio.get_running_loop()
+        task: Optional["asyncio.Task[None]"] = self._task
+        if task is None or task.done() or task.get_loop() is not loop:
+            self._position = None
+            self._started = asyncio.Event()
+            # A fresh context: the task outlives the request starting it
+            self._task = loop.create_task(
+                self._run(self._started),
+                context=contextvars.Context(),
+            )
+        assert self._started is not None
+        await self._started.wait()
+
+        # The task publishes the changes after its position to the
+        # subscriber, those before it are read again
+        position: Optional[int] = self._position
+        if position is not None and position > since:
+            await self._catch_up(subscriber, position)
+
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        for product_id in subscriber.product_ids:
+            subscribers = self._subscribers.get(product_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[product_id]
+
+    def publish(self, updates: List[AvailabilityUpdate]) -> None:
+        """
+        Send updates to the subscribers of their products.
+
+        Args:
+            updates (List[AvailabilityUpdate]): The updates, oldest first.
+
+        Returns:
+            None
+        """
+        for update in updates:
+            for subscriber in self._subscribers.get(update.product_id, ()):
+                subscriber.add(update)
+
+    async def events(self, subscriber: Subscriber) -> AsyncIterator[bytes]:
+        """
+        Stream the events of a subscriber: its snapshot, then its batches
+        of updates, until the client disconnects.
+
+        Args:
+            subscriber (Subscriber): The subscriber.
+
+        Yields:
+            bytes: Server-Sent Events.
+        """
+        try:
+            yield availability_frame(subscriber.snapshot)
+            while True:
+                try:
+                    await asyncio.wait_for(
+                        subscriber.ready.wait(),
+                        self.keepalive,
+                    )
+                except asyncio.TimeoutError:
+                    yield KEEPALIVE_FRAME
+                    continue
+
+                await asyncio.sleep(self.coalesce)
+                yield availability_frame(subscriber.drain())
+        finally:
+            self.unsubscribe(subscriber)
+
+    async def close(self) -> None:
+        """
+        Stop the change log task.
+
+        Returns:
+            None
+        """
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _run(self, started: asyncio.Event) -> None:
+        position: Optional[int] = None
+        while self._subscribers or position is None:
+            generation: int = change_notifier.generation
+            try:
+                position, updates, more = await run_in_threadpool(
+                    self._read,
+                    position,
+                )
+            except Exception:
+                logger.exception("Reading the change log failed")
+                # Subscribers are not kept waiting while it is unreadable
+                started.set()
+                await asyncio.sleep(self.poll_interval)
+                continue
+
+            started.set()
+            self.publish(updates)
+            self._position = position
+            if not more:
+                await change_notifier.wait(generation, self.poll_interval)
+
+    async def _catch_up(self, subscriber: Subscriber, until: int) -> None:
+        since: int = subscriber.since
+        try:
+            while since < until:
+                since, updates, more = await run_in_threadpool(
+                    self._read,
+                    since,
+                )
+                for update in updates:
+                    if update.seq <= until and (
+                        update.product_id in subscriber.product_ids
+                    ):
+                        subscriber.add(update)
+                if not more:
+                    break
+        except Exception:
+            logger.exception("Reading the change log failed")
+
+    def _read(
+        self,
+        since: Optional[int],
+    ) -> Tuple[int, List[AvailabilityUpdate], bool]:
+        with Session(self.engine) as session:
+            position, changes = read_changes(session, since, READ_LIMIT)
+            rows: List[Tuple[int, str, Dict[str, Any]]] = [
+                (change.seq or 0, change.entity, orjson.loads(change.data))
+                for change in changes
+                if change.op == UPSERT
+                and change.data is not None
+                and change.entity in ("products", "part_variants")
+            ]
+
+            variants: List[Dict[str, Any]] = [
+                row for _, entity, row in rows if entity == "part_variants"
+            ]
+            part_ids: Set[str] = {row["part_id"] for row in variants}
+            products: Dict[UUID, UUID] = {}
+            if part_ids:
+                products = dict(
+                    session.exec(
+                        select(ProductPart.id, ProductPart.product_id).where(
+                            col(ProductPart.id).in_(map(UUID, part_ids))
+                        )
+                    ).all()
+                )
+
+        updates: List[AvailabilityUpdate] = []
+        for seq, entity, row in rows:
+            row_id: UUID = UUID(row["id"])
+            if entity == "products":
+                product_id: Optional[UUID] = row_id
+            else:
+                product_id = products.get(UUID(row["part_id"]))
+            if product_id is not None:
+                updates.append(
+                    AvailabilityUpdate(
+                        seq,
+                        "products" if entity == "products" else "variants",
+                        row_id,
+                        product_id,
+                        row["is_available"],
+                        row["stock_quantity"],
+                    )
+                )
+
+        return position, updates, len(changes) == READ_LIMIT
@@ -0,0 +1,194 @@
+# app/api/cache.py
+
+import logging
+import threading
+import time
+import uuid
+from typing import Any, Hashable, List, Optional, Set
+
+import orjson
+
+from app.api.changes import change_notifier
+from app.cache_backend import CacheBackend, CacheBackendError, MemoryBackend
+from app.config import settings
+from app.coalescing import CoalescingCache, LRUCache, SingleFlight
+from app.metrics import register_cache
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Serialised catalog pages, shared by every request of this worker
+catalog_cache: CoalescingCache = CoalescingCache(
+    ttl=settings.CATALOG_CACHE_TTL,
+)
+
+register_cache("catalog", catalog_cache)
+
+# Rows read by the get_*_by_id services, keyed by table and ID
+entity_cache: LRUCache = LRUCache(
+    maxsize=settings.ENTITY_CACHE_SIZE,
+    ttl=settings.ENTITY_CACHE_TTL,
+)
+
+register_cache("entity", entity_cache)
+
+# Concurrent identical price calculations share one database round trip
+price_flight: SingleFlight = SingleFlight()
+
+# The channel of the invalidations broadcast between workers
+INVALIDATION_CHANNEL = "bike-shop:catalog:invalidations"
+
+# Tells the invalidations of this worker from the ones of the others
+WORKER_ID: str = uuid.uuid4().hex
+
+_backend: CacheBackend = MemoryBackend()
+
+
+def use_backend(backend: Optional[CacheBackend]) -> None:
+    """
+    Broadcast the invalidations of this worker through a cache backend,
+    and apply the ones broadcast by the other workers.
+
+    Args:
+        backend (Optional[CacheBackend]): The backend shared with the
+            other workers, or None to stop sharing invalidations.
+
+    Returns:
+        None
+    """
+    global _backend
+    _backend = backend if backend is not None else MemoryBackend()
+    _backend.subscribe(
+        INVALIDATION_CHANNEL,
+        _apply_invalidation,
+        on_connect=_drop_all,
+    )
+
+
+def invalidate_catalog(*keys: Hashable) -> None:
+    """
+    Drop every cached catalog entry and the cached rows written, and wake
+    the requests waiting for catalog changes, in this worker and then in
+    the others.
+
+    Called by the services after any write that changes products, parts,
+    variants, dependencies or custom prices.
+
+    Args:
+        *keys (Hashable): The keys of the rows in `entity_cache` changed
+            by the write.
+
+    Returns:
+        None
+    """
+    catalog_cache.invalidate()
+    if keys:
+        entity_cache.invalidate(*keys)
+    change_notifier.notify()
+
+    message: bytes = orjson.dumps(
+        {
+            "origin": WORKER_ID,
+            # Keys are (table, UUID) pairs
+            "keys": [[table, str(value)] for table, value in keys],
+        }
+    )
+    try:
+        _backend.publish(INVALIDATION_CHANNEL, message)
+    except CacheBackendError:
+        # The other workers catch up when their entries expire
+        logger.warning(
+            "Could not broadcast a catalog invalidation",
+            exc_info=True,
+        )
+
+
+def _apply_invalidation(message: bytes) -> None:
+    data: Any = orjson.loads(message)
+    if data["origin"] == WORKER_ID:
+        return
+
+    keys: List[Hashable] = [
+        (table, uuid.UUID(value)) for table, value in data.get("keys", ())
+    ]
+    catalog_cache.invalidate()
+    if keys:
+        entity_cache.invalidate(*keys)
+    change_notifier.notify()
+
+
+def _drop_all() -> None:
+    # Invalidations broadcast while disconnected were missed
+    catalog_cache.invalidate()
+    entity_cache.clear()
+    change_notifier.notify()
+
+
+class DeferredInvalidation:
+    """
+    Invalidate the catalog for writes that can be shown a little late,
+    i.e. the stock taken by checkouts: their keys are collected and
+    invalidated together, at most once every `interval` seconds.
+
+    The first write after a quiet interval is invalidated right away, the
+    ones following it at the end of the interval, so a burst of checkouts
+    rebuilds the read model of every worker once per interval instead of
+    once per cart.
+
+    Args:
+        interval (float): Seconds between two invalidations, 0 to
+            invalidate every write right away.
+    """
+
+    def __init__(self, interval: float) -> None:
+        self.interval: float = interval
+        self._lock: threading.Lock = threading.Lock()
+        self._keys: Set[Hashable] = set()
+        self._timer: Optional[threading.Timer] = None
+        self._last: float = float("-inf")
+
+    def add(self, *keys: Hashable) -> None:
+        """
+        Invalidate the rows of a write, now or at the end of the interval.
+
+        Args:
+            *keys (Hashable): The keys of the rows in `entity_cache`.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._keys.update(keys)
+            if self._timer is not None:
+                return
+            delay: float = self._last + self.interval - time.monotonic()
+            if delay > 0:
+                self._timer = threading.Timer(delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+                return
+
+        self.flush()
+
+    def flush(self) -> None:
+        """
+        Invalidate the rows collected so far, i.e. on shutdown.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            keys: Set[Hashable] = self._keys
+            self._keys = set()
+            self._last = time.monotonic()
+
+        if keys:
+            invalidate_catalog(*keys)
+
+
+# The stock taken by the checkouts of this worker
+stock_invalidations: DeferredInvalidation = DeferredInvalidation(
+    settings.STOCK_INVALIDATION_INTERVAL,
+)
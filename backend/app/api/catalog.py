@@ -0,0 +1,619 @@
+# app/api/catalog.py
+
+import sys
+from datetime import datetime
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    TypeVar,
+)
+from uuid import UUID
+
+from sqlmodel import Session, select
+
+from app.api.cache import catalog_cache
+from app.api.models import (
+    CustomPrice,
+    PartVariant,
+    Product,
+    ProductPart,
+    VariantDependency,
+)
+from app.tracing import traced
+
+if TYPE_CHECKING:
+    from app.api.snapshot import SnapshotStore
+
+T = TypeVar("T")
+
+# Values memoised per catalog version, see `Catalog.memo`
+MEMO_SIZE = 256
+
+_MISSING = object()
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    # Names and categories repeat a lot (i.e. "Frame", "Bicycle")
+    return sys.intern(value) if value is not None else None
+
+
+def _restricted_ids(dependencies: Sequence[Optional[str]]) -> List[str]:
+    # Restrictions are comma separated variant ids
+    return [
+        token.strip().lower()
+        for restrictions in dependencies
+        for token in (restrictions or "").split(",")
+    ]
+
+
+def _isoformat(value: datetime) -> str:
+    # Same format as pydantic, which writes UTC as "Z"
+    text: str = value.isoformat()
+
+    return text[:-6] + "Z" if text.endswith("+00:00") else text
+
+
+class VariantRecord:
+    """
+    A part variant of the catalog read model.
+
+    Variants reference each other by their index in `Catalog.variants`
+    rather than by UUID.
+
+    Attributes:
+        index (int): The position of the variant in the catalog.
+        custom_prices (Tuple[Tuple[int, float], ...]): The index of each
+            dependent variant and the price added when both are selected.
+        dependencies (Tuple[Optional[str], ...]): The restrictions of each
+            dependency of the variant.
+    """
+
+    __slots__ = (
+        "index",
+        "id",
+        "part_id",
+        "name",
+        "price",
+        "is_available",
+        "stock_quantity",
+        "created_at",
+        "updated_at",
+        "dependencies",
+        "custom_prices",
+    )
+
+    def __init__(
+        self,
+        index: int,
+        id: UUID,
+        part_id: UUID,
+        name: str,
+        price: float,
+        is_available: bool,
+        stock_quantity: int,
+        created_at: datetime,
+        updated_at: datetime,
+        dependencies: Tuple[Optional[str], ...],
+        custom_prices: Tuple[Tuple[int, float], ...],
+    ) -> None:
+        self.index: int = index
+        self.id: UUID = id
+        self.part_id: UUID = part_id
+        self.name: Optional[str] = _intern(name)
+        self.price: float = price
+        self.is_available: bool = is_available
+        self.stock_quantity: int = stock_quantity
+        self.created_at: datetime = created_at
+        self.updated_at: datetime = updated_at
+        self.dependencies: Tuple[Optional[str], ...] = dependencies
+        self.custom_prices: Tuple[Tuple[int, float], ...] = custom_prices
+
+
+class PartRecord:
+    """
+    A product part of the catalog read model.
+
+    Attributes:
+        variants (Tuple[int, ...]): The indexes of the variants of the
+            part in `Catalog.variants`.
+    """
+
+    __slots__ = (
+        "id",
+        "product_id",
+        "name",
+        "created_at",
+        "updated_at",
+        "variants",
+    )
+
+    def __init__(
+        self,
+        id: UUID,
+        product_id: UUID,
+        name: str,
+        created_at: datetime,
+        updated_at: datetime,
+        variants: Tuple[int, ...],
+    ) -> None:
+        self.id: UUID = id
+        self.product_id: UUID = product_id
+        self.name: Optional[str] = _intern(name)
+        self.created_at: datetime = created_at
+        self.updated_at: datetime = updated_at
+        self.variants: Tuple[int, ...] = variants
+
+
+class ProductRecord:
+    """
+    A product of the catalog read model.
+
+    Attributes:
+        parts (Tuple[PartRecord, ...]): The parts of the product.
+    """
+
+    __slots__ = (
+        "id",
+        "name",
+        "description",
+        "category",
+        "base_price",
+        "is_custom",
+        "is_available",
+        "stock_quantity",
+        "created_at",
+        "updated_at",
+        "parts",
+    )
+
+    def __init__(
+        self,
+        id: UUID,
+        name: str,
+        description: Optional[str],
+        category: str,
+        base_price: float,
+        is_custom: bool,
+        is_available: bool,
+        stock_quantity: int,
+        created_at: datetime,
+        updated_at: datetime,
+        parts: Tuple[PartRecord, ...],
+    ) -> None:
+        self.id: UUID = id
+        self.name: Optional[str] = _intern(name)
+        self.description: Optional[str] = description
+        self.category: Optional[str] = _intern(category)
+        self.base_price: float = base_price
+        self.is_custom: bool = is_custom
+        self.is_available: bool = is_available
+        self.stock_quantity: int = stock_quantity
+        self.created_at: datetime = created_at
+        self.updated_at: datetime = updated_at
+        self.parts: Tuple[PartRecord, ...] = parts
+
+
+class Catalog:
+    """
+    An immutable, compact copy of the whole catalog, built with one query
+    per table and shared by every request until the catalog changes.
+
+    Records are slotted objects rather than ORM instances, so they carry
+    no identity map or attribute instrumentation, and variants refer to
+    each other by small integers. The `*_dict` methods render records in
+    the shape of the API schemas, ready to be encoded as JSON.
+
+    Attributes:
+        version (int): The catalog generation the copy was built from,
+            it changes whenever the catalog is written to.
+        products (Sequence[ProductRecord]): Every product, in the order
+            the database returns them.
+        parts (Sequence[PartRecord]): Every product part.
+        variants (Sequence[VariantRecord]): Every part variant, the
+            position of a variant is its index.
+        last_modified (Optional[datetime]): The latest `updated_at` of
+            the catalog rows, None when the catalog is empty.
+    """
+
+    __slots__ = (
+        "version",
+        "products",
+        "parts",
+        "variants",
+        "last_modified",
+        "_product_index",
+        "_variant_index",
+        "_memo",
+    )
+
+    def __init__(
+        self,
+        version: int,
+        products: Sequence[ProductRecord],
+        parts: Sequence[PartRecord],
+        variants: Sequence[VariantRecord],
+        last_modified: Optional[datetime] = None,
+    ) -> None:
+        self.version: int = version
+        self.products: Sequence[ProductRecord] = products
+        self.parts: Sequence[PartRecord] = parts
+        self.variants: Sequence[VariantRecord] = variants
+        self.last_modified: Optional[datetime] = last_modified
+        self._product_index: Dict[UUID, ProductRecord] = {
+            product.id: product for product in products
+        }
+        self._variant_index: Dict[UUID, int] = {
+            variant.id: variant.index for variant in variants
+        }
+        self._memo: Dict[Hashable, Any] = {}
+
+    @classmethod
+    @traced
+    def load(cls, session: Session, version: int = 0) -> "Catalog":
+        """
+        Read the whole catalog with one query per table.
+
+        On Postgres the queries run in a read-only REPEATABLE READ
+        transaction of their own, so they all see the same snapshot: a
+        write committed while the tables are read (i.e. a variant added
+        with its custom prices) is seen by every query or by none.
+
+        Args:
+            session (Session): The database session.
+            version (int): The catalog generation being loaded.
+
+        Returns:
+            Catalog: The read model.
+        """
+        bind: Any = session.get_bind()
+        if bind.dialect.name != "postgresql":
+            return cls._read(session, version)
+
+        snapshot: Any = bind.execution_options(
+            isolation_level="REPEATABLE READ",
+            postgresql_readonly=True,
+        )
+        with Session(snapshot) as snapshot_session:
+            return cls._read(snapshot_session, version)
+
+    @classmethod
+    def _read(cls, session: Session, version: int) -> "Catalog":
+        variant_rows: Sequence[Any] = session.exec(
+            select(
+                PartVariant.id,
+                PartVariant.part_id,
+                PartVariant.name,
+                PartVariant.price,
+                PartVariant.is_available,
+                PartVariant.stock_quantity,
+                PartVariant.created_at,
+                PartVariant.updated_at,
+            )
+        ).all()
+        variant_index: Dict[UUID, int] = {
+            row[0]: index for index, row in enumerate(variant_rows)
+        }
+
+        # The `updated_at` of every row, for `last_modified`
+        updates: List[datetime] = []
+
+        dependencies: Dict[UUID, List[Optional[str]]] = {}
+        for variant_id, restrictions, updated_at in session.exec(
+            select(
+                VariantDependency.variant_id,
+                VariantDependency.restrictions,
+                VariantDependency.updated_at,
+            )
+        ).all():
+            dependencies.setdefault(variant_id, []).append(restrictions)
+            updates.append(updated_at)
+
+        custom_prices: Dict[UUID, List[Tuple[int, float]]] = {}
+        for variant_id, dependent_id, price, updated_at in session.exec(
+            select(
+                CustomPrice.variant_id,
+                CustomPrice.dependent_variant_id,
+                CustomPrice.custom_price,
+                CustomPrice.updated_at,
+            )
+        ).all():
+            updates.append(updated_at)
+            if dependent_id in variant_index:
+                custom_prices.setdefault(variant_id, []).append(
+                    (variant_index[dependent_id], price)
+                )
+
+        variants: Tuple[VariantRecord, ...] = tuple(
+            VariantRecord(
+                index,
+                *row,
+                tuple(dependencies.get(row[0], ())),
+                tuple(custom_prices.get(row[0], ())),
+            )
+            for index, row in enumerate(variant_rows)
+        )
+
+        part_variants: Dict[UUID, List[int]] = {}
+        for variant in variants:
+            part_variants.setdefault(variant.part_id, []).append(variant.index)
+
+        parts: Tuple[PartRecord, ...] = tuple(
+            PartRecord(*row, tuple(part_variants.get(row[0], ())))
+            for row in session.exec(
+                select(
+                    ProductPart.id,
+                    ProductPart.product_id,
+                    ProductPart.name,
+                    ProductPart.created_at,
+                    ProductPart.updated_at,
+                )
+            ).all()
+        )
+
+        product_parts: Dict[UUID, List[PartRecord]] = {}
+        for part in parts:
+            product_parts.setdefault(part.product_id, []).append(part)
+
+        products: Tuple[ProductRecord, ...] = tuple(
+            ProductRecord(*row, tuple(product_parts.get(row[0], ())))
+            for row in session.exec(
+                select(
+                    Product.id,
+                    Product.name,
+                    Product.description,
+                    Product.category,
+                    Product.base_price,
+                    Product.is_custom,
+                    Product.is_available,
+                    Product.stock_quantity,
+                    Product.created_at,
+                    Product.updated_at,
+                )
+            ).all()
+        )
+
+        for records in (products, parts, variants):
+            updates.extend(record.updated_at for record in records)
+        last_modified: Optional[datetime] = max(updates, default=None)
+
+        return cls(version, products, parts, variants, last_modified)
+
+    def page(self, page: int, page_size: int) -> Sequence[ProductRecord]:
+        """
+        Get a page of products, like `get_all_products`.
+
+        Args:
+            page (int): The page number, starting at 1.
+            page_size (int): The number of products per page.
+
+        Returns:
+            Sequence[ProductRecord]: The products of the page.
+        """
+        start: int = (page - 1) * page_size
+        end: int = start + page_size
+
+        return self.products[start:end]
+
+    def product(self, product_id: UUID) -> Optional[ProductRecord]:
+        return self._product_index.get(product_id)
+
+    def variant(self, variant_id: UUID) -> Optional[VariantRecord]:
+        index: Optional[int] = self._variant_index.get(variant_id)
+
+        return self.variants[index] if index is not None else None
+
+    def memo(self, key: Hashable, build: Callable[[], T]) -> T:
+        """
+        Get a value derived from this version of the catalog (i.e. a
+        rendered response), building it on first use.
+
+        Values live as long as the catalog, so they are dropped with it
+        when the catalog changes. At most `MEMO_SIZE` values are kept,
+        the others are built on every call.
+
+        Args:
+            key (Hashable): Identifies the value.
+            build (Callable[[], T]): Builds the value.
+
+        Returns:
+            T: The value.
+        """
+        value: Any = self._memo.get(key, _MISSING)
+        if value is _MISSING:
+            value = build()
+            if len(self._memo) < MEMO_SIZE:
+                self._memo[key] = value
+
+        return value
+
+    def variant_dict(self, variant: VariantRecord) -> Dict[str, Any]:
+        """
+        Render a variant like `PartVariantSchema`.
+
+        Args:
+            variant (VariantRecord): The variant to render.
+
+        Returns:
+            Dict[str, Any]: The variant with JSON compatible values.
+        """
+        variant_id: str = str(variant.id)
+
+        return {
+            "id": variant_id,
+            "created_at": _isoformat(variant.created_at),
+            "updated_at": _isoformat(variant.updated_at),
+            "part_id": str(variant.part_id),
+            "name": variant.name,
+            "price": variant.price,
+            "is_available": variant.is_available,
+            "stock_quantity": variant.stock_quantity,
+            "dependencies": [
+                {"variant_id": variant_id, "restrictions": restrictions}
+                for restrictions in variant.dependencies
+            ],
+            "custom_prices": [
+                {
+                    "variant_id": variant_id,
+                    "dependent_variant_id": str(self.variants[index].id),
+                    "custom_price": price,
+                }
+                for index, price in variant.custom_prices
+            ],
+        }
+
+    def part_dict(self, part: PartRecord) -> Dict[str, Any]:
+        """
+        Render a part, and its variants, like `ProductPartSchema`.
+
+        Args:
+            part (PartRecord): The part to render.
+
+        Returns:
+            Dict[str, Any]: The part with JSON compatible values.
+        """
+        return {
+            "id": str(part.id),
+            "created_at": _isoformat(part.created_at),
+            "updated_at": _isoformat(part.updated_at),
+            "product_id": str(part.product_id),
+            "name": part.name,
+            "variants": [
+                self.variant_dict(variant)
+                for variant in map(self.variants.__getitem__, part.variants)
+            ],
+        }
+
+    def product_dict(self, product: ProductRecord) -> Dict[str, Any]:
+        """
+        Render a product, its parts and their variants like
+        `ProductSchema`.
+
+        Args:
+            product (ProductRecord): The product to render.
+
+        Returns:
+            Dict[str, Any]: The product with JSON compatible values.
+        """
+        return {
+            "id": str(product.id),
+            "created_at": _isoformat(product.created_at),
+            "updated_at": _isoformat(product.updated_at),
+            "name": product.name,
+            "description": product.description,
+            "category": product.category,
+            "base_price": product.base_price,
+            "is_custom": product.is_custom,
+            "is_available": product.is_available,
+            "stock_quantity": product.stock_quantity,
+            "parts": [self.part_dict(part) for part in product.parts],
+        }
+
+    def builder_dict(self, product: ProductRecord) -> Dict[str, Any]:
+        """
+        Render everything the product builder needs, like
+        `BuilderSchema`: the product with its parts and variants, and the
+        lookups the builder would otherwise derive on every selection.
+
+        Restrictions are parsed once and made symmetric (a variant
+        restricting another is restricted by it too). Restrictions and
+        custom prices only refer to variants of the product, the others
+        cannot be selected in its builder.
+
+        Args:
+            product (ProductRecord): The product to render.
+
+        Returns:
+            Dict[str, Any]: The builder data with JSON compatible values.
+        """
+        variant_parts: Dict[str, str] = {}
+        indexes: Dict[int, str] = {}
+        for part in product.parts:
+            part_id: str = str(part.id)
+            for index in part.variants:
+                variant_id: str = str(self.variants[index].id)
+                variant_parts[variant_id] = part_id
+                indexes[index] = variant_id
+
+        restrictions: Dict[str, Set[str]] = {}
+        custom_prices: Dict[str, List[Dict[str, Any]]] = {}
+        for index, variant_id in indexes.items():
+            variant: VariantRecord = self.variants[index]
+            for restricted in _restricted_ids(variant.dependencies):
+                if restricted in variant_parts and restricted != variant_id:
+                    restrictions.setdefault(variant_id, set()).add(restricted)
+                    restrictions.setdefault(restricted, set()).add(variant_id)
+
+            for dependent, price in variant.custom_prices:
+                dependent_id: Optional[str] = indexes.get(dependent)
+                if dependent_id is None:
+                    continue
+                custom_prices.setdefault(variant_id, []).append(
+                    {
+                        "dependent_variant_id": dependent_id,
+                        "dependent_part_id": variant_parts[dependent_id],
+                        "custom_price": price,
+                    }
+                )
+
+        return {
+            "product": self.product_dict(product),
+            "variant_parts": variant_parts,
+            "restrictions": {
+                variant_id: sorted(restricted)
+                for variant_id, restricted in restrictions.items()
+            },
+            "custom_prices": custom_prices,
+        }
+
+
+_snapshot_store: Optional["SnapshotStore"] = None
+
+
+def use_snapshots(store: Optional["SnapshotStore"]) -> None:
+    """
+    Share the read model between worker processes through a snapshot
+    file, instead of keeping a copy in each of them.
+
+    Args:
+        store (Optional[SnapshotStore]): The store of the snapshot, or
+            None to keep the read model in memory.
+
+    Returns:
+        None
+    """
+    global _snapshot_store
+    _snapshot_store = store
+
+
+def get_catalog(session: Session) -> Catalog:
+    """
+    Get the read model of the catalog, loading it when the catalog has
+    changed since it was last loaded.
+
+    Concurrent requests share a single load, see `catalog_cache`. With a
+    snapshot store, the read model is mapped from the snapshot file and
+    only loaded from the database to publish a new snapshot.
+
+    Args:
+        session (Session): The database session used to load it.
+
+    Returns:
+        Catalog: The read model.
+    """
+    version: int = catalog_cache.generation
+
+    def load() -> Catalog:
+        return Catalog.load(session, version=version)
+
+    if _snapshot_store is not None:
+        return _snapshot_store.get(load, generation=version)
+
+    return catalog_cache.get_or_build("catalog", load)
@@ -0,0 +1,416 @@
+# app/api/changes.py
+
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import orjson
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Engine, delete, func, text
+from sqlmodel import Session, SQLModel, col, select
+
+from app.api.models import CatalogChange, utc_now
+from app.tracing import traced
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+UPSERT = "upsert"
+DELETE = "delete"
+
+
+def _row_id(record: SQLModel) -> Any:
+    # Variant dependencies are identified by their variant
+    return getattr(record, "id", None) or getattr(record, "variant_id")
+
+
+@traced
+def record_change(
+    session: Session,
+    record: SQLModel,
+    deleted: bool = False,
+) -> None:
+    """
+    Add a write of a catalog row to the change log, in the transaction of
+    the write: the change is committed, or rolled back, with it.
+
+    Call it after the row is added or modified (the pending changes are
+    flushed to apply the column defaults, i.e. `updated_at`) and before
+    it is deleted. On Postgres the change log is locked until the commit,
+    so changes are committed in the order of their sequence numbers and
+    a consumer never skips one committed late.
+
+    Args:
+        session (Session): The session of the write.
+        record (SQLModel): The written row.
+        deleted (bool): Whether the row is being deleted.
+
+    Returns:
+        None
+    """
+    data: Optional[str] = None
+    if not deleted:
+        session.flush()
+        columns: Any = getattr(record, "__table__").columns
+        data = orjson.dumps(
+            {column.key: getattr(record, column.key) for column in columns},
+            option=orjson.OPT_UTC_Z,
+        ).decode()
+
+    if session.get_bind().dialect.name == "postgresql":
+        lock = text("LOCK TABLE catalog_changes IN EXCLUSIVE MODE")
+        session.connection().execute(lock)
+
+    session.add(
+        CatalogChange(
+            entity=str(record.__tablename__),
+            entity_id=_row_id(record),
+            op=DELETE if deleted else UPSERT,
+            data=data,
+        )
+    )
+
+
+@traced
+def read_changes(
+    session: Session,
+    since: Optional[int],
+    limit: int,
+) -> Tuple[int, List[CatalogChange]]:
+    """
+    Read the changes made after `since`, oldest first.
+
+    The read transaction is ended before returning, so a client waiting
+    for changes does not hold a database connection.
+
+    Args:
+        session (Session): The database session.
+        since (Optional[int]): The sequence number of the last change the
+            client has seen, None for the current position only.
+        limit (int): The maximum number of changes to read.
+
+    Returns:
+        Tuple[int, List[CatalogChange]]: The position to resume from and
+            the changes.
+    """
+    try:
+        if since is None:
+            latest: Optional[int] = session.exec(
+                select(func.max(CatalogChange.seq))
+            ).one()
+            return latest or 0, []
+
+        changes: List[CatalogChange] = list(
+            session.exec(
+                select(CatalogChange)
+                .where(col(CatalogChange.seq) > since)
+                .order_by(col(CatalogChange.seq))
+                .limit(limit)
+            ).all()
+        )
+    finally:
+        session.rollback()
+
+    position: Optional[int] = changes[-1].seq if changes else since
+
+    return position or 0, changes
+
+
+def changes_pruned(
+    session: Session,
+    since: int,
+    changes: List[CatalogChange],
+) -> bool:
+    """
+    Tell whether changes made after `since` may have been pruned from the
+    log: a client that has seen none after `since` has to fetch the whole
+    catalog again.
+
+    Sequence numbers are only missing before the first change read when
+    it is the oldest change kept (or was, if pruned since), so the log is
+    only read again then. A sequence number skipped by a rolled back
+    write looks the same, and also asks for a resync.
+
+    Args:
+        session (Session): The database session.
+        since (int): The sequence number of the last change the client
+            has seen.
+        changes (List[CatalogChange]): The changes read after `since`.
+
+    Returns:
+        bool: Whether the client has to resync.
+    """
+    if not changes or (changes[0].seq or 0) <= since + 1:
+        return False
+
+    try:
+        first = select(func.min(CatalogChange.seq))
+        oldest: Optional[int] = session.exec(first).one()
+    finally:
+        session.rollback()
+
+    return oldest is None or oldest >= (changes[0].seq or 0)
+
+
+def prune_changes(session: Session, before: datetime) -> int:
+    """
+    Delete the changes made before `before`, but the latest one: the
+    position of the log is read from it.
+
+    Args:
+        session (Session): The database session.
+        before (datetime): The time of the oldest change kept.
+
+    Returns:
+        int: The number of changes deleted.
+    """
+    last = select(func.max(CatalogChange.seq))
+    latest: Optional[int] = session.exec(last).one()
+    if latest is None:
+        session.rollback()
+        return 0
+
+    result = session.execute(
+        delete(CatalogChange).where(
+            col(CatalogChange.created_at) < before,
+            col(CatalogChange.seq) < latest,
+        )
+    )
+    session.commit()
+
+    return result.rowcount
+
+
+class ChangeLogPruner:
+    """
+    Delete the changes older than `retention` seconds every `interval`
+    seconds, in the background. Every worker runs one: a change is only
+    deleted once, by whichever comes first.
+
+    Args:
+        engine (Engine): The database engine of the change log.
+        retention (float): Seconds the changes are kept for.
+        interval (float): Seconds between two deletions.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        retention: float,
+        interval: float = 3600.0,
+    ) -> None:
+        self.engine: Engine = engine
+        self.retention: float = retention
+        self.interval: float = interval
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    def prune(self, now: Optional[datetime] = None) -> int:
+        """
+        Delete the changes older than `retention` seconds.
+
+        Args:
+            now (Optional[datetime]): The current time.
+
+        Returns:
+            int: The number of changes deleted.
+        """
+        retention: timedelta = timedelta(seconds=self.retention)
+        before: datetime = (now or utc_now()) - retention
+        with Session(self.engine) as session:
+            return prune_changes(session, before)
+
+    async def start(self) -> None:
+        """
+        Start the task pruning every `interval` seconds, on the running
+        event loop.
+
+        Returns:
+            None
+        """
+        loop = asyncio.get_running_loop()
+        task: Optional["asyncio.Task[None]"] = self._task
+        if task is None or task.done() or task.get_loop() is not loop:
+            # A fresh context: the task outlives the caller starting it
+            self._task = loop.create_task(
+                self._run(),
+                context=contextvars.Context(),
+            )
+
+    async def close(self) -> None:
+        """
+        Stop the task.
+
+        Returns:
+            None
+        """
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await run_in_threadpool(self.prune)
+            except Exception:
+                logger.exception("Pruning the change log failed")
+            await asyncio.sleep(self.interval)
+
+
+def _fragment(data: Optional[str]) -> Any:
+    # Logged rows are already JSON, embedded as they are
+    return orjson.Fragment(data) if data is not None else None
+
+
+def render_changes(
+    position: int,
+    changes: List[CatalogChange],
+    limit: int,
+) -> Dict[str, Any]:
+    """
+    Render changes like `ChangesSchema`: compact rows, upserts carrying
+    the columns of the row as they were logged, without decoding them.
+
+    Args:
+        position (int): The position to resume from.
+        changes (List[CatalogChange]): The changes.
+        limit (int): The limit the changes were read with.
+
+    Returns:
+        Dict[str, Any]: The changes, ready to be encoded with orjson.
+    """
+    return {
+        "seq": position,
+        "more": len(changes) == limit,
+        "changes": [
+            {
+                "seq": change.seq,
+                "entity": change.entity,
+                "id": str(change.entity_id),
+                "op": change.op,
+                "data": _fragment(change.data),
+            }
+            for change in changes
+        ],
+    }
+
+
+class ChangeNotifier:
+    """
+    Wakes the requests of this worker waiting for changes when the
+    catalog is written to.
+
+    Writers run in threads and waiters in event loops, so waiters are
+    futures resolved thread-safely. Each notification bumps `generation`,
+    which a waiter reads before checking for changes: a write committed
+    between the check and the wait is not missed.
+    """
+
+    def __init__(self) -> None:
+        self.generation: int = 0
+        self._lock: threading.Lock = threading.Lock()
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, Any]] = []
+
+    def notify(self) -> None:
+        """
+        Wake every waiter.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self.generation += 1
+            waiters, self._waiters = self._waiters, []
+
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_resolve, future)
+            except RuntimeError:
+                # The loop of the waiter is closed
+                pass
+
+    async def wait(self, generation: int, timeout: float) -> bool:
+        """
+        Wait for a notification after `generation`.
+
+        Args:
+            generation (int): The generation read before checking for
+                changes.
+            timeout (float): The maximum number of seconds to wait.
+
+        Returns:
+            bool: False if the wait timed out.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            if self.generation != generation:
+                return True
+            self._waiters.append((loop, future))
+
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                if (loop, future) in self._waiters:
+                    self._waiters.remove((loop, future))
+
+
+def _resolve(future: Any) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+change_notifier: ChangeNotifier = ChangeNotifier()
+
+
+async def wait_for_changes(
+    session: Session,
+    since: Optional[int],
+    limit: int,
+    wait: float,
+    poll_interval: float,
+) -> Tuple[int, List[CatalogChange]]:
+    """
+    Long-poll the change log: read the changes made after `since`,
+    waiting up to `wait` seconds for one when there are none yet.
+
+    Writes made by this worker wake the wait at once, writes made by the
+    others are noticed by reading the log every `poll_interval` seconds.
+
+    Args:
+        session (Session): The database session.
+        since (Optional[int]): The sequence number of the last change the
+            client has seen, None for the current position only.
+        limit (int): The maximum number of changes to read.
+        wait (float): The maximum number of seconds to wait.
+        poll_interval (float): The seconds between two reads of the log.
+
+    Returns:
+        Tuple[int, List[CatalogChange]]: The position to resume from and
+            the changes, none if the wait timed out.
+    """
+    deadline: float = time.monotonic() + wait
+
+    while True:
+        generation: int = change_notifier.generation
+        position, changes = await run_in_threadpool(
+            read_changes,
+            session,
+            since,
+            limit,
+        )
+        remaining: float = deadline - time.monotonic()
+        if changes or since is None or remaining <= 0:
+            return position, changes
+
+        await change_notifier.wait(generation, min(poll_interval, remaining))
@@ -0,0 +1,310 @@
+# app/api/compact.py
+
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+from uuid import UUID
+
+import msgpack
+from fastapi.responses import Response
+
+from app.api.catalog import (
+    Catalog,
+    PartRecord,
+    ProductRecord,
+    VariantRecord,
+    _isoformat,
+)
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+# The extension type of naive datetimes: a MessagePack timestamp of the
+# value read as UTC, decoded back without a timezone, as JSON renders it
+NAIVE_TIMESTAMP = 1
+
+# The fields of each row, a part has no `product_id` and a variant no
+# `part_id` (they are the ids of the row they are nested in). The
+# `variant_id` of dependencies and custom prices is the variant itself.
+PRODUCT_FIELDS = (
+    "id",
+    "created_at",
+    "updated_at",
+    "name",
+    "description",
+    "category",
+    "base_price",
+    "is_custom",
+    "is_available",
+    "stock_quantity",
+    "parts",
+)
+PART_FIELDS = ("id", "created_at", "updated_at", "name", "variants")
+VARIANT_FIELDS = (
+    "id",
+    "created_at",
+    "updated_at",
+    "name",
+    "price",
+    "is_available",
+    "stock_quantity",
+    "dependencies",
+    "custom_prices",
+)
+
+
+class MsgPackResponse(Response):
+    """
+    A MessagePack response.
+
+    Args:
+        content (Any): The content, of types MessagePack can encode.
+        id_table (bool): Whether variant ids are dictionary encoded,
+            advertised in the content type as `variant-ids=table`.
+    """
+
+    media_type = MSGPACK_MEDIA_TYPE
+
+    def __init__(
+        self,
+        content: Any,
+        id_table: bool = False,
+        **kwargs: Any,
+    ) -> None:
+        if id_table:
+            kwargs["media_type"] = f"{MSGPACK_MEDIA_TYPE}; variant-ids=table"
+        super().__init__(content, **kwargs)
+
+    def render(self, content: Any) -> bytes:
+        return msgpack.packb(content)
+
+
+def negotiate(accept: Optional[str]) -> Tuple[bool, bool]:
+    """
+    Pick the format of a response from an `Accept` header.
+
+    MessagePack is only picked when it is preferred to JSON, so clients
+    sending no `Accept` header or `*/*` keep getting JSON.
+
+    Args:
+        accept (Optional[str]): The `Accept` header of the request.
+
+    Returns:
+        Tuple[bool, bool]: Whether to respond with MessagePack, and
+            whether the variant ids should be dictionary encoded.
+    """
+    best_json: float = 0.0 if accept else 1.0
+    best_msgpack: float = 0.0
+    id_table: bool = False
+
+    for item in (accept or "").split(","):
+        media_type, *params = (p.strip() for p in item.split(";"))
+        options: Dict[str, str] = dict(
+            (key.strip().lower(), value.strip())
+            for key, _, value in (p.partition("=") for p in params)
+        )
+        try:
+            quality: float = float(options.get("q", "1"))
+        except ValueError:
+            quality = 0.0
+
+        media_type = media_type.lower()
+        if media_type == MSGPACK_MEDIA_TYPE and quality > best_msgpack:
+            best_msgpack = quality
+            id_table = options.get("variant-ids") == "table"
+        elif media_type in ("application/json", "application/*", "*/*"):
+            best_json = max(best_json, quality)
+
+    return best_msgpack > best_json, id_table
+
+
+def _timestamp(value: datetime) -> Any:
+    if value.tzinfo is None:
+        utc: datetime = value.replace(tzinfo=timezone.utc)
+        timestamp: msgpack.Timestamp = msgpack.Timestamp.from_datetime(utc)
+        return msgpack.ExtType(NAIVE_TIMESTAMP, timestamp.to_bytes())
+
+    return msgpack.Timestamp.from_datetime(value)
+
+
+def _ext(code: int, data: bytes) -> Any:
+    if code == NAIVE_TIMESTAMP:
+        utc: datetime = msgpack.Timestamp.from_bytes(data).to_datetime()
+        return utc.replace(tzinfo=None)
+
+    return msgpack.ExtType(code, data)
+
+
+class _Encoder:
+    def __init__(self, catalog: Catalog, id_table: bool) -> None:
+        self.catalog: Catalog = catalog
+        self.id_table: bool = id_table
+        # The position in `variant_ids` of each variant index
+        self.positions: Dict[int, int] = {}
+        self.variant_ids: List[bytes] = []
+
+    def variant_ref(self, index: int) -> Any:
+        if not self.id_table:
+            return self.catalog.variants[index].id.bytes
+
+        position: Optional[int] = self.positions.get(index)
+        if position is None:
+            position = self.positions[index] = len(self.variant_ids)
+            self.variant_ids.append(self.catalog.variants[index].id.bytes)
+
+        return position
+
+    def variant(self, variant: VariantRecord) -> List[Any]:
+        return [
+            self.variant_ref(variant.index),
+            _timestamp(variant.created_at),
+            _timestamp(variant.updated_at),
+            variant.name,
+            variant.price,
+            variant.is_available,
+            variant.stock_quantity,
+            list(variant.dependencies),
+            [
+                [self.variant_ref(index), price]
+                for index, price in variant.custom_prices
+            ],
+        ]
+
+    def part(self, part: PartRecord) -> List[Any]:
+        variants: Sequence[VariantRecord] = self.catalog.variants
+
+        return [
+            part.id.bytes,
+            _timestamp(part.created_at),
+            _timestamp(part.updated_at),
+            part.name,
+            [self.variant(variants[index]) for index in part.variants],
+        ]
+
+    def product(self, product: ProductRecord) -> List[Any]:
+        return [
+            product.id.bytes,
+            _timestamp(product.created_at),
+            _timestamp(product.updated_at),
+            product.name,
+            product.description,
+            product.category,
+            product.base_price,
+            product.is_custom,
+            product.is_available,
+            product.stock_quantity,
+            [self.part(part) for part in product.parts],
+        ]
+
+
+def encode_products(
+    catalog: Catalog,
+    products: Sequence[ProductRecord],
+    id_table: bool = False,
+) -> Dict[str, Any]:
+    """
+    Render products in the compact MessagePack format.
+
+    Rows are arrays whose field names are sent once, in `fields`, UUIDs
+    are 16 bytes binaries and datetimes MessagePack timestamps (naive
+    ones the `NAIVE_TIMESTAMP` extension type). With
+    `id_table`, every variant id (including the dependent variants of
+    custom prices) is replaced by its position in `variant_ids`.
+
+    Args:
+        catalog (Catalog): The catalog of the products.
+        products (Sequence[ProductRecord]): The products to render.
+        id_table (bool): Whether to dictionary encode variant ids.
+
+    Returns:
+        Dict[str, Any]: The content of the response.
+    """
+    encoder = _Encoder(catalog, id_table)
+    rows: List[List[Any]] = [encoder.product(p) for p in products]
+    content: Dict[str, Any] = {
+        "fields": {
+            "product": PRODUCT_FIELDS,
+            "part": PART_FIELDS,
+            "variant": VARIANT_FIELDS,
+        },
+        "products": rows,
+    }
+    if id_table:
+        content["variant_ids"] = encoder.variant_ids
+
+    return content
+
+
+def decode_products(data: bytes) -> List[Dict[str, Any]]:
+    """
+    Decode a compact MessagePack payload to the products of the JSON
+    response, for Python consumers (and tests).
+
+    Args:
+        data (bytes): The body of a MessagePack response.
+
+    Returns:
+        List[Dict[str, Any]]: The products, like `ProductSchema`.
+    """
+    content: Dict[str, Any] = msgpack.unpackb(data, ext_hook=_ext)
+    variant_ids: Optional[List[bytes]] = content.get("variant_ids")
+
+    def uuid(value: Any) -> str:
+        if variant_ids is not None and isinstance(value, int):
+            value = variant_ids[value]
+        return str(UUID(bytes=value))
+
+    def when(value: Union[msgpack.Timestamp, datetime]) -> str:
+        # Naive datetimes keep no timezone, like in the JSON response
+        if isinstance(value, msgpack.Timestamp):
+            value = value.to_datetime()
+        return _isoformat(value)
+
+    def variant(row: List[Any], part_id: str) -> Dict[str, Any]:
+        fields: Dict[str, Any] = dict(zip(VARIANT_FIELDS, row))
+        variant_id: str = uuid(fields["id"])
+
+        return {
+            **fields,
+            "id": variant_id,
+            "created_at": when(fields["created_at"]),
+            "updated_at": when(fields["updated_at"]),
+            "part_id": part_id,
+            "dependencies": [
+                {"variant_id": variant_id, "restrictions": restrictions}
+                for restrictions in fields["dependencies"]
+            ],
+            "custom_prices": [
+                {
+                    "variant_id": variant_id,
+                    "dependent_variant_id": uuid(dependent),
+                    "custom_price": price,
+                }
+                for dependent, price in fields["custom_prices"]
+            ],
+        }
+
+    def part(row: List[Any], product_id: str) -> Dict[str, Any]:
+        fields: Dict[str, Any] = dict(zip(PART_FIELDS, row))
+        part_id: str = uuid(fields["id"])
+
+        return {
+            **fields,
+            "id": part_id,
+            "created_at": when(fields["created_at"]),
+            "updated_at": when(fields["updated_at"]),
+            "product_id": product_id,
+            "variants": [variant(v, part_id) for v in fields["variants"]],
+        }
+
+    def product(row: List[Any]) -> Dict[str, Any]:
+        fields: Dict[str, Any] = dict(zip(PRODUCT_FIELDS, row))
+        product_id: str = uuid(fields["id"])
+
+        return {
+            **fields,
+            "id": product_id,
+            "created_at": when(fields["created_at"]),
+            "updated_at": when(fields["updated_at"]),
+            "parts": [part(p, product_id) for p in fields["parts"]],
+        }
+
+    return [product(row) for row in content["products"]]
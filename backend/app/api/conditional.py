@@ -0,0 +1,380 @@
+# app/api/conditional.py
+
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Type,
+    Union,
+)
+from uuid import UUID
+
+from fastapi import Request
+from fastapi.responses import Response
+from sqlalchemy import func, union_all
+from sqlmodel import Session, SQLModel, col, select
+
+from app.api.catalog import Catalog
+from app.api.models import (
+    CustomPrice,
+    PartVariant,
+    Product,
+    ProductPart,
+    VariantDependency,
+)
+from app.compression import CompressedBody
+from app.config import settings
+from app.tracing import traced
+
+# Documents the response to conditional GETs in the OpenAPI schema
+NOT_MODIFIED: Dict[Union[int, str], Dict[str, Any]] = {
+    304: {"description": "Not Modified: the client's copy is current."}
+}
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def _utc(value: datetime) -> datetime:
+    # Naive datetimes are stored in UTC
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+
+    return value.astimezone(timezone.utc)
+
+
+def _weak(etag: str) -> str:
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+class Validator:
+    """
+    The validators of a representation, sent as `ETag` and
+    `Last-Modified` and compared with the `If-None-Match` and
+    `If-Modified-Since` headers of conditional requests.
+
+    Entity tags are weak: the same tag is used for the compressed and
+    uncompressed bodies.
+
+    Args:
+        etag (str): The entity tag, quoted.
+        last_modified (Optional[datetime]): When the representation
+            last changed, None if unknown.
+    """
+
+    __slots__ = ("etag", "last_modified")
+
+    def __init__(self, etag: str, last_modified: Optional[datetime]) -> None:
+        self.etag: str = etag
+        self.last_modified: Optional[datetime] = last_modified
+
+    @classmethod
+    def of_rows(
+        cls,
+        count: int,
+        last_modified: Optional[datetime],
+    ) -> "Validator":
+        """
+        Build the validator of a set of rows from their number and their
+        latest `updated_at`.
+
+        Adding or updating a row moves the latest `updated_at` forward
+        and deleting one lowers the count, so any change gives a new tag.
+
+        Args:
+            count (int): The number of rows.
+            last_modified (Optional[datetime]): The latest `updated_at`.
+
+        Returns:
+            Validator: The validator.
+        """
+        microseconds: int = 0
+        if last_modified is not None:
+            last_modified = _utc(last_modified)
+            microseconds = (last_modified - _EPOCH) // _MICROSECOND
+
+        return cls(f'W/"{count:x}-{microseconds:x}"', last_modified)
+
+    def headers(self) -> Dict[str, str]:
+        """
+        The validator and caching headers of a response.
+
+        Returns:
+            Dict[str, str]: `ETag`, `Last-Modified` and `Cache-Control`.
+        """
+        headers: Dict[str, str] = {
+            "ETag": self.etag,
+            "Cache-Control": settings.HTTP_CACHE_CONTROL,
+        }
+        if self.last_modified is not None:
+            headers["Last-Modified"] = format_datetime(
+                _utc(self.last_modified),
+                usegmt=True,
+            )
+
+        return headers
+
+    def matches(self, request: Request) -> bool:
+        """
+        Whether the client's copy is still valid.
+
+        `If-None-Match` takes precedence over `If-Modified-Since`, which
+        has a resolution of one second.
+
+        Args:
+            request (Request): The conditional request.
+
+        Returns:
+            bool: True to respond with 304 Not Modified.
+        """
+        headers = request.headers
+        if_none_match: Optional[str] = headers.get("if-none-match")
+        if if_none_match is not None:
+            listed: List[str] = if_none_match.split(",")
+            tags: Set[str] = {_weak(tag.strip()) for tag in listed}
+            return "*" in tags or _weak(self.etag) in tags
+
+        if_modified_since: Optional[str] = headers.get("if-modified-since")
+        if if_modified_since is None or self.last_modified is None:
+            return False
+        try:
+            since: datetime = _utc(parsedate_to_datetime(if_modified_since))
+        except (TypeError, ValueError):
+            return False
+
+        return _utc(self.last_modified).replace(microsecond=0) <= since
+
+
+def conditional(
+    request: Request,
+    validator: Validator,
+    render: Callable[[], Response],
+    headers: Optional[Dict[str, str]] = None,
+) -> Response:
+    """
+    Respond to a conditional GET: 304 Not Modified when the client's copy
+    is still valid, otherwise the rendered response with its validators.
+
+    The validator must be checked before the response is rendered, so it
+    is never newer than the response it is sent with.
+
+    Args:
+        request (Request): The request.
+        validator (Validator): The validator of the current
+            representation.
+        render (Callable[[], Response]): Renders the full response.
+        headers (Optional[Dict[str, str]]): Headers a 304 response must
+            repeat (i.e. `Vary`).
+
+    Returns:
+        Response: The response.
+    """
+    response_headers: Dict[str, str] = {**(headers or {})}
+    response_headers.update(validator.headers())
+    if validator.matches(request):
+        return Response(status_code=304, headers=response_headers)
+
+    response: Response = render()
+    response.headers.update(response_headers)
+
+    return response
+
+
+def _validator(session: Session, *statements: Any) -> Validator:
+    rows = union_all(*statements).subquery()
+    count, last_modified = session.exec(
+        select(func.count(), func.max(rows.c.updated_at))
+    ).one()
+
+    return Validator.of_rows(count, last_modified)
+
+
+def _variant_rows(variant_ids: Any) -> Any:
+    # The rows of the variants, their dependencies and custom prices
+    return (
+        select(PartVariant.updated_at).where(
+            col(PartVariant.id).in_(variant_ids),
+        ),
+        select(VariantDependency.updated_at).where(
+            col(VariantDependency.variant_id).in_(variant_ids)
+        ),
+        select(CustomPrice.updated_at).where(
+            col(CustomPrice.variant_id).in_(variant_ids)
+        ),
+    )
+
+
+@traced
+def product_validator(
+    session: Session,
+    product_id: UUID,
+) -> Optional[Validator]:
+    """
+    Get the validator of a product, its parts and their variants, with a
+    single aggregate query.
+
+    Args:
+        session (Session): The database session.
+        product_id (UUID): The ID of the product.
+
+    Returns:
+        Optional[Validator]: The validator, None if the product does not
+            exist.
+    """
+    in_product: Any = ProductPart.product_id == product_id
+    part_ids = select(ProductPart.id).where(in_product)
+    of_parts: Any = col(PartVariant.part_id).in_(part_ids)
+    variant_ids = select(PartVariant.id).where(of_parts)
+    validator: Validator = _validator(
+        session,
+        select(Product.updated_at).where(Product.id == product_id),
+        select(ProductPart.updated_at).where(in_product),
+        *_variant_rows(variant_ids),
+    )
+
+    return validator if validator.last_modified is not None else None
+
+
+@traced
+def part_validator(session: Session, part_id: UUID) -> Optional[Validator]:
+    """
+    Get the validator of a product part and its variants, with a single
+    aggregate query.
+
+    Args:
+        session (Session): The database session.
+        part_id (UUID): The ID of the product part.
+
+    Returns:
+        Optional[Validator]: The validator, None if the part does not
+            exist.
+    """
+    variant_ids = select(PartVariant.id).where(PartVariant.part_id == part_id)
+    validator: Validator = _validator(
+        session,
+        select(ProductPart.updated_at).where(ProductPart.id == part_id),
+        *_variant_rows(variant_ids),
+    )
+
+    return validator if validator.last_modified is not None else None
+
+
+@traced
+def variant_validator(
+    session: Session,
+    variant_id: UUID,
+) -> Optional[Validator]:
+    """
+    Get the validator of a part variant, with its dependencies and custom
+    prices, with a single aggregate query.
+
+    Args:
+        session (Session): The database session.
+        variant_id (UUID): The ID of the part variant.
+
+    Returns:
+        Optional[Validator]: The validator, None if the variant does not
+            exist.
+    """
+    validator: Validator = _validator(session, *_variant_rows([variant_id]))
+
+    return validator if validator.last_modified is not None else None
+
+
+def _rendered_rows(record: SQLModel) -> Iterator[SQLModel]:
+    # The rows counted by the validator of each entity, in memory
+    yield record
+    if isinstance(record, Product):
+        for part in record.parts:
+            yield from _rendered_rows(part)
+    elif isinstance(record, ProductPart):
+        for variant in record.variants:
+            yield from _rendered_rows(variant)
+    elif isinstance(record, PartVariant):
+        yield from record.dependencies
+        yield from record.custom_prices
+
+
+def entity_validator(record: SQLModel) -> Validator:
+    """
+    Get the validator of a catalog row loaded with its children, from the
+    rows themselves: it is the validator `product_validator`,
+    `part_validator`, `variant_validator` or `row_validator` returned
+    when the rows were read, i.e. before they were cached.
+
+    Args:
+        record (SQLModel): The row, with the children it renders loaded.
+
+    Returns:
+        Validator: The validator.
+    """
+    updates: List[datetime] = [
+        getattr(row, "updated_at") for row in _rendered_rows(record)
+    ]
+
+    return Validator.of_rows(len(updates), max(updates))
+
+
+@traced
+def row_validator(
+    session: Session,
+    model: Type[SQLModel],
+    column: Any,
+    value: UUID,
+) -> Optional[Validator]:
+    """
+    Get the validator of a single row.
+
+    Args:
+        session (Session): The database session.
+        model (Type[SQLModel]): The model of the row.
+        column (Any): The column identifying the row.
+        value (UUID): The value of `column`.
+
+    Returns:
+        Optional[Validator]: The validator, None if the row does not
+            exist.
+    """
+    updated_at: Any = getattr(model, "updated_at")
+    validator: Validator = _validator(
+        session,
+        select(updated_at).where(column == value),
+    )
+
+    return validator if validator.last_modified is not None else None
+
+
+@traced
+def table_validator(session: Session, model: Type[SQLModel]) -> Validator:
+    """
+    Get the validator of a whole table.
+
+    Args:
+        session (Session): The database session.
+        model (Type[SQLModel]): The model of the table.
+
+    Returns:
+        Validator: The validator.
+    """
+    return _validator(session, select(getattr(model, "updated_at")))
+
+
+def catalog_validator(catalog: Catalog, body: CompressedBody) -> Validator:
+    """
+    Get the validator of a response rendered from the catalog read model,
+    which needs no query: the tag is the digest of the body.
+
+    Args:
+        catalog (Catalog): The catalog the body was rendered from.
+        body (CompressedBody): The rendered body.
+
+    Returns:
+        Validator: The validator.
+    """
+    return Validator(body.etag, catalog.last_modified)
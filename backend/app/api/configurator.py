@@ -0,0 +1,370 @@
+# app/api/configurator.py
+
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple, Union
+from uuid import UUID
+
+import orjson
+
+from app.api.catalog import Catalog, ProductRecord, _restricted_ids
+
+
+class PricingIndex:
+    """
+    The prices and restrictions of the variants of a product, indexed for
+    the configurator, built once per catalog version.
+
+    Variants are identified by their ID as a string. A custom price adds
+    to the total when both of its variants are selected, so the custom
+    prices of a pair are summed, in both directions, into `pair_prices`.
+
+    Attributes:
+        version (int): The version of the catalog the index was built
+            from, see `Catalog.version`.
+        base_price (float): The base price of the product.
+        parts (Dict[str, str]): The part of each variant.
+        prices (Dict[str, float]): The price of each variant.
+        unavailable (FrozenSet[str]): The variants out of stock.
+        pair_prices (Dict[str, Dict[str, float]]): The price added when
+            two variants are selected together, both ways.
+        restrictions (Dict[str, FrozenSet[str]]): The variants that cannot
+            be selected with each variant, both ways.
+    """
+
+    __slots__ = (
+        "version",
+        "base_price",
+        "parts",
+        "prices",
+        "unavailable",
+        "pair_prices",
+        "restrictions",
+    )
+
+    def __init__(self, catalog: Catalog, product: ProductRecord) -> None:
+        self.version: int = catalog.version
+        self.base_price: float = product.base_price
+        self.parts: Dict[str, str] = {}
+        self.prices: Dict[str, float] = {}
+        indexes: Dict[int, str] = {}
+        unavailable: Set[str] = set()
+        for part in product.parts:
+            part_id: str = str(part.id)
+            for index in part.variants:
+                variant = catalog.variants[index]
+                variant_id: str = str(variant.id)
+                indexes[index] = variant_id
+                self.parts[variant_id] = part_id
+                self.prices[variant_id] = variant.price
+                if not variant.is_available or variant.stock_quantity <= 0:
+                    unavailable.add(variant_id)
+        self.unavailable: FrozenSet[str] = frozenset(unavailable)
+
+        self.pair_prices: Dict[str, Dict[str, float]] = {}
+        restrictions: Dict[str, Set[str]] = {}
+        for index, variant_id in indexes.items():
+            variant = catalog.variants[index]
+            for dependent, price in variant.custom_prices:
+                dependent_id: Optional[str] = indexes.get(dependent)
+                if dependent_id is None or dependent_id == variant_id:
+                    continue
+                for one, other in (
+                    (variant_id, dependent_id),
+                    (dependent_id, variant_id),
+                ):
+                    pairs = self.pair_prices.setdefault(one, {})
+                    pairs[other] = pairs.get(other, 0.0) + price
+
+            for restricted in _restricted_ids(variant.dependencies):
+                if restricted in self.parts and restricted != variant_id:
+                    restrictions.setdefault(variant_id, set()).add(restricted)
+                    restrictions.setdefault(restricted, set()).add(variant_id)
+
+        self.restrictions: Dict[str, FrozenSet[str]] = {
+            variant_id: frozenset(restricted)
+            for variant_id, restricted in restrictions.items()
+        }
+
+    def same_prices(self, other: "PricingIndex") -> bool:
+        """
+        Tell whether another index prices every configuration the same,
+        whatever the catalog versions they were built from.
+
+        Args:
+            other (PricingIndex): The other index.
+
+        Returns:
+            bool: Whether the indexes only differ by their version.
+        """
+        return all(
+            getattr(self, name) == getattr(other, name)
+            for name in self.__slots__
+            if name != "version"
+        )
+
+    def contribution(
+        self,
+        variant_id: str,
+        selection: Dict[str, str],
+    ) -> float:
+        """
+        Get what a variant adds to the total: its price and the custom
+        prices shared with the variants selected for the other parts.
+
+        Args:
+            variant_id (str): The variant.
+            selection (Dict[str, str]): The selected variant of each part.
+
+        Returns:
+            float: The price the variant adds.
+        """
+        price: float = self.prices[variant_id]
+        pairs: Optional[Dict[str, float]] = self.pair_prices.get(variant_id)
+        if pairs:
+            part_id: str = self.parts[variant_id]
+            for other_part, other in selection.items():
+                if other_part != part_id:
+                    price += pairs.get(other, 0.0)
+
+        return price
+
+    def total(self, selection: Dict[str, str]) -> float:
+        """
+        Price a whole selection, like `calculate_total_price`.
+
+        Args:
+            selection (Dict[str, str]): The selected variant of each part.
+
+        Returns:
+            float: The total price.
+        """
+        total: float = self.base_price
+        selected: List[str] = list(selection.values())
+        for position, variant_id in enumerate(selected):
+            total += self.prices[variant_id]
+            pairs: Dict[str, float] = self.pair_prices.get(variant_id, {})
+            for other in selected[:position]:
+                total += pairs.get(other, 0.0)
+
+        return total
+
+
+def pricing_index(catalog: Catalog, product: ProductRecord) -> PricingIndex:
+    """
+    Get the pricing index of a product, built once per catalog version
+    and shared by every configuration of the product.
+
+    Args:
+        catalog (Catalog): The catalog.
+        product (ProductRecord): The product, in the catalog.
+
+    Returns:
+        PricingIndex: The index.
+    """
+    return catalog.memo(
+        ("pricing", product.id),
+        lambda: PricingIndex(catalog, product),
+    )
+
+
+def _variant_id(message: Dict[str, Any]) -> str:
+    # The canonical form, whatever the case the client sent
+    return str(UUID(str(message["variant_id"])))
+
+
+class Configuration:
+    """
+    The selection of a configurator session, one variant per part, with
+    its total price kept up to date.
+
+    A selection only reprices the part that changed: the contribution of
+    its previous variant is replaced by the one of the new variant. The
+    variants restricted by the selection are counted, so the variants
+    newly disabled, or enabled again, are known without a full scan.
+
+    Args:
+        index (PricingIndex): The pricing index of the product.
+    """
+
+    def __init__(self, index: PricingIndex) -> None:
+        self.index: PricingIndex = index
+        self.selection: Dict[str, str] = {}
+        self.total: float = index.base_price
+        # The previous variant of each part changed, for undo
+        self.history: List[Tuple[str, Optional[str]]] = []
+        # How many selected variants restrict each variant
+        self.blocked: Dict[str, int] = {}
+
+    def disabled(self) -> List[str]:
+        """
+        Get the variants that cannot be selected: out of stock, or
+        restricted by a selected variant.
+
+        Returns:
+            List[str]: The variants, sorted.
+        """
+        return sorted(self.index.unavailable.union(self.blocked))
+
+    def state(self) -> Dict[str, Any]:
+        """
+        Describe the whole configuration, the first message of a session.
+
+        Returns:
+            Dict[str, Any]: A `state` message.
+        """
+        return {
+            "type": "state",
+            "total": self.total,
+            "selection": dict(self.selection),
+            "disabled": self.disabled(),
+        }
+
+    def select(self, variant_id: str) -> Dict[str, Any]:
+        """
+        Select a variant, replacing the one selected for its part.
+
+        Args:
+            variant_id (str): The variant.
+
+        Returns:
+            Dict[str, Any]: A `priced` message.
+
+        Raises:
+            ValueError: If the variant cannot be selected.
+        """
+        part_id: Optional[str] = self.index.parts.get(variant_id)
+        if part_id is None:
+            raise ValueError(f"Variant with ID {variant_id} not found.")
+        if variant_id in self.index.unavailable:
+            raise ValueError(f"Variant with ID {variant_id} is out of stock.")
+        restricted: FrozenSet[str] = self.index.restrictions.get(
+            variant_id,
+            frozenset(),
+        )
+        for other_part, other in self.selection.items():
+            if other_part != part_id and other in restricted:
+                raise ValueError(
+                    f"Variant with ID {variant_id} cannot be selected "
+                    f"with variant {other}."
+                )
+
+        self.history.append((part_id, self.selection.get(part_id)))
+
+        return self._change(part_id, variant_id)
+
+    def undo(self) -> Dict[str, Any]:
+        """
+        Restore the variant selected for a part before its last change.
+
+        Returns:
+            Dict[str, Any]: A `priced` message.
+
+        Raises:
+            ValueError: If there is nothing to undo.
+        """
+        if not self.history:
+            raise ValueError("Nothing to undo.")
+        part_id, variant_id = self.history.pop()
+
+        return self._change(part_id, variant_id)
+
+    def reprice(self, index: PricingIndex) -> Dict[str, Any]:
+        """
+        Switch to the index of a new catalog version, pricing the whole
+        selection again.
+
+        Variants removed or out of stock since are unselected, and the
+        history is cleared as it may refer to them.
+
+        Args:
+            index (PricingIndex): The new index.
+
+        Returns:
+            Dict[str, Any]: A `state` message, with the `dropped` variants.
+        """
+        kept: Dict[str, str] = {
+            part_id: variant_id
+            for part_id, variant_id in self.selection.items()
+            if index.parts.get(variant_id) == part_id
+            and variant_id not in index.unavailable
+        }
+        dropped: List[str] = sorted(
+            set(self.selection.values()).difference(kept.values())
+        )
+        self.index = index
+        self.selection = kept
+        self.total = index.total(self.selection)
+        self.history = []
+        self.blocked = {}
+        for variant_id in self.selection.values():
+            for restricted in index.restrictions.get(variant_id, ()):
+                self.blocked[restricted] = self.blocked.get(restricted, 0) + 1
+
+        return {**self.state(), "dropped": dropped}
+
+    def handle(self, message: Union[str, bytes]) -> Dict[str, Any]:
+        """
+        Apply a message of the client:
+        `{"type": "select", "variant_id": ...}` or `{"type": "undo"}`.
+
+        Args:
+            message (Union[str, bytes]): The JSON message.
+
+        Returns:
+            Dict[str, Any]: The reply, an `error` message if the message
+                cannot be applied.
+        """
+        try:
+            request: Any = orjson.loads(message)
+            if not isinstance(request, dict):
+                raise ValueError("Messages are JSON objects.")
+            kind: Any = request.get("type")
+            if kind == "select":
+                return self.select(_variant_id(request))
+            if kind == "undo":
+                return self.undo()
+            raise ValueError(f"Unknown message type: {kind}.")
+        except (KeyError, ValueError) as e:
+            # orjson.JSONDecodeError is a ValueError too
+            return {"type": "error", "detail": str(e)}
+
+    def _change(
+        self,
+        part_id: str,
+        variant_id: Optional[str],
+    ) -> Dict[str, Any]:
+        index: PricingIndex = self.index
+        previous: Optional[str] = self.selection.pop(part_id, None)
+
+        delta: float = 0.0
+        if previous is not None:
+            delta -= index.contribution(previous, self.selection)
+        if variant_id is not None:
+            delta += index.contribution(variant_id, self.selection)
+            self.selection[part_id] = variant_id
+        self.total += delta
+
+        old: FrozenSet[str] = frozenset()
+        new: FrozenSet[str] = frozenset()
+        if previous is not None:
+            old = index.restrictions.get(previous, frozenset())
+        if variant_id is not None:
+            new = index.restrictions.get(variant_id, frozenset())
+        touched: FrozenSet[str] = old | new
+        before: Set[str] = {v for v in touched if v in self.blocked}
+        for restricted in old:
+            self.blocked[restricted] -= 1
+            if not self.blocked[restricted]:
+                del self.blocked[restricted]
+        for restricted in new:
+            self.blocked[restricted] = self.blocked.get(restricted, 0) + 1
+        after: Set[str] = {v for v in touched if v in self.blocked}
+
+        return {
+            "type": "priced",
+            "part_id": part_id,
+            "variant_id": variant_id,
+            "delta": delta,
+            "total": self.total,
+            "disabled": sorted(after - before - index.unavailable),
+            "enabled": sorted(before - after - index.unavailable),
+        }
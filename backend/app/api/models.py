@@ -7,6 +7,16 @@ from datetime import datetime, timezone
 from sqlmodel import Field, SQLModel, Relationship
 
 
+def utc_now() -> datetime:
+    """
+    The current time in UTC, the default of the timestamp columns.
+
+    Returns:
+        datetime: The current time.
+    """
+    return datetime.now(timezone.utc)
+
+
 class BaseModel(SQLModel):
     """
     Base model that includes common fields for all database models.
@@ -25,12 +35,12 @@ class BaseModel(SQLModel):
     )
 
     created_at: datetime = Field(
-        default=datetime.now(timezone.utc),
+        default_factory=utc_now,
         nullable=False,
     )
     updated_at: datetime = Field(
-        default=datetime.now(timezone.utc),
-        sa_column_kwargs={"onupdate": datetime.now(timezone.utc)},
+        default_factory=utc_now,
+        sa_column_kwargs={"onupdate": utc_now},
         nullable=False,
     )
 
@@ -143,6 +153,8 @@ class VariantDependency(SQLModel, table=True):
             related to.
         restrictions (Optional[str]): Any restrictions related to
             the dependency.
+        updated_at (datetime): The timestamp when the dependency was
+            last updated.
         variant (Optional[PartVariant]): The part variant that this
             dependency applies to.
     """
@@ -154,6 +166,11 @@ class VariantDependency(SQLModel, table=True):
         primary_key=True,
     )
     restrictions: Optional[str]
+    updated_at: datetime = Field(
+        default_factory=utc_now,
+        sa_column_kwargs={"onupdate": utc_now},
+        nullable=False,
+    )
 
     variant: Optional[PartVariant] = Relationship(
         back_populates="dependencies",
@@ -201,12 +218,14 @@ class CustomPrice(BaseModel, table=True):
 
 class Cart(BaseModel, table=True):
     """
-    Represents a shopping cart. It omits the user for the moment.
+    Represents a shopping cart. It omits the user for the moment, guests
+    leave their email to get the confirmation of their purchase.
 
     Attributes:
         purchased (bool): Whether the cart has been purchased or not.
         total_price (float): The total price of the cart including all
             products.
+        email (Optional[str]): Where the confirmation is sent.
         items (List[CartItem]): The items contained in the cart.
     """
 
@@ -214,6 +233,7 @@ class Cart(BaseModel, table=True):
 
     purchased: bool
     total_price: float
+    email: Optional[str] = None
 
     items: List["CartItem"] = Relationship(
         back_populates="cart",
@@ -247,3 +267,121 @@ class CartItem(BaseModel, table=True):
     product: Optional[Product] = Relationship(
         back_populates="cart_items",
     )
+
+
+class CatalogChange(SQLModel, table=True):
+    """
+    Represents a write to the catalog, in the change log read by
+    consumers syncing the catalog incrementally.
+
+    Attributes:
+        seq (Optional[int]): The position of the change in the log, it
+            only ever increases.
+        entity (str): The table of the changed row (i.e. "products").
+        entity_id (UUID): The ID of the changed row.
+        op (str): "upsert" or "delete".
+        data (Optional[str]): The columns of the row as a JSON object,
+            None for deletes.
+        created_at (datetime): The timestamp when the change was made.
+    """
+
+    __tablename__: str = "catalog_changes"
+    # Never reuse the sequence number of a pruned change
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    seq: Optional[int] = Field(default=None, primary_key=True)
+    entity: str
+    entity_id: UUID
+    op: str
+    data: Optional[str]
+    created_at: datetime = Field(
+        default_factory=utc_now,
+        nullable=False,
+    )
+
+
+class WaitingRoomTicket(SQLModel, table=True):
+    """
+    Represents the place of a client in the waiting room of a product in
+    queue mode. Tickets are admitted in the order the clients joined, and
+    an admitted ticket allows creating one cart with the product.
+
+    Attributes:
+        seq (Optional[int]): The order the ticket was written in.
+        token (UUID): The secret identifying the ticket, held by the
+            client.
+        product_id (UUID): The product the client is waiting for.
+        joined_at (datetime): When the client joined the waiting room.
+        admitted_at (Optional[datetime]): When the ticket was admitted.
+        expires_at (Optional[datetime]): When the admission expires.
+        used_at (Optional[datetime]): When the ticket was used for a cart.
+    """
+
+    __tablename__: str = "waiting_room_tickets"
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    seq: Optional[int] = Field(default=None, primary_key=True)
+    token: UUID = Field(unique=True)
+    product_id: UUID = Field(foreign_key="products.id", index=True)
+    joined_at: datetime
+    admitted_at: Optional[datetime] = Field(default=None, index=True)
+    expires_at: Optional[datetime] = None
+    used_at: Optional[datetime] = None
+
+
+class WaitingRoomBucket(SQLModel, table=True):
+    """
+    Represents the admissions of the waiting room of a product, a token
+    bucket refilled at the admission rate. Its row is locked while a
+    worker admits tickets, so the workers never admit more than the rate
+    together.
+
+    Attributes:
+        product_id (UUID): The product in queue mode.
+        tokens (float): The admissions available.
+        refilled_at (datetime): When the bucket was last refilled.
+    """
+
+    __tablename__: str = "waiting_room_buckets"
+
+    product_id: UUID = Field(foreign_key="products.id", primary_key=True)
+    tokens: float = 0.0
+    refilled_at: datetime = Field(default_factory=utc_now, nullable=False)
+
+
+class OutboxMessage(SQLModel, table=True):
+    """
+    Represents work to do after a write, e.g. after a purchase, written in
+    the same transaction as the write and done later by the outbox worker.
+
+    Attributes:
+        seq (Optional[int]): The order the message was written in.
+        topic (str): The handler of the message.
+        payload (str): The arguments of the handler, as JSON.
+        created_at (datetime): When the message was written.
+        available_at (datetime): When the message can be claimed, the end
+            of the retry backoff or of the lease of a worker.
+        claimed_by (Optional[UUID]): The batch of the worker holding it.
+        attempts (int): The failed attempts.
+        last_error (Optional[str]): The error of the last failed attempt.
+        processed_at (Optional[datetime]): When the message was done.
+        failed_at (Optional[datetime]): When the message was given up on.
+    """
+
+    __tablename__: str = "outbox_messages"
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    seq: Optional[int] = Field(default=None, primary_key=True)
+    topic: str
+    payload: str
+    created_at: datetime = Field(default_factory=utc_now, nullable=False)
+    available_at: datetime = Field(
+        default_factory=utc_now,
+        nullable=False,
+        index=True,
+    )
+    claimed_by: Optional[UUID] = Field(default=None, index=True)
+    attempts: int = 0
+    last_error: Optional[str] = None
+    processed_at: Optional[datetime] = None
+    failed_at: Optional[datetime] = None
@@ -0,0 +1,337 @@
+# app/api/outbox.py
+
+import asyncio
+import contextvars
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+from uuid import UUID, uuid4
+
+import orjson
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Engine, update
+from sqlmodel import Session, col, select
+
+from app.api.changes import ChangeNotifier
+from app.api.models import OutboxMessage, utc_now
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# A handler does the work of a message in the session without committing
+# it, and returns what to do once its writes are committed, if anything
+AfterCommit = Callable[[], None]
+Handler = Callable[[Session, Dict[str, Any]], Optional[AfterCommit]]
+
+# Wakes the worker of this process when messages are committed
+outbox_notifier: ChangeNotifier = ChangeNotifier()
+
+
+def enqueue(
+    session: Session,
+    topic: str,
+    payload: Dict[str, Any],
+) -> OutboxMessage:
+    """
+    Add a message to the outbox, in the transaction of the session: it is
+    committed, or rolled back, with the write it follows. Call
+    `outbox_notifier.notify()` once committed to wake the worker up.
+
+    Args:
+        session (Session): The session of the write.
+        topic (str): The handler of the message.
+        payload (Dict[str, Any]): The arguments of the handler.
+
+    Returns:
+        OutboxMessage: The message.
+    """
+    message = OutboxMessage(
+        topic=topic,
+        payload=orjson.dumps(payload).decode(),
+    )
+    session.add(message)
+
+    return message
+
+
+def _alive(
+    task: "asyncio.Task[None]",
+    loop: asyncio.AbstractEventLoop,
+) -> bool:
+    return task.get_loop() is loop and not task.done()
+
+
+class OutboxWorker:
+    """
+    Drain the outbox in the background: `workers` tasks claim batches of
+    up to `batch_size` messages, oldest first, and run their handlers in
+    the threadpool. They are woken by the commits of this process and
+    poll every `poll_interval` seconds for those of the others.
+
+    A claimed message is leased to its batch for `lease` seconds, so the
+    workers of every process share the outbox without doing a message
+    twice. The messages of a batch are processed one after the other, so
+    the lease of each is renewed right before its handler runs, and a
+    message whose lease expired meanwhile (taken over by another batch)
+    is skipped. A message is marked done in the transaction of the writes
+    of its handler. A failed message is retried after a backoff doubling
+    from `backoff` seconds up to `max_backoff`, and given up on after
+    `max_attempts` attempts (its `failed_at` is set, for an operator to
+    look at).
+
+    Args:
+        engine (Engine): The database engine of the outbox.
+        handlers (Dict[str, Handler]): The handler of each topic.
+        workers (int): The batches processed at a time.
+        batch_size (int): The messages claimed at once.
+        poll_interval (float): Seconds between two reads of the outbox.
+        lease (float): Seconds a batch holds a message, longer than the
+            slowest handler.
+        max_attempts (int): The attempts before giving a message up.
+        backoff (float): Seconds before the first retry.
+        max_backoff (float): The longest wait before a retry.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        handlers: Dict[str, Handler],
+        workers: int = 2,
+        batch_size: int = 20,
+        poll_interval: float = 1.0,
+        lease: float = 60.0,
+        max_attempts: int = 8,
+        backoff: float = 1.0,
+        max_backoff: float = 300.0,
+    ) -> None:
+        self.engine: Engine = engine
+        self.handlers: Dict[str, Handler] = handlers
+        self.workers: int = workers
+        self.batch_size: int = batch_size
+        self.poll_interval: float = poll_interval
+        self.lease: float = lease
+        self.max_attempts: int = max_attempts
+        self.backoff: float = backoff
+        self.max_backoff: float = max_backoff
+        self._tasks: List["asyncio.Task[None]"] = []
+
+    def retry_delay(self, attempts: int) -> float:
+        """
+        Get the seconds to wait before retrying a message.
+
+        Args:
+            attempts (int): The failed attempts, at least 1.
+
+        Returns:
+            float: The delay.
+        """
+        return min(self.backoff * 2 ** (attempts - 1), self.max_backoff)
+
+    def run_batch(self, now: Optional[datetime] = None) -> int:
+        """
+        Claim a batch of messages and process them.
+
+        Args:
+            now (Optional[datetime]): The current time.
+
+        Returns:
+            int: The messages claimed.
+        """
+        batch: UUID = uuid4()
+        with Session(self.engine) as session:
+            messages: List[OutboxMessage] = self._claim(
+                session,
+                batch,
+                now or utc_now(),
+            )
+        for message in messages:
+            self._process(message, batch)
+
+        return len(messages)
+
+    async def start(self) -> None:
+        """
+        Start the worker tasks on the running event loop.
+
+        Returns:
+            None
+        """
+        loop = asyncio.get_running_loop()
+        # Tasks of a stopped loop, i.e. of a previous lifespan, are dropped
+        self._tasks = [task for task in self._tasks if _alive(task, loop)]
+        while len(self._tasks) < self.workers:
+            # A fresh context: the tasks outlive the caller starting them
+            self._tasks.append(
+                loop.create_task(self._run(), context=contextvars.Context())
+            )
+
+    async def close(self) -> None:
+        """
+        Stop the worker tasks. The batches in flight are finished in the
+        threadpool, their messages are leased to them until then.
+
+        Returns:
+            None
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self) -> None:
+        while True:
+            generation: int = outbox_notifier.generation
+            try:
+                claimed: int = await run_in_threadpool(self.run_batch)
+            except Exception:
+                logger.exception("Reading the outbox failed")
+                claimed = 0
+            if claimed < self.batch_size:
+                # Drained, until the next commit or poll
+                await outbox_notifier.wait(generation, self.poll_interval)
+
+    def _claim(
+        self,
+        session: Session,
+        batch: UUID,
+        now: datetime,
+    ) -> List[OutboxMessage]:
+        available: Any = (
+            select(OutboxMessage.seq)
+            .where(
+                col(OutboxMessage.processed_at).is_(None),
+                col(OutboxMessage.failed_at).is_(None),
+                col(OutboxMessage.available_at) <= now,
+            )
+            .order_by(col(OutboxMessage.seq))
+            .limit(self.batch_size)
+            # Postgres skips the rows being claimed by another batch
+            .with_for_update(skip_locked=True)
+        )
+        # The conditions are checked again by the update, so two batches
+        # never claim the same message
+        session.execute(
+            update(OutboxMessage)
+            .where(
+                col(OutboxMessage.seq).in_(available.scalar_subquery()),
+                col(OutboxMessage.processed_at).is_(None),
+                col(OutboxMessage.failed_at).is_(None),
+                col(OutboxMessage.available_at) <= now,
+            )
+            .values(
+                claimed_by=batch,
+                available_at=now + timedelta(seconds=self.lease),
+            )
+        )
+        session.commit()
+
+        return list(
+            session.exec(
+                select(OutboxMessage)
+                .where(OutboxMessage.claimed_by == batch)
+                .order_by(col(OutboxMessage.seq))
+            ).all()
+        )
+
+    def _renew(self, message: OutboxMessage, batch: UUID) -> bool:
+        with Session(self.engine) as session:
+            result = session.execute(
+                update(OutboxMessage)
+                .where(
+                    col(OutboxMessage.seq) == message.seq,
+                    col(OutboxMessage.claimed_by) == batch,
+                    col(OutboxMessage.processed_at).is_(None),
+                )
+                .values(
+                    available_at=utc_now() + timedelta(seconds=self.lease),
+                )
+            )
+            session.commit()
+
+        return result.rowcount == 1
+
+    def _process(self, message: OutboxMessage, batch: UUID) -> None:
+        # The handlers before it may have outlived the lease of the batch
+        if not self._renew(message, batch):
+            logger.warning(
+                "Outbox message %s was taken over before being processed",
+                message.seq,
+            )
+            return
+
+        with Session(self.engine) as session:
+            try:
+                handler: Optional[Handler] = self.handlers.get(message.topic)
+                if handler is None:
+                    raise LookupError(f"No handler for {message.topic!r}")
+                after_commit: Optional[AfterCommit] = handler(
+                    session,
+                    orjson.loads(message.payload),
+                )
+
+                result = session.execute(
+                    update(OutboxMessage)
+                    .where(
+                        col(OutboxMessage.seq) == message.seq,
+                        col(OutboxMessage.claimed_by) == batch,
+                    )
+                    .values(processed_at=utc_now(), claimed_by=None)
+                )
+                if result.rowcount != 1:
+                    # The lease expired and another batch took it over
+                    session.rollback()
+                    logger.warning(
+                        "Outbox message %s outlived its lease",
+                        message.seq,
+                    )
+                    return
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                self._fail(session, message, batch, e)
+                return
+
+        if after_commit is not None:
+            after_commit()
+
+    def _fail(
+        self,
+        session: Session,
+        message: OutboxMessage,
+        batch: UUID,
+        error: Exception,
+    ) -> None:
+        attempts: int = message.attempts + 1
+        now: datetime = utc_now()
+        values: Dict[str, Any] = {
+            "attempts": attempts,
+            "last_error": f"{type(error).__name__}: {error}"[:1000],
+            "claimed_by": None,
+        }
+        if attempts >= self.max_attempts:
+            values["failed_at"] = now
+            logger.error(
+                "Outbox message %s (%s) failed %d times, giving up",
+                message.seq,
+                message.topic,
+                attempts,
+                exc_info=error,
+            )
+        else:
+            delay: float = self.retry_delay(attempts)
+            values["available_at"] = now + timedelta(seconds=delay)
+            logger.warning(
+                "Outbox message %s (%s) failed, retrying: %s",
+                message.seq,
+                message.topic,
+                error,
+            )
+
+        session.execute(
+            update(OutboxMessage)
+            .where(
+                col(OutboxMessage.seq) == message.seq,
+                col(OutboxMessage.claimed_by) == batch,
+            )
+            .values(**values)
+        )
+        session.commit()
@@ -1,12 +1,72 @@
 # app/api/routes.py
 
-from typing import List, Optional
+import time
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
 from uuid import UUID
 
-from fastapi import APIRouter, HTTPException, Query, status, Depends
-from sqlmodel import Session
+import orjson
+
+from fastapi import (
+    APIRouter,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    WebSocket,
+    WebSocketDisconnect,
+    WebSocketException,
+    status,
+)
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
+from sqlmodel import Session, SQLModel
 
+from app.compression import CompressedBody
+from app.config import settings
 from app.database import get_session
+from app.tracing import TracedRoute
+from app.api.cache import catalog_cache, entity_cache, price_flight
+from app.api.catalog import Catalog, ProductRecord, get_catalog
+from app.api.availability import (
+    AvailabilityBroadcaster,
+    read_availability,
+)
+from app.api.configurator import Configuration, pricing_index
+from app.api.changes import (
+    changes_pruned,
+    read_changes,
+    render_changes,
+    wait_for_changes,
+)
+from app.api.conditional import (
+    NOT_MODIFIED,
+    Validator,
+    catalog_validator,
+    conditional,
+    entity_validator,
+    part_validator,
+    product_validator,
+    row_validator,
+    table_validator,
+    variant_validator,
+)
+from app.api.compact import (
+    MSGPACK_MEDIA_TYPE,
+    MsgPackResponse,
+    encode_products,
+    negotiate,
+)
 from app.api.models import (
     Cart,
     CustomPrice,
@@ -15,6 +75,7 @@ from app.api.models import (
     PartVariant,
     VariantDependency,
 )
+from app.api.responses import FastJSONResponse, dump_trusted
 from app.api.services import (
     create_cart_with_items,
     create_custom_price,
@@ -26,24 +87,23 @@ from app.api.services import (
     get_all_variant_dependencies,
     get_custom_price_by_id,
     get_product_by_id,
-    get_all_products,
     get_variant_dependency_by_id,
     update_custom_price,
     update_product,
     delete_product,
     create_product_part,
     get_product_part_by_id,
-    get_all_product_parts,
     update_product_part,
     delete_product_part,
     create_part_variant,
     get_part_variant_by_id,
-    get_all_part_variants,
     update_part_variant,
     delete_part_variant,
     update_variant_dependency,
 )
 from app.api.schemas import (
+    BuilderSchema,
+    ChangesSchema,
     CartCreateSchema,
     CartSchema,
     CustomPriceCreateSchema,
@@ -64,7 +124,14 @@ from app.api.schemas import (
 )
 from app.api.utils import calculate_total_price
 
-router = APIRouter()
+if TYPE_CHECKING:
+    from app.api.waiting_room import WaitingRoom
+    from app.api.warmup import WarmUp
+
+router = APIRouter(route_class=TracedRoute)
+
+# Products followed by one availability stream
+MAX_STREAMED_PRODUCTS = 50
 
 
 @router.get("/healthchecker")
@@ -78,6 +145,52 @@ def healthcheck_route() -> dict:
     return {"message": "API is Live"}
 
 
+@router.get("/readiness")
+def readiness_route(request: Request) -> dict:
+    """
+    Readiness endpoint for load balancers: unlike the health check, it
+    only succeeds once the worker has warmed up its caches, and fails
+    again while the worker shuts down.
+
+    Args:
+        request (Request): The request, for the warm-up of the app.
+
+    Returns:
+        dict: A dictionary containing a message indicating the API status.
+
+    Raises:
+        HTTPException: If the worker is not ready, a 503 error is raised.
+    """
+    warmup: Optional["WarmUp"] = getattr(request.app.state, "warmup", None)
+    if getattr(request.app.state, "shutting_down", False):
+        raise HTTPException(status_code=503, detail="API is shutting down")
+    if warmup is not None and not warmup.ready:
+        raise HTTPException(status_code=503, detail="API is warming up")
+
+    return {"message": "API is Ready"}
+
+
+M = TypeVar("M", bound=SQLModel)
+
+
+def _matching(
+    load: Callable[[], Optional[M]],
+    key: Tuple[str, UUID],
+    validator: Optional[Validator],
+) -> Optional[M]:
+    # A row cached before a write of another worker is older than the
+    # validator sent with it: load it again, or a client would keep the
+    # stale body with 304s for the new ETag
+    record: Optional[M] = load()
+    if record is None or validator is None:
+        return record
+    if entity_validator(record).etag == validator.etag:
+        return record
+    entity_cache.invalidate(key)
+
+    return load()
+
+
 # Product Routes
 
 
@@ -102,16 +215,26 @@ def create_product_route(
     return create_product(session=session, product=product)
 
 
-@router.get("/products/{product_id}", response_model=ProductSchema)
+@router.get(
+    "/products/{product_id}",
+    response_model=ProductSchema,
+    responses=NOT_MODIFIED,
+)
 def get_product_route(
+    request: Request,
     product_id: UUID,
     session: Session = Depends(get_session),
-) -> Product:
+) -> Response:
     """
     This route retrieves a product based on the provided `product_id`.
     If no product is found, a 404 error is raised.
 
+    The response carries an `ETag` and a `Last-Modified` header, and a
+    conditional request for an unchanged product gets a 304 after a
+    single aggregate query, without loading the product.
+
     Args:
+        request (Request): The request, for its conditional headers.
         product_id (UUID): The ID of the product to retrieve.
         session (Session): The database session for executing queries.
 
@@ -121,39 +244,178 @@ def get_product_route(
     Raises:
         HTTPException: If the product is not found, a 404 error is raised.
     """
-    product: Optional[Product] = get_product_by_id(
-        session=session,
-        product_id=product_id,
-    )
+    validator: Optional[Validator] = product_validator(session, product_id)
 
-    if not product:
-        raise HTTPException(
-            status_code=404,
-            detail="Product not found",
+    def render() -> Response:
+        product: Optional[Product] = _matching(
+            lambda: get_product_by_id(session=session, product_id=product_id),
+            ("products", product_id),
+            validator,
         )
 
-    return product
+        if not product:
+            raise HTTPException(
+                status_code=404,
+                detail="Product not found",
+            )
+
+        return FastJSONResponse(dump_trusted(ProductSchema, product))
+
+    if validator is None:
+        return render()
+
+    return conditional(request, validator, render)
 
 
-@router.get("/products", response_model=List[ProductSchema])
+def products_page(
+    catalog: Catalog,
+    page: int,
+    page_size: int,
+    use_msgpack: bool = False,
+    id_table: bool = False,
+) -> CompressedBody:
+    """
+    Render a page of `GET /products`, once per catalog version.
+
+    Args:
+        catalog (Catalog): The catalog read model.
+        page (int): The page number.
+        page_size (int): The number of products per page.
+        use_msgpack (bool): Render the compact MessagePack format.
+        id_table (bool): Replace the variant ids with their position in
+            a table, in the MessagePack format.
+
+    Returns:
+        CompressedBody: The rendered page.
+    """
+
+    def render() -> CompressedBody:
+        products = catalog.page(page, page_size)
+        if use_msgpack:
+            return CompressedBody.of(
+                MsgPackResponse(
+                    encode_products(catalog, products, id_table=id_table),
+                    id_table=id_table,
+                )
+            )
+
+        return CompressedBody.of(
+            FastJSONResponse([catalog.product_dict(p) for p in products])
+        )
+
+    return catalog.memo(
+        ("products", page, page_size, use_msgpack, id_table),
+        render,
+    )
+
+
+@router.get(
+    "/products",
+    response_model=List[ProductSchema],
+    responses={
+        200: {
+            "content": {MSGPACK_MEDIA_TYPE: {}},
+            "description": "JSON, or the compact MessagePack format "
+            "when requested with `Accept: application/msgpack`.",
+        },
+        **NOT_MODIFIED,
+    },
+)
 def get_all_products__route(
+    request: Request,
     session: Session = Depends(get_session),
     page: int = Query(1, ge=1),
     page_size: int = Query(10, le=100),
-) -> List[Product]:
+) -> Response:
     """
     This route retrieves all products from the database. The list of
-    products is returned as a response (serialised by the schema).
+    products is returned as a response (in the shape of the schema).
+
+    Products are read from the catalog read model, which is loaded with
+    one query per table and shared by every request until the catalog
+    changes. Clients preferring `application/msgpack` get the compact
+    format of `app.api.compact` instead, with variant ids dictionary
+    encoded when they ask for `application/msgpack; variant-ids=table`.
 
     Args:
+        request (Request): The request, for its `Accept` and conditional
+            headers.
         session (Session): The database session for executing queries.
         page (int): The page number used for the offset.
         page_size (int): The number of rows to limit the query.
 
     Returns:
-        List[Product]: A list of all products.
+        JSONResponse: A list of all products.
     """
-    return get_all_products(session=session, page=page, page_size=page_size)
+    catalog: Catalog = get_catalog(session)
+    use_msgpack, id_table = negotiate(request.headers.get("accept"))
+    body: CompressedBody = products_page(
+        catalog,
+        page,
+        page_size,
+        use_msgpack=use_msgpack,
+        id_table=id_table,
+    )
+
+    return conditional(
+        request,
+        catalog_validator(catalog, body),
+        lambda: body.response(request, headers={"Vary": "Accept"}),
+        headers={"Vary": "Accept, Accept-Encoding"},
+    )
+
+
+@router.get(
+    "/products/{product_id}/builder",
+    response_model=BuilderSchema,
+    responses=NOT_MODIFIED,
+)
+def get_product_builder_route(
+    request: Request,
+    product_id: UUID,
+    session: Session = Depends(get_session),
+) -> Response:
+    """
+    This route retrieves everything the product builder needs in one
+    response: the product with its parts and variants, the part of each
+    variant, the (symmetric) restrictions between variants and the
+    custom prices of each variant.
+
+    The response is rendered from the catalog read model once per catalog
+    version, then served from memory until the catalog changes.
+
+    Args:
+        request (Request): The request, for its `Accept-Encoding` and
+            conditional headers.
+        product_id (UUID): The ID of the product to build.
+        session (Session): The database session for executing queries.
+
+    Returns:
+        JSONResponse: The builder data of the product.
+
+    Raises:
+        HTTPException: If the product is not found, a 404 error is raised.
+    """
+    catalog: Catalog = get_catalog(session)
+    product: Optional[ProductRecord] = catalog.product(product_id)
+    if product is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Product not found",
+        )
+
+    def render() -> CompressedBody:
+        builder = catalog.builder_dict(product)
+        return CompressedBody.of(FastJSONResponse(builder))
+
+    body: CompressedBody = catalog.memo(("builder", product_id), render)
+
+    return conditional(
+        request,
+        catalog_validator(catalog, body),
+        lambda: body.response(request),
+        headers={"Vary": "Accept-Encoding"},
+    )
 
 
 @router.put("/products/{product_id}", response_model=ProductSchema)
@@ -255,16 +517,22 @@ def create_product_part_route(
     return create_product_part(session=session, part=part)
 
 
-@router.get("/product-parts/{part_id}", response_model=ProductPartSchema)
+@router.get(
+    "/product-parts/{part_id}",
+    response_model=ProductPartSchema,
+    responses=NOT_MODIFIED,
+)
 def get_product_part_route(
+    request: Request,
     part_id: UUID,
     session: Session = Depends(get_session),
-) -> ProductPart:
+) -> Response:
     """
     This route retrieves a product part based on the provided `part_id`.
     If no part is found, a 404 error is raised.
 
     Args:
+        request (Request): The request, for its conditional headers.
         part_id (UUID): The ID of the product part to retrieve.
         session (Session): The database session for executing queries.
 
@@ -274,34 +542,64 @@ def get_product_part_route(
     Raises:
         HTTPException: If the product part is not found, a 404 error is raised.
     """
-    part: Optional[ProductPart] = get_product_part_by_id(
-        session=session,
-        part_id=part_id,
-    )
-    if not part:
-        raise HTTPException(
-            status_code=404,
-            detail="Product part not found",
+    validator: Optional[Validator] = part_validator(session, part_id)
+
+    def render() -> Response:
+        part: Optional[ProductPart] = _matching(
+            lambda: get_product_part_by_id(session=session, part_id=part_id),
+            ("product_parts", part_id),
+            validator,
         )
+        if not part:
+            raise HTTPException(
+                status_code=404,
+                detail="Product part not found",
+            )
 
-    return part
+        return FastJSONResponse(dump_trusted(ProductPartSchema, part))
 
+    if validator is None:
+        return render()
 
-@router.get("/product-parts", response_model=List[ProductPartSchema])
+    return conditional(request, validator, render)
+
+
+@router.get(
+    "/product-parts",
+    response_model=List[ProductPartSchema],
+    responses=NOT_MODIFIED,
+)
 def get_all_product_parts_route(
+    request: Request,
     session: Session = Depends(get_session),
-) -> List[ProductPart]:
+) -> Response:
     """
-    This route retrieves all product parts from the database. The list of
-    product parts is returned as a response, serialised by the schema.
+    This route retrieves all product parts from the catalog read model.
+    The list of product parts is returned as a response, in the shape of
+    the schema.
 
     Args:
+        request (Request): The request, for its `Accept-Encoding` and
+            conditional headers.
         session (Session): The database session for executing operations.
 
     Returns:
-        List[ProductPart]: A list of all product parts.
+        JSONResponse: A list of all product parts.
     """
-    return get_all_product_parts(session=session)
+    catalog: Catalog = get_catalog(session)
+
+    def render() -> CompressedBody:
+        parts = [catalog.part_dict(p) for p in catalog.parts]
+        return CompressedBody.of(FastJSONResponse(parts))
+
+    body: CompressedBody = catalog.memo("product-parts", render)
+
+    return conditional(
+        request,
+        catalog_validator(catalog, body),
+        lambda: body.response(request),
+        headers={"Vary": "Accept-Encoding"},
+    )
 
 
 @router.put("/product-parts/{part_id}", response_model=ProductPartSchema)
@@ -398,16 +696,22 @@ def create_part_variant_route(
     return create_part_variant(session=session, variant=variant)
 
 
-@router.get("/part-variants/{variant_id}", response_model=PartVariantSchema)
+@router.get(
+    "/part-variants/{variant_id}",
+    response_model=PartVariantSchema,
+    responses=NOT_MODIFIED,
+)
 def get_part_variant_route(
+    request: Request,
     variant_id: UUID,
     session: Session = Depends(get_session),
-) -> PartVariant:
+) -> Response:
     """
     This route retrieves a part variant based on the provided `variant_id`.
     If no part variant is found, a 404 error is raised.
 
     Args:
+        request (Request): The request, for its conditional headers.
         variant_id (UUID): The ID of the part variant to retrieve.
         session (Session): The database session for executing queries.
 
@@ -417,34 +721,67 @@ def get_part_variant_route(
     Raises:
         HTTPException: If the part variant is not found, a 404 error is raised.
     """
-    variant: Optional[PartVariant] = get_part_variant_by_id(
-        session=session,
-        variant_id=variant_id,
-    )
-    if not variant:
-        raise HTTPException(
-            status_code=404,
-            detail="Part variant not found",
+    validator: Optional[Validator] = variant_validator(session, variant_id)
+
+    def render() -> Response:
+        variant: Optional[PartVariant] = _matching(
+            lambda: get_part_variant_by_id(
+                session=session,
+                variant_id=variant_id,
+            ),
+            ("part_variants", variant_id),
+            validator,
         )
+        if not variant:
+            raise HTTPException(
+                status_code=404,
+                detail="Part variant not found",
+            )
 
-    return variant
+        return FastJSONResponse(dump_trusted(PartVariantSchema, variant))
 
+    if validator is None:
+        return render()
 
-@router.get("/part-variants", response_model=List[PartVariantSchema])
+    return conditional(request, validator, render)
+
+
+@router.get(
+    "/part-variants",
+    response_model=List[PartVariantSchema],
+    responses=NOT_MODIFIED,
+)
 def get_all_part_variants_route(
+    request: Request,
     session: Session = Depends(get_session),
-) -> List[PartVariant]:
+) -> Response:
     """
-    This route retrieves all part variants from the database. The list of
-    part variants is returned as a response.
+    This route retrieves all part variants from the catalog read model.
+    The list of part variants is returned as a response, in the shape of
+    the schema.
 
     Args:
+        request (Request): The request, for its `Accept-Encoding` and
+            conditional headers.
         session (Session): The database session for executing operations.
 
     Returns:
-        List[PartVariant]: A list of all part variants.
+        JSONResponse: A list of all part variants.
     """
-    return get_all_part_variants(session=session)
+    catalog: Catalog = get_catalog(session)
+
+    def render() -> CompressedBody:
+        variants = [catalog.variant_dict(v) for v in catalog.variants]
+        return CompressedBody.of(FastJSONResponse(variants))
+
+    body: CompressedBody = catalog.memo("part-variants", render)
+
+    return conditional(
+        request,
+        catalog_validator(catalog, body),
+        lambda: body.response(request),
+        headers={"Vary": "Accept-Encoding"},
+    )
 
 
 @router.put("/part-variants/{variant_id}", response_model=PartVariantSchema)
@@ -543,17 +880,20 @@ def create_variant_dependency_route(
 @router.get(
     "/variant-dependencies/{variant_id}",
     response_model=VariantDependencySchema,
+    responses=NOT_MODIFIED,
 )
 def get_variant_dependency_route(
+    request: Request,
     variant_id: UUID,
     session: Session = Depends(get_session),
-) -> VariantDependency:
+) -> Response:
     """
     This route retrieves a variant dependency based on the provided
     `variant_id`.
     If no variant dependency is found, a 404 error is raised.
 
     Args:
+        request (Request): The request, for its conditional headers.
         variant_id (UUID): The ID of the variant dependency to retrieve.
         session (Session): The database session for executing operations.
 
@@ -564,37 +904,69 @@ def get_variant_dependency_route(
         HTTPException: If the variant dependency is not found, a 404
             error is raised.
     """
-    dependency: Optional[VariantDependency] = get_variant_dependency_by_id(
-        session=session,
-        variant_id=variant_id,
+    validator: Optional[Validator] = row_validator(
+        session,
+        VariantDependency,
+        VariantDependency.variant_id,
+        variant_id,
     )
-    if not dependency:
-        raise HTTPException(
-            status_code=404,
-            detail="Variant dependency not found",
+
+    def render() -> Response:
+        dependency: Optional[VariantDependency] = _matching(
+            lambda: get_variant_dependency_by_id(
+                session=session,
+                variant_id=variant_id,
+            ),
+            ("variant_dependencies", variant_id),
+            validator,
         )
+        if not dependency:
+            raise HTTPException(
+                status_code=404,
+                detail="Variant dependency not found",
+            )
+
+        rendered = dump_trusted(VariantDependencySchema, dependency)
+        return FastJSONResponse(rendered)
 
-    return dependency
+    if validator is None:
+        return render()
+
+    return conditional(request, validator, render)
 
 
 @router.get(
     "/variant-dependencies",
     response_model=List[VariantDependencySchema],
+    responses=NOT_MODIFIED,
 )
 def get_all_variant_dependencies_route(
+    request: Request,
     session: Session = Depends(get_session),
-) -> List[VariantDependency]:
+) -> Response:
     """
     This route retrieves all variant dependencies from the database.
     The list of variant dependencies is returned as a response.
 
     Args:
+        request (Request): The request, for its conditional headers.
         session (Session): The database session for executing operations.
 
     Returns:
         List[VariantDependency]: A list of all variant dependencies.
     """
-    return get_all_variant_dependencies(session=session)
+    validator: Validator = table_validator(session, VariantDependency)
+
+    def render() -> Response:
+        dependencies = get_all_variant_dependencies(session=session)
+        return FastJSONResponse(
+            [
+                dump_trusted(VariantDependencySchema, dependency)
+                for dependency in dependencies
+            ]
+        )
+
+    return conditional(request, validator, render)
 
 
 @router.put(
@@ -700,17 +1072,20 @@ def create_custom_price_route(
 @router.get(
     "/custom-prices/{custom_price_id}",
     response_model=CustomPriceSchema,
+    responses=NOT_MODIFIED,
 )
 def get_custom_price_route(
+    request: Request,
     custom_price_id: UUID,
     session: Session = Depends(get_session),
-) -> CustomPrice:
+) -> Response:
     """
     This route retrieves a custom price based on the provided
     `custom_price_id`.
     If no custom price is found, a 404 error is raised.
 
     Args:
+        request (Request): The request, for its conditional headers.
         custom_price_id (UUID): The ID of the custom price to retrieve.
         session (Session): The database session for executing operations.
 
@@ -721,34 +1096,67 @@ def get_custom_price_route(
         HTTPException: If the custom price is not found, a 404 error
             is raised.
     """
-    custom_price: Optional[CustomPrice] = get_custom_price_by_id(
-        session=session,
-        custom_price_id=custom_price_id,
+    validator: Optional[Validator] = row_validator(
+        session,
+        CustomPrice,
+        CustomPrice.id,
+        custom_price_id,
     )
-    if not custom_price:
-        raise HTTPException(
-            status_code=404,
-            detail="Custom price not found",
+
+    def render() -> Response:
+        custom_price: Optional[CustomPrice] = _matching(
+            lambda: get_custom_price_by_id(
+                session=session,
+                custom_price_id=custom_price_id,
+            ),
+            ("custom_prices", custom_price_id),
+            validator,
         )
+        if not custom_price:
+            raise HTTPException(
+                status_code=404,
+                detail="Custom price not found",
+            )
 
-    return custom_price
+        return FastJSONResponse(dump_trusted(CustomPriceSchema, custom_price))
 
+    if validator is None:
+        return render()
 
-@router.get("/custom-prices", response_model=List[CustomPriceSchema])
+    return conditional(request, validator, render)
+
+
+@router.get(
+    "/custom-prices",
+    response_model=List[CustomPriceSchema],
+    responses=NOT_MODIFIED,
+)
 def get_all_custom_prices_route(
+    request: Request,
     session: Session = Depends(get_session),
-) -> List[CustomPrice]:
+) -> Response:
     """
     This route retrieves all custom prices from the database. The list of
     custom prices is returned as a response.
 
     Args:
+        request (Request): The request, for its conditional headers.
         session (Session): The database session for executing operations.
 
     Returns:
         List[CustomPrice]: A list of all custom prices.
     """
-    return get_all_custom_prices(session=session)
+    validator: Validator = table_validator(session, CustomPrice)
+
+    def render() -> Response:
+        return FastJSONResponse(
+            [
+                dump_trusted(CustomPriceSchema, custom_price)
+                for custom_price in get_all_custom_prices(session=session)
+            ]
+        )
+
+    return conditional(request, validator, render)
 
 
 @router.put(
@@ -825,12 +1233,314 @@ def delete_custom_price_route(
         )
 
 
+# Change Feed Routes
+
+
+@router.get("/changes", response_model=ChangesSchema)
+async def get_changes_route(
+    since: Optional[int] = Query(None, ge=0),
+    limit: int = Query(500, ge=1, le=1000),
+    wait: float = Query(0.0, ge=0.0, le=settings.CHANGES_MAX_WAIT),
+    session: Session = Depends(get_session),
+) -> FastJSONResponse:
+    """
+    This route retrieves the writes made to the catalog after the change
+    `since`, oldest first, so consumers can sync the catalog from the
+    changes alone instead of fetching it again.
+
+    Upserts carry every column of the row, deletes only its ID. With
+    `wait`, the request waits up to that many seconds for a change when
+    there is none yet (long-polling). Without `since`, only the current
+    position is returned: the `since` to start from after fetching the
+    whole catalog.
+
+    Changes are only kept for a while: when changes made after `since`
+    were pruned, the response is a `410` with the `seq` to resume from
+    once the whole catalog has been fetched again.
+
+    Args:
+        since (Optional[int]): The `seq` of the last change seen.
+        limit (int): The maximum number of changes returned.
+        wait (float): The maximum number of seconds to wait for a change.
+        session (Session): The database session for executing queries.
+
+    Returns:
+        JSONResponse: The changes and the `seq` to resume from.
+    """
+    position, changes = await wait_for_changes(
+        session,
+        since,
+        limit,
+        wait,
+        poll_interval=settings.CHANGES_POLL_INTERVAL,
+    )
+    if since is not None and await run_in_threadpool(
+        changes_pruned,
+        session,
+        since,
+        changes,
+    ):
+        position, _ = await run_in_threadpool(read_changes, session, None, 0)
+        return FastJSONResponse(
+            {"detail": "Changes were pruned, resync", "seq": position},
+            status_code=410,
+        )
+
+    return FastJSONResponse(render_changes(position, changes, limit))
+
+
+@router.get(
+    "/availability/stream",
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "content": {"text/event-stream": {}},
+            "description": "Server-Sent Events, each an `availability` "
+            "batch of `products` and `variants` by ID.",
+        },
+        404: {"description": "A product is not found."},
+    },
+)
+async def stream_availability_route(
+    request: Request,
+    product_id: List[UUID] = Query(...),
+    session: Session = Depends(get_session),
+) -> StreamingResponse:
+    """
+    This route pushes the stock and availability of products, and of
+    their variants, as Server-Sent Events.
+
+    The first event has the current availability of every product and
+    variant followed, read from the database, the next ones only what
+    changed after it. Updates made close together are sent as one event.
+
+    Args:
+        request (Request): The request.
+        product_id (List[UUID]): The IDs of the products to follow, up to
+            `MAX_STREAMED_PRODUCTS`.
+        session (Session): The database session for executing queries.
+
+    Returns:
+        StreamingResponse: The event stream.
+
+    Raises:
+        HTTPException: If a product is not found, a 404 error is raised.
+    """
+    product_ids: FrozenSet[UUID] = frozenset(product_id)
+    if len(product_ids) > MAX_STREAMED_PRODUCTS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Follow at most {MAX_STREAMED_PRODUCTS} products",
+        )
+
+    # From the database, not the cached catalog: the stream starts from
+    # the position of the change log the snapshot was read at
+    read: Optional[Tuple[int, Dict[str, Dict[str, Any]]]]
+    read = await run_in_threadpool(read_availability, session, product_ids)
+    if read is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Product not found",
+        )
+    position, snapshot = read
+
+    broadcaster: AvailabilityBroadcaster = request.app.state.availability
+    subscriber = await broadcaster.subscribe(
+        product_ids,
+        snapshot,
+        since=position,
+    )
+
+    return StreamingResponse(
+        broadcaster.events(subscriber),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# Configurator routes
+
+
+async def _send(websocket: WebSocket, message: Dict[str, Any]) -> None:
+    await websocket.send_text(orjson.dumps(message).decode())
+
+
+@router.websocket("/configurator/{product_id}")
+async def configurator_route(
+    websocket: WebSocket,
+    product_id: UUID,
+    session: Session = Depends(get_session),
+) -> None:
+    """
+    This WebSocket holds the configuration of a product server-side and
+    prices it as the client builds it.
+
+    The first message is the `state` of the configuration. The client
+    then sends `{"type": "select", "variant_id": ...}` or
+    `{"type": "undo"}` messages, each answered with a `priced` message:
+    the part changed, the price delta, the new total, and the variants
+    newly disabled or enabled again by restrictions. Messages that cannot
+    be applied are answered with an `error` message. When the prices of
+    the product change, the configuration is priced again and its new
+    `state` sent before the next reply. The catalog is checked on writes
+    of this worker, and once per `CATALOG_CACHE_TTL` for the others.
+
+    Args:
+        websocket (WebSocket): The WebSocket.
+        product_id (UUID): The ID of the product configured.
+        session (Session): The database session, used only to load the
+            catalog when it changes.
+
+    Raises:
+        WebSocketException: If the product is not found, the connection
+        is closed with a policy violation.
+    """
+
+    async def load() -> Catalog:
+        try:
+            return await run_in_threadpool(get_catalog, session)
+        finally:
+            # The session can stay open for hours, without a connection
+            session.rollback()
+
+    # The generation of the loaded catalog, its own version is that of
+    # the snapshot when the catalog is shared through one
+    generation: int = catalog_cache.generation
+    catalog: Catalog = await load()
+    loaded_at: float = time.monotonic()
+    product: Optional[ProductRecord] = catalog.product(product_id)
+    if product is None:
+        raise WebSocketException(
+            code=status.WS_1008_POLICY_VIOLATION,
+            reason="Product not found",
+        )
+    configuration = Configuration(pricing_index(catalog, product))
+
+    await websocket.accept()
+    await _send(websocket, configuration.state())
+    try:
+        while True:
+            message: str = await websocket.receive_text()
+
+            # Written by this worker, or possibly by another one once the
+            # cache reloads the catalog, keeping the same generation
+            if (
+                catalog_cache.generation != generation
+                or time.monotonic() - loaded_at >= catalog_cache.ttl
+            ):
+                generation = catalog_cache.generation
+                catalog = await load()
+                loaded_at = time.monotonic()
+                product = catalog.product(product_id)
+                if product is None:
+                    await websocket.close(
+                        code=status.WS_1008_POLICY_VIOLATION,
+                        reason="Product not found",
+                    )
+                    return
+                index = pricing_index(catalog, product)
+                if index is configuration.index:
+                    # The same catalog, i.e. the snapshot was not replaced
+                    pass
+                elif index.same_prices(configuration.index):
+                    configuration.index = index
+                else:
+                    await _send(websocket, configuration.reprice(index))
+
+            await _send(websocket, configuration.handle(message))
+    except WebSocketDisconnect:
+        pass
+
+
+# Waiting room routes
+
+
+def _waiting_room(request: Request, product_id: UUID) -> "WaitingRoom":
+    waiting_room: Optional["WaitingRoom"] = getattr(
+        request.app.state, "waiting_room", None
+    )
+    if waiting_room is None or not waiting_room.queued(product_id):
+        raise HTTPException(
+            status_code=404,
+            detail="Product not in queue mode",
+        )
+
+    return waiting_room
+
+
+@router.post("/waiting-room/{product_id}", status_code=201)
+def join_waiting_room_route(
+    request: Request,
+    product_id: UUID,
+) -> Dict[str, Any]:
+    """
+    Join the waiting room of a product in queue mode (a flash sale).
+
+    The ticket returned holds the `token` to poll the status with, every
+    `retry_after` seconds, and to send in the `X-Waiting-Room-Token`
+    header of the cart once admitted.
+
+    Args:
+        request (Request): The request, for the waiting room of the app.
+        product_id (UUID): The ID of the product.
+
+    Returns:
+        Dict[str, Any]: The status of the ticket, with its position in
+            the queue and an estimate of the seconds left.
+
+    Raises:
+        HTTPException: If the product is not in queue mode, a 404 error
+        is raised.
+    """
+    return _waiting_room(request, product_id).join(product_id)
+
+
+@router.get("/waiting-room/{product_id}/{token}")
+def get_waiting_room_ticket_route(
+    request: Request,
+    product_id: UUID,
+    token: UUID,
+    session: Session = Depends(get_session),
+) -> Dict[str, Any]:
+    """
+    Get the status of a ticket of the waiting room of a product:
+    `waiting` (with its position and an estimate of the seconds left),
+    `admitted` (until `expires_at`), `used` or `expired`.
+
+    Args:
+        request (Request): The request, for the waiting room of the app.
+        product_id (UUID): The ID of the product.
+        token (UUID): The token of the ticket.
+        session (Session): The database session, used only for tickets
+            this worker does not know yet.
+
+    Returns:
+        Dict[str, Any]: The status of the ticket.
+
+    Raises:
+        HTTPException: If the product is not in queue mode or the ticket
+        is not found, a 404 error is raised.
+    """
+    waiting_room: "WaitingRoom" = _waiting_room(request, product_id)
+    ticket: Optional[Dict[str, Any]] = waiting_room.status(
+        product_id,
+        token,
+        session=session,
+    )
+    if ticket is None:
+        raise HTTPException(status_code=404, detail="Ticket not found")
+
+    return ticket
+
+
 # Carts routes
 
 
 @router.post("/carts", response_model=CartSchema)
 def create_cart_with_items_route(
+    request: Request,
     cart_data: CartCreateSchema,
+    x_waiting_room_token: Optional[List[UUID]] = Header(None),
     session: Session = Depends(get_session),
 ) -> Cart:
     """
@@ -841,18 +1551,42 @@ def create_cart_with_items_route(
     CartItem objects. After the cart is created and the items are added, the
     created cart is returned.
 
+    The items of products in queue mode need an admitted ticket of their
+    waiting room, sent in an `X-Waiting-Room-Token` header (one per
+    product). The tickets are used by the cart, in the same transaction.
+
     Args:
+        request (Request): The request, for the waiting room of the app.
         cart_data (CartCreateSchema): An object for a Cart and a list of
             CartItem objects to be added to the cart.
+        x_waiting_room_token (Optional[List[UUID]]): The tokens of the
+            admitted tickets.
         session (Session): The database session for executing operations.
 
     Returns:
         Cart: The newly created cart with the added items.
 
     Raises:
-        HTTPException: If an error occurs during cart creation or item
-        addition, a 400 error with the exception message is raised.
+        HTTPException: If a product in queue mode has no admitted ticket,
+        a 403 error is raised. If an error occurs during cart creation or
+        item addition, a 400 error with the exception message is raised.
     """
+    waiting_room: Optional["WaitingRoom"] = getattr(
+        request.app.state, "waiting_room", None
+    )
+    if waiting_room is not None:
+        tokens: List[UUID] = x_waiting_room_token or []
+        for product_id in {item.product_id for item in cart_data.items}:
+            if waiting_room.queued(product_id) and not any(
+                waiting_room.consume_ticket(session, product_id, token)
+                for token in tokens
+            ):
+                session.rollback()
+                raise HTTPException(
+                    status_code=403,
+                    detail="Product in queue mode, join its waiting room",
+                )
+
     try:
         cart: Cart = create_cart_with_items(
             session=session,
@@ -868,7 +1602,7 @@ def create_cart_with_items_route(
 # Pricing routes
 
 
-@router.post("/calculate-price", response_model=float)
+@router.post("/calculate-price", response_model=Dict[str, float])
 def calculate_total_price_route(
     product_id: UUID,
     variant_ids: List[UUID],
@@ -892,10 +1626,15 @@ def calculate_total_price_route(
         dict: A dictionary containing the total price of the product as
             a float.
     """
-    total_price: float = calculate_total_price(
-        session=session,
-        product_id=product_id,
-        selected_variant_ids=variant_ids,
+    # Identical concurrent requests share a single calculation, the
+    # variant order does not change the total so it is normalised away.
+    total_price: float = price_flight.do(
+        (product_id, tuple(sorted(variant_ids))),
+        lambda: calculate_total_price(
+            session=session,
+            product_id=product_id,
+            selected_variant_ids=variant_ids,
+        ),
     )
 
     return {"message": total_price}
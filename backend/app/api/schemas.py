@@ -1,7 +1,7 @@
 # app/api/schemas.py
 
 from uuid import UUID
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 from datetime import datetime
 
 from pydantic import BaseModel
@@ -63,6 +63,7 @@ class CartSchema(BaseSchema):
 
     purchased: bool
     total_price: float
+    email: Optional[str] = None
 
     items: Optional[List[CartItemSchema]] = []
 
@@ -74,6 +75,7 @@ class CartCreateSchema(BaseModel):
 
     purchased: bool
     total_price: float
+    email: Optional[str] = None
 
     items: List[CartItemCreateSchema]
 
@@ -85,6 +87,7 @@ class CartUpdateSchema(BaseModel):
 
     purchased: Optional[bool] = None
     total_price: Optional[float] = None
+    email: Optional[str] = None
 
 
 class VariantDependencySchema(BaseModel):
@@ -254,3 +257,71 @@ class ProductUpdateSchema(BaseModel):
     is_custom: Optional[bool] = None
     is_available: Optional[bool] = None
     stock_quantity: Optional[int] = None
+
+
+class BuilderCustomPriceSchema(BaseModel):
+    """
+    Schema for a custom price in the product builder, with the part of
+    the dependent variant.
+    """
+
+    dependent_variant_id: UUID
+    dependent_part_id: UUID
+    custom_price: float
+
+
+class BuilderSchema(BaseModel):
+    """
+    Schema for everything the product builder needs, with lookups keyed
+    by variant id.
+
+    Attributes:
+        product (ProductSchema): The product, its parts and variants.
+        variant_parts (Dict[UUID, UUID]): The part of each variant.
+        restrictions (Dict[UUID, List[UUID]]): The variants each variant
+            is incompatible with, in both directions.
+        custom_prices (Dict[UUID, List[BuilderCustomPriceSchema]]): The
+            prices added to each variant when a dependent variant is
+            selected too.
+    """
+
+    product: ProductSchema
+    variant_parts: Dict[UUID, UUID]
+    restrictions: Dict[UUID, List[UUID]]
+    custom_prices: Dict[UUID, List[BuilderCustomPriceSchema]]
+
+
+class ChangeSchema(BaseModel):
+    """
+    Schema for a write to the catalog in the change log.
+
+    Attributes:
+        seq (int): The position of the change in the log.
+        entity (str): The table of the row (i.e. "part_variants").
+        id (UUID): The ID of the row (the variant ID for dependencies).
+        op (str): "upsert" or "delete".
+        data (Optional[Dict[str, Any]]): The columns of the row after an
+            upsert, None for deletes.
+    """
+
+    seq: int
+    entity: str
+    id: UUID
+    op: str
+    data: Optional[Dict[str, Any]] = None
+
+
+class ChangesSchema(BaseModel):
+    """
+    Schema for a page of the change log.
+
+    Attributes:
+        seq (int): The position to resume from, the `since` of the next
+            request.
+        more (bool): Whether more changes may follow without waiting.
+        changes (List[ChangeSchema]): The changes, oldest first.
+    """
+
+    seq: int
+    more: bool
+    changes: List[ChangeSchema]
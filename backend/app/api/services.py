@@ -1,12 +1,35 @@
 # app/api/services.py
 
+from collections import Counter
+from functools import partial
 from uuid import UUID
-from typing import Optional, List, Sequence
+from typing import (
+    Any,
+    Dict,
+    Optional,
+    List,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+    TypeVar,
+)
 
-from sqlmodel import select
+from sqlalchemy import case, update
+from sqlalchemy.orm import selectinload
+from sqlmodel import SQLModel, select
 from sqlmodel.sql._expression_select_cls import SelectOfScalar
 
 from app.database import Session
+from app.api.cache import (
+    entity_cache,
+    invalidate_catalog,
+    stock_invalidations,
+)
+from app.api.changes import record_change
+from app.api.outbox import AfterCommit, Handler, enqueue, outbox_notifier
+from app.mailer import Mailer
+from app.tracing import traced
 from app.api.models import (
     Cart,
     CartItem,
@@ -30,9 +53,94 @@ from app.api.schemas import (
     VariantDependencyUpdateSchema,
 )
 
+M = TypeVar("M", bound=SQLModel)
+
+# The children rendered with a variant, loaded with it when it is cached
+_VARIANT_CHILDREN: Tuple[Any, ...] = (
+    selectinload(getattr(PartVariant, "dependencies")),
+    selectinload(getattr(PartVariant, "custom_prices")),
+)
+_PART_CHILDREN: Tuple[Any, ...] = (
+    selectinload(getattr(ProductPart, "variants")).options(*_VARIANT_CHILDREN),
+)
+_PRODUCT_CHILDREN: Tuple[Any, ...] = (
+    selectinload(getattr(Product, "parts")).options(*_PART_CHILDREN),
+)
+
+
+def _cached(
+    session: Session,
+    model: Type[M],
+    column: Any,
+    value: UUID,
+    children: Tuple[Any, ...] = (),
+) -> Optional[M]:
+    """
+    Get a catalog row through `entity_cache`, loading it on a miss with
+    the children its schema renders.
+
+    Rows are loaded by a session of their own, in the transaction of
+    `session`, and detached from it: the rows returned are shared with
+    other requests and must only be read.
+
+    Args:
+        session (Session): The database session.
+        model (Type[M]): The model of the row.
+        column (Any): The column identifying the row.
+        value (UUID): The value of `column`.
+        children (Tuple[Any, ...]): The loader options of its children.
+
+    Returns:
+        Optional[M]: The row if found, otherwise None.
+    """
+    statement = select(model).where(column == value).options(*children)
+
+    def load() -> Optional[M]:
+        with Session(bind=session.connection()) as loader:
+            return loader.exec(statement).first()
+
+    table: str = str(getattr(model, "__tablename__"))
+
+    return entity_cache.get_or_load((table, value), load)
+
+
+def _cache_keys(session: Session, record: SQLModel) -> Set[Tuple[str, Any]]:
+    """
+    Get the keys of the cached rows rendering a catalog row: its own and,
+    as rows are cached with their children, those of its parents.
+
+    Args:
+        session (Session): The database session.
+        record (SQLModel): The row.
+
+    Returns:
+        Set[Tuple[str, Any]]: The keys in `entity_cache`.
+    """
+    if isinstance(record, Product):
+        return {("products", record.id)}
+    if isinstance(record, ProductPart):
+        return {("product_parts", record.id), ("products", record.product_id)}
+
+    parent: Optional[SQLModel]
+    if isinstance(record, PartVariant):
+        key = ("part_variants", record.id)
+        parent = session.get(ProductPart, record.part_id)
+    elif isinstance(record, VariantDependency):
+        key = ("variant_dependencies", record.variant_id)
+        parent = session.get(PartVariant, record.variant_id)
+    elif isinstance(record, CustomPrice):
+        key = ("custom_prices", record.id)
+        parent = session.get(PartVariant, record.variant_id)
+    else:
+        return set()
+
+    return {key} | (_cache_keys(session, parent) if parent else set())
+
+
 # Products CRUD
 
 
+@traced
 def create_product(
     session: Session,
     product: ProductCreateSchema,
@@ -50,12 +158,15 @@ def create_product(
     created_product = Product(**product.model_dump())
 
     session.add(created_product)
+    record_change(session, created_product)
     session.commit()
+    invalidate_catalog()
     session.refresh(created_product)
 
     return created_product
 
 
+@traced
 def get_product_by_id(
     session: Session,
     product_id: UUID,
@@ -70,9 +181,16 @@ def get_product_by_id(
     Returns:
         Optional[Product]: The product object if found, otherwise None.
     """
-    return session.get(Product, product_id)
+    return _cached(
+        session,
+        Product,
+        Product.id,
+        product_id,
+        _PRODUCT_CHILDREN,
+    )
 
 
+@traced
 def get_all_products(
     session: Session,
     page: int = 1,
@@ -105,6 +223,7 @@ def get_all_products(
     return list(products)
 
 
+@traced
 def update_product(
     session: Session,
     product_id: UUID,
@@ -125,15 +244,21 @@ def update_product(
     if not product:
         return None
 
+    # The cached rows rendering it, before and after the update
+    keys: Set[Tuple[str, Any]] = _cache_keys(session, product)
     for key, value in product_data.model_dump(exclude_unset=True).items():
         setattr(product, key, value)
+    keys |= _cache_keys(session, product)
 
+    record_change(session, product)
     session.commit()
+    invalidate_catalog(*keys)
     session.refresh(product)
 
     return product
 
 
+@traced
 def delete_product(
     session: Session,
     product_id: UUID,
@@ -152,8 +277,11 @@ def delete_product(
     if not product:
         return False
 
+    keys: Set[Tuple[str, Any]] = _cache_keys(session, product)
+    record_change(session, product, deleted=True)
     session.delete(product)
     session.commit()
+    invalidate_catalog(*keys)
 
     return True
 
@@ -161,6 +289,7 @@ def delete_product(
 # Product Parts CRUD
 
 
+@traced
 def create_product_part(
     session: Session,
     part: ProductPartCreateSchema,
@@ -179,12 +308,17 @@ def create_product_part(
     created_part = ProductPart(**part.model_dump())
 
     session.add(created_part)
+    record_change(session, created_part)
+    # Its parents are cached with their children
+    keys: Set[Tuple[str, Any]] = _cache_keys(session, created_part)
     session.commit()
+    invalidate_catalog(*keys)
     session.refresh(created_part)
 
     return created_part
 
 
+@traced
 def update_product_part(
     session: Session,
     part_id: UUID,
@@ -206,15 +340,21 @@ def update_product_part(
     if not part:
         return None
 
+    # The cached rows rendering it, before and after the update
+    keys: Set[Tuple[str, Any]] = _cache_keys(session, part)
     for key, value in part_data.model_dump(exclude_unset=True).items():
         setattr(part, key, value)
+    keys |= _cache_keys(session, part)
 
+    record_change(session, part)
     session.commit()
+    invalidate_catalog(*keys)
     session.refresh(part)
 
     return part
 
 
+@traced
 def get_product_part_by_id(
     session: Session,
     part_id: UUID,
@@ -230,9 +370,16 @@ def get_product_part_by_id(
         Optional[ProductPart]: The product part object if found, otherwise
             None.
     """
-    return session.get(ProductPart, part_id)
+    return _cached(
+        session,
+        ProductPart,
+        ProductPart.id,
+        part_id,
+        _PART_CHILDREN,
+    )
 
 
+@traced
 def get_all_product_parts(
     session: Session,
 ) -> List[ProductPart]:
@@ -251,6 +398,7 @@ def get_all_product_parts(
     return list(product_parts)
 
 
+@traced
 def delete_product_part(
     session: Session,
     part_id: UUID,
@@ -272,8 +420,11 @@ def delete_product_part(
     if not part:
         return False
 
+    keys: Set[Tuple[str, Any]] = _cache_keys(session, part)
+    record_change(session, part, deleted=True)
     session.delete(part)
     session.commit()
+    invalidate_catalog(*keys)
 
     return True
 
@@ -281,6 +432,7 @@ def delete_product_part(
 # Part Variants CRUD
 
 
+@traced
 def create_part_variant(
     session: Session,
     variant: PartVariantCreateSchema,
@@ -299,12 +451,17 @@ def create_part_variant(
     created_variant = PartVariant(**variant.model_dump())
 
     session.add(created_variant)
+    record_change(session, created_variant)
+    # Its parents are cached with their children
+    keys: Set[Tuple[str, Any]] = _cache_keys(session, created_variant)
     session.commit()
+    invalidate_catalog(*keys)
     session.refresh(created_variant)
 
     return created_variant
 
 
+@traced
 def get_part_variant_by_id(
     session: Session,
     variant_id: UUID,
@@ -320,9 +477,16 @@ def get_part_variant_by_id(
         Optional[PartVariant]: The part variant object if found,
             otherwise None.
     """
-    return session.get(PartVariant, variant_id)
+    return _cached(
+        session,
+        PartVariant,
+        PartVariant.id,
+        variant_id,
+        _VARIANT_CHILDREN,
+    )
 
 
+@traced
 def get_all_part_variants(
     session: Session,
 ) -> List[PartVariant]:
@@ -341,6 +505,7 @@ def get_all_part_variants(
     return list(part_variants)
 
 
+@traced
 def update_part_variant(
     session: Session,
     variant_id: UUID,
@@ -365,15 +530,21 @@ def update_part_variant(
     if not variant:
         return None
 
+    # The cached rows rendering it, before and after the update
+    keys: Set[Tuple[str, Any]] = _cache_keys(session, variant)
     for key, value in variant_data.model_dump(exclude_unset=True).items():
         setattr(variant, key, value)
+    keys |= _cache_keys(session, variant)
 
+    record_change(session, variant)
     session.commit()
+    invalidate_catalog(*keys)
     session.refresh(variant)
 
     return variant
 
 
+@traced
 def delete_part_variant(
     session: Session,
     variant_id: UUID,
@@ -396,8 +567,11 @@ def delete_part_variant(
     if not variant:
         return False
 
+    keys: Set[Tuple[str, Any]] = _cache_keys(session, variant)
+    record_change(session, variant, deleted=True)
     session.delete(variant)
     session.commit()
+    invalidate_catalog(*keys)
 
     return True
 
@@ -405,6 +579,7 @@ def delete_part_variant(
 # Variant Dependencies CRUD
 
 
+@traced
 def create_variant_dependency(
     session: Session,
     dependency: VariantDependencyCreateSchema,
@@ -424,12 +599,17 @@ def create_variant_dependency(
     created_dependency = VariantDependency(**dependency.model_dump())
 
     session.add(created_dependency)
+    record_change(session, created_dependency)
+    # Its parents are cached with their children
+    keys: Set[Tuple[str, Any]] = _cache_keys(session, created_dependency)
     session.commit()
+    invalidate_catalog(*keys)
     session.refresh(created_dependency)
 
     return created_dependency
 
 
+@traced
 def get_variant_dependency_by_id(
     session: Session,
     variant_id: UUID,
@@ -445,9 +625,15 @@ def get_variant_dependency_by_id(
         Optional[VariantDependency]: The variant dependency object
             if found, otherwise None.
     """
-    return session.get(VariantDependency, variant_id)
+    return _cached(
+        session,
+        VariantDependency,
+        VariantDependency.variant_id,
+        variant_id,
+    )
 
 
+@traced
 def get_all_variant_dependencies(
     session: Session,
 ) -> List[VariantDependency]:
@@ -468,6 +654,7 @@ def get_all_variant_dependencies(
     return list(variant_dependencies)
 
 
+@traced
 def update_variant_dependency(
     session: Session,
     variant_id: UUID,
@@ -493,15 +680,21 @@ def update_variant_dependency(
     if not dependency:
         return None
 
+    # The cached rows rendering it, before and after the update
+    keys: Set[Tuple[str, Any]] = _cache_keys(session, dependency)
     for key, value in dependency_data.model_dump(exclude_unset=True).items():
         setattr(dependency, key, value)
+    keys |= _cache_keys(session, dependency)
 
+    record_change(session, dependency)
     session.commit()
+    invalidate_catalog(*keys)
     session.refresh(dependency)
 
     return dependency
 
 
+@traced
 def delete_variant_dependency(
     session: Session,
     variant_id: UUID,
@@ -524,8 +717,11 @@ def delete_variant_dependency(
     if not dependency:
         return False
 
+    keys: Set[Tuple[str, Any]] = _cache_keys(session, dependency)
+    record_change(session, dependency, deleted=True)
     session.delete(dependency)
     session.commit()
+    invalidate_catalog(*keys)
 
     return True
 
@@ -533,6 +729,7 @@ def delete_variant_dependency(
 # Custom Prices CRUD
 
 
+@traced
 def create_custom_price(
     session: Session,
     custom_price: CustomPriceCreateSchema,
@@ -551,12 +748,17 @@ def create_custom_price(
     created_custom_price = CustomPrice(**custom_price.model_dump())
 
     session.add(created_custom_price)
+    record_change(session, created_custom_price)
+    # Its parents are cached with their children
+    keys: Set[Tuple[str, Any]] = _cache_keys(session, created_custom_price)
     session.commit()
+    invalidate_catalog(*keys)
     session.refresh(created_custom_price)
 
     return created_custom_price
 
 
+@traced
 def get_custom_price_by_id(
     session: Session,
     custom_price_id: UUID,
@@ -572,9 +774,12 @@ def get_custom_price_by_id(
         Optional[CustomPrice]: The custom price object if found,
             otherwise None.
     """
-    return session.get(CustomPrice, custom_price_id)
+    # The primary key also spans both variants, so `session.get` cannot
+    # find a custom price by its ID alone
+    return _cached(session, CustomPrice, CustomPrice.id, custom_price_id)
 
 
+@traced
 def get_all_custom_prices(
     session: Session,
 ) -> List[CustomPrice]:
@@ -593,6 +798,7 @@ def get_all_custom_prices(
     return list(custom_prices)
 
 
+@traced
 def update_custom_price(
     session: Session,
     custom_price_id: UUID,
@@ -617,15 +823,21 @@ def update_custom_price(
     if not custom_price:
         return None
 
+    # The cached rows rendering it, before and after the update
+    keys: Set[Tuple[str, Any]] = _cache_keys(session, custom_price)
     for key, value in custom_price_data.model_dump(exclude_unset=True).items():
         setattr(custom_price, key, value)
+    keys |= _cache_keys(session, custom_price)
 
+    record_change(session, custom_price)
     session.commit()
+    invalidate_catalog(*keys)
     session.refresh(custom_price)
 
     return custom_price
 
 
+@traced
 def delete_custom_price(
     session: Session,
     custom_price_id: UUID,
@@ -647,8 +859,11 @@ def delete_custom_price(
     if not custom_price:
         return False
 
+    keys: Set[Tuple[str, Any]] = _cache_keys(session, custom_price)
+    record_change(session, custom_price, deleted=True)
     session.delete(custom_price)
     session.commit()
+    invalidate_catalog(*keys)
 
     return True
 
@@ -656,6 +871,7 @@ def delete_custom_price(
 # Cart CRUD
 
 
+@traced
 def create_cart_with_items(
     session: Session,
     cart_data: CartCreateSchema,
@@ -663,6 +879,10 @@ def create_cart_with_items(
     """
     Create a new cart and add multiple items to it in a single transaction.
 
+    The work following the checkout (updating the stock, sending the
+    confirmation) is added to the outbox in the same transaction, and done
+    by the outbox worker once the cart is committed.
+
     Args:
         session (Session): The database session.
         cart_data (CartCreateSchema): A cart object with a list of
@@ -675,6 +895,7 @@ def create_cart_with_items(
     cart = Cart(
         purchased=False,
         total_price=cart_data.total_price,
+        email=cart_data.email,
     )
     session.add(cart)
 
@@ -690,7 +911,142 @@ def create_cart_with_items(
 
     session.add_all(cart_items)
 
+    enqueue(session, STOCK_UPDATE, {"cart_id": str(cart.id)})
+    if cart.email:
+        enqueue(session, CART_CONFIRMATION, {"cart_id": str(cart.id)})
+
     session.commit()
+    outbox_notifier.notify()
     session.refresh(cart)
 
     return cart
+
+
+# Post-checkout work, done by the outbox worker
+
+STOCK_UPDATE = "stock_update"
+CART_CONFIRMATION = "cart_confirmation"
+
+
+def _variant_ids(selected_parts: Optional[str]) -> List[UUID]:
+    variant_ids: List[UUID] = []
+    for value in (selected_parts or "").split(","):
+        try:
+            variant_ids.append(UUID(value.strip()))
+        except ValueError:
+            continue
+
+    return variant_ids
+
+
+@traced
+def update_stock_after_checkout(
+    session: Session,
+    payload: Dict[str, Any],
+) -> Optional[AfterCommit]:
+    """
+    Take the products and variants of a cart out of the stock, one per
+    item, without going below zero. Each row is decremented in a single
+    UPDATE, so the checkouts handled at the same time by other workers
+    are not lost. The writes are committed by the outbox worker, with
+    the message.
+
+    Args:
+        session (Session): The database session.
+        payload (Dict[str, Any]): The `cart_id`.
+
+    Returns:
+        Optional[AfterCommit]: Invalidates the cached catalog once the
+            stock is committed, together with the other checkouts of the
+            interval (see `stock_invalidations`).
+    """
+    items: Sequence[CartItem] = session.exec(
+        select(CartItem).where(CartItem.cart_id == UUID(payload["cart_id"]))
+    ).all()
+    quantities: Counter[Tuple[Type[SQLModel], UUID]] = Counter()
+    for item in items:
+        quantities[(Product, item.product_id)] += 1
+        for variant_id in _variant_ids(item.selected_parts):
+            quantities[(PartVariant, variant_id)] += 1
+
+    keys: Set[Tuple[str, Any]] = set()
+    for (model, record_id), quantity in quantities.items():
+        # In one statement, so concurrent checkouts never take the same
+        # stock (the row is locked until the commit)
+        stock: Any = getattr(model, "stock_quantity")
+        taken: Any = session.execute(
+            update(model)
+            .where(getattr(model, "id") == record_id)
+            .values(
+                stock_quantity=case(
+                    (stock > quantity, stock - quantity),
+                    else_=0,
+                )
+            )
+        )
+        if taken.rowcount == 0:
+            continue
+        record: Any = session.get(model, record_id, populate_existing=True)
+        keys |= _cache_keys(session, record)
+        record_change(session, record)
+
+    return partial(stock_invalidations.add, *keys) if keys else None
+
+
+def send_cart_confirmation(
+    session: Session,
+    payload: Dict[str, Any],
+    mailer: Optional[Mailer],
+) -> None:
+    """
+    Send the confirmation of a cart to its email.
+
+    Args:
+        session (Session): The database session.
+        payload (Dict[str, Any]): The `cart_id`.
+        mailer (Optional[Mailer]): The SMTP client, None when no SMTP
+            server is configured (the confirmation is skipped).
+
+    Returns:
+        None
+    """
+    cart: Optional[Cart] = session.get(Cart, UUID(payload["cart_id"]))
+    if cart is None or not cart.email or mailer is None:
+        return
+
+    statement: Any = (
+        select(CartItem, Product.name)
+        .join(Product)
+        .where(
+            CartItem.cart_id == cart.id,
+        )
+    )
+    items: Sequence[Tuple[CartItem, str]] = session.exec(statement).all()
+    lines: List[str] = [
+        "Thank you for your order!",
+        "",
+        f"Order {cart.id}:",
+        *(f"- {name}: {item.total_price:.2f}" for item, name in items),
+        "",
+        f"Total: {cart.total_price:.2f}",
+    ]
+    # Nothing is locked while the server is waited for
+    session.rollback()
+
+    mailer.send(cart.email, "Your bike shop order", "\n".join(lines))
+
+
+def checkout_handlers(mailer: Optional[Mailer]) -> Dict[str, Handler]:
+    """
+    Get the outbox handlers of the work following a checkout.
+
+    Args:
+        mailer (Optional[Mailer]): The SMTP client of the confirmations.
+
+    Returns:
+        Dict[str, Handler]: The handler of each topic.
+    """
+    return {
+        STOCK_UPDATE: update_stock_after_checkout,
+        CART_CONFIRMATION: partial(send_cart_confirmation, mailer=mailer),
+    }
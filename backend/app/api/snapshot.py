@@ -0,0 +1,677 @@
+# app/api/snapshot.py
+
+import bisect
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    Hashable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+    overload,
+)
+from uuid import UUID
+
+from app.api.catalog import (
+    Catalog,
+    PartRecord,
+    ProductRecord,
+    VariantRecord,
+)
+from app.coalescing import SingleFlight
+
+MAGIC = b"BKCS"
+FORMAT_VERSION = 2
+
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_UTC = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+# Strings are stored once in a blob and referenced by (offset, length),
+# a length of -1 is None
+_PRODUCT = struct.Struct("<16sIiIiIid??qqq?II")
+_PART = struct.Struct("<16s16sIiqq?II")
+_VARIANT = struct.Struct("<16s16sIid?qqq?IIII")
+_INDEX = struct.Struct("<I")
+_DEPENDENCY = struct.Struct("<Ii")
+_CUSTOM_PRICE = struct.Struct("<Id")
+_UUID_INDEX = struct.Struct("<16sI")
+
+SECTIONS = (
+    "products",
+    "parts",
+    "variants",
+    "product_parts",
+    "part_variants",
+    "dependencies",
+    "custom_prices",
+    "strings",
+    "product_ids",
+    "variant_ids",
+)
+# The flags tell whether `last_modified` (-1 for None) is timezone aware
+_HEADER = struct.Struct("<4sHHqqIII" + "Q" * len(SECTIONS))
+_AWARE = 1
+
+R = TypeVar("R")
+
+
+def _timestamp(value: datetime) -> int:
+    epoch: datetime = _EPOCH if value.tzinfo is None else _EPOCH_UTC
+
+    return (value - epoch) // _MICROSECOND
+
+
+def _datetime(microseconds: int, aware: bool) -> datetime:
+    epoch: datetime = _EPOCH_UTC if aware else _EPOCH
+
+    return epoch + timedelta(microseconds=microseconds)
+
+
+def _length(section: bytearray, layout: struct.Struct) -> int:
+    return len(section) // layout.size
+
+
+class _Strings:
+    def __init__(self) -> None:
+        self.blob: bytearray = bytearray()
+        self._refs: Dict[str, Tuple[int, int]] = {}
+
+    def ref(self, value: Optional[str]) -> Tuple[int, int]:
+        if value is None:
+            return (0, -1)
+
+        ref: Optional[Tuple[int, int]] = self._refs.get(value)
+        if ref is None:
+            encoded: bytes = value.encode()
+            ref = self._refs[value] = (len(self.blob), len(encoded))
+            self.blob += encoded
+
+        return ref
+
+
+def encode_catalog(catalog: Catalog, version: int) -> bytes:
+    """
+    Encode a catalog in the snapshot format.
+
+    The snapshot is a header followed by fixed size tables (products,
+    parts, variants, dependencies and custom prices), the arrays of
+    indexes linking them, a blob of deduplicated strings, and the ids of
+    the products and variants sorted for binary search. Every record can
+    be decoded in place, without reading the rest of the file.
+
+    Args:
+        catalog (Catalog): The catalog to encode.
+        version (int): The version of the snapshot.
+
+    Returns:
+        bytes: The snapshot.
+    """
+    strings = _Strings()
+    parts_positions: Dict[int, int] = {
+        id(part): index for index, part in enumerate(catalog.parts)
+    }
+    sections: Dict[str, bytearray] = {name: bytearray() for name in SECTIONS}
+
+    for product in catalog.products:
+        aware: bool = product.created_at.tzinfo is not None
+        start: int = _length(sections["product_parts"], _INDEX)
+        for part in product.parts:
+            position: int = parts_positions[id(part)]
+            sections["product_parts"] += _INDEX.pack(position)
+        sections["products"] += _PRODUCT.pack(
+            product.id.bytes,
+            *strings.ref(product.name),
+            *strings.ref(product.description),
+            *strings.ref(product.category),
+            product.base_price,
+            product.is_custom,
+            product.is_available,
+            product.stock_quantity,
+            _timestamp(product.created_at),
+            _timestamp(product.updated_at),
+            aware,
+            start,
+            len(product.parts),
+        )
+
+    for part in catalog.parts:
+        start = _length(sections["part_variants"], _INDEX)
+        for index in part.variants:
+            sections["part_variants"] += _INDEX.pack(index)
+        sections["parts"] += _PART.pack(
+            part.id.bytes,
+            part.product_id.bytes,
+            *strings.ref(part.name),
+            _timestamp(part.created_at),
+            _timestamp(part.updated_at),
+            part.created_at.tzinfo is not None,
+            start,
+            len(part.variants),
+        )
+
+    for variant in catalog.variants:
+        dependencies_start: int = _length(
+            sections["dependencies"],
+            _DEPENDENCY,
+        )
+        for restrictions in variant.dependencies:
+            ref: Tuple[int, int] = strings.ref(restrictions)
+            sections["dependencies"] += _DEPENDENCY.pack(*ref)
+        prices_start: int = _length(sections["custom_prices"], _CUSTOM_PRICE)
+        for index, price in variant.custom_prices:
+            sections["custom_prices"] += _CUSTOM_PRICE.pack(index, price)
+        sections["variants"] += _VARIANT.pack(
+            variant.id.bytes,
+            variant.part_id.bytes,
+            *strings.ref(variant.name),
+            variant.price,
+            variant.is_available,
+            variant.stock_quantity,
+            _timestamp(variant.created_at),
+            _timestamp(variant.updated_at),
+            variant.created_at.tzinfo is not None,
+            dependencies_start,
+            len(variant.dependencies),
+            prices_start,
+            len(variant.custom_prices),
+        )
+
+    for name, records in (
+        ("product_ids", catalog.products),
+        ("variant_ids", catalog.variants),
+    ):
+        for record_id, index in sorted(
+            (record.id.bytes, index) for index, record in enumerate(records)
+        ):
+            sections[name] += _UUID_INDEX.pack(record_id, index)
+
+    sections["strings"] = strings.blob
+
+    offsets: List[int] = []
+    offset: int = _HEADER.size
+    for name in SECTIONS:
+        offsets.append(offset)
+        offset += len(sections[name])
+
+    last_modified: Optional[datetime] = catalog.last_modified
+    header: bytes = _HEADER.pack(
+        MAGIC,
+        FORMAT_VERSION,
+        _AWARE if last_modified and last_modified.tzinfo else 0,
+        version,
+        _timestamp(last_modified) if last_modified else -1,
+        len(catalog.products),
+        len(catalog.parts),
+        len(catalog.variants),
+        *offsets,
+    )
+
+    return header + b"".join(bytes(sections[name]) for name in SECTIONS)
+
+
+class _Table(Sequence[R], Generic[R]):
+    """
+    A table of the snapshot, decoding each record when it is accessed.
+    """
+
+    def __init__(
+        self,
+        length: int,
+        decode: Callable[[int], R],
+    ) -> None:
+        self._length: int = length
+        self._decode: Callable[[int], R] = decode
+
+    def __len__(self) -> int:
+        return self._length
+
+    @overload
+    def __getitem__(self, index: int) -> R: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> Tuple[R, ...]: ...
+
+    def __getitem__(
+        self,
+        index: Union[int, slice],
+    ) -> Union[R, Tuple[R, ...]]:
+        if isinstance(index, slice):
+            indexes: range = range(*index.indices(self._length))
+            return tuple(self._decode(i) for i in indexes)
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError(index)
+
+        return self._decode(index)
+
+
+class _Keys(Sequence[bytes]):
+    # The sorted ids of an index section, for `bisect`
+
+    def __init__(self, buffer: Any, offset: int, length: int) -> None:
+        self._buffer: Any = buffer
+        self._offset: int = offset
+        self._length: int = length
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index: Any) -> Any:
+        start: int = self._offset + index * _UUID_INDEX.size
+        end: int = start + 16
+
+        return self._buffer[start:end]
+
+
+class SnapshotCatalog(Catalog):
+    """
+    A catalog read from a memory-mapped snapshot.
+
+    Records are decoded from the mapping when they are accessed, so every
+    worker process mapping the same file shares a single physical copy
+    of the catalog (the page cache) and opening a snapshot costs nothing
+    until it is read.
+
+    Attributes:
+        version (int): The version of the snapshot, its creation time in
+            nanoseconds rather than a `catalog_cache` generation.
+        built_at (float): When the snapshot was written, in seconds since
+            the epoch.
+    """
+
+    __slots__ = ("built_at", "_buffer", "_offsets", "_strings_offset")
+
+    def __init__(self, buffer: Any) -> None:
+        header: Tuple[Any, ...] = _HEADER.unpack_from(buffer, 0)
+        magic, format_version, flags, version, last_modified = header[:5]
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise ValueError("Not a catalog snapshot, or an older format.")
+
+        products, parts, variants = header[5:8]
+        self._buffer: Any = buffer
+        self._offsets: Dict[str, int] = dict(zip(SECTIONS, header[8:]))
+        self._strings_offset: int = self._offsets["strings"]
+        self.version: int = version
+        self.built_at: float = version / 1e9
+        self.last_modified: Optional[datetime] = (
+            _datetime(last_modified, bool(flags & _AWARE))
+            if last_modified >= 0
+            else None
+        )
+        self.products = _Table(products, self._product)
+        self.parts = _Table(parts, self._part)
+        self.variants = _Table(variants, self._variant)
+        self._memo: Dict[Hashable, Any] = {}
+
+    def _string(self, offset: int, length: int) -> Optional[str]:
+        if length < 0:
+            return None
+        start: int = self._strings_offset + offset
+        end: int = start + length
+
+        return bytes(self._buffer[start:end]).decode()
+
+    def _records(
+        self,
+        section: str,
+        layout: struct.Struct,
+        start: int,
+        count: int,
+    ) -> Iterator[Tuple[Any, ...]]:
+        begin: int = self._offsets[section] + start * layout.size
+        end: int = begin + count * layout.size
+
+        return layout.iter_unpack(self._buffer[begin:end])
+
+    def _indexes(self, section: str, start: int, count: int) -> List[int]:
+        return [i for (i,) in self._records(section, _INDEX, start, count)]
+
+    def _product(self, index: int) -> ProductRecord:
+        (
+            product_id,
+            name_offset,
+            name_length,
+            description_offset,
+            description_length,
+            category_offset,
+            category_length,
+            base_price,
+            is_custom,
+            is_available,
+            stock_quantity,
+            created_at,
+            updated_at,
+            aware,
+            parts_start,
+            parts_count,
+        ) = _PRODUCT.unpack_from(
+            self._buffer,
+            self._offsets["products"] + index * _PRODUCT.size,
+        )
+        parts: Tuple[PartRecord, ...] = tuple(
+            map(
+                self._part,
+                self._indexes("product_parts", parts_start, parts_count),
+            )
+        )
+
+        return ProductRecord(
+            UUID(bytes=product_id),
+            self._string(name_offset, name_length),  # type: ignore
+            self._string(description_offset, description_length),
+            self._string(category_offset, category_length),  # type: ignore
+            base_price,
+            is_custom,
+            is_available,
+            stock_quantity,
+            _datetime(created_at, aware),
+            _datetime(updated_at, aware),
+            parts,
+        )
+
+    def _part(self, index: int) -> PartRecord:
+        (
+            part_id,
+            product_id,
+            name_offset,
+            name_length,
+            created_at,
+            updated_at,
+            aware,
+            variants_start,
+            variants_count,
+        ) = _PART.unpack_from(
+            self._buffer,
+            self._offsets["parts"] + index * _PART.size,
+        )
+
+        return PartRecord(
+            UUID(bytes=part_id),
+            UUID(bytes=product_id),
+            self._string(name_offset, name_length),  # type: ignore
+            _datetime(created_at, aware),
+            _datetime(updated_at, aware),
+            tuple(
+                self._indexes(
+                    "part_variants",
+                    variants_start,
+                    variants_count,
+                )
+            ),
+        )
+
+    def _variant(self, index: int) -> VariantRecord:
+        (
+            variant_id,
+            part_id,
+            name_offset,
+            name_length,
+            price,
+            is_available,
+            stock_quantity,
+            created_at,
+            updated_at,
+            aware,
+            dependencies_start,
+            dependencies_count,
+            prices_start,
+            prices_count,
+        ) = _VARIANT.unpack_from(
+            self._buffer,
+            self._offsets["variants"] + index * _VARIANT.size,
+        )
+
+        return VariantRecord(
+            index,
+            UUID(bytes=variant_id),
+            UUID(bytes=part_id),
+            self._string(name_offset, name_length),  # type: ignore
+            price,
+            is_available,
+            stock_quantity,
+            _datetime(created_at, aware),
+            _datetime(updated_at, aware),
+            tuple(
+                self._string(*ref)
+                for ref in self._records(
+                    "dependencies",
+                    _DEPENDENCY,
+                    dependencies_start,
+                    dependencies_count,
+                )
+            ),
+            tuple(
+                self._records(
+                    "custom_prices",
+                    _CUSTOM_PRICE,
+                    prices_start,
+                    prices_count,
+                )
+            ),
+        )
+
+    def _find(self, section: str, length: int, record_id: UUID) -> int:
+        offset: int = self._offsets[section]
+        keys = _Keys(self._buffer, offset, length)
+        position: int = bisect.bisect_left(keys, record_id.bytes)
+        if position == length or keys[position] != record_id.bytes:
+            return -1
+
+        return _UUID_INDEX.unpack_from(
+            self._buffer,
+            offset + position * _UUID_INDEX.size,
+        )[1]
+
+    def product(self, product_id: UUID) -> Optional[ProductRecord]:
+        index: int = self._find("product_ids", len(self.products), product_id)
+
+        return self.products[index] if index >= 0 else None
+
+    def variant(self, variant_id: UUID) -> Optional[VariantRecord]:
+        index: int = self._find("variant_ids", len(self.variants), variant_id)
+
+        return self.variants[index] if index >= 0 else None
+
+
+def _snapshot_version(path: str) -> Optional[int]:
+    # The version in the header of a snapshot file, None without one
+    try:
+        with open(path, "rb") as f:
+            header: bytes = f.read(_HEADER.size)
+    except FileNotFoundError:
+        return None
+    if len(header) < _HEADER.size:
+        return None
+    magic, format_version, _, version = _HEADER.unpack_from(header)[:4]
+    if magic != MAGIC or format_version != FORMAT_VERSION:
+        return None
+
+    return version
+
+
+def write_snapshot(
+    catalog: Catalog,
+    path: str,
+    version: Optional[int] = None,
+) -> int:
+    """
+    Publish a catalog as the snapshot at `path`, unless the snapshot there
+    is already newer.
+
+    The snapshot is written to a temporary file in the same directory and
+    renamed over the previous one, so readers see either the old or the
+    new snapshot, never a partial one. Processes that mapped the old file
+    keep reading it until they swap. The versions are compared and the
+    file replaced under a lock file, so a worker that took longer to load
+    the catalog does not overwrite the snapshot of a later load.
+
+    Args:
+        catalog (Catalog): The catalog to publish.
+        path (str): The path of the snapshot.
+        version (Optional[int]): The version of the snapshot, when the
+            catalog started loading in nanoseconds since the epoch.
+            Defaults to now.
+
+    Returns:
+        int: The version of the snapshot at `path`, this one or a newer
+            one published meanwhile.
+    """
+    if version is None:
+        version = time.time_ns()
+    directory: str = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path: str = os.path.join(
+        directory,
+        f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp",
+    )
+
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(encode_catalog(catalog, version))
+            f.flush()
+            os.fsync(f.fileno())
+        with open(f"{path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            published: Optional[int] = _snapshot_version(path)
+            if published is not None and published >= version:
+                os.remove(tmp_path)
+                return published
+            os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return version
+
+
+def open_snapshot(path: str) -> SnapshotCatalog:
+    """
+    Map a snapshot file read-only.
+
+    Args:
+        path (str): The path of the snapshot.
+
+    Returns:
+        SnapshotCatalog: The catalog, valid even after the file is
+            replaced.
+    """
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    return SnapshotCatalog(buffer)
+
+
+class SnapshotStore:
+    """
+    Share the catalog read model between the worker processes of a host
+    through a snapshot file.
+
+    Every worker maps the current snapshot and checks on each access
+    whether it was replaced, swapping to the new one if so. A worker
+    publishes a new snapshot when it changed the catalog itself (its
+    `catalog_cache` generation moved on), when there is no snapshot yet,
+    or when the snapshot is older than `max_age` (to pick up writes made
+    outside of the API).
+
+    Args:
+        path (str): The path of the snapshot file.
+        max_age (float): Seconds after which the snapshot is rebuilt, 0
+            to only rebuild it on writes.
+
+    Attributes:
+        builds (int): Snapshots published by this worker.
+        swaps (int): Snapshots mapped by this worker.
+    """
+
+    def __init__(self, path: str, max_age: float = 0.0) -> None:
+        self.path: str = path
+        self.max_age: float = max_age
+        self.builds: int = 0
+        self.swaps: int = 0
+        self._lock: threading.Lock = threading.Lock()
+        self._flight: SingleFlight = SingleFlight()
+        self._current: Optional[SnapshotCatalog] = None
+        self._file: Optional[Tuple[int, int, int]] = None
+        self._generation: Optional[int] = None
+
+    def _refresh(self) -> Optional[SnapshotCatalog]:
+        try:
+            stat: os.stat_result = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+
+        file: Tuple[int, int, int] = (
+            stat.st_ino,
+            stat.st_mtime_ns,
+            stat.st_size,
+        )
+        with self._lock:
+            if file != self._file:
+                self._current = open_snapshot(self.path)
+                self._file = file
+                self.swaps += 1
+
+            return self._current
+
+    def get(self, load: Callable[[], Catalog], generation: int) -> Catalog:
+        """
+        Get the current snapshot, publishing a new one when needed.
+
+        Args:
+            load (Callable[[], Catalog]): Loads the catalog from the
+                database.
+            generation (int): The `catalog_cache` generation of this
+                worker.
+
+        Returns:
+            Catalog: The mapped snapshot.
+        """
+        current: Optional[SnapshotCatalog] = self._refresh()
+        if current is not None and self._generation is None:
+            # Warm start from a snapshot published by another process
+            self._generation = generation
+
+        expired: bool = current is not None and (
+            self.max_age > 0 and time.time() - current.built_at > self.max_age
+        )
+        if current is not None and not expired:
+            if self._generation == generation:
+                return current
+
+        return self._flight.do(
+            generation,
+            lambda: self._publish(load, generation),
+        )
+
+    def _publish(
+        self,
+        load: Callable[[], Catalog],
+        generation: int,
+    ) -> SnapshotCatalog:
+        # Taken before the load: a snapshot never claims to be newer
+        # than the rows it holds
+        version: int = time.time_ns()
+        write_snapshot(load(), self.path, version)
+        self.builds += 1
+        current: Optional[SnapshotCatalog] = self._refresh()
+        assert current is not None
+        self._generation = generation
+
+        return current
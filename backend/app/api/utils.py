@@ -6,8 +6,10 @@ from typing import List, Optional, Sequence
 from sqlmodel import Session, select
 
 from app.api.models import CustomPrice, Product, PartVariant
+from app.tracing import traced
 
 
+@traced
 def calculate_total_price(
     session: Session,
     product_id: UUID,
@@ -0,0 +1,640 @@
+# app/api/waiting_room.py
+
+import asyncio
+import contextvars
+import logging
+import threading
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta, timezone
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+from uuid import UUID, uuid4
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Engine, delete, event, func, insert, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session as OrmSession, SessionTransaction
+from sqlmodel import Session, col, select
+
+from app.api.models import WaitingRoomBucket, WaitingRoomTicket, utc_now
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Clients are told to poll their status this many intervals apart
+POLL_INTERVALS = 2
+
+# Seconds between two deletions of the tickets and buckets of the past
+PRUNE_INTERVAL = 60.0
+
+# The order tickets are admitted in: the time the client joined, then
+# the token to break the ties the same way in the database and in memory
+TicketKey = Tuple[datetime, UUID]
+
+
+# The tickets used in the transaction of a session, in `session.info`,
+# marked used in memory once the transaction is committed
+_USED = "waiting_room_used"
+
+
+@event.listens_for(OrmSession, "after_commit")
+def _mark_used(session: OrmSession) -> None:
+    marks: List[Callable[[], None]] = session.info.pop(_USED, [])
+    for mark in marks:
+        mark()
+
+
+@event.listens_for(OrmSession, "after_transaction_end")
+def _forget_used(session: OrmSession, transaction: SessionTransaction) -> None:
+    # Rolled back or closed, the tickets were not used
+    if transaction.parent is None:
+        session.info.pop(_USED, None)
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _token(joined_at: datetime) -> UUID:
+    # A version 7 UUID: the milliseconds of the time the client joined,
+    # the microseconds in the 12 bits after the version, then random bits
+    micros: int = (joined_at - _EPOCH) // timedelta(microseconds=1)
+    millis, rest = divmod(micros, 1000)
+    fraction: int = rest * 4096 // 1000
+
+    return UUID(
+        int=(millis << 80)
+        | (0x7 << 76)
+        | (fraction << 64)
+        | (uuid4().int & ((1 << 64) - 1))
+    )
+
+
+def _joined_at(token: UUID) -> Optional[datetime]:
+    # The time a client joined, as written in its token by `_token`
+    if token.version != 7:
+        return None
+    millis: int = token.int >> 80
+    fraction: int = (token.int >> 64) & 0xFFF
+    micros: int = millis * 1000 + (fraction * 1000 + 4095) // 4096
+
+    return _EPOCH + timedelta(microseconds=micros)
+
+
+def _utc(value: datetime) -> datetime:
+    # SQLite gives naive datetimes back
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+class _Ticket:
+    __slots__ = ("key", "expires_at", "used")
+
+    def __init__(
+        self,
+        key: TicketKey,
+        expires_at: Optional[datetime] = None,
+        used: bool = False,
+    ) -> None:
+        self.key: TicketKey = key
+        self.expires_at: Optional[datetime] = expires_at
+        self.used: bool = used
+
+
+class _Queue:
+    """
+    The waiting room of a product as seen by this worker.
+
+    Attributes:
+        tickets (Dict[UUID, _Ticket]): The tickets waiting or admitted.
+        waiting (List[TicketKey]): The keys of the waiting tickets, in
+            the order they are admitted.
+        pending (List[Dict[str, Any]]): The tickets joined on this worker
+            and not written yet.
+        last_seq (Optional[int]): The last ticket read from the database.
+        admitted_since (Optional[datetime]): When the admissions were
+            last read from the database.
+    """
+
+    __slots__ = ("tickets", "waiting", "pending", "last_seq", "admitted_since")
+
+    def __init__(self) -> None:
+        self.tickets: Dict[UUID, _Ticket] = {}
+        self.waiting: List[TicketKey] = []
+        self.pending: List[Dict[str, Any]] = []
+        self.last_seq: Optional[int] = None
+        self.admitted_since: Optional[datetime] = None
+
+    def add(self, token: UUID, ticket: _Ticket) -> None:
+        if token in self.tickets:
+            return
+        self.tickets[token] = ticket
+        if ticket.expires_at is None:
+            insort(self.waiting, ticket.key)
+
+    def admit(self, token: UUID, expires_at: datetime) -> None:
+        ticket: Optional[_Ticket] = self.tickets.get(token)
+        if ticket is None or ticket.expires_at is not None:
+            return
+        ticket.expires_at = expires_at
+        index: int = bisect_left(self.waiting, ticket.key)
+        if index < len(self.waiting) and self.waiting[index] == ticket.key:
+            del self.waiting[index]
+
+
+class WaitingRoom:
+    """
+    A virtual waiting room in front of the checkout of the products in
+    queue mode, for flash sales: clients join the queue of a product and
+    get a token, and tickets are admitted in the order the clients joined
+    at `rate` admissions per second. An admitted ticket allows creating
+    one cart with the product within `ttl` seconds.
+
+    Positions and ETAs are read from memory. Each worker keeps the queues
+    in memory and, every `interval` seconds, writes the tickets joined
+    since in one statement, admits the tickets due and reads what the
+    other workers wrote. The database holds the admissions: a token
+    bucket row per product, locked while admitting, so the workers admit
+    `rate` tickets per second together and the checkout only sees that
+    many writes, however many clients are waiting.
+
+    Tickets are deleted `retention` seconds after their admission expired
+    (used or not), as are the tickets still waiting for a product no
+    longer in queue mode, and the buckets no worker refilled for as long.
+
+    Args:
+        engine (Engine): The database engine the tickets are written to.
+        product_ids (Iterable[UUID]): The products in queue mode.
+        rate (float): The tickets admitted per second, per product.
+        ttl (float): Seconds an admitted ticket can be used for.
+        interval (float): Seconds between two writes and reads of the
+            tickets.
+        retention (float): Seconds the tickets and buckets of the past
+            are kept for.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        product_ids: Iterable[UUID],
+        rate: float = 2.0,
+        ttl: float = 300.0,
+        interval: float = 1.0,
+        retention: float = 3600.0,
+    ) -> None:
+        self.engine: Engine = engine
+        self.product_ids: FrozenSet[UUID] = frozenset(product_ids)
+        self.rate: float = rate
+        self.ttl: float = ttl
+        self.interval: float = interval
+        self.retention: float = retention
+        self._queues: Dict[UUID, _Queue] = {
+            product_id: _Queue() for product_id in self.product_ids
+        }
+        self._lock: threading.Lock = threading.Lock()
+        self._last_joined: datetime = datetime.min.replace(tzinfo=timezone.utc)
+        self._task: Optional["asyncio.Task[None]"] = None
+        self._pruned_at: Optional[datetime] = None
+
+    def queued(self, product_id: UUID) -> bool:
+        return product_id in self.product_ids
+
+    def join(self, product_id: UUID) -> Dict[str, Any]:
+        """
+        Join the queue of a product.
+
+        Args:
+            product_id (UUID): The product, in queue mode.
+
+        Returns:
+            Dict[str, Any]: The status of the new ticket, with its token.
+        """
+        queue: _Queue = self._queues[product_id]
+        with self._lock:
+            # Never the same time twice: the clients joining a worker are
+            # admitted in the order they joined
+            joined_at: datetime = max(
+                utc_now(),
+                self._last_joined + timedelta(microseconds=1),
+            )
+            self._last_joined = joined_at
+            token: UUID = _token(joined_at)
+            ticket = _Ticket((joined_at, token))
+            queue.add(token, ticket)
+            queue.pending.append(
+                {
+                    "token": token,
+                    "product_id": product_id,
+                    "joined_at": joined_at,
+                }
+            )
+
+            return self._waiting(queue, ticket, product_id)
+
+    def status(
+        self,
+        product_id: UUID,
+        token: UUID,
+        session: Optional[Session] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Get the status of a ticket: `waiting` with its position and an
+        estimate of the seconds left, `admitted` with the time the
+        admission expires, `used` or `expired`.
+
+        A ticket joined on another worker and not written yet is waiting
+        behind the tickets joined before it, as far as this worker knows:
+        its token tells when the client joined.
+
+        Args:
+            product_id (UUID): The product, in queue mode.
+            token (UUID): The token of the ticket.
+            session (Optional[Session]): Reads the ticket from the
+                database when this worker does not know it yet.
+
+        Returns:
+            Optional[Dict[str, Any]]: The status, None if the ticket is
+                not found.
+        """
+        queue: _Queue = self._queues[product_id]
+        with self._lock:
+            ticket: Optional[_Ticket] = queue.tickets.get(token)
+            if ticket is not None and ticket.expires_at is None:
+                return self._waiting(queue, ticket, product_id)
+
+        if ticket is None and session is not None:
+            ticket = self._read_ticket(session, queue, product_id, token)
+        if ticket is None:
+            return self._joining(queue, product_id, token)
+
+        status: Dict[str, Any] = {
+            "token": str(token),
+            "product_id": str(product_id),
+        }
+        expires_at: Optional[datetime] = ticket.expires_at
+        if expires_at is None:
+            # Joined on another worker, now known by this one
+            with self._lock:
+                return self._waiting(queue, ticket, product_id)
+        if ticket.used:
+            return {**status, "status": "used"}
+        if expires_at <= utc_now():
+            return {**status, "status": "expired"}
+
+        return {
+            **status,
+            "status": "admitted",
+            "expires_at": expires_at.isoformat(),
+        }
+
+    def _waiting(
+        self,
+        queue: _Queue,
+        ticket: _Ticket,
+        product_id: UUID,
+    ) -> Dict[str, Any]:
+        # The status of a waiting ticket, called with the lock held
+        position: int = bisect_left(queue.waiting, ticket.key) + 1
+
+        return {
+            "token": str(ticket.key[1]),
+            "product_id": str(product_id),
+            "status": "waiting",
+            "position": position,
+            "eta": round(position / self.rate, 1),
+            "retry_after": POLL_INTERVALS * self.interval,
+        }
+
+    def _joining(
+        self,
+        queue: _Queue,
+        product_id: UUID,
+        token: UUID,
+    ) -> Optional[Dict[str, Any]]:
+        joined_at: Optional[datetime] = _joined_at(token)
+        if joined_at is None:
+            return None
+        # Written at the next tick of its worker, whose clock is allowed
+        # an interval of skew
+        age: float = (utc_now() - joined_at).total_seconds()
+        if not -self.interval <= age <= 2 * self.interval:
+            return None
+
+        ticket: _Ticket = _Ticket((joined_at, token))
+        with self._lock:
+            return self._waiting(queue, ticket, product_id)
+
+    def consume_ticket(
+        self,
+        session: Session,
+        product_id: UUID,
+        token: UUID,
+    ) -> bool:
+        """
+        Use an admitted ticket, in the transaction of the session: it is
+        only used, in the database and in the memory of this worker, if
+        the transaction is committed.
+
+        Args:
+            session (Session): The session the cart is created with.
+            product_id (UUID): The product of the ticket.
+            token (UUID): The token of the ticket.
+
+        Returns:
+            bool: Whether the ticket was admitted, not expired and not
+                used yet.
+        """
+        now: datetime = utc_now()
+        result = session.execute(
+            update(WaitingRoomTicket)
+            .where(
+                col(WaitingRoomTicket.token) == token,
+                col(WaitingRoomTicket.product_id) == product_id,
+                col(WaitingRoomTicket.admitted_at).is_not(None),
+                col(WaitingRoomTicket.used_at).is_(None),
+                col(WaitingRoomTicket.expires_at) > now,
+            )
+            .values(used_at=now)
+        )
+        if result.rowcount != 1:
+            return False
+
+        queue: _Queue = self._queues[product_id]
+
+        def mark_used() -> None:
+            with self._lock:
+                ticket: Optional[_Ticket] = queue.tickets.get(token)
+                if ticket is not None:
+                    ticket.used = True
+
+        session.info.setdefault(_USED, []).append(mark_used)
+
+        return True
+
+    def tick(self, now: Optional[datetime] = None) -> None:
+        """
+        Write the tickets joined on this worker, admit the tickets due and
+        read the tickets and admissions of the other workers. Once every
+        `PRUNE_INTERVAL` seconds, delete the tickets and buckets of the
+        past.
+
+        Args:
+            now (Optional[datetime]): The current time.
+
+        Returns:
+            None
+        """
+        now = now or utc_now()
+        with Session(self.engine) as session:
+            for product_id, queue in self._queues.items():
+                self._flush(session, queue)
+                self._admit(session, product_id, now)
+                self._refresh(session, queue, product_id, now)
+            if self._pruned_at is None or (
+                (now - self._pruned_at).total_seconds() >= PRUNE_INTERVAL
+            ):
+                self._prune(session, now)
+                self._pruned_at = now
+
+    async def start(self) -> None:
+        """
+        Start the task ticking every `interval` seconds, on the running
+        event loop.
+
+        Returns:
+            None
+        """
+        loop = asyncio.get_running_loop()
+        task: Optional["asyncio.Task[None]"] = self._task
+        if task is None or task.done() or task.get_loop() is not loop:
+            # A fresh context: the task outlives the caller starting it
+            self._task = loop.create_task(
+                self._run(),
+                context=contextvars.Context(),
+            )
+
+    async def close(self) -> None:
+        """
+        Stop the task, writing the tickets joined since its last tick.
+
+        Returns:
+            None
+        """
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+        with Session(self.engine) as session:
+            for queue in self._queues.values():
+                self._flush(session, queue)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await run_in_threadpool(self.tick)
+            except Exception:
+                logger.exception("Updating the waiting room failed")
+            await asyncio.sleep(self.interval)
+
+    def _flush(self, session: Session, queue: _Queue) -> None:
+        with self._lock:
+            pending: List[Dict[str, Any]] = queue.pending
+            queue.pending = []
+        if not pending:
+            return
+
+        try:
+            session.execute(insert(WaitingRoomTicket), pending)
+            session.commit()
+        except Exception:
+            session.rollback()
+            with self._lock:
+                # Written again at the next tick
+                queue.pending[:0] = pending
+            raise
+
+    def _admit(
+        self,
+        session: Session,
+        product_id: UUID,
+        now: datetime,
+    ) -> None:
+        bucket: Optional[WaitingRoomBucket] = session.exec(
+            select(WaitingRoomBucket)
+            .where(WaitingRoomBucket.product_id == product_id)
+            .with_for_update()
+        ).first()
+        if bucket is None:
+            try:
+                bucket = WaitingRoomBucket(
+                    product_id=product_id,
+                    refilled_at=now,
+                )
+                session.add(bucket)
+                session.commit()
+            except IntegrityError:
+                # Created by another worker
+                session.rollback()
+            return
+
+        # Full after `interval` seconds, so the admissions keep up with the
+        # rate without bursting after a quiet period
+        elapsed: float = (now - _utc(bucket.refilled_at)).total_seconds()
+        capacity: float = max(self.rate * self.interval, 1.0)
+        tokens: float = min(
+            bucket.tokens + self.rate * max(elapsed, 0.0),
+            capacity,
+        )
+
+        seqs: List[int] = []
+        if tokens >= 1:
+            seqs = list(
+                session.exec(
+                    select(WaitingRoomTicket.seq)
+                    .where(
+                        WaitingRoomTicket.product_id == product_id,
+                        col(WaitingRoomTicket.admitted_at).is_(None),
+                    )
+                    .order_by(
+                        col(WaitingRoomTicket.joined_at),
+                        col(WaitingRoomTicket.token),
+                    )
+                    .limit(int(tokens))
+                ).all()
+            )
+        if seqs:
+            session.execute(
+                update(WaitingRoomTicket)
+                .where(col(WaitingRoomTicket.seq).in_(seqs))
+                .values(
+                    admitted_at=now,
+                    expires_at=now + timedelta(seconds=self.ttl),
+                )
+            )
+
+        # An empty queue does not save admissions up
+        bucket.tokens = tokens - len(seqs) if seqs else min(tokens, 1.0)
+        bucket.refilled_at = now
+        session.add(bucket)
+        session.commit()
+
+    def _refresh(
+        self,
+        session: Session,
+        queue: _Queue,
+        product_id: UUID,
+        now: datetime,
+    ) -> None:
+        if queue.admitted_since is None:
+            queue.admitted_since = now - timedelta(seconds=self.interval)
+        admitted_since: datetime = queue.admitted_since
+
+        last_seq: Optional[int] = session.exec(
+            select(func.max(WaitingRoomTicket.seq)).where(
+                WaitingRoomTicket.product_id == product_id
+            )
+        ).one()
+        tickets: List[WaitingRoomTicket] = []
+        if last_seq is not None and last_seq != queue.last_seq:
+            tickets = list(
+                session.exec(
+                    select(WaitingRoomTicket).where(
+                        WaitingRoomTicket.product_id == product_id,
+                        col(WaitingRoomTicket.seq) > (queue.last_seq or 0),
+                        col(WaitingRoomTicket.seq) <= last_seq,
+                        col(WaitingRoomTicket.used_at).is_(None),
+                    )
+                ).all()
+            )
+        # The clocks of the workers are allowed an interval of skew
+        admitted: List[Tuple[UUID, datetime]] = list(
+            session.exec(
+                select(
+                    WaitingRoomTicket.token,
+                    WaitingRoomTicket.expires_at,
+                ).where(
+                    WaitingRoomTicket.product_id == product_id,
+                    col(WaitingRoomTicket.admitted_at) >= admitted_since,
+                )
+            ).all()
+        )
+        session.rollback()
+
+        with self._lock:
+            for row in tickets:
+                expires_at: Optional[datetime] = (
+                    _utc(row.expires_at) if row.expires_at else None
+                )
+                if expires_at is None or expires_at > now:
+                    queue.add(row.token, _ticket(row))
+            for token, expires_at in admitted:
+                queue.admit(token, _utc(expires_at))
+
+            # Forget the admissions that can no longer be used
+            for token, ticket in list(queue.tickets.items()):
+                if ticket.expires_at is not None and ticket.expires_at <= now:
+                    del queue.tickets[token]
+
+            if last_seq is not None:
+                queue.last_seq = last_seq
+            queue.admitted_since = now - timedelta(seconds=self.interval)
+
+    def _prune(self, session: Session, now: datetime) -> None:
+        before: datetime = now - timedelta(seconds=self.retention)
+        ticket: Any = WaitingRoomTicket
+        session.execute(
+            delete(ticket).where(
+                or_(
+                    col(ticket.expires_at) < before,
+                    # Sales that are over, never admitted
+                    col(ticket.admitted_at).is_(None)
+                    & col(ticket.product_id).not_in(self.product_ids)
+                    & (col(ticket.joined_at) < before),
+                )
+            )
+        )
+        # The buckets of the sales going on are refilled at every tick
+        bucket: Any = WaitingRoomBucket
+        session.execute(delete(bucket).where(col(bucket.refilled_at) < before))
+        session.commit()
+
+    def _read_ticket(
+        self,
+        session: Session,
+        queue: _Queue,
+        product_id: UUID,
+        token: UUID,
+    ) -> Optional[_Ticket]:
+        row: Optional[WaitingRoomTicket] = session.exec(
+            select(WaitingRoomTicket).where(
+                WaitingRoomTicket.token == token,
+                WaitingRoomTicket.product_id == product_id,
+            )
+        ).first()
+        if row is None:
+            return None
+
+        ticket: _Ticket = _ticket(row)
+        if ticket.expires_at is None:
+            # Joined on another worker since the last tick
+            with self._lock:
+                queue.add(token, ticket)
+
+        return ticket
+
+
+def _ticket(row: WaitingRoomTicket) -> _Ticket:
+    return _Ticket(
+        (_utc(row.joined_at), row.token),
+        _utc(row.expires_at) if row.expires_at else None,
+        row.used_at is not None,
+    )
@@ -0,0 +1,143 @@
+# app/api/warmup.py
+
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Generator, List, Optional
+from uuid import UUID
+
+from sqlmodel import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.api.catalog import Catalog, get_catalog
+from app.api.configurator import pricing_index
+from app.api.routes import products_page
+from app.api.utils import calculate_total_price
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Seconds before retrying a failed warm-up, doubled up to the maximum
+RETRY_DELAY = 1.0
+MAX_RETRY_DELAY = 30.0
+
+# The page size of GET /products when the client sends none
+DEFAULT_PAGE_SIZE = 10
+
+
+def warm_up(
+    session: Session,
+    pages: int = 1,
+    compression_min_size: int = 0,
+) -> Dict[str, int]:
+    """
+    Fill the caches the first requests would otherwise fill: the catalog
+    read model, the pricing index of every product, and the first pages
+    of `GET /products` (compressed too). One price is also calculated, to
+    prepare the statements of `POST /calculate-price`.
+
+    Args:
+        session (Session): The database session.
+        pages (int): The pages of `GET /products` to render, with the
+            default page size.
+        compression_min_size (int): The smallest body compressed, 0 when
+            responses are not compressed.
+
+    Returns:
+        Dict[str, int]: What was warmed up, for the logs.
+    """
+    catalog: Catalog = get_catalog(session)
+    for product in catalog.products:
+        pricing_index(catalog, product)
+
+    for page in range(1, pages + 1):
+        body = products_page(catalog, page, DEFAULT_PAGE_SIZE)
+        if 0 < compression_min_size <= len(body.body):
+            body.encoded("br")
+            body.encoded("gzip")
+
+    if catalog.products:
+        product = catalog.products[0]
+        selection: List[UUID] = []
+        for part in product.parts:
+            for index in part.variants:
+                variant = catalog.variants[index]
+                if variant.is_available and variant.stock_quantity > 0:
+                    selection.append(variant.id)
+                    break
+        calculate_total_price(
+            session=session,
+            product_id=product.id,
+            selected_variant_ids=selection,
+        )
+    session.rollback()
+
+    return {
+        "products": len(catalog.products),
+        "variants": len(catalog.variants),
+        "pages": pages,
+    }
+
+
+class WarmUp:
+    """
+    The warm-up of a worker, run once at startup, and whether it has
+    finished, for the readiness route.
+
+    A failed warm-up (i.e. the database is not reachable yet) is retried
+    with a backoff until it succeeds, the worker is not ready until then.
+
+    Args:
+        sessions (Callable[[], Generator[Session, Any, None]]): Provides
+            the session, like the `get_session` dependency.
+        pages (int): The pages of `GET /products` to render.
+        compression_min_size (int): The smallest body compressed, 0 when
+            responses are not compressed.
+
+    Attributes:
+        ready (bool): True once the warm-up has finished.
+        duration (Optional[float]): How long the warm-up took, in seconds.
+    """
+
+    def __init__(
+        self,
+        sessions: Callable[[], Generator[Session, Any, None]],
+        pages: int = 1,
+        compression_min_size: int = 0,
+    ) -> None:
+        self.sessions: Callable[[], Generator[Session, Any, None]] = sessions
+        self.pages: int = pages
+        self.compression_min_size: int = compression_min_size
+        self.ready: bool = False
+        self.duration: Optional[float] = None
+
+    async def run(self) -> None:
+        """
+        Warm up, retrying until it succeeds.
+
+        Returns:
+            None
+        """
+        delay: float = RETRY_DELAY
+        while True:
+            start: float = time.perf_counter()
+            try:
+                stats: Dict[str, int] = await run_in_threadpool(self._warm_up)
+            except Exception:
+                logger.exception("Warm-up failed, retrying in %.0fs", delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+                continue
+
+            self.duration = time.perf_counter() - start
+            self.ready = True
+            logger.info("Warm-up done in %.3fs: %s", self.duration, stats)
+            return
+
+    def _warm_up(self) -> Dict[str, int]:
+        with contextmanager(self.sessions)() as session:
+            return warm_up(
+                session,
+                pages=self.pages,
+                compression_min_size=self.compression_min_size,
+            )
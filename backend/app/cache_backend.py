@@ -0,0 +1,471 @@
+# app/cache_backend.py
+
+import abc
+import logging
+import select
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from urllib.parse import unquote, urlsplit
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+Callback = Callable[[bytes], None]
+
+# Seconds between two reconnection attempts, doubled up to the maximum
+RECONNECT_DELAY = 0.1
+MAX_RECONNECT_DELAY = 5.0
+
+
+class CacheBackendError(Exception):
+    """
+    Raised when the cache backend cannot be reached or rejects a command.
+    """
+
+
+class CacheBackend(abc.ABC):
+    """
+    What the caches of the workers share: a channel broadcasting their
+    invalidations.
+
+    Cached values stay in the memory of each worker (they are Python
+    objects, i.e. the catalog read model or ORM rows), only the
+    invalidations go through the backend.
+    """
+
+    @abc.abstractmethod
+    def publish(self, channel: str, message: bytes) -> None:
+        """
+        Send a message to every subscriber of a channel.
+
+        Args:
+            channel (str): The channel.
+            message (bytes): The message.
+
+        Returns:
+            None
+
+        Raises:
+            CacheBackendError: If the message cannot be sent.
+        """
+
+    @abc.abstractmethod
+    def subscribe(
+        self,
+        channel: str,
+        callback: Callback,
+        on_connect: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """
+        Call `callback` with every message published on a channel.
+
+        Messages published while the subscriber is disconnected are lost,
+        so `on_connect` is called whenever the subscription starts again
+        (and when it first starts).
+
+        Args:
+            channel (str): The channel.
+            callback (Callback): Called with each message.
+            on_connect (Optional[Callable[[], None]]): Called once
+                subscribed.
+
+        Returns:
+            None
+        """
+
+    def close(self) -> None:
+        """
+        Stop the subscriptions and close the connections.
+
+        Returns:
+            None
+        """
+
+
+class MemoryBackend(CacheBackend):
+    """
+    A backend for a single process: messages are delivered to the
+    subscribers of the same process, synchronously.
+    """
+
+    def __init__(self) -> None:
+        self._lock: threading.Lock = threading.Lock()
+        self._subscribers: Dict[str, List[Callback]] = {}
+
+    def publish(self, channel: str, message: bytes) -> None:
+        with self._lock:
+            callbacks: List[Callback] = list(
+                self._subscribers.get(channel, ()),
+            )
+        for callback in callbacks:
+            callback(message)
+
+    def subscribe(
+        self,
+        channel: str,
+        callback: Callback,
+        on_connect: Optional[Callable[[], None]] = None,
+    ) -> None:
+        with self._lock:
+            self._subscribers.setdefault(channel, []).append(callback)
+        if on_connect is not None:
+            on_connect()
+
+    def close(self) -> None:
+        with self._lock:
+            self._subscribers.clear()
+
+
+def encode_command(*args: Union[str, bytes, int]) -> bytes:
+    """
+    Encode a command in the Redis protocol (RESP), as an array of bulk
+    strings.
+
+    Args:
+        *args (Union[str, bytes, int]): The command and its arguments.
+
+    Returns:
+        bytes: The encoded command.
+    """
+    parts: List[bytes] = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode()
+        elif isinstance(arg, int):
+            arg = b"%d" % arg
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+
+    return b"".join(parts)
+
+
+class RespConnection:
+    """
+    A connection speaking the Redis protocol, reading replies from its
+    own buffer so waiting for one can time out without losing data.
+
+    Args:
+        sock (socket.socket): The connected socket.
+    """
+
+    def __init__(self, sock: socket.socket) -> None:
+        self.sock: socket.socket = sock
+        self._buffer: bytearray = bytearray()
+
+    def send(self, *args: Union[str, bytes, int]) -> None:
+        self.sock.sendall(encode_command(*args))
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Wait until a reply can be read.
+
+        Args:
+            timeout (float): The maximum number of seconds to wait.
+
+        Returns:
+            bool: False if the wait timed out.
+        """
+        if self._buffer:
+            return True
+        readable, _, _ = select.select([self.sock], [], [], timeout)
+
+        return bool(readable)
+
+    def reply(self) -> Any:
+        """
+        Read a reply.
+
+        Returns:
+            Any: The decoded reply: bytes, int, None or a list of them.
+
+        Raises:
+            CacheBackendError: If the reply is an error.
+            ConnectionError: If the connection was closed.
+        """
+        line: bytes = self._line()
+        kind, rest = line[:1], line[1:]
+        if kind == b"+":
+            return rest
+        if kind == b"-":
+            raise CacheBackendError(rest.decode(errors="replace"))
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length: int = int(rest)
+            return None if length < 0 else self._exact(length)
+        if kind == b"*":
+            count: int = int(rest)
+            return None if count < 0 else [self.reply() for _ in range(count)]
+
+        raise ConnectionError(f"Unexpected reply: {line!r}")
+
+    def close(self) -> None:
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+    def _fill(self) -> None:
+        chunk: bytes = self.sock.recv(65536)
+        if not chunk:
+            raise ConnectionError("Connection closed by the server")
+        self._buffer += chunk
+
+    def _line(self) -> bytes:
+        end: int = self._buffer.find(b"\r\n")
+        while end < 0:
+            self._fill()
+            end = self._buffer.find(b"\r\n")
+        line: bytes = bytes(self._buffer[:end])
+        del self._buffer[: end + 2]
+
+        return line
+
+    def _exact(self, length: int) -> bytes:
+        while len(self._buffer) < length + 2:
+            self._fill()
+        data: bytes = bytes(self._buffer[:length])
+        del self._buffer[: length + 2]
+
+        return data
+
+
+class RedisBackend(CacheBackend):
+    """
+    A backend shared by every worker through a server speaking the Redis
+    protocol (Redis, Valkey, KeyDB...), broadcasting with its pub/sub.
+
+    Commands share one connection. Once it cannot be reconnected,
+    commands fail at once until the next attempt, after a backoff, so
+    writes publishing invalidations are not held up by a server that is
+    down. Each subscription has a connection
+    and a thread of its own, which pings the server when the channel is
+    quiet to notice a dead connection, and reconnects with a backoff.
+
+    Args:
+        host (str): The host of the server.
+        port (int): The port of the server.
+        db (int): The database number.
+        password (Optional[str]): The password, if the server needs one.
+        timeout (float): Seconds to wait for the server.
+        ping_interval (float): Seconds of silence on a subscription
+            before pinging the server.
+    """
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 6379,
+        db: int = 0,
+        password: Optional[str] = None,
+        timeout: float = 1.0,
+        ping_interval: float = 5.0,
+    ) -> None:
+        self.host: str = host
+        self.port: int = port
+        self.db: int = db
+        self.password: Optional[str] = password
+        self.timeout: float = timeout
+        self.ping_interval: float = ping_interval
+        self._lock: threading.Lock = threading.Lock()
+        self._connection: Optional[RespConnection] = None
+        # When commands may try to reconnect again, and the next backoff
+        self._retry_at: float = 0.0
+        self._delay: float = RECONNECT_DELAY
+        self._closed: threading.Event = threading.Event()
+        self._subscriptions: List[Tuple[threading.Thread, List[Any]]] = []
+
+    @classmethod
+    def from_url(cls, url: str, **options: Any) -> "RedisBackend":
+        """
+        Create a backend from a `redis://[:password@]host[:port][/db]` URL.
+
+        Args:
+            url (str): The URL of the server.
+            **options (Any): The other arguments of the backend.
+
+        Returns:
+            RedisBackend: The backend.
+        """
+        parts = urlsplit(url)
+        if parts.scheme != "redis":
+            raise ValueError(f"Unsupported cache backend URL: {url}")
+        path: str = parts.path.strip("/")
+
+        return cls(
+            host=parts.hostname or "localhost",
+            port=parts.port or 6379,
+            db=int(path) if path else 0,
+            password=unquote(parts.password) if parts.password else None,
+            **options,
+        )
+
+    def command(self, *args: Union[str, bytes, int]) -> Any:
+        """
+        Run a command, reconnecting once if the connection was lost. While
+        the server cannot be reached, commands fail without waiting for
+        it until the backoff is over.
+
+        Args:
+            *args (Union[str, bytes, int]): The command and its arguments.
+
+        Returns:
+            Any: The reply.
+
+        Raises:
+            CacheBackendError: If the server cannot be reached or rejects
+                the command.
+        """
+        with self._lock:
+            if self._connection is None and time.monotonic() < self._retry_at:
+                raise CacheBackendError(
+                    f"{self.host}:{self.port} unreachable, reconnecting later"
+                )
+
+            for attempt in range(2):
+                # A new connection that fails is not tried again at once
+                reconnecting: bool = self._connection is None
+                try:
+                    if self._connection is None:
+                        self._connection = self._connect()
+                    self._connection.send(*args)
+                    reply: Any = self._connection.reply()
+                except OSError as e:
+                    # ConnectionError and timeouts included
+                    if self._connection is not None:
+                        self._connection.close()
+                        self._connection = None
+                    if attempt or reconnecting:
+                        self._retry_at = time.monotonic() + self._delay
+                        self._delay = min(self._delay * 2, MAX_RECONNECT_DELAY)
+                        raise CacheBackendError(str(e)) from e
+                else:
+                    self._delay = RECONNECT_DELAY
+                    return reply
+
+    def publish(self, channel: str, message: bytes) -> None:
+        self.command("PUBLISH", channel, message)
+
+    def subscribe(
+        self,
+        channel: str,
+        callback: Callback,
+        on_connect: Optional[Callable[[], None]] = None,
+    ) -> None:
+        # The connection of the subscription, closed to stop it
+        current: List[Any] = [None]
+        thread = threading.Thread(
+            target=self._listen,
+            args=(channel, callback, on_connect, current),
+            name=f"cache-backend-{channel}",
+            daemon=True,
+        )
+        self._subscriptions.append((thread, current))
+        thread.start()
+
+    def close(self) -> None:
+        self._closed.set()
+        for _, current in self._subscriptions:
+            if current[0] is not None:
+                current[0].close()
+        for thread, _ in self._subscriptions:
+            thread.join(timeout=self.timeout + 1)
+        self._subscriptions.clear()
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _connect(self) -> RespConnection:
+        sock: socket.socket = socket.create_connection(
+            (self.host, self.port),
+            timeout=self.timeout,
+        )
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection = RespConnection(sock)
+        try:
+            if self.password:
+                connection.send("AUTH", self.password)
+                connection.reply()
+            if self.db:
+                connection.send("SELECT", self.db)
+                connection.reply()
+        except BaseException:
+            connection.close()
+            raise
+
+        return connection
+
+    def _listen(
+        self,
+        channel: str,
+        callback: Callback,
+        on_connect: Optional[Callable[[], None]],
+        current: List[Any],
+    ) -> None:
+        delay: float = RECONNECT_DELAY
+        while not self._closed.is_set():
+            try:
+                connection: RespConnection = self._connect()
+                current[0] = connection
+                if self._closed.is_set():
+                    break
+                connection.send("SUBSCRIBE", channel)
+                connection.reply()
+                delay = RECONNECT_DELAY
+                if on_connect is not None:
+                    on_connect()
+                self._receive(connection, callback)
+            except (OSError, CacheBackendError) as e:
+                if self._closed.is_set():
+                    break
+                logger.warning(
+                    "Cache backend subscription to %s lost (%s), "
+                    "reconnecting in %.1fs",
+                    channel,
+                    e,
+                    delay,
+                )
+            finally:
+                if current[0] is not None:
+                    current[0].close()
+                    current[0] = None
+
+            self._closed.wait(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+    def _receive(self, connection: RespConnection, callback: Callback) -> None:
+        pinged: bool = False
+        while not self._closed.is_set():
+            if not connection.wait(self.ping_interval):
+                if pinged:
+                    raise ConnectionError("No reply to the ping")
+                connection.send("PING")
+                pinged = True
+                continue
+
+            pinged = False
+            reply: Any = connection.reply()
+            if isinstance(reply, list) and reply[0] == b"message":
+                try:
+                    callback(reply[2])
+                except Exception:
+                    logger.exception("Cache backend callback failed")
+
+
+def backend_from_url(url: str) -> CacheBackend:
+    """
+    Create the backend of a URL: `memory://` (or empty) for a single
+    process, `redis://...` for a server speaking the Redis protocol.
+
+    Args:
+        url (str): The URL of the backend.
+
+    Returns:
+        CacheBackend: The backend.
+    """
+    if not url or url.startswith("memory:"):
+        return MemoryBackend()
+
+    return RedisBackend.from_url(url)
@@ -0,0 +1,321 @@
+# app/coalescing.py
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class _Call:
+    """
+    A single in-flight execution shared by a leader and its followers.
+
+    Attributes:
+        done (threading.Event): Set once the leader has finished.
+        result (Any): The value returned by the leader.
+        error (Optional[BaseException]): The exception raised by the
+            leader, if any.
+    """
+
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self) -> None:
+        self.done: threading.Event = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls sharing the same key into a single execution.
+
+    The first caller for a key becomes the leader and runs the function,
+    every caller arriving while it runs waits and receives the same result
+    (or the same exception). Once the leader finishes the key is released,
+    so nothing is cached: the next call executes again.
+
+    Attributes:
+        coalesced (int): How many callers were served by another caller's
+            execution instead of running their own.
+    """
+
+    def __init__(self) -> None:
+        self._lock: threading.Lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self.coalesced: int = 0
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        """
+        Run `fn` unless a call with the same key is already in flight.
+
+        Args:
+            key (Hashable): The normalised parameters identifying the call.
+            fn (Callable[[], T]): The function executed by the leader.
+
+        Returns:
+            T: The result of the leader's execution.
+
+        Raises:
+            BaseException: Whatever the leader's execution raised.
+        """
+        with self._lock:
+            call: Optional[_Call] = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                is_leader = True
+            else:
+                self.coalesced += 1
+                is_leader = False
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+    def is_running(self, key: Hashable) -> bool:
+        """
+        Check whether a call with the given key is currently in flight.
+
+        Args:
+            key (Hashable): The key passed to `do`.
+
+        Returns:
+            bool: True if a leader is executing for this key.
+        """
+        return key in self._calls
+
+
+class CoalescingCache:
+    """
+    A TTL cache whose misses and expiries are rebuilt by a single caller.
+
+    When an entry is missing, one caller builds it while the others wait
+    for that result. When an entry has expired, one caller rebuilds it and
+    the others keep being served the expired value until the new one is
+    stored, so the database sees one rebuild instead of a thundering herd.
+
+    Invalidated entries are dropped rather than served stale, and a build
+    that started before an invalidation is returned to its callers but is
+    never stored.
+
+    Attributes:
+        ttl (float): Seconds an entry stays fresh. With a TTL of zero or
+            less nothing is kept, but concurrent builds are still
+            coalesced.
+        hits (int): Lookups served from a fresh entry.
+        stale_hits (int): Lookups served from an expired entry while it
+            was being rebuilt.
+        misses (int): Lookups that had to build or wait for a build.
+    """
+
+    def __init__(self, ttl: float) -> None:
+        self.ttl: float = ttl
+        self._lock: threading.Lock = threading.Lock()
+        self._entries: Dict[Hashable, Tuple[float, Any]] = {}
+        self._generation: int = 0
+        self._flight: SingleFlight = SingleFlight()
+        self.hits: int = 0
+        self.stale_hits: int = 0
+        self.misses: int = 0
+
+    def get_or_build(self, key: Hashable, builder: Callable[[], T]) -> T:
+        """
+        Return the cached value for `key`, building it when needed.
+
+        Args:
+            key (Hashable): The normalised parameters identifying the entry.
+            builder (Callable[[], T]): Produces the value on a miss. It must
+                return data that is safe to share between requests.
+
+        Returns:
+            T: The cached or freshly built value.
+        """
+        now: float = time.monotonic()
+        with self._lock:
+            generation: int = self._generation
+            entry: Optional[Tuple[float, Any]] = self._entries.get(key)
+
+        if entry is not None and entry[0] > now:
+            self.hits += 1
+            return entry[1]
+
+        flight_key: Tuple[int, Hashable] = (generation, key)
+        if entry is not None and self._flight.is_running(flight_key):
+            self.stale_hits += 1
+            return entry[1]
+
+        self.misses += 1
+
+        def build() -> T:
+            value: T = builder()
+            if self.ttl > 0:
+                with self._lock:
+                    if self._generation == generation:
+                        expires_at = time.monotonic() + self.ttl
+                        self._entries[key] = (expires_at, value)
+
+            return value
+
+        return self._flight.do(flight_key, build)
+
+    @property
+    def generation(self) -> int:
+        """
+        The number of invalidations so far, which identifies the version
+        of the cached data.
+        """
+        return self._generation
+
+    def invalidate(self) -> None:
+        """
+        Drop every entry and detach any build currently in flight.
+        """
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class LRUCache:
+    """
+    A bounded TTL cache of independent entries, each invalidated on its
+    own, whose misses are loaded by a single caller.
+
+    Entries are evicted least recently used first once there are more
+    than `maxsize`, and expire `ttl` seconds after they were loaded.
+    `None` is never stored, so a missing row is looked up again until it
+    exists.
+
+    A load racing with a write never stores the value read before the
+    write: invalidating a key discards the loads of the key in flight,
+    and callers arriving after an invalidation start a new load instead
+    of waiting for one that may have read the old value.
+
+    Attributes:
+        maxsize (int): The maximum number of entries, 0 disables caching
+            (concurrent loads are still coalesced).
+        ttl (float): Seconds an entry stays fresh.
+        hits (int): Lookups served from a fresh entry.
+        misses (int): Lookups that had to load or wait for a load.
+        evictions (int): Entries dropped to make room for others.
+    """
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize: int = maxsize
+        self.ttl: float = ttl
+        self._lock: threading.Lock = threading.Lock()
+        # Least recently used first
+        self._entries: OrderedDict[Hashable, Tuple[float, Any]] = OrderedDict()
+        # The load of each key allowed to store its value
+        self._loads: Dict[Hashable, object] = {}
+        self._generation: int = 0
+        self._flight: SingleFlight = SingleFlight()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def get_or_load(
+        self,
+        key: Hashable,
+        loader: Callable[[], Optional[T]],
+    ) -> Optional[T]:
+        """
+        Return the cached value for `key`, loading it when needed.
+
+        Args:
+            key (Hashable): Identifies the entry, i.e. a table and an ID.
+            loader (Callable[[], Optional[T]]): Loads the value on a
+                miss. It must return data that is safe to share between
+                requests, or None when there is nothing to cache.
+
+        Returns:
+            Optional[T]: The cached or freshly loaded value.
+        """
+        now: float = time.monotonic()
+        with self._lock:
+            generation: int = self._generation
+            entry: Optional[Tuple[float, Any]] = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        def load() -> Optional[T]:
+            token: object = object()
+            with self._lock:
+                self._loads[key] = token
+            try:
+                value: Optional[T] = loader()
+            except BaseException:
+                with self._lock:
+                    if self._loads.get(key) is token:
+                        del self._loads[key]
+                raise
+
+            with self._lock:
+                # Not stored if the key was invalidated during the load
+                if self._loads.get(key) is token:
+                    del self._loads[key]
+                    if value is not None and self.maxsize > 0:
+                        self._store(key, value)
+
+            return value
+
+        return self._flight.do((generation, key), load)
+
+    def invalidate(self, *keys: Hashable) -> None:
+        """
+        Drop entries, and discard the loads of their keys in flight.
+
+        Args:
+            *keys (Hashable): The keys of the entries.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+                self._loads.pop(key, None)
+
+    def clear(self) -> None:
+        """
+        Drop every entry, and discard every load in flight.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._loads.clear()
+
+    def _store(self, key: Hashable, value: Any) -> None:
+        # Called with the lock held
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,318 @@
+# app/compression.py
+
+import gzip
+import hashlib
+import threading
+import zlib
+from typing import Any, Dict, Optional
+
+import brotli
+from fastapi import Request
+from fastapi.responses import Response
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# In order of preference when a client accepts both equally
+ENCODINGS = ("br", "gzip")
+
+# Compressed on every request: fast levels
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+
+# Compressed once per catalog version, on the request that renders the
+# body: higher levels (brotli 10 and 11 are over 15x slower than 9)
+PRECOMPRESSED_GZIP_LEVEL = 9
+PRECOMPRESSED_BROTLI_QUALITY = 9
+
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/msgpack",
+    "application/javascript",
+    "image/svg+xml",
+    "text/css",
+    "text/csv",
+    "text/html",
+    "text/plain",
+)
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Pick a content encoding from an `Accept-Encoding` header.
+
+    Args:
+        accept_encoding (Optional[str]): The header of the request.
+
+    Returns:
+        Optional[str]: `br`, `gzip`, or None to send the body as is.
+    """
+    qualities: Dict[str, float] = {}
+
+    for item in (accept_encoding or "").split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        quality: float = 1.0
+        name, _, value = params.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        qualities[coding] = quality
+
+    wildcard: float = qualities.get("*", 0.0)
+    best: Optional[str] = None
+    best_quality: float = 0.0
+    for encoding in ENCODINGS:
+        quality = qualities.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+
+    return best
+
+
+def compress(body: bytes, encoding: str, best: bool = False) -> bytes:
+    """
+    Compress a body.
+
+    Args:
+        body (bytes): The body to compress.
+        encoding (str): `br` or `gzip`.
+        best (bool): Whether to use the best (and slowest) level, for
+            bodies compressed once and sent many times.
+
+    Returns:
+        bytes: The compressed body.
+    """
+    if encoding == "br":
+        quality: int = PRECOMPRESSED_BROTLI_QUALITY if best else BROTLI_QUALITY
+        return brotli.compress(body, quality=quality)
+
+    level: int = PRECOMPRESSED_GZIP_LEVEL if best else GZIP_LEVEL
+
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+def is_compressible(content_type: Optional[str]) -> bool:
+    media_type: str = (content_type or "").split(";")[0].strip().lower()
+
+    return media_type in COMPRESSIBLE_TYPES
+
+
+def accepted_encoding(request: Request, size: int) -> Optional[str]:
+    """
+    Pick the content encoding of a body prepared by a route, following
+    the compression settings of the application.
+
+    Args:
+        request (Request): The request.
+        size (int): The size of the uncompressed body.
+
+    Returns:
+        Optional[str]: `br`, `gzip`, or None to send the body as is.
+    """
+    minimum_size: Optional[int] = getattr(
+        request.app.state,
+        "compression_min_size",
+        None,
+    )
+    if minimum_size is None or size < minimum_size:
+        return None
+
+    return negotiate_encoding(request.headers.get("accept-encoding"))
+
+
+class CompressedBody:
+    """
+    A rendered response body, and its compressed encodings computed on
+    first use, meant to be cached and sent to many clients.
+
+    Args:
+        body (bytes): The uncompressed body.
+        media_type (str): The content type of the body.
+
+    Attributes:
+        etag (str): A weak entity tag, the digest of the body.
+    """
+
+    __slots__ = ("body", "media_type", "etag", "_encoded", "_lock")
+
+    def __init__(self, body: bytes, media_type: str) -> None:
+        self.body: bytes = body
+        self.media_type: str = media_type
+        digest: str = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self.etag: str = f'W/"{digest}"'
+        self._encoded: Dict[str, bytes] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    @classmethod
+    def of(cls, response: Response) -> "CompressedBody":
+        return cls(bytes(response.body), response.headers["content-type"])
+
+    def encoded(self, encoding: str) -> bytes:
+        """
+        Get the body compressed with `encoding`, compressing it once.
+
+        Args:
+            encoding (str): `br` or `gzip`.
+
+        Returns:
+            bytes: The compressed body.
+        """
+        body: Optional[bytes] = self._encoded.get(encoding)
+        if body is None:
+            with self._lock:
+                body = self._encoded.get(encoding)
+                if body is None:
+                    body = compress(self.body, encoding, best=True)
+                    self._encoded[encoding] = body
+
+        return body
+
+    def response(
+        self,
+        request: Request,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Response:
+        """
+        Build the response for a request, compressed when the client
+        accepts it.
+
+        Args:
+            request (Request): The request.
+            headers (Optional[Dict[str, str]]): Extra response headers.
+
+        Returns:
+            Response: The response.
+        """
+        response_headers: Dict[str, str] = dict(headers or {})
+        encoding: Optional[str] = accepted_encoding(request, len(self.body))
+        body: bytes = self.body
+        if encoding is not None:
+            body = self.encoded(encoding)
+            response_headers["Content-Encoding"] = encoding
+
+        response = Response(
+            body,
+            media_type=self.media_type,
+            headers=response_headers,
+        )
+        response.headers.add_vary_header("Accept-Encoding")
+
+        return response
+
+
+class CompressionMiddleware:
+    """
+    Compress responses with brotli or gzip, as negotiated with the
+    `Accept-Encoding` header of the request.
+
+    Only compressible content types of at least `minimum_size` bytes are
+    compressed, and responses that already have a `Content-Encoding`
+    (i.e. pre-compressed by the route) are sent as they are. Streamed
+    responses are compressed chunk by chunk, flushing after each one.
+
+    Args:
+        app (ASGIApp): The application.
+        minimum_size (int): The size under which bodies are sent as is.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024) -> None:
+        self.app: ASGIApp = app
+        self.minimum_size: int = minimum_size
+
+    async def __call__(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+    ) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding: Optional[str] = negotiate_encoding(
+            Headers(scope=scope).get("accept-encoding")
+        )
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _Responder(send, encoding, self.minimum_size)
+        await self.app(scope, receive, responder.send)
+
+
+class _Responder:
+    def __init__(self, send: Send, encoding: str, minimum_size: int) -> None:
+        self._send: Send = send
+        self.encoding: str = encoding
+        self.minimum_size: int = minimum_size
+        self.start: Optional[Message] = None
+        self.passthrough: bool = False
+        self.compressor: Any = None
+
+    async def send(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            # Held until the first chunk of the body tells how to send it
+            self.start = message
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self._send(message)
+            return
+
+        body: bytes = message.get("body", b"")
+        more_body: bool = message.get("more_body", False)
+
+        if self.start is not None:
+            start: Message = self.start
+            self.start = None
+            headers = MutableHeaders(raw=start["headers"])
+            if (
+                "content-encoding" in headers
+                or not is_compressible(headers.get("content-type"))
+                or (not more_body and len(body) < self.minimum_size)
+            ):
+                self.passthrough = True
+                await self._send(start)
+                await self._send(message)
+                return
+
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            if not more_body:
+                body = compress(body, self.encoding)
+                headers["Content-Length"] = str(len(body))
+                await self._send(start)
+                await self._send({**message, "body": body})
+                return
+
+            del headers["Content-Length"]
+            self.compressor = self._compressor()
+            await self._send(start)
+
+        await self._send(
+            {
+                "type": "http.response.body",
+                "body": self._compress_chunk(body, more_body),
+                "more_body": more_body,
+            }
+        )
+
+    def _compressor(self) -> Any:
+        if self.encoding == "br":
+            return brotli.Compressor(quality=BROTLI_QUALITY)
+
+        return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def _compress_chunk(self, body: bytes, more_body: bool) -> bytes:
+        if self.encoding == "br":
+            chunk: bytes = self.compressor.process(body)
+            end: bytes = self.compressor.flush()
+            if not more_body:
+                end += self.compressor.finish()
+            return chunk + end
+
+        flush_mode: int = zlib.Z_SYNC_FLUSH if more_body else zlib.Z_FINISH
+        compressed: bytes = self.compressor.compress(body)
+
+        return compressed + self.compressor.flush(flush_mode)
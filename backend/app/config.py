@@ -1,6 +1,7 @@
 # app/config.py
 
-from typing import List
+from typing import List, Optional
+from uuid import UUID
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field
@@ -39,6 +40,377 @@ class Settings(BaseSettings):
         json_schema_extra={"env": "ALLOW_HEADERS"},
     )
 
+    # Address and port the server listens on
+    SERVER_HOST: str = Field(
+        default="0.0.0.0",
+        json_schema_extra={"env": "SERVER_HOST"},
+    )
+    SERVER_PORT: int = Field(
+        default=8000,
+        json_schema_extra={"env": "SERVER_PORT"},
+    )
+    # Worker processes outside of development, 0 for one per CPU
+    SERVER_WORKERS: int = Field(
+        default=0,
+        json_schema_extra={"env": "SERVER_WORKERS"},
+    )
+    # Seconds an idle keep-alive connection stays open
+    SERVER_KEEP_ALIVE: int = Field(
+        default=5,
+        json_schema_extra={"env": "SERVER_KEEP_ALIVE"},
+    )
+    # Connections waiting to be accepted before new ones are refused
+    SERVER_BACKLOG: int = Field(
+        default=2048,
+        json_schema_extra={"env": "SERVER_BACKLOG"},
+    )
+    # Connections and tasks per worker before answering 503, 0 for no limit
+    SERVER_LIMIT_CONCURRENCY: int = Field(
+        default=0,
+        json_schema_extra={"env": "SERVER_LIMIT_CONCURRENCY"},
+    )
+    # Seconds a stopping worker waits for the requests in flight
+    SERVER_GRACEFUL_TIMEOUT: int = Field(
+        default=20,
+        json_schema_extra={"env": "SERVER_GRACEFUL_TIMEOUT"},
+    )
+    # Event loop ("auto" uses uvloop when installed, or "asyncio")
+    SERVER_LOOP: str = Field(
+        default="auto",
+        json_schema_extra={"env": "SERVER_LOOP"},
+    )
+    # HTTP parser ("auto" uses httptools when installed, or "h11")
+    SERVER_HTTP: str = Field(
+        default="auto",
+        json_schema_extra={"env": "SERVER_HTTP"},
+    )
+
+    # Requests handled at a time per class of routes, 0 for no limit
+    ADMISSION_READS_LIMIT: int = Field(
+        default=64,
+        json_schema_extra={"env": "ADMISSION_READS_LIMIT"},
+    )
+    ADMISSION_PRICING_LIMIT: int = Field(
+        default=16,
+        json_schema_extra={"env": "ADMISSION_PRICING_LIMIT"},
+    )
+    ADMISSION_CHECKOUT_LIMIT: int = Field(
+        default=8,
+        json_schema_extra={"env": "ADMISSION_CHECKOUT_LIMIT"},
+    )
+    # Requests waiting for a slot per class of routes, before refusing
+    ADMISSION_READS_QUEUE: int = Field(
+        default=256,
+        json_schema_extra={"env": "ADMISSION_READS_QUEUE"},
+    )
+    ADMISSION_PRICING_QUEUE: int = Field(
+        default=64,
+        json_schema_extra={"env": "ADMISSION_PRICING_QUEUE"},
+    )
+    ADMISSION_CHECKOUT_QUEUE: int = Field(
+        default=32,
+        json_schema_extra={"env": "ADMISSION_CHECKOUT_QUEUE"},
+    )
+    # Seconds a request waits for a slot before being refused
+    ADMISSION_QUEUE_TIMEOUT: float = Field(
+        default=2.0,
+        json_schema_extra={"env": "ADMISSION_QUEUE_TIMEOUT"},
+    )
+    # Retry-After of the refused requests, in seconds
+    ADMISSION_RETRY_AFTER: int = Field(
+        default=1,
+        json_schema_extra={"env": "ADMISSION_RETRY_AFTER"},
+    )
+
+    # Products whose checkout goes through the waiting room (flash sales),
+    # empty disables it
+    WAITING_ROOM_PRODUCTS: List[UUID] = Field(
+        default=[],
+        json_schema_extra={"env": "WAITING_ROOM_PRODUCTS"},
+    )
+    # Tickets admitted per second, per product
+    WAITING_ROOM_RATE: float = Field(
+        default=2.0,
+        json_schema_extra={"env": "WAITING_ROOM_RATE"},
+    )
+    # Seconds an admitted ticket can be used to create a cart
+    WAITING_ROOM_ADMISSION_TTL: float = Field(
+        default=300.0,
+        json_schema_extra={"env": "WAITING_ROOM_ADMISSION_TTL"},
+    )
+    # Seconds between two writes and reads of the tickets by a worker
+    WAITING_ROOM_INTERVAL: float = Field(
+        default=1.0,
+        json_schema_extra={"env": "WAITING_ROOM_INTERVAL"},
+    )
+    # Seconds tickets are kept once their admission expired, and buckets
+    # once their sale is over
+    WAITING_ROOM_RETENTION: float = Field(
+        default=3600.0,
+        json_schema_extra={"env": "WAITING_ROOM_RETENTION"},
+    )
+
+    # Tasks draining the outbox in each worker process, 0 to not drain it
+    OUTBOX_WORKERS: int = Field(
+        default=2,
+        json_schema_extra={"env": "OUTBOX_WORKERS"},
+    )
+    # Messages claimed at once by a task
+    OUTBOX_BATCH_SIZE: int = Field(
+        default=20,
+        json_schema_extra={"env": "OUTBOX_BATCH_SIZE"},
+    )
+    # Seconds between two reads of the outbox, for the other processes
+    OUTBOX_POLL_INTERVAL: float = Field(
+        default=1.0,
+        json_schema_extra={"env": "OUTBOX_POLL_INTERVAL"},
+    )
+    # Seconds a task holds a message from its handler on, before others
+    # retry it: longer than the slowest handler (i.e. an SMTP send)
+    OUTBOX_LEASE: float = Field(
+        default=60.0,
+        json_schema_extra={"env": "OUTBOX_LEASE"},
+    )
+    # Attempts before a message is given up on
+    OUTBOX_MAX_ATTEMPTS: int = Field(
+        default=8,
+        json_schema_extra={"env": "OUTBOX_MAX_ATTEMPTS"},
+    )
+    # Seconds before the first retry, doubled at each attempt up to the max
+    OUTBOX_BACKOFF: float = Field(
+        default=1.0,
+        json_schema_extra={"env": "OUTBOX_BACKOFF"},
+    )
+    OUTBOX_MAX_BACKOFF: float = Field(
+        default=300.0,
+        json_schema_extra={"env": "OUTBOX_MAX_BACKOFF"},
+    )
+    # Seconds the catalog may show the stock taken by checkouts late: the
+    # read model is rebuilt once per interval during a burst of checkouts
+    STOCK_INVALIDATION_INTERVAL: float = Field(
+        default=2.0,
+        json_schema_extra={"env": "STOCK_INVALIDATION_INTERVAL"},
+    )
+
+    # SMTP server of the order confirmations, empty to not send them
+    SMTP_HOST: str = Field(
+        default="",
+        json_schema_extra={"env": "SMTP_HOST"},
+    )
+    SMTP_PORT: int = Field(
+        default=25,
+        json_schema_extra={"env": "SMTP_PORT"},
+    )
+    SMTP_SENDER: str = Field(
+        default="shop@localhost",
+        json_schema_extra={"env": "SMTP_SENDER"},
+    )
+    # Credentials, empty when the server does not need them
+    SMTP_USERNAME: str = Field(
+        default="",
+        json_schema_extra={"env": "SMTP_USERNAME"},
+    )
+    SMTP_PASSWORD: str = Field(
+        default="",
+        json_schema_extra={"env": "SMTP_PASSWORD"},
+    )
+    SMTP_STARTTLS: bool = Field(
+        default=False,
+        json_schema_extra={"env": "SMTP_STARTTLS"},
+    )
+    # Seconds to wait for the SMTP server
+    SMTP_TIMEOUT: float = Field(
+        default=10.0,
+        json_schema_extra={"env": "SMTP_TIMEOUT"},
+    )
+
+    # Seconds a catalog page stays cached, 0 disables caching
+    CATALOG_CACHE_TTL: float = Field(
+        default=30.0,
+        json_schema_extra={"env": "CATALOG_CACHE_TTL"},
+    )
+    # Rows kept by the cache of the get_*_by_id services, 0 disables it
+    ENTITY_CACHE_SIZE: int = Field(
+        default=10000,
+        json_schema_extra={"env": "ENTITY_CACHE_SIZE"},
+    )
+    # Seconds a cached row stays fresh, for writes made outside of the API
+    ENTITY_CACHE_TTL: float = Field(
+        default=30.0,
+        json_schema_extra={"env": "ENTITY_CACHE_TTL"},
+    )
+    # Warm the caches up at startup, before the worker reports ready
+    WARMUP_ENABLED: bool = Field(
+        default=True,
+        json_schema_extra={"env": "WARMUP_ENABLED"},
+    )
+    # Pages of GET /products rendered by the warm-up
+    WARMUP_PAGES: int = Field(
+        default=1,
+        json_schema_extra={"env": "WARMUP_PAGES"},
+    )
+    # Seconds the startup waits for the warm-up before accepting requests
+    WARMUP_TIMEOUT: float = Field(
+        default=30.0,
+        json_schema_extra={"env": "WARMUP_TIMEOUT"},
+    )
+    # Backend broadcasting cache invalidations to the other workers,
+    # i.e. redis://localhost:6379/0, empty for a single worker
+    CACHE_BACKEND_URL: str = Field(
+        default="",
+        json_schema_extra={"env": "CACHE_BACKEND_URL"},
+    )
+
+    # Longest wait of a long-polling GET /changes request, in seconds
+    CHANGES_MAX_WAIT: float = Field(
+        default=30.0,
+        json_schema_extra={"env": "CHANGES_MAX_WAIT"},
+    )
+    # Seconds between two reads of the change log by a waiting request,
+    # to notice the writes made by other workers
+    CHANGES_POLL_INTERVAL: float = Field(
+        default=1.0,
+        json_schema_extra={"env": "CHANGES_POLL_INTERVAL"},
+    )
+    # Seconds the changes are kept in the change log, 0 keeps them all;
+    # clients behind the oldest change kept have to resync
+    CHANGES_RETENTION: float = Field(
+        default=7 * 24 * 3600.0,
+        json_schema_extra={"env": "CHANGES_RETENTION"},
+    )
+    # Seconds between two deletions of the changes past their retention
+    CHANGES_PRUNE_INTERVAL: float = Field(
+        default=3600.0,
+        json_schema_extra={"env": "CHANGES_PRUNE_INTERVAL"},
+    )
+
+    # Seconds the availability updates pushed to a client are gathered
+    # before being sent together
+    AVAILABILITY_COALESCE: float = Field(
+        default=0.1,
+        json_schema_extra={"env": "AVAILABILITY_COALESCE"},
+    )
+    # Seconds without updates before a keepalive is sent to the client
+    AVAILABILITY_KEEPALIVE: float = Field(
+        default=15.0,
+        json_schema_extra={"env": "AVAILABILITY_KEEPALIVE"},
+    )
+
+    # Log every SQL statement (verbose, for debugging only)
+    DB_ECHO: bool = Field(
+        default=False,
+        json_schema_extra={"env": "DB_ECHO"},
+    )
+    # Statements slower than this are logged, 0 disables the slow-query log
+    SLOW_QUERY_THRESHOLD_MS: float = Field(
+        default=100.0,
+        json_schema_extra={"env": "SLOW_QUERY_THRESHOLD_MS"},
+    )
+    # Statement shapes in each periodic summary of the database time
+    SLOW_QUERY_TOP_N: int = Field(
+        default=10,
+        json_schema_extra={"env": "SLOW_QUERY_TOP_N"},
+    )
+    # Seconds between two summaries, 0 disables them
+    SLOW_QUERY_SUMMARY_INTERVAL: float = Field(
+        default=60.0,
+        json_schema_extra={"env": "SLOW_QUERY_SUMMARY_INTERVAL"},
+    )
+
+    # Share the catalog read model between the workers of a host through
+    # a memory-mapped snapshot at this path, empty keeps a copy per worker
+    CATALOG_SNAPSHOT_PATH: str = Field(
+        default="",
+        json_schema_extra={"env": "CATALOG_SNAPSHOT_PATH"},
+    )
+
+    # Compress responses (brotli or gzip) of at least this many bytes,
+    # 0 disables compression
+    COMPRESSION_MIN_SIZE: int = Field(
+        default=1024,
+        json_schema_extra={"env": "COMPRESSION_MIN_SIZE"},
+    )
+
+    # Cache-Control of the GET responses carrying an ETag, by default
+    # caches keep them but revalidate them on every use
+    HTTP_CACHE_CONTROL: str = Field(
+        default="public, no-cache",
+        json_schema_extra={"env": "HTTP_CACHE_CONTROL"},
+    )
+
+    # Count SQL statements per request and report them in the response,
+    # None for only in development
+    QUERY_INSTRUMENTATION: Optional[bool] = Field(
+        default=None,
+        json_schema_extra={"env": "QUERY_INSTRUMENTATION"},
+    )
+    # Executions of one statement shape per request before warning of N+1
+    QUERY_REPEAT_THRESHOLD: int = Field(
+        default=10,
+        json_schema_extra={"env": "QUERY_REPEAT_THRESHOLD"},
+    )
+
+    # Expose Prometheus metrics on /metrics
+    METRICS_ENABLED: bool = Field(
+        default=False,
+        json_schema_extra={"env": "METRICS_ENABLED"},
+    )
+    # Bearer token the scrapers of /metrics must send, empty for none
+    METRICS_TOKEN: str = Field(
+        default="",
+        json_schema_extra={"env": "METRICS_TOKEN"},
+    )
+
+    # Profile requests sent with an `X-Profile` header signed with the secret
+    PROFILING_ENABLED: bool = Field(
+        default=False,
+        json_schema_extra={"env": "PROFILING_ENABLED"},
+    )
+    PROFILING_SECRET: str = Field(
+        default="",
+        json_schema_extra={"env": "PROFILING_SECRET"},
+    )
+    PROFILE_DIR: str = Field(
+        default="./profiles",
+        json_schema_extra={"env": "PROFILE_DIR"},
+    )
+    # Number of profiles kept in PROFILE_DIR, the oldest are deleted
+    PROFILE_KEEP: int = Field(
+        default=50,
+        json_schema_extra={"env": "PROFILE_KEEP"},
+    )
+    # Seconds between samples of the endpoint stacks, 0 disables sampling
+    PROFILE_SAMPLE_INTERVAL: float = Field(
+        default=0.0,
+        json_schema_extra={"env": "PROFILE_SAMPLE_INTERVAL"},
+    )
+    # Distinct stacks kept by the sampler
+    PROFILE_MAX_STACKS: int = Field(
+        default=2000,
+        json_schema_extra={"env": "PROFILE_MAX_STACKS"},
+    )
+
+    # Export request traces to a JSON lines file, or "stdout", empty disables
+    TRACING_EXPORT: str = Field(
+        default="",
+        json_schema_extra={"env": "TRACING_EXPORT"},
+    )
+    # Share of the requests traced, from 0 to 1
+    TRACING_SAMPLE_RATIO: float = Field(
+        default=0.01,
+        json_schema_extra={"env": "TRACING_SAMPLE_RATIO"},
+    )
+    # Requests slower than this are exported even if not sampled, 0 disables
+    TRACING_SLOW_MS: float = Field(
+        default=0.0,
+        json_schema_extra={"env": "TRACING_SLOW_MS"},
+    )
+    # Spans kept per trace
+    TRACING_MAX_SPANS: int = Field(
+        default=1000,
+        json_schema_extra={"env": "TRACING_MAX_SPANS"},
+    )
+
     model_config = SettingsConfigDict(env_file=".env")
 
 
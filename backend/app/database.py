@@ -1,22 +1,41 @@
 # app/database.py
 
+import time
 from typing import Any, Generator
 
 from sqlalchemy import Engine
+from sqlalchemy.pool import ConnectionPoolEntry, QueuePool
 from sqlmodel import Session, SQLModel, create_engine
 
 from app.config import settings
+from app.metrics import POOL_WAIT
+
+
+class TimedQueuePool(QueuePool):
+    """
+    Queue pool recording how long each checkout waits for a connection
+    (including the time to open one when the pool has room to grow).
+    """
+
+    def _do_get(self) -> ConnectionPoolEntry:
+        start: float = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_WAIT.observe(time.perf_counter() - start)
+
 
 if settings.DATABASE_URL.startswith("sqlite"):
     engine: Engine = create_engine(
         settings.DATABASE_URL,
-        echo=True,
+        echo=settings.DB_ECHO,
         connect_args={"check_same_thread": False},
     )
 else:
     engine: Engine = create_engine(
         settings.DATABASE_URL,
-        echo=True,
+        echo=settings.DB_ECHO,
+        poolclass=TimedQueuePool,
     )
 
 
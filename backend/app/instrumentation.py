@@ -0,0 +1,464 @@
+# app/instrumentation.py
+
+import json
+import logging
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from types import FrameType
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import Engine, event
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger: logging.Logger = logging.getLogger(__name__)
+slow_query_logger: logging.Logger = logging.getLogger("app.slow_queries")
+
+# Placeholder lists such as `IN (?, ?, ?)` only differ by their length
+_PLACEHOLDER_LIST = re.compile(
+    r"\((?:\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*,)+\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*\)"
+)
+
+
+def statement_shape(statement: str) -> str:
+    """
+    Normalise a SQL statement so that executions of the same query share
+    one shape, whatever the length of their placeholder lists.
+
+    Args:
+        statement (str): The SQL sent to the database driver.
+
+    Returns:
+        str: The statement on a single line with placeholder lists
+            collapsed.
+    """
+    return _PLACEHOLDER_LIST.sub("(?)", " ".join(statement.split()))
+
+
+class QueryStats:
+    """
+    Statements executed within a request (or any other scope).
+
+    Attributes:
+        count (int): Number of statements executed.
+        duration (float): Time spent executing them, in seconds.
+        shapes (Dict[str, int]): How many times each statement shape was
+            executed.
+    """
+
+    __slots__ = ("count", "duration", "shapes")
+
+    def __init__(self) -> None:
+        self.count: int = 0
+        self.duration: float = 0.0
+        self.shapes: Dict[str, int] = {}
+
+    def record(self, statement: str, duration: float) -> None:
+        self.count += 1
+        self.duration += duration
+        shape: str = statement_shape(statement)
+        self.shapes[shape] = self.shapes.get(shape, 0) + 1
+
+    def repeated(self, threshold: int) -> Dict[str, int]:
+        """
+        Statement shapes executed more than `threshold` times, which
+        usually means a relationship is lazy loaded in a loop (N+1).
+
+        Args:
+            threshold (int): The number of executions allowed per shape.
+
+        Returns:
+            Dict[str, int]: The execution count of each offending shape.
+        """
+        shapes: Dict[str, int] = self.shapes
+
+        return {shape: n for shape, n in shapes.items() if n > threshold}
+
+
+_request_stats: ContextVar[Optional[QueryStats]] = ContextVar(
+    "request_query_stats",
+    default=None,
+)
+
+_request_scope: ContextVar[Optional[Scope]] = ContextVar(
+    "request_scope",
+    default=None,
+)
+
+# Stats recording every statement of the process, whatever the context
+# they run in (used by tests and benchmarks).
+_global_stats: List[QueryStats] = []
+
+
+def current_query_stats() -> Optional[QueryStats]:
+    """
+    Get the stats of the request being handled, if any.
+
+    Returns:
+        Optional[QueryStats]: The stats, or None outside of a request.
+    """
+    return _request_stats.get()
+
+
+@contextmanager
+def count_queries() -> Iterator[QueryStats]:
+    """
+    Record every statement executed, by any engine and thread, while the
+    context is open.
+
+    Yields:
+        QueryStats: The stats being recorded.
+
+    Example:
+        ```python
+        with count_queries() as stats:
+            client.get("/api/v1/products")
+        assert stats.count <= 3
+        ```
+    """
+    install_query_listeners()
+    stats = QueryStats()
+    _global_stats.append(stats)
+    try:
+        yield stats
+    finally:
+        _global_stats.remove(stats)
+
+
+def _before_cursor_execute(
+    conn: Any,
+    cursor: Any,
+    statement: str,
+    parameters: Any,
+    context: Any,
+    executemany: bool,
+) -> None:
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(
+    conn: Any,
+    cursor: Any,
+    statement: str,
+    parameters: Any,
+    context: Any,
+    executemany: bool,
+) -> None:
+    duration: float = time.perf_counter() - conn.info["query_start_time"].pop()
+
+    stats: Optional[QueryStats] = _request_stats.get()
+    if stats is not None:
+        stats.record(statement, duration)
+    for global_stats in _global_stats:
+        global_stats.record(statement, duration)
+    if _slow_query_log is not None:
+        _slow_query_log.record(statement, parameters, executemany, duration)
+
+
+def _handle_error(context: Any) -> None:
+    start_times: List[float] = context.connection.info.get(
+        "query_start_time",
+        [],
+    )
+    if start_times:
+        start_times.pop()
+
+
+def install_query_listeners() -> None:
+    """
+    Time every statement executed by any engine.
+
+    Safe to call more than once.
+
+    Returns:
+        None
+    """
+    if event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        return
+
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(Engine, "handle_error", _handle_error)
+
+
+def parameter_shape(parameters: Any, executemany: bool = False) -> Any:
+    """
+    Describe the bound parameters of a statement by their types, so they
+    can be logged without leaking their values.
+
+    Args:
+        parameters (Any): The parameters sent to the database driver.
+        executemany (bool): Whether `parameters` holds one set per row.
+
+    Returns:
+        Any: The type name of each parameter, in a list or a dict like
+            the parameters, or the number of rows and the shape of the
+            first one for `executemany`.
+    """
+    if executemany:
+        rows: List[Any] = list(parameters or [])
+        first: Any = parameter_shape(rows[0]) if rows else []
+
+        return {"rows": len(rows), "shape": first}
+    if isinstance(parameters, dict):
+        return {k: type(v).__name__ for k, v in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(v).__name__ for v in parameters]
+
+    return type(parameters).__name__
+
+
+_PLUMBING = (
+    "app.instrumentation",
+    "app.database",
+    "app.profiling",
+    "app.tracing",
+)
+
+
+def _origin() -> Optional[str]:
+    # The innermost frame of the application outside of the database
+    # plumbing, usually a function of `app/api/services.py`
+    frame: Optional[FrameType] = sys._getframe(1)
+    while frame is not None:
+        module: str = frame.f_globals.get("__name__", "")
+        if module.startswith("app.") and module not in _PLUMBING:
+            return f"{module}:{frame.f_code.co_name}"
+        frame = frame.f_back
+
+    return None
+
+
+class SlowQueryLog:
+    """
+    Log the statements slower than a threshold, and summarise where the
+    database time goes.
+
+    Each slow statement is logged as a JSON line on the `app.slow_queries`
+    logger with its duration, the types of its parameters (never their
+    values), the route of the request and the application function that
+    executed it. Every statement is also counted by shape, and the
+    `top_n` shapes with the most database time are logged every
+    `interval` seconds, so the expensive queries show up without logging
+    all of them.
+
+    Args:
+        threshold (float): Duration, in seconds, above which a statement
+            is logged.
+        top_n (int): The number of shapes in each summary.
+        interval (float): Seconds between two summaries, 0 disables them.
+        max_shapes (int): The number of distinct shapes counted between
+            two summaries, the others are counted together.
+    """
+
+    def __init__(
+        self,
+        threshold: float,
+        top_n: int = 10,
+        interval: float = 60.0,
+        max_shapes: int = 1000,
+    ) -> None:
+        self.threshold: float = threshold
+        self.top_n: int = top_n
+        self.interval: float = interval
+        self.max_shapes: int = max_shapes
+        # Executions, total and max duration of each shape
+        self.shapes: Dict[str, List[float]] = {}
+        self._since: float = time.monotonic()
+        self._lock: threading.Lock = threading.Lock()
+
+    def record(
+        self,
+        statement: str,
+        parameters: Any,
+        executemany: bool,
+        duration: float,
+    ) -> None:
+        if duration >= self.threshold:
+            self._log_slow(statement, parameters, executemany, duration)
+        if self.interval <= 0:
+            return
+
+        shape: str = statement_shape(statement)
+        with self._lock:
+            full: bool = len(self.shapes) >= self.max_shapes
+            if full and shape not in self.shapes:
+                shape = "<other>"
+            totals: List[float] = self.shapes.setdefault(shape, [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += duration
+            totals[2] = max(totals[2], duration)
+            due: bool = time.monotonic() - self._since >= self.interval
+
+        if due:
+            self.flush()
+
+    def _log_slow(
+        self,
+        statement: str,
+        parameters: Any,
+        executemany: bool,
+        duration: float,
+    ) -> None:
+        scope: Optional[Scope] = _request_scope.get()
+        route: Any = scope.get("route") if scope else None
+        record: Dict[str, Any] = {
+            "event": "slow_query",
+            "duration_ms": round(duration * 1000, 2),
+            "statement": " ".join(statement.split()),
+            "parameters": parameter_shape(parameters, executemany),
+            "route": getattr(route, "path", None),
+            "method": scope["method"] if scope else None,
+            "origin": _origin(),
+        }
+        slow_query_logger.warning(json.dumps(record))
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """
+        The shapes with the most database time since the last summary.
+
+        Returns:
+            List[Dict[str, Any]]: The executions, total and max duration
+                of each shape, most expensive first.
+        """
+        with self._lock:
+            shapes: List[Tuple[str, List[float]]] = list(self.shapes.items())
+
+        shapes.sort(key=lambda item: item[1][1], reverse=True)
+
+        return [
+            {
+                "statement": shape,
+                "count": int(count),
+                "total_ms": round(total * 1000, 2),
+                "max_ms": round(longest * 1000, 2),
+            }
+            for shape, (count, total, longest) in shapes[: self.top_n]
+        ]
+
+    def flush(self) -> None:
+        """
+        Log the summary of the shapes counted so far and start over.
+
+        Returns:
+            None
+        """
+        top: List[Dict[str, Any]] = self.summary()
+        with self._lock:
+            elapsed: float = time.monotonic() - self._since
+            self.shapes = {}
+            self._since = time.monotonic()
+
+        if top:
+            record: Dict[str, Any] = {
+                "event": "query_summary",
+                "period_s": round(elapsed, 1),
+                "top": top,
+            }
+            slow_query_logger.info(json.dumps(record))
+
+
+_slow_query_log: Optional[SlowQueryLog] = None
+
+
+def set_slow_query_log(log: Optional[SlowQueryLog]) -> None:
+    """
+    Report the slow statements of every engine to `log`.
+
+    Args:
+        log (Optional[SlowQueryLog]): The log to use, or None to stop
+            logging slow statements.
+
+    Returns:
+        None
+    """
+    global _slow_query_log
+    install_query_listeners()
+    _slow_query_log = log
+
+
+class QueryStatsMiddleware:
+    """
+    Count the statements and database time of every HTTP request.
+
+    The totals are sent back in the `X-Query-Count` and `Server-Timing`
+    headers and logged as a JSON line once the response is complete.
+    Statement shapes repeated more than `repeat_threshold` times are
+    logged as a warning, as they are most likely N+1 queries.
+
+    Args:
+        app (ASGIApp): The application to wrap.
+        repeat_threshold (int): The number of executions of the same
+            statement shape allowed per request.
+    """
+
+    def __init__(self, app: ASGIApp, repeat_threshold: int = 10) -> None:
+        self.app: ASGIApp = app
+        self.repeat_threshold: int = repeat_threshold
+        install_query_listeners()
+
+    async def __call__(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+    ) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = _request_stats.set(stats)
+        scope_token = _request_scope.set(scope)
+        start: float = time.perf_counter()
+        status_code: int = 500
+
+        async def send_with_stats(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                db_ms: float = stats.duration * 1000
+                app_ms: float = (time.perf_counter() - start) * 1000
+                headers = MutableHeaders(scope=message)
+                headers["X-Query-Count"] = str(stats.count)
+                headers.append(
+                    "Server-Timing",
+                    f'db;dur={db_ms:.2f};desc="{stats.count} queries", '
+                    f"app;dur={app_ms:.2f}",
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            _request_stats.reset(token)
+            _request_scope.reset(scope_token)
+            self._log(scope, status_code, stats, time.perf_counter() - start)
+
+    def _log(
+        self,
+        scope: Scope,
+        status_code: int,
+        stats: QueryStats,
+        duration: float,
+    ) -> None:
+        route: Any = scope.get("route")
+        record: Dict[str, Any] = {
+            "method": scope["method"],
+            "path": scope["path"],
+            "route": getattr(route, "path", None),
+            "status": status_code,
+            "duration_ms": round(duration * 1000, 2),
+            "query_count": stats.count,
+            "query_duration_ms": round(stats.duration * 1000, 2),
+        }
+        logger.info(json.dumps(record))
+
+        repeated: Dict[str, int] = stats.repeated(self.repeat_threshold)
+        if repeated:
+            record["repeated_statements"] = repeated
+            logger.warning(json.dumps(record))
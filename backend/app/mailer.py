@@ -0,0 +1,69 @@
+# app/mailer.py
+
+import smtplib
+from email.message import EmailMessage
+from typing import Optional
+
+
+class Mailer:
+    """
+    Send emails through an SMTP server, one connection per email. It is
+    blocking, and meant for the outbox worker threads rather than the
+    requests.
+
+    Args:
+        host (str): The host of the SMTP server.
+        port (int): The port of the SMTP server.
+        sender (str): The address the emails are sent from.
+        username (Optional[str]): The user to log in as, if any.
+        password (Optional[str]): The password of the user.
+        starttls (bool): Upgrade the connection to TLS before sending.
+        timeout (float): Seconds to wait for the server.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int = 25,
+        sender: str = "shop@localhost",
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        starttls: bool = False,
+        timeout: float = 10.0,
+    ) -> None:
+        self.host: str = host
+        self.port: int = port
+        self.sender: str = sender
+        self.username: Optional[str] = username
+        self.password: Optional[str] = password
+        self.starttls: bool = starttls
+        self.timeout: float = timeout
+
+    def send(self, to: str, subject: str, body: str) -> None:
+        """
+        Send a plain text email.
+
+        Args:
+            to (str): The address of the recipient.
+            subject (str): The subject.
+            body (str): The text.
+
+        Returns:
+            None
+
+        Raises:
+            OSError: If the server cannot be reached or refuses the email
+                (`smtplib.SMTPException` is one).
+        """
+        message = EmailMessage()
+        message["From"] = self.sender
+        message["To"] = to
+        message["Subject"] = subject
+        message.set_content(body)
+
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password or "")
+            smtp.send_message(message)
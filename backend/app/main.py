@@ -1,10 +1,56 @@
 # app/main.py
 
+import asyncio
+import inspect
+from contextlib import asynccontextmanager
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Union,
+)
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from app.admission import AdmissionLimiter, AdmissionMiddleware
+from app.compression import CompressionMiddleware
 from app.config import settings, Settings
+from app.api.availability import AvailabilityBroadcaster
+from app.api.cache import stock_invalidations, use_backend
+from app.api.catalog import use_snapshots
+from app.api.changes import ChangeLogPruner
+from app.api.outbox import OutboxWorker
 from app.api.routes import router as api_router
+from app.api.services import checkout_handlers
+from app.api.snapshot import SnapshotStore
+from app.api.waiting_room import WaitingRoom
+from app.api.warmup import WarmUp
+from app.cache_backend import backend_from_url
+from app.database import engine, get_session
+from app.instrumentation import (
+    QueryStatsMiddleware,
+    SlowQueryLog,
+    set_slow_query_log,
+)
+from app.mailer import Mailer
+from app.metrics import MetricsMiddleware, register_pool_metrics
+from app.metrics import router as metrics_router
+from app.profiling import RequestProfiler, StackSampler
+from app.profiling import router as profiling_router
+from app.tracing import JsonLinesExporter, TracingMiddleware
+
+Hook = Callable[[], Union[None, Awaitable[None]]]
+
+
+async def _run_hooks(hooks: List[Hook]) -> None:
+    for hook in hooks:
+        result = hook()
+        if inspect.isawaitable(result):
+            await result
 
 
 def create_app(settings: Settings) -> FastAPI:
@@ -16,6 +62,10 @@ def create_app(settings: Settings) -> FastAPI:
 
     It also includes the router for the API under the prefix "/api/v1".
 
+    Its lifespan starts and stops the background services, and warms the
+    caches up before the worker accepts requests (for `WARMUP_TIMEOUT`
+    seconds at most, the readiness route tells when it is done).
+
     Args:
         settings (Settings): The settings object containing configuration
             values like the environment (`ENV`) to determine whether
@@ -36,11 +86,75 @@ def create_app(settings: Settings) -> FastAPI:
         docs_url = None
         redoc_url = None
 
+    # Run in order at startup and at shutdown
+    startup: List[Hook] = []
+    shutdown: List[Hook] = []
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+        app.state.shutting_down = False
+        await _run_hooks(startup)
+
+        task: Optional[asyncio.Task] = None
+        if settings.WARMUP_ENABLED:
+            # Warm up with the sessions the routes get
+            warmup = WarmUp(
+                app.dependency_overrides.get(get_session, get_session),
+                pages=settings.WARMUP_PAGES,
+                compression_min_size=settings.COMPRESSION_MIN_SIZE,
+            )
+            # Read by the readiness route
+            app.state.warmup = warmup
+            task = asyncio.create_task(warmup.run())
+            # No request is accepted until the startup is complete
+            await asyncio.wait({task}, timeout=settings.WARMUP_TIMEOUT)
+
+        try:
+            yield
+        finally:
+            app.state.shutting_down = True
+            if task is not None:
+                task.cancel()
+            await _run_hooks(shutdown)
+
     app = FastAPI(
         docs_url=docs_url,
         redoc_url=redoc_url,
+        lifespan=lifespan,
     )
 
+    limiters: Dict[str, AdmissionLimiter] = {
+        name: AdmissionLimiter(
+            limit=limit,
+            queue_size=queue_size,
+            queue_timeout=settings.ADMISSION_QUEUE_TIMEOUT,
+        )
+        for name, limit, queue_size in (
+            (
+                "reads",
+                settings.ADMISSION_READS_LIMIT,
+                settings.ADMISSION_READS_QUEUE,
+            ),
+            (
+                "pricing",
+                settings.ADMISSION_PRICING_LIMIT,
+                settings.ADMISSION_PRICING_QUEUE,
+            ),
+            (
+                "checkout",
+                settings.ADMISSION_CHECKOUT_LIMIT,
+                settings.ADMISSION_CHECKOUT_QUEUE,
+            ),
+        )
+        if limit > 0
+    }
+    if limiters:
+        # Innermost, so refused requests still get CORS headers
+        app.add_middleware(
+            AdmissionMiddleware,
+            limiters=limiters,
+            retry_after=settings.ADMISSION_RETRY_AFTER,
+        )
     app.add_middleware(
         CORSMiddleware,
         allow_origins=settings.CORS_ORIGINS,
@@ -48,6 +162,148 @@ def create_app(settings: Settings) -> FastAPI:
         allow_methods=settings.ALLOW_METHODS,
         allow_headers=settings.ALLOW_HEADERS,
     )
+    if settings.COMPRESSION_MIN_SIZE > 0:
+        app.add_middleware(
+            CompressionMiddleware,
+            minimum_size=settings.COMPRESSION_MIN_SIZE,
+        )
+        # Read by the routes sending pre-compressed bodies
+        app.state.compression_min_size = settings.COMPRESSION_MIN_SIZE
+    query_instrumentation: bool = (
+        settings.ENV == "development"
+        if settings.QUERY_INSTRUMENTATION is None
+        else settings.QUERY_INSTRUMENTATION
+    )
+    if query_instrumentation:
+        app.add_middleware(
+            QueryStatsMiddleware,
+            repeat_threshold=settings.QUERY_REPEAT_THRESHOLD,
+        )
+    if settings.SLOW_QUERY_THRESHOLD_MS > 0:
+        set_slow_query_log(
+            SlowQueryLog(
+                threshold=settings.SLOW_QUERY_THRESHOLD_MS / 1000,
+                top_n=settings.SLOW_QUERY_TOP_N,
+                interval=settings.SLOW_QUERY_SUMMARY_INTERVAL,
+            )
+        )
+    if settings.METRICS_ENABLED:
+        app.add_middleware(MetricsMiddleware)
+        app.include_router(metrics_router)
+        # Read by the metrics route
+        app.state.metrics_token = settings.METRICS_TOKEN
+        register_pool_metrics(engine.pool)
+    if settings.TRACING_EXPORT:
+        exporter = JsonLinesExporter(settings.TRACING_EXPORT)
+        # Writes the traces left in its queue
+        shutdown.append(exporter.close)
+        app.add_middleware(
+            TracingMiddleware,
+            exporter=exporter,
+            sample_ratio=settings.TRACING_SAMPLE_RATIO,
+            slow_threshold=settings.TRACING_SLOW_MS / 1000,
+            max_spans=settings.TRACING_MAX_SPANS,
+        )
+    if settings.PROFILING_ENABLED:
+        app.state.profiler = RequestProfiler(
+            secret=settings.PROFILING_SECRET,
+            directory=settings.PROFILE_DIR,
+            keep=settings.PROFILE_KEEP,
+        )
+        app.include_router(profiling_router)
+    if settings.PROFILE_SAMPLE_INTERVAL > 0:
+        sampler = StackSampler(
+            interval=settings.PROFILE_SAMPLE_INTERVAL,
+            max_stacks=settings.PROFILE_MAX_STACKS,
+        )
+        app.state.sampler = sampler
+        startup.append(sampler.start)
+        shutdown.append(sampler.stop)
+
+    use_snapshots(
+        SnapshotStore(
+            settings.CATALOG_SNAPSHOT_PATH,
+            max_age=settings.CATALOG_CACHE_TTL,
+        )
+        if settings.CATALOG_SNAPSHOT_PATH
+        else None
+    )
+
+    if settings.CACHE_BACKEND_URL:
+        backend = backend_from_url(settings.CACHE_BACKEND_URL)
+
+        def share_invalidations() -> None:
+            use_backend(backend)
+
+        def stop_sharing_invalidations() -> None:
+            use_backend(None)
+            backend.close()
+
+        # Subscribed in the worker process, once it has started
+        startup.append(share_invalidations)
+        shutdown.append(stop_sharing_invalidations)
+
+    if settings.CHANGES_RETENTION > 0:
+        pruner = ChangeLogPruner(
+            engine,
+            retention=settings.CHANGES_RETENTION,
+            interval=settings.CHANGES_PRUNE_INTERVAL,
+        )
+        startup.append(pruner.start)
+        shutdown.append(pruner.close)
+
+    availability = AvailabilityBroadcaster(
+        engine,
+        poll_interval=settings.CHANGES_POLL_INTERVAL,
+        coalesce=settings.AVAILABILITY_COALESCE,
+        keepalive=settings.AVAILABILITY_KEEPALIVE,
+    )
+    # Read by the availability stream route
+    app.state.availability = availability
+    shutdown.append(availability.close)
+
+    if settings.WAITING_ROOM_PRODUCTS:
+        waiting_room = WaitingRoom(
+            engine,
+            settings.WAITING_ROOM_PRODUCTS,
+            rate=settings.WAITING_ROOM_RATE,
+            ttl=settings.WAITING_ROOM_ADMISSION_TTL,
+            interval=settings.WAITING_ROOM_INTERVAL,
+            retention=settings.WAITING_ROOM_RETENTION,
+        )
+        # Read by the waiting room and cart routes
+        app.state.waiting_room = waiting_room
+        startup.append(waiting_room.start)
+        shutdown.append(waiting_room.close)
+
+    if settings.OUTBOX_WORKERS > 0:
+        mailer: Optional[Mailer] = None
+        if settings.SMTP_HOST:
+            mailer = Mailer(
+                settings.SMTP_HOST,
+                settings.SMTP_PORT,
+                sender=settings.SMTP_SENDER,
+                username=settings.SMTP_USERNAME or None,
+                password=settings.SMTP_PASSWORD or None,
+                starttls=settings.SMTP_STARTTLS,
+                timeout=settings.SMTP_TIMEOUT,
+            )
+        outbox = OutboxWorker(
+            engine,
+            checkout_handlers(mailer),
+            workers=settings.OUTBOX_WORKERS,
+            batch_size=settings.OUTBOX_BATCH_SIZE,
+            poll_interval=settings.OUTBOX_POLL_INTERVAL,
+            lease=settings.OUTBOX_LEASE,
+            max_attempts=settings.OUTBOX_MAX_ATTEMPTS,
+            backoff=settings.OUTBOX_BACKOFF,
+            max_backoff=settings.OUTBOX_MAX_BACKOFF,
+        )
+        startup.append(outbox.start)
+        shutdown.append(outbox.close)
+        # The stock taken by the last checkouts
+        shutdown.append(stock_invalidations.flush)
+
     app.include_router(api_router, prefix="/api/v1")
 
     return app
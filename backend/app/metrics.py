@@ -0,0 +1,498 @@
+# app/metrics.py
+
+import abc
+import bisect
+import hmac
+import threading
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+
+import anyio.to_thread
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.responses import PlainTextResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+Labels = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs: List[str] = [
+        '{}="{}"'.format(
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"'),
+        )
+        for name, value in zip(names, values)
+    ]
+
+    return "{" + ",".join(pairs) + "}"
+
+
+class _Metric(abc.ABC):
+    """
+    Base class of the metrics, with values sharded per thread.
+
+    Each thread only ever writes to its own shard, so recording a value
+    never takes a lock; the shards are summed when the metrics are
+    scraped. The lock is only taken the first time a thread records a
+    value.
+
+    Args:
+        name (str): The name of the metric.
+        documentation (str): The help text of the metric.
+        labelnames (Sequence[str]): The names of the labels, whose values
+            are passed in the same order when recording.
+    """
+
+    kind: str = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+    ) -> None:
+        self.name: str = name
+        self.documentation: str = documentation
+        self.labelnames: Tuple[str, ...] = tuple(labelnames)
+        self._local: threading.local = threading.local()
+        self._shards: List[Dict[Labels, Any]] = []
+        self._lock: threading.Lock = threading.Lock()
+
+    def _shard(self) -> Dict[Labels, Any]:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard: Dict[Labels, Any] = {}
+            with self._lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+            return shard
+
+    def _snapshots(self) -> List[Dict[Labels, Any]]:
+        with self._lock:
+            shards: List[Dict[Labels, Any]] = list(self._shards)
+
+        # Copying a dict is atomic, the owning thread may keep writing
+        return [dict(shard) for shard in shards]
+
+    def _line(self, labels: Labels, value: float) -> str:
+        return f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+    @abc.abstractmethod
+    def samples(self) -> Iterable[str]:
+        """
+        Get the sample lines of the metric, in the Prometheus text format.
+
+        Returns:
+            Iterable[str]: The lines.
+        """
+
+    def expose(self) -> str:
+        lines: List[str] = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+            *self.samples(),
+        ]
+
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """
+    A value that only goes up.
+    """
+
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        shard: Dict[Labels, Any] = self._shard()
+        shard[labels] = shard.get(labels, 0.0) + amount
+
+    def samples(self) -> Iterable[str]:
+        totals: Dict[Labels, float] = {}
+        for shard in self._snapshots():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0.0) + value
+
+        for labels, value in sorted(totals.items()):
+            yield self._line(labels, value)
+
+
+class Gauge(Counter):
+    """
+    A value that goes up and down, such as the number of requests in
+    flight.
+    """
+
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    """
+    Counts observations (i.e. request durations) in cumulative buckets.
+
+    Args:
+        buckets (Sequence[float]): The upper bounds of the buckets, the
+            `+Inf` bucket is always added.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str) -> None:
+        shard: Dict[Labels, Any] = self._shard()
+        # One slot per bucket, then +Inf, then the sum of the values
+        values: List[float] = shard.get(labels) or shard.setdefault(
+            labels,
+            [0] * (len(self.buckets) + 2),
+        )
+        values[bisect.bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def samples(self) -> Iterable[str]:
+        totals: Dict[Labels, List[float]] = {}
+        for shard in self._snapshots():
+            for labels, values in shard.items():
+                total = totals.setdefault(labels, [0] * len(values))
+                for index, value in enumerate(list(values)):
+                    total[index] += value
+
+        label_names: Tuple[str, ...] = self.labelnames + ("le",)
+        for labels, values in sorted(totals.items()):
+            cumulative: float = 0
+            bounds: List[str] = [repr(b) for b in self.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, values):
+                cumulative += count
+                yield (
+                    f"{self.name}_bucket"
+                    f"{_format_labels(label_names, labels + (bound,))} "
+                    f"{cumulative}"
+                )
+            suffix: str = _format_labels(self.labelnames, labels)
+            yield f"{self.name}_count{suffix} {cumulative}"
+            yield f"{self.name}_sum{suffix} {values[-1]}"
+
+
+class CallbackGauge(_Metric):
+    """
+    A gauge whose values are read from a callback when scraped, for values
+    that are already tracked elsewhere (i.e. the database pool).
+
+    Args:
+        callback (Callable[[], Dict[Labels, float]]): Returns the value of
+            each set of labels.
+        kind (str): The type of the metric, "gauge" or "counter".
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], Dict[Labels, float]],
+        labelnames: Sequence[str] = (),
+        kind: str = "gauge",
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.callback: Callable[[], Dict[Labels, float]] = callback
+        self.kind = kind
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in sorted(self.callback().items()):
+            yield self._line(labels, value)
+
+
+M = TypeVar("M", bound=_Metric)
+
+
+class Registry:
+    """
+    The metrics exposed by the `/metrics` endpoint.
+
+    Metrics are per process: with several workers, each one exposes its
+    own values and Prometheus should scrape (or sum) them all.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: M) -> M:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def expose(self) -> str:
+        """
+        Render every metric in the Prometheus text format.
+
+        Returns:
+            str: The exposition, ending with a new line.
+        """
+        return "\n".join(m.expose() for m in self._metrics.values()) + "\n"
+
+
+registry: Registry = Registry()
+
+REQUEST_DURATION: Histogram = registry.register(
+    Histogram(
+        "http_request_duration_seconds",
+        "Time spent handling HTTP requests.",
+        labelnames=("method", "route", "status"),
+    )
+)
+REQUESTS_IN_FLIGHT: Gauge = registry.register(
+    Gauge(
+        "http_requests_in_flight",
+        "HTTP requests being handled.",
+    )
+)
+POOL_WAIT: Histogram = registry.register(
+    Histogram(
+        "db_pool_wait_seconds",
+        "Time spent waiting for a connection from the database pool.",
+        buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0),
+    )
+)
+
+
+def register_pool_metrics(pool: Any) -> None:
+    """
+    Expose the state of a SQLAlchemy connection pool.
+
+    Pools without a fixed size (i.e. SQLite's `StaticPool`) have nothing
+    to report and are ignored.
+
+    Args:
+        pool (Any): The pool of the application's engine.
+
+    Returns:
+        None
+    """
+    if not hasattr(pool, "checkedout"):
+        return
+
+    gauges: Dict[str, Tuple[str, Callable[[], float]]] = {
+        "db_pool_size": ("Size of the database pool.", pool.size),
+        "db_pool_checked_out": (
+            "Connections currently checked out of the pool.",
+            pool.checkedout,
+        ),
+        "db_pool_overflow": (
+            "Connections opened beyond the size of the pool.",
+            pool.overflow,
+        ),
+    }
+    for name, (documentation, read) in gauges.items():
+        registry.register(
+            CallbackGauge(
+                name,
+                documentation,
+                lambda read=read: {(): float(read())},
+            )
+        )
+
+
+def _threadpool_usage() -> Dict[Labels, float]:
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    statistics = limiter.statistics()
+
+    return {
+        ("busy",): float(statistics.borrowed_tokens),
+        ("limit",): float(statistics.total_tokens),
+        ("waiting",): float(statistics.tasks_waiting),
+    }
+
+
+registry.register(
+    CallbackGauge(
+        "threadpool_threads",
+        "Worker threads running sync routes: busy, limit, and tasks "
+        "waiting for a thread.",
+        _threadpool_usage,
+        labelnames=("state",),
+    )
+)
+
+_caches: Dict[str, Any] = {}
+
+
+def register_cache(name: str, cache: Any) -> None:
+    """
+    Expose the hit and miss counters of a cache.
+
+    Args:
+        name (str): The label of the cache in the metrics.
+        cache (Any): Any object with `hits` and `misses` attributes, and
+            optionally `stale_hits` and `evictions`.
+
+    Returns:
+        None
+    """
+    _caches[name] = cache
+
+
+def _cache_lookups() -> Dict[Labels, float]:
+    values: Dict[Labels, float] = {}
+    for name, cache in _caches.items():
+        for result in ("hits", "stale_hits", "misses"):
+            if hasattr(cache, result):
+                values[(name, result)] = float(getattr(cache, result))
+
+    return values
+
+
+def _cache_evictions() -> Dict[Labels, float]:
+    return {
+        (name,): float(cache.evictions)
+        for name, cache in _caches.items()
+        if hasattr(cache, "evictions")
+    }
+
+
+def _cache_hit_ratio() -> Dict[Labels, float]:
+    values: Dict[Labels, float] = {}
+    for name, cache in _caches.items():
+        hits: int = cache.hits + getattr(cache, "stale_hits", 0)
+        lookups: int = hits + cache.misses
+        values[(name,)] = hits / lookups if lookups else 0.0
+
+    return values
+
+
+registry.register(
+    CallbackGauge(
+        "cache_lookups_total",
+        "Cache lookups by result.",
+        _cache_lookups,
+        labelnames=("cache", "result"),
+        kind="counter",
+    )
+)
+registry.register(
+    CallbackGauge(
+        "cache_evictions_total",
+        "Cache entries evicted to make room for others.",
+        _cache_evictions,
+        labelnames=("cache",),
+        kind="counter",
+    )
+)
+registry.register(
+    CallbackGauge(
+        "cache_hit_ratio",
+        "Share of cache lookups served from the cache.",
+        _cache_hit_ratio,
+        labelnames=("cache",),
+    )
+)
+
+
+class MetricsMiddleware:
+    """
+    Record the latency of every HTTP request and the number of requests
+    in flight.
+
+    Requests are labelled with their route template (i.e.
+    `/api/v1/products/{product_id}`) rather than their path, so the
+    number of series stays bounded.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app: ASGIApp = app
+
+    async def __call__(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+    ) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code: int = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        start: float = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            route: Any = scope.get("route")
+            REQUEST_DURATION.observe(
+                time.perf_counter() - start,
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                str(status_code),
+            )
+
+
+def _authorise(request: Request) -> None:
+    token: str = getattr(request.app.state, "metrics_token", "")
+    if not token:
+        return
+    header: str = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(header.encode(), f"Bearer {token}".encode()):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+# Scrapers send the `METRICS_TOKEN` as a bearer token, when it is set
+router = APIRouter(dependencies=[Depends(_authorise)])
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics_route() -> PlainTextResponse:
+    """
+    Expose the metrics in the Prometheus text format.
+
+    Returns:
+        PlainTextResponse: The metrics of this worker process.
+    """
+    return PlainTextResponse(
+        registry.expose(),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
@@ -0,0 +1,583 @@
+# app/profiling.py
+
+import asyncio
+import cProfile
+import functools
+import hashlib
+import hmac
+import json
+import os
+import profile
+import re
+import sys
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from types import FrameType
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, PlainTextResponse
+from fastapi.routing import APIRoute
+from starlette.responses import Response
+
+PROFILE_HEADER = "X-Profile"
+# Seconds a signed `X-Profile` header stays valid
+SIGNATURE_MAX_AGE = 300
+
+_PROFILE_ID = re.compile(r"^\d+-[0-9a-f]{8}$")
+
+
+def _digest(secret: str, path: str, expires: int) -> str:
+    return hmac.new(
+        secret.encode(),
+        f"{expires}:{path}".encode(),
+        hashlib.sha256,
+    ).hexdigest()
+
+
+def sign_profile_request(
+    secret: str,
+    path: str,
+    expires: Optional[int] = None,
+) -> str:
+    """
+    Build the value of the `X-Profile` header that asks for a request to
+    be profiled. The header is only valid for the path it is signed for,
+    and until it expires.
+
+    Args:
+        secret (str): The `PROFILING_SECRET` of the application.
+        path (str): The path of the request, without the query string.
+        expires (Optional[int]): When the header expires, in seconds
+            since the epoch. Defaults to `SIGNATURE_MAX_AGE` from now.
+
+    Returns:
+        str: The expiry and its HMAC-SHA256 with the path, separated by
+            a dot.
+
+    Example:
+        ```python
+        headers = {PROFILE_HEADER: sign_profile_request(secret, path)}
+        client.get(path, headers=headers)
+        ```
+    """
+    if expires is None:
+        expires = int(time.time()) + SIGNATURE_MAX_AGE
+
+    return f"{expires}.{_digest(secret, path, expires)}"
+
+
+def verify_signature(
+    value: Optional[str],
+    secret: str,
+    path: str,
+    max_age: int = SIGNATURE_MAX_AGE,
+) -> bool:
+    """
+    Check a header built by `sign_profile_request`.
+
+    Args:
+        value (Optional[str]): The value of the header, if sent.
+        secret (str): The secret the header must be signed with. An empty
+            secret rejects every header.
+        path (str): The path of the request the header is sent with.
+        max_age (int): The longest a header may stay valid, in seconds.
+
+    Returns:
+        bool: Whether the header is signed with the secret for the path,
+            and not expired.
+    """
+    if not value or not secret:
+        return False
+
+    expires: str = value.partition(".")[0]
+    if not expires.isdigit():
+        return False
+    remaining: float = int(expires) - time.time()
+    if not 0 <= remaining <= max_age:
+        return False
+
+    expected: str = sign_profile_request(secret, path, int(expires))
+
+    return hmac.compare_digest(expected, value)
+
+
+# From Python 3.12 cProfile is built on `sys.monitoring`, which reports
+# the calls of every thread: the profile of a worker thread would mix in,
+# and lose frames to, those of the event loop. The pure Python profiler
+# still follows the thread it runs in, at a higher overhead.
+_ThreadProfile: Any = (
+    profile.Profile if sys.version_info >= (3, 12) else cProfile.Profile
+)
+
+
+class _Capture:
+    """
+    The profile of one request. cProfile allows a single active profiler
+    (Python 3.12 refuses a second one, even in another thread), so it
+    covers the worker thread of a sync endpoint, or the event loop for an
+    async one, never both.
+    """
+
+    def __init__(self) -> None:
+        self.profile: Any = None
+        self.ran: bool = False
+
+    def run(self, call: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        self.ran = True
+        self.profile = _ThreadProfile()
+
+        return self.profile.runcall(call, *args, **kwargs)
+
+    async def run_async(self, call: Callable[..., Any], *args: Any) -> Any:
+        self.ran = True
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        try:
+            return await call(*args)
+        finally:
+            self.profile.disable()
+
+
+_current_capture: ContextVar[Optional[_Capture]] = ContextVar(
+    "current_profile_capture",
+    default=None,
+)
+
+# The route each worker thread is running, read by the stack sampler
+_active_threads: Dict[int, str] = {}
+
+
+class RequestProfiler:
+    """
+    Profile the requests sent with a valid `X-Profile` header and store
+    the results in a local directory.
+
+    A sync endpoint is profiled in the worker thread it runs in (with the
+    pure Python profiler from Python 3.12, as cProfile sees every thread),
+    an async one on the event loop, with the request parsing and
+    serialisation around it. The event loop is shared with the other
+    requests in flight, which may show up in the profile. Only one
+    request is profiled at a time, the others run as usual.
+
+    Args:
+        secret (str): The secret the `X-Profile` header is signed with.
+        directory (str): Where the profiles are stored.
+        keep (int): The number of profiles kept, the oldest are deleted.
+    """
+
+    def __init__(self, secret: str, directory: str, keep: int = 50) -> None:
+        self.secret: str = secret
+        self.directory: str = directory
+        self.keep: int = keep
+        self._lock: threading.Lock = threading.Lock()
+
+    def authorised(self, request: Request) -> bool:
+        header: Optional[str] = request.headers.get(PROFILE_HEADER)
+
+        return verify_signature(header, self.secret, request.url.path)
+
+    def start(self) -> Optional[_Capture]:
+        """
+        Start profiling a request, unless another one already is.
+
+        Returns:
+            Optional[_Capture]: The capture to enable, or None if busy.
+        """
+        if not self._lock.acquire(blocking=False):
+            return None
+
+        return _Capture()
+
+    def finish(self) -> None:
+        self._lock.release()
+
+    def save(
+        self,
+        capture: _Capture,
+        request: Request,
+        route: str,
+        duration: float,
+    ) -> str:
+        """
+        Store a profile, in the `pstats` format, with a JSON description
+        of the request next to it.
+
+        Args:
+            capture (_Capture): The profile of the request.
+            request (Request): The request profiled.
+            route (str): The route template of the request.
+            duration (float): Time spent handling the request, in seconds.
+
+        Returns:
+            str: The id of the profile.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        profile_id: str = f"{time.time_ns() // 1000000}-{uuid.uuid4().hex[:8]}"
+        path: str = os.path.join(self.directory, profile_id)
+
+        capture.profile.dump_stats(f"{path}.prof")
+        with open(f"{path}.json", "w") as f:
+            json.dump(
+                {
+                    "id": profile_id,
+                    "method": request.method,
+                    "path": request.url.path,
+                    "route": route,
+                    "duration_ms": round(duration * 1000, 2),
+                },
+                f,
+            )
+        self._prune()
+
+        return profile_id
+
+    def _prune(self) -> None:
+        profile_ids: List[str] = sorted(
+            self._profile_ids(),
+            key=lambda p: int(p.split("-")[0]),
+        )
+        stale: List[str] = profile_ids[: max(0, len(profile_ids) - self.keep)]
+        for profile_id in stale:
+            for extension in (".prof", ".json"):
+                name: str = profile_id + extension
+                path: str = os.path.join(self.directory, name)
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _profile_ids(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+
+        return [
+            name[: -len(".json")]
+            for name in os.listdir(self.directory)
+            if name.endswith(".json") and _PROFILE_ID.match(name[:-5])
+        ]
+
+    def profiles(self) -> List[Dict[str, Any]]:
+        """
+        Describe the stored profiles, newest first.
+
+        Returns:
+            List[Dict[str, Any]]: The request of each profile.
+        """
+        profiles: List[Dict[str, Any]] = []
+        for profile_id in self._profile_ids():
+            with open(os.path.join(self.directory, f"{profile_id}.json")) as f:
+                profiles.append(json.load(f))
+
+        return sorted(
+            profiles,
+            key=lambda p: int(p["id"].split("-")[0]),
+            reverse=True,
+        )
+
+    def path(self, profile_id: str) -> Optional[str]:
+        """
+        Get the file of a stored profile.
+
+        Args:
+            profile_id (str): The id returned in the `X-Profile-Id` header.
+
+        Returns:
+            Optional[str]: The path of the profile, or None if not found.
+        """
+        if not _PROFILE_ID.match(profile_id):
+            return None
+
+        path: str = os.path.join(self.directory, f"{profile_id}.prof")
+
+        return path if os.path.exists(path) else None
+
+
+def _fold(frame: Optional[FrameType], max_depth: int) -> str:
+    names: List[str] = []
+    while frame is not None and len(names) < max_depth:
+        module: str = frame.f_globals.get("__name__", "?")
+        names.append(f"{module}:{frame.f_code.co_name}")
+        frame = frame.f_back
+
+    return ";".join(reversed(names))
+
+
+class StackSampler:
+    """
+    Sample the stacks of the threads running sync endpoints at a fixed
+    interval, and count the samples of each stack across requests.
+
+    Sampling happens in a background thread and never blocks requests,
+    the cost is one walk of each busy thread's stack per interval. The
+    number of distinct stacks kept is bounded, samples of new stacks are
+    only counted as dropped once the bound is reached.
+
+    The counts are exposed in the folded format (`stack count` per line)
+    read by flame graph tools, each stack rooted at its route.
+
+    Args:
+        interval (float): Seconds between two samples.
+        max_stacks (int): The number of distinct stacks kept.
+        max_depth (int): The number of innermost frames kept per stack.
+    """
+
+    def __init__(
+        self,
+        interval: float,
+        max_stacks: int = 2000,
+        max_depth: int = 64,
+    ) -> None:
+        self.interval: float = interval
+        self.max_stacks: int = max_stacks
+        self.max_depth: int = max_depth
+        self.stacks: Dict[str, int] = {}
+        self.samples: int = 0
+        self.dropped: int = 0
+        self._stop: threading.Event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            name="stack-sampler",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self) -> None:
+        """
+        Record the current stack of every thread running an endpoint.
+
+        Returns:
+            None
+        """
+        frames: Dict[int, FrameType] = sys._current_frames()
+        for ident, route in list(_active_threads.items()):
+            frame: Optional[FrameType] = frames.get(ident)
+            if frame is None:
+                continue
+
+            stack: str = f"{route};{_fold(frame, self.max_depth)}"
+            self.samples += 1
+            if stack in self.stacks or len(self.stacks) < self.max_stacks:
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            else:
+                self.dropped += 1
+
+    def folded(self) -> str:
+        """
+        Render the sampled stacks, most frequent first.
+
+        Returns:
+            str: One `stack count` line per stack.
+        """
+        stacks: List[Tuple[str, int]] = sorted(
+            dict(self.stacks).items(),
+            key=lambda item: item[1],
+            reverse=True,
+        )
+
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def reset(self) -> None:
+        self.stacks = {}
+        self.samples = 0
+        self.dropped = 0
+
+
+def _sync_endpoint(call: Callable[..., Any], route: str) -> Callable[..., Any]:
+    @functools.wraps(call)
+    def endpoint(*args: Any, **kwargs: Any) -> Any:
+        ident: int = threading.get_ident()
+        _active_threads[ident] = route
+        capture: Optional[_Capture] = _current_capture.get()
+        try:
+            if capture is None:
+                return call(*args, **kwargs)
+            return capture.run(call, *args, **kwargs)
+        finally:
+            _active_threads.pop(ident, None)
+
+    return endpoint
+
+
+class ProfiledRoute(APIRoute):
+    """
+    A route whose requests can be profiled on demand, and whose worker
+    threads are visible to the `StackSampler`.
+
+    Profiling needs a `RequestProfiler` in `app.state.profiler`, routes
+    of applications without one behave like any `APIRoute`.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        call: Optional[Callable[..., Any]] = self.dependant.call
+        # Sync endpoints are profiled in their worker thread
+        self.sync: bool = False
+        if call is not None and not asyncio.iscoroutinefunction(call):
+            self.sync = True
+            self.dependant.call = _sync_endpoint(call, self.label)
+
+    @property
+    def label(self) -> str:
+        return f"{','.join(sorted(self.methods))} {self.path}"
+
+    def get_route_handler(self) -> Callable[[Request], Any]:
+        handler: Callable[[Request], Any] = super().get_route_handler()
+
+        async def profiled_handler(request: Request) -> Response:
+            profiler: Optional[RequestProfiler] = getattr(
+                request.app.state,
+                "profiler",
+                None,
+            )
+            if profiler is None or not profiler.authorised(request):
+                return await handler(request)
+
+            capture: Optional[_Capture] = profiler.start()
+            if capture is None:
+                return await handler(request)
+
+            token = _current_capture.set(capture)
+            start: float = time.perf_counter()
+            try:
+                if self.sync:
+                    response: Response = await handler(request)
+                else:
+                    response = await capture.run_async(handler, request)
+                if not capture.ran:
+                    # Rejected before reaching the endpoint
+                    return response
+                profile_id: str = await run_in_threadpool(
+                    profiler.save,
+                    capture,
+                    request,
+                    self.label,
+                    time.perf_counter() - start,
+                )
+            finally:
+                _current_capture.reset(token)
+                profiler.finish()
+
+            response.headers["X-Profile-Id"] = profile_id
+
+            return response
+
+        return profiled_handler
+
+
+def _get_profiler(request: Request) -> RequestProfiler:
+    profiler: Optional[RequestProfiler] = getattr(
+        request.app.state,
+        "profiler",
+        None,
+    )
+    if profiler is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    if not profiler.authorised(request):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Invalid or expired profiling signature",
+        )
+
+    return profiler
+
+
+router = APIRouter(prefix="/debug/profiles", include_in_schema=False)
+
+
+@router.get("")
+def list_profiles_route(
+    profiler: RequestProfiler = Depends(_get_profiler),
+) -> List[Dict[str, Any]]:
+    """
+    List the stored profiles, newest first.
+
+    Returns:
+        List[Dict[str, Any]]: The id, route and duration of each profile.
+    """
+    return profiler.profiles()
+
+
+@router.get("/hot-stacks")
+def hot_stacks_route(
+    request: Request,
+    profiler: RequestProfiler = Depends(_get_profiler),
+) -> PlainTextResponse:
+    """
+    Get the stacks counted by the always-on sampler.
+
+    Returns:
+        PlainTextResponse: The stacks in the folded format.
+
+    Raises:
+        HTTPException: If the sampler is disabled.
+    """
+    sampler: Optional[StackSampler] = getattr(
+        request.app.state,
+        "sampler",
+        None,
+    )
+    if sampler is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Stack sampling is disabled",
+        )
+
+    return PlainTextResponse(
+        sampler.folded(),
+        headers={
+            "X-Samples": str(sampler.samples),
+            "X-Samples-Dropped": str(sampler.dropped),
+        },
+    )
+
+
+@router.get("/{profile_id}")
+def get_profile_route(
+    profile_id: str,
+    profiler: RequestProfiler = Depends(_get_profiler),
+) -> FileResponse:
+    """
+    Download a profile, to be read with `pstats` or `snakeviz`.
+
+    Args:
+        profile_id (str): The id returned in the `X-Profile-Id` header.
+
+    Returns:
+        FileResponse: The profile in the `pstats` format.
+
+    Raises:
+        HTTPException: If the profile does not exist.
+    """
+    path: Optional[str] = profiler.path(profile_id)
+    if path is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Profile not found",
+        )
+
+    return FileResponse(
+        path,
+        media_type="application/octet-stream",
+        filename=f"{profile_id}.prof",
+    )
@@ -0,0 +1,638 @@
+# app/tracing.py
+
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import queue
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    TypeVar,
+)
+
+from fastapi import Request
+from sqlalchemy import Engine, event
+from starlette.datastructures import MutableHeaders
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.instrumentation import statement_shape
+from app.profiling import ProfiledRoute
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+class Span:
+    """
+    A timed operation within a trace.
+
+    Attributes:
+        trace_id (str): The id of the trace the span belongs to.
+        span_id (str): The id of the span.
+        parent_id (Optional[str]): The id of the enclosing span.
+        name (str): What the span measures, i.e. `services.get_product`.
+        kind (str): One of `server`, `route`, `endpoint`, `service`,
+            `sql` or `serialize`.
+        start (int): When the span started, in nanoseconds since the
+            epoch.
+        end (int): When the span ended, 0 while it is running.
+        attributes (Dict[str, Any]): Details of the operation.
+    """
+
+    __slots__ = (
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "name",
+        "kind",
+        "start",
+        "end",
+        "attributes",
+    )
+
+    def __init__(
+        self,
+        trace_id: str,
+        parent_id: Optional[str],
+        name: str,
+        kind: str,
+        attributes: Optional[Dict[str, Any]] = None,
+        start: Optional[int] = None,
+    ) -> None:
+        self.trace_id: str = trace_id
+        self.span_id: str = _new_id(64)
+        self.parent_id: Optional[str] = parent_id
+        self.name: str = name
+        self.kind: str = kind
+        self.start: int = time.time_ns() if start is None else start
+        self.end: int = 0
+        self.attributes: Dict[str, Any] = attributes or {}
+
+    @property
+    def duration(self) -> float:
+        """
+        The duration of the span, in seconds.
+        """
+        return (self.end - self.start) / 1e9
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_us": self.start // 1000,
+            "duration_ms": round(self.duration * 1000, 3),
+            "attributes": self.attributes,
+        }
+
+
+class Trace:
+    """
+    The spans of one request, exported together once it completes.
+
+    Args:
+        max_spans (int): The number of spans kept, the others are only
+            counted so a request looping over queries stays cheap.
+    """
+
+    __slots__ = ("trace_id", "spans", "dropped", "max_spans")
+
+    def __init__(self, max_spans: int = 1000) -> None:
+        self.trace_id: str = _new_id(128)
+        self.spans: List[Span] = []
+        self.dropped: int = 0
+        self.max_spans: int = max_spans
+
+    def add(self, span: Span) -> None:
+        if len(self.spans) < self.max_spans:
+            self.spans.append(span)
+        else:
+            self.dropped += 1
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar(
+    "current_trace",
+    default=None,
+)
+_current_span: ContextVar[Optional[Span]] = ContextVar(
+    "current_span",
+    default=None,
+)
+
+
+@contextmanager
+def span(
+    name: str,
+    kind: str = "internal",
+    **attributes: Any,
+) -> Iterator[Optional[Span]]:
+    """
+    Measure a block of code as a child of the current span.
+
+    Outside of a traced request, nothing is recorded.
+
+    Args:
+        name (str): The name of the span.
+        kind (str): The kind of the span.
+        **attributes (Any): Details of the operation.
+
+    Yields:
+        Optional[Span]: The span, or None outside of a traced request.
+
+    Example:
+        ```python
+        with span("pricing.rules", kind="service", rules=len(rules)):
+            apply_rules(rules)
+        ```
+    """
+    trace: Optional[Trace] = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+
+    parent: Optional[Span] = _current_span.get()
+    current = Span(
+        trace.trace_id,
+        parent.span_id if parent else None,
+        name,
+        kind,
+        attributes,
+    )
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        current.end = time.time_ns()
+        _current_span.reset(token)
+        trace.add(current)
+
+
+def record_span(
+    name: str,
+    kind: str,
+    start: int,
+    end: int,
+    parent: Optional[Span] = None,
+    **attributes: Any,
+) -> None:
+    """
+    Record a span that was timed elsewhere, i.e. by an event listener.
+
+    Args:
+        name (str): The name of the span.
+        kind (str): The kind of the span.
+        start (int): When it started, in nanoseconds since the epoch.
+        end (int): When it ended, in nanoseconds since the epoch.
+        parent (Optional[Span]): The enclosing span, defaults to the
+            current one.
+        **attributes (Any): Details of the operation.
+
+    Returns:
+        None
+    """
+    trace: Optional[Trace] = _current_trace.get()
+    if trace is None:
+        return
+
+    parent = parent or _current_span.get()
+    recorded = Span(
+        trace.trace_id,
+        parent.span_id if parent else None,
+        name,
+        kind,
+        attributes,
+        start=start,
+    )
+    recorded.end = end
+    trace.add(recorded)
+
+
+def traced(fn: F) -> F:
+    """
+    Record every call of a service function as a span.
+
+    Args:
+        fn (F): The function to trace.
+
+    Returns:
+        F: The function, recording a `service` span when called within a
+            traced request.
+
+    Example:
+        ```python
+        @traced
+        def get_product_by_id(session: Session, product_id: UUID):
+            ...
+        ```
+    """
+    name: str = f"{fn.__module__.rsplit('.', 1)[-1]}.{fn.__qualname__}"
+
+    @functools.wraps(fn)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        if _current_trace.get() is None:
+            return fn(*args, **kwargs)
+        with span(name, kind="service"):
+            return fn(*args, **kwargs)
+
+    return wrapper  # type: ignore[return-value]
+
+
+def _before_cursor_execute(
+    conn: Any,
+    cursor: Any,
+    statement: str,
+    parameters: Any,
+    context: Any,
+    executemany: bool,
+) -> None:
+    if _current_trace.get() is not None:
+        conn.info.setdefault("trace_start", []).append(time.time_ns())
+
+
+def _after_cursor_execute(
+    conn: Any,
+    cursor: Any,
+    statement: str,
+    parameters: Any,
+    context: Any,
+    executemany: bool,
+) -> None:
+    starts: List[int] = conn.info.get("trace_start", [])
+    if _current_trace.get() is None or not starts:
+        return
+
+    shape: str = statement_shape(statement)
+    record_span(
+        f"sql {shape.split(' ', 1)[0]}",
+        "sql",
+        starts.pop(),
+        time.time_ns(),
+        statement=shape,
+        executemany=executemany,
+    )
+
+
+def _handle_error(context: Any) -> None:
+    starts: List[int] = context.connection.info.get("trace_start", [])
+    if _current_trace.get() is not None and starts:
+        starts.pop()
+
+
+def install_sql_tracing() -> None:
+    """
+    Record a span for every statement executed during a traced request.
+
+    Safe to call more than once.
+
+    Returns:
+        None
+    """
+    if event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        return
+
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(Engine, "handle_error", _handle_error)
+
+
+def _traced_endpoint(call: Callable[..., Any], name: str) -> Any:
+    if asyncio.iscoroutinefunction(call):
+
+        @functools.wraps(call)
+        async def async_endpoint(*args: Any, **kwargs: Any) -> Any:
+            with span(name, kind="endpoint"):
+                return await call(*args, **kwargs)
+
+        return async_endpoint
+
+    @functools.wraps(call)
+    def endpoint(*args: Any, **kwargs: Any) -> Any:
+        with span(name, kind="endpoint"):
+            return call(*args, **kwargs)
+
+    return endpoint
+
+
+class TracedRoute(ProfiledRoute):
+    """
+    A route recording spans for the route, its endpoint function, and the
+    validation and serialisation of the response (the time between the
+    end of the endpoint and the end of the route).
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        call: Optional[Callable[..., Any]] = self.dependant.call
+        if call is not None:
+            name: str = getattr(self.endpoint, "__name__", self.label)
+            self.dependant.call = _traced_endpoint(call, name)
+
+    def get_route_handler(self) -> Callable[[Request], Any]:
+        handler: Callable[[Request], Any] = super().get_route_handler()
+
+        async def traced_handler(request: Request) -> Response:
+            if _current_trace.get() is None:
+                return await handler(request)
+
+            with span(self.label, kind="route") as route_span:
+                response: Response = await handler(request)
+                if route_span is not None:
+                    self._record_serialisation(route_span)
+
+            return response
+
+        return traced_handler
+
+    def _record_serialisation(self, route_span: Span) -> None:
+        trace: Optional[Trace] = _current_trace.get()
+        if trace is None:
+            return
+
+        children: List[Span] = [
+            s for s in trace.spans if s.parent_id == route_span.span_id
+        ]
+        endpoint: Optional[Span] = next(
+            (s for s in children if s.kind == "endpoint"),
+            None,
+        )
+        if endpoint is None:
+            return
+
+        serialisation = Span(
+            trace.trace_id,
+            route_span.span_id,
+            "serialize response",
+            "serialize",
+            start=endpoint.end,
+        )
+        serialisation.end = time.time_ns()
+        # Statements run after the endpoint returned (i.e. relationships
+        # lazy loaded by the response model) belong to the serialisation
+        for child in children:
+            if child.start >= endpoint.end:
+                child.parent_id = serialisation.span_id
+        trace.add(serialisation)
+
+
+# The spans of a trace, or None to stop the writer thread
+_Pending = Optional[List[Span]]
+
+
+class JsonLinesExporter:
+    """
+    Write the spans of each exported trace as JSON lines, to a file or to
+    the standard output.
+
+    Traces are handed to a background thread through a bounded queue, so
+    the event loop never waits on the disk. When the queue is full (the
+    disk cannot keep up), the trace is dropped and counted instead.
+
+    Args:
+        target (str): A file path, or `stdout`.
+        max_pending (int): The number of traces waiting to be written.
+    """
+
+    def __init__(self, target: str, max_pending: int = 1000) -> None:
+        self.target: str = target
+        self.dropped: int = 0
+        self._queue: "queue.Queue[_Pending]" = queue.Queue(max_pending)
+        self._lock: threading.Lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stream: IO[str] = sys.stdout
+        if target != "stdout":
+            self._stream = open(target, "a")
+
+    def export(self, spans: List[Span]) -> None:
+        """
+        Queue the spans of a trace to be written, without blocking.
+
+        Args:
+            spans (List[Span]): The spans of the trace.
+
+        Returns:
+            None
+        """
+        self._start()
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self) -> None:
+        """
+        Wait until the queued traces are written.
+
+        Returns:
+            None
+        """
+        self._queue.join()
+
+    def close(self) -> None:
+        """
+        Write the queued traces and stop the background thread. Exporting
+        again starts a new one.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            if self._thread is None:
+                return
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _start(self) -> None:
+        if self._thread is not None:
+            return
+
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run,
+                    name="trace-exporter",
+                    daemon=True,
+                )
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            spans: _Pending = self._queue.get()
+            try:
+                if spans is None:
+                    return
+                self._write(spans)
+            except Exception:
+                logger.exception("Writing a trace failed")
+            finally:
+                self._queue.task_done()
+
+    def _write(self, spans: List[Span]) -> None:
+        lines: str = "".join(json.dumps(s.to_dict()) + "\n" for s in spans)
+        self._stream.write(lines)
+        self._stream.flush()
+
+
+class TracingMiddleware:
+    """
+    Trace a share of the HTTP requests and export their spans once they
+    complete.
+
+    A request is traced when it is sampled (`sample_ratio`), or, when
+    `slow_threshold` is set, every request is traced and the ones slower
+    than the threshold are exported even if they were not sampled.
+    Sampled requests get an `X-Trace-Id` response header.
+
+    Args:
+        app (ASGIApp): The application to wrap.
+        exporter (JsonLinesExporter): Where the traces are written.
+        sample_ratio (float): The share of requests traced, from 0 to 1.
+        slow_threshold (float): Duration, in seconds, above which a trace
+            is always exported, 0 to only export sampled traces.
+        max_spans (int): The number of spans kept per trace.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        exporter: JsonLinesExporter,
+        sample_ratio: float = 1.0,
+        slow_threshold: float = 0.0,
+        max_spans: int = 1000,
+    ) -> None:
+        self.app: ASGIApp = app
+        self.exporter: JsonLinesExporter = exporter
+        self.sample_ratio: float = sample_ratio
+        self.slow_threshold: float = slow_threshold
+        self.max_spans: int = max_spans
+        install_sql_tracing()
+
+    async def __call__(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+    ) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        sampled: bool = random.random() < self.sample_ratio
+        if not sampled and self.slow_threshold <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(self.max_spans)
+        root = Span(trace.trace_id, None, "request", "server")
+        trace_token = _current_trace.set(trace)
+        span_token = _current_span.set(root)
+        status_code: int = 500
+
+        async def send_with_trace(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if sampled:
+                    headers = MutableHeaders(scope=message)
+                    headers["X-Trace-Id"] = trace.trace_id
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace)
+        finally:
+            root.end = time.time_ns()
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+
+            route: Any = scope.get("route")
+            root.name = f"{scope['method']} {getattr(route, 'path', None)}"
+            root.attributes.update(
+                {
+                    "http.path": scope["path"],
+                    "http.status": status_code,
+                    "dropped_spans": trace.dropped,
+                }
+            )
+            trace.add(root)
+            if sampled or root.duration >= self.slow_threshold:
+                self.exporter.export(trace.spans)
+
+
+def format_trace(spans: List[Dict[str, Any]]) -> str:
+    """
+    Render the spans of one trace as an indented tree.
+
+    Args:
+        spans (List[Dict[str, Any]]): The exported spans of the trace.
+
+    Returns:
+        str: One line per span with its duration, children under their
+            parent in the order they started.
+    """
+    children: Dict[Optional[str], List[Dict[str, Any]]] = {}
+    ids = {s["span_id"] for s in spans}
+    for s in sorted(spans, key=lambda s: s["start_us"]):
+        parent: Optional[str] = s["parent_id"]
+        children.setdefault(parent if parent in ids else None, []).append(s)
+
+    lines: List[str] = []
+
+    def walk(parent_id: Optional[str], depth: int) -> None:
+        for s in children.get(parent_id, []):
+            lines.append(
+                f"{'  ' * depth}{s['duration_ms']:>10.3f} ms  "
+                f"[{s['kind']}] {s['name']}"
+            )
+            walk(s["span_id"], depth + 1)
+
+    walk(None, 0)
+
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Print the traces exported to a JSON lines file.",
+    )
+    parser.add_argument("path", help="The file written by the exporter.")
+    parser.add_argument("--trace-id", help="Only print this trace.")
+    args = parser.parse_args(argv)
+
+    traces: Dict[str, List[Dict[str, Any]]] = {}
+    with open(args.path) as f:
+        for line in f:
+            s: Dict[str, Any] = json.loads(line)
+            traces.setdefault(s["trace_id"], []).append(s)
+
+    for trace_id, spans in traces.items():
+        if args.trace_id and trace_id != args.trace_id:
+            continue
+        sys.stdout.write(f"trace {trace_id}\n{format_trace(spans)}\n\n")
+
+
+if __name__ == "__main__":
+    main()
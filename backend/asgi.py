@@ -1,12 +1,123 @@
 # asgi.py
 
+import argparse
+import logging
+import os
+from importlib.util import find_spec
+from typing import Any, Dict, List, Optional
+
 import uvicorn
-from fastapi import FastAPI
 
-from app.main import create_app
-from app.config import settings
+from app.config import settings, Settings
+from app.main import app as api  # noqa: F401 (served as "asgi:api")
+
+logger: logging.Logger = logging.getLogger("asgi")
+
+
+def server_options(settings: Settings, reload: bool = False) -> Dict[str, Any]:
+    """
+    Get the options of the uvicorn server.
+
+    In development (`ENV=development`, or `reload`), a single process
+    reloads the application when the code changes. Otherwise the
+    application is served by `SERVER_WORKERS` processes (one per CPU by
+    default), which finish the requests in flight before stopping.
+
+    Args:
+        settings (Settings): The settings of the server.
+        reload (bool): Reload on code changes, whatever the environment.
+
+    Returns:
+        Dict[str, Any]: The keyword arguments of `uvicorn.run`.
+    """
+    options: Dict[str, Any] = {
+        "host": settings.SERVER_HOST,
+        "port": settings.SERVER_PORT,
+        "loop": settings.SERVER_LOOP,
+        "http": settings.SERVER_HTTP,
+        "timeout_keep_alive": settings.SERVER_KEEP_ALIVE,
+        "backlog": settings.SERVER_BACKLOG,
+        "limit_concurrency": settings.SERVER_LIMIT_CONCURRENCY or None,
+        "timeout_graceful_shutdown": settings.SERVER_GRACEFUL_TIMEOUT,
+    }
+
+    if reload or settings.ENV == "development":
+        # The reloader runs the application in a single process
+        options["reload"] = True
+        options["workers"] = 1
+    else:
+        options["workers"] = settings.SERVER_WORKERS or os.cpu_count() or 1
+
+    return options
+
+
+def check_shared_caches(settings: Settings, workers: int) -> bool:
+    """
+    Warn when several workers serve the application without a cache
+    backend: each worker then only invalidates its own caches on writes,
+    and the others serve the old catalog until their entries expire.
+
+    Args:
+        settings (Settings): The settings of the server.
+        workers (int): The number of worker processes.
+
+    Returns:
+        bool: Whether the caches of the workers are kept in sync.
+    """
+    if workers <= 1 or settings.CACHE_BACKEND_URL:
+        return True
+
+    logger.warning(
+        "Serving with %d workers without CACHE_BACKEND_URL: the writes of "
+        "a worker only invalidate its own caches, the others serve stale "
+        "data for up to CATALOG_CACHE_TTL (%ss) and ENTITY_CACHE_TTL "
+        "(%ss). Set CACHE_BACKEND_URL, or SERVER_WORKERS=1.",
+        workers,
+        settings.CATALOG_CACHE_TTL,
+        settings.ENTITY_CACHE_TTL,
+    )
+
+    return False
+
+
+def _implementation(option: str, fast: str, default: str) -> str:
+    # What uvicorn picks for "auto"
+    if option != "auto":
+        return option
+
+    return fast if find_spec(fast) is not None else default
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    Run the server, i.e. `python asgi.py` (`--reload` in development).
+
+    Args:
+        argv (Optional[List[str]]): The command line arguments.
+
+    Returns:
+        None
+    """
+    parser = argparse.ArgumentParser(description="Run the bike shop API.")
+    parser.add_argument(
+        "--reload",
+        action="store_true",
+        help="reload on code changes, in a single process",
+    )
+    args = parser.parse_args(argv)
+
+    options: Dict[str, Any] = server_options(settings, reload=args.reload)
+    logging.basicConfig(level=logging.INFO)
+    logger.info(
+        "Serving with %d worker(s), %s event loop and %s HTTP parser",
+        options["workers"],
+        _implementation(options["loop"], "uvloop", "asyncio"),
+        _implementation(options["http"], "httptools", "h11"),
+    )
+    check_shared_caches(settings, options["workers"])
+
+    uvicorn.run("asgi:api", **options)
 
-api: FastAPI = create_app(settings)
 
 if __name__ == "__main__":
-    uvicorn.run("asgi:api", host="0.0.0.0", port=8000, reload=True)
+    main()
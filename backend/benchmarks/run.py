@@ -0,0 +1,368 @@
+# benchmarks/run.py
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Generator, List, Optional, Tuple
+from uuid import UUID
+
+from fastapi.testclient import TestClient
+from pydantic import TypeAdapter
+from sqlalchemy import Engine
+from sqlmodel import Session, SQLModel, create_engine
+
+from app.api.cache import invalidate_catalog
+from app.api.responses import FastJSONResponse, dump_trusted
+from app.api.schemas import (
+    CartCreateSchema,
+    CartItemCreateSchema,
+    ProductSchema,
+)
+from app.api.services import create_cart_with_items, get_all_products
+from app.api.utils import calculate_total_price
+from app.config import Settings
+from app.database import get_session
+from app.instrumentation import QueryStats, count_queries
+from app.main import create_app
+from datagen import CatalogSpec, GeneratedProduct, generate
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def percentile(sorted_values: List[float], rank: int) -> float:
+    """
+    Nearest-rank percentile of an already sorted list.
+
+    Args:
+        sorted_values (List[float]): The samples in ascending order.
+        rank (int): The percentile to compute, between 0 and 100.
+
+    Returns:
+        float: The sample at the given percentile.
+    """
+    index: int = max(0, -(-rank * len(sorted_values) // 100) - 1)
+
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def measure(
+    fn: Callable[[], Any],
+    counter: QueryStats,
+    iterations: int,
+    warmup: int,
+    before: Optional[Callable[[], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Run a benchmark case and summarise its latency and query count.
+
+    Args:
+        fn (Callable[[], Any]): The operation being measured.
+        counter (QueryStats): Counts the statements of each iteration.
+        iterations (int): Number of measured iterations.
+        warmup (int): Number of unmeasured iterations run first.
+        before (Optional[Callable[[], None]]): Runs before every iteration,
+            outside of the measured time (i.e. to drop caches).
+
+    Returns:
+        Dict[str, Any]: Latency percentiles in milliseconds and the
+            statements executed per iteration.
+    """
+    for _ in range(warmup):
+        if before:
+            before()
+        fn()
+
+    latencies: List[float] = []
+    queries: List[int] = []
+
+    for _ in range(iterations):
+        if before:
+            before()
+        start_count: int = counter.count
+        start: float = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+        queries.append(counter.count - start_count)
+
+    latencies.sort()
+    latency_ms: Dict[str, float] = {
+        "min": latencies[0],
+        "mean": sum(latencies) / len(latencies),
+        **{f"p{rank}": percentile(latencies, rank) for rank in PERCENTILES},
+        "max": latencies[-1],
+    }
+
+    return {
+        "iterations": iterations,
+        "latency_ms": {k: round(v, 4) for k, v in latency_ms.items()},
+        "queries": {
+            "mean": sum(queries) / len(queries),
+            "max": max(queries),
+        },
+    }
+
+
+def run_benchmarks(
+    engine: Engine,
+    counter: QueryStats,
+    spec: CatalogSpec,
+    iterations: int,
+    warmup: int,
+    page_size: int,
+    seed: int,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Seed a catalog and measure the pricing, catalog and cart hot paths.
+
+    Args:
+        engine (Engine): The engine of an empty database.
+        counter (QueryStats): Records the statements executed.
+        spec (CatalogSpec): The shape of the synthetic catalog.
+        iterations (int): Number of measured iterations per case.
+        warmup (int): Number of unmeasured iterations per case.
+        page_size (int): The page size used for product listings.
+        seed (int): The seed used for the catalog and the selections.
+
+    Returns:
+        Dict[str, Dict[str, Any]]: The summary of each benchmark case.
+    """
+    SQLModel.metadata.create_all(engine)
+    with engine.begin() as connection:
+        _, catalog = generate(connection, spec, seed)
+
+    rng = random.Random(seed)
+    products_adapter = TypeAdapter(List[ProductSchema])
+    results: Dict[str, Dict[str, Any]] = {}
+
+    def pick_selection() -> Tuple[UUID, List[UUID]]:
+        product: GeneratedProduct = rng.choice(catalog)
+        return product.product_id, [
+            rng.choice(variants)[0] for variants in product.parts
+        ]
+
+    def price_selection() -> float:
+        product_id, variant_ids = pick_selection()
+        with Session(engine) as session:
+            return calculate_total_price(
+                session=session,
+                product_id=product_id,
+                selected_variant_ids=variant_ids,
+            )
+
+    def serialise_products() -> bytes:
+        with Session(engine) as session:
+            products = get_all_products(
+                session=session,
+                page=1,
+                page_size=page_size,
+            )
+            return products_adapter.dump_json(
+                [
+                    ProductSchema.model_validate(p, from_attributes=True)
+                    for p in products
+                ]
+            )
+
+    def create_cart() -> None:
+        product_id, variant_ids = pick_selection()
+        cart = CartCreateSchema(
+            purchased=False,
+            total_price=100.0,
+            items=[
+                CartItemCreateSchema(
+                    product_id=product_id,
+                    selected_parts=",".join(map(str, variant_ids)),
+                    total_price=100.0,
+                )
+            ],
+        )
+        with Session(engine) as session:
+            create_cart_with_items(session=session, cart_data=cart)
+
+    results["calculate_total_price"] = measure(
+        price_selection, counter, iterations, warmup
+    )
+    results["get_all_products_serialisation"] = measure(
+        serialise_products, counter, iterations, warmup
+    )
+
+    # Encoding alone, on a page of products with their relationships loaded
+    with Session(engine) as session:
+        page = get_all_products(session=session, page=1, page_size=page_size)
+        products_adapter.validate_python(page, from_attributes=True)
+
+        def encode_validated() -> bytes:
+            # What FastAPI does with a `response_model`
+            validated = products_adapter.validate_python(
+                page,
+                from_attributes=True,
+            )
+            return json.dumps(
+                products_adapter.dump_python(validated, mode="json"),
+                ensure_ascii=False,
+                separators=(",", ":"),
+            ).encode()
+
+        def encode_trusted() -> bytes:
+            rendered = [dump_trusted(ProductSchema, p) for p in page]
+            return FastJSONResponse(rendered).body
+
+        results["products_encoding (response_model)"] = measure(
+            encode_validated, counter, iterations, warmup
+        )
+        results["products_encoding (trusted)"] = measure(
+            encode_trusted, counter, iterations, warmup
+        )
+    results["create_cart_with_items"] = measure(
+        create_cart, counter, iterations, warmup
+    )
+
+    # Nothing in the background (warm-up, outbox, waiting room) would use
+    # the database of the settings rather than the benchmark one
+    app = create_app(
+        Settings(
+            WARMUP_ENABLED=False,
+            OUTBOX_WORKERS=0,
+            WAITING_ROOM_PRODUCTS=[],
+        )
+    )
+
+    def override_get_session() -> Generator[Session, Any, None]:
+        with Session(engine) as session:
+            yield session
+
+    app.dependency_overrides[get_session] = override_get_session
+    try:
+        with TestClient(app) as client:
+            endpoints: Dict[str, str] = {
+                "GET /products": f"/api/v1/products?page_size={page_size}",
+                "GET /product-parts": "/api/v1/product-parts",
+                "GET /part-variants": "/api/v1/part-variants",
+                "GET /variant-dependencies": "/api/v1/variant-dependencies",
+                "GET /custom-prices": "/api/v1/custom-prices",
+                "GET /products/{product_id}": (
+                    f"/api/v1/products/{catalog[0].product_id}"
+                ),
+                "GET /products/{product_id}/builder": (
+                    f"/api/v1/products/{catalog[0].product_id}/builder"
+                ),
+            }
+
+            def request(url: str) -> Callable[[], None]:
+                def call() -> None:
+                    response = client.get(url)
+                    response.raise_for_status()
+
+                return call
+
+            for name, url in endpoints.items():
+                results[name] = measure(
+                    request(url),
+                    counter,
+                    iterations,
+                    warmup,
+                )
+
+            results["GET /products (uncached)"] = measure(
+                request(endpoints["GET /products"]),
+                counter,
+                iterations,
+                warmup,
+                before=invalidate_catalog,
+            )
+    finally:
+        invalidate_catalog()
+
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pricing, catalog and cart hot paths.",
+    )
+    parser.add_argument("--products", type=int, default=20)
+    parser.add_argument("--parts", type=int, default=4)
+    parser.add_argument("--variants", type=int, default=5)
+    parser.add_argument("--restriction-density", type=float, default=0.02)
+    parser.add_argument("--custom-price-density", type=float, default=0.05)
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--page-size", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--database-url",
+        help="An empty database to benchmark against, defaults to a "
+        "temporary SQLite file.",
+    )
+    parser.add_argument(
+        "--output",
+        help="Write the JSON report to this file instead of stdout.",
+    )
+    args = parser.parse_args(argv)
+
+    # Every product is customisable and in stock, so any selection can be
+    # priced and added to a cart.
+    spec = CatalogSpec(
+        products=args.products,
+        parts=args.parts,
+        variants=args.variants,
+        restriction_density=args.restriction_density,
+        custom_price_density=args.custom_price_density,
+        custom_ratio=1.0,
+        unavailable_ratio=0.0,
+    )
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database_url: str = args.database_url or (
+            f"sqlite:///{os.path.join(tmp_dir, 'benchmark.db')}"
+        )
+        connect_args: Dict[str, Any] = {}
+        if database_url.startswith("sqlite"):
+            connect_args = {"check_same_thread": False}
+        engine: Engine = create_engine(
+            database_url,
+            connect_args=connect_args,
+        )
+
+        with count_queries() as counter:
+            results = run_benchmarks(
+                engine=engine,
+                counter=counter,
+                spec=spec,
+                iterations=args.iterations,
+                warmup=args.warmup,
+                page_size=args.page_size,
+                seed=args.seed,
+            )
+        engine.dispose()
+
+    report: Dict[str, Any] = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "dialect": engine.dialect.name,
+            "catalog": vars(spec),
+            "iterations": args.iterations,
+            "warmup": args.warmup,
+            "page_size": args.page_size,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    output: str = json.dumps(report, indent=2)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        sys.stdout.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,564 @@
+# datagen.py
+
+import argparse
+import csv
+import io
+import math
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from alembic.command import upgrade
+from alembic.config import Config as AlembicConfig
+from sqlalchemy import Connection, Table, func, select
+from sqlmodel import Session
+
+from app.api.models import (
+    Cart,
+    CartItem,
+    CustomPrice,
+    Product,
+    ProductPart,
+    PartVariant,
+    VariantDependency,
+)
+
+# Every generated timestamp is relative to this date, so the output does
+# not depend on when the generator runs.
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+# Rows sent to the database per statement when COPY is not available
+CHUNK_SIZE = 5000
+
+# Products generated (and written) before the next batch starts
+PRODUCT_BATCH_SIZE = 500
+
+Rows = Dict[Table, List[Dict[str, Any]]]
+
+NAMES = ("Road", "Mountain", "Gravel", "Touring", "City", "Track", "Fat")
+PARTS = ("Frame", "Finish", "Wheels", "Rim colour", "Chain", "Handlebar")
+
+
+@dataclass
+class CatalogSpec:
+    """
+    Shape of a generated catalog.
+
+    Attributes:
+        products (int): Number of products.
+        parts (int): Number of parts per customisable product.
+        variants (int): Number of variants per part.
+        restriction_density (float): Probability for each variant of a
+            product to be restricted with each variant of another part.
+        custom_price_density (float): Probability for each variant of a
+            product to have a custom price depending on each variant of
+            another part.
+        custom_ratio (float): Share of customisable products, the others
+            have no parts.
+        unavailable_ratio (float): Share of products and variants that are
+            out of stock.
+        carts (int): Number of historical carts.
+        max_cart_items (int): Maximum number of items per cart.
+        purchased_ratio (float): Share of purchased carts.
+    """
+
+    products: int = 1000
+    parts: int = 4
+    variants: int = 5
+    restriction_density: float = 0.02
+    custom_price_density: float = 0.05
+    custom_ratio: float = 0.8
+    unavailable_ratio: float = 0.05
+    carts: int = 0
+    max_cart_items: int = 3
+    purchased_ratio: float = 0.7
+
+
+@dataclass
+class GeneratedProduct:
+    """
+    What carts need to know about a generated product to price it.
+
+    Attributes:
+        product_id (UUID): The ID of the product.
+        base_price (float): The base price of the product.
+        parts (List[List[Tuple[UUID, float]]]): The id and price of the
+            variants of each part.
+        custom_prices (Dict[UUID, List[Tuple[UUID, float]]]): The
+            dependent variant id and the custom price of each variant that
+            has custom prices.
+    """
+
+    product_id: UUID
+    base_price: float
+    parts: List[List[Tuple[UUID, float]]] = field(default_factory=list)
+    custom_prices: Dict[UUID, List[Tuple[UUID, float]]] = field(
+        default_factory=dict,
+    )
+
+
+class CatalogGenerator:
+    """
+    Deterministically generate catalog and cart rows.
+
+    The same spec and seed always produce the same rows, ids included, so
+    a load test can be reproduced on any machine.
+    """
+
+    def __init__(self, spec: CatalogSpec, seed: int = 0) -> None:
+        self.spec: CatalogSpec = spec
+        self.rng: random.Random = random.Random(seed)
+
+    def uuid(self) -> UUID:
+        """
+        Draw a version 4 UUID from the seeded generator.
+        """
+        return UUID(int=self.rng.getrandbits(128), version=4)
+
+    def timestamp(self) -> datetime:
+        """
+        Draw a timestamp within the year after `EPOCH`.
+        """
+        return EPOCH + timedelta(seconds=self.rng.randrange(365 * 86400))
+
+    def sample(self, population: Sequence[Any], p: float) -> Iterator[Any]:
+        """
+        Yield each item of the population with probability `p`.
+
+        Gaps between the picked items are drawn from a geometric
+        distribution, so sparse densities cost O(picked) instead of
+        O(population).
+
+        Args:
+            population (Sequence[Any]): The candidates.
+            p (float): The probability of picking each candidate.
+
+        Yields:
+            Any: The picked items, in order.
+        """
+        if p <= 0:
+            return
+        if p >= 1:
+            yield from population
+            return
+
+        log_q: float = math.log(1.0 - p)
+        index: int = -1
+        while True:
+            index += 1 + int(math.log(1.0 - self.rng.random()) / log_q)
+            if index >= len(population):
+                return
+            yield population[index]
+
+    def catalog(self) -> Iterator[Tuple[Rows, List[GeneratedProduct]]]:
+        """
+        Generate the catalog in batches of products.
+
+        Yields:
+            Tuple[Rows, List[GeneratedProduct]]: The rows of each table for
+                the batch, and the customisable products of the batch.
+        """
+        total: int = self.spec.products
+
+        for batch_start in range(0, total, PRODUCT_BATCH_SIZE):
+            rows: Rows = {
+                table: []
+                for table in (
+                    Product.__table__,
+                    ProductPart.__table__,
+                    PartVariant.__table__,
+                    VariantDependency.__table__,
+                    CustomPrice.__table__,
+                )
+            }
+            generated: List[GeneratedProduct] = []
+
+            for number in range(
+                batch_start,
+                min(batch_start + PRODUCT_BATCH_SIZE, total),
+            ):
+                product: Optional[GeneratedProduct] = self._product(
+                    number,
+                    rows,
+                )
+                if product:
+                    generated.append(product)
+
+            yield rows, generated
+
+    def _product(
+        self,
+        number: int,
+        rows: Rows,
+    ) -> Optional[GeneratedProduct]:
+        spec: CatalogSpec = self.spec
+        rng: random.Random = self.rng
+
+        created_at: datetime = self.timestamp()
+        is_custom: bool = rng.random() < spec.custom_ratio
+        is_available: bool = rng.random() >= spec.unavailable_ratio
+        product = GeneratedProduct(
+            product_id=self.uuid(),
+            base_price=float(rng.randrange(200, 3000, 10)),
+        )
+        rows[Product.__table__].append(
+            {
+                "id": product.product_id,
+                "created_at": created_at,
+                "updated_at": created_at,
+                "name": f"{rng.choice(NAMES)} Bike {number}",
+                "description": "Generated product.",
+                "category": "Bike",
+                "base_price": product.base_price,
+                "is_custom": is_custom,
+                "is_available": is_available,
+                "stock_quantity": rng.randint(1, 50) if is_available else 0,
+            }
+        )
+        if not is_custom:
+            return None
+
+        for part_number in range(spec.parts):
+            part_id: UUID = self.uuid()
+            name: str = PARTS[part_number % len(PARTS)]
+            rows[ProductPart.__table__].append(
+                {
+                    "id": part_id,
+                    "created_at": created_at,
+                    "updated_at": created_at,
+                    "name": name,
+                    "product_id": product.product_id,
+                }
+            )
+            product.parts.append(
+                self._variants(part_id, name, created_at, rows),
+            )
+
+        for part_number, variants in enumerate(product.parts):
+            # Rules only link variants of different parts
+            others: List[UUID] = [
+                variant_id
+                for other_number, other in enumerate(product.parts)
+                if other_number != part_number
+                for variant_id, _ in other
+            ]
+            for variant_id, _ in variants:
+                self._rules(product, variant_id, others, created_at, rows)
+
+        return product
+
+    def _variants(
+        self,
+        part_id: UUID,
+        name: str,
+        created_at: datetime,
+        rows: Rows,
+    ) -> List[Tuple[UUID, float]]:
+        variants: List[Tuple[UUID, float]] = []
+
+        for number in range(self.spec.variants):
+            variant_id: UUID = self.uuid()
+            price: float = float(self.rng.randrange(10, 600, 5))
+            in_stock: bool = self.rng.random() >= self.spec.unavailable_ratio
+            stock: int = self.rng.randint(1, 100) if in_stock else 0
+            rows[PartVariant.__table__].append(
+                {
+                    "id": variant_id,
+                    "created_at": created_at,
+                    "updated_at": created_at,
+                    "name": f"{name} {number}",
+                    "price": price,
+                    "is_available": in_stock,
+                    "stock_quantity": stock,
+                    "part_id": part_id,
+                }
+            )
+            variants.append((variant_id, price))
+
+        return variants
+
+    def _rules(
+        self,
+        product: GeneratedProduct,
+        variant_id: UUID,
+        others: List[UUID],
+        created_at: datetime,
+        rows: Rows,
+    ) -> None:
+        restrictions: List[UUID] = list(
+            self.sample(others, self.spec.restriction_density)
+        )
+        if restrictions:
+            rows[VariantDependency.__table__].append(
+                {
+                    "variant_id": variant_id,
+                    "restrictions": ",".join(map(str, restrictions)),
+                    "updated_at": created_at,
+                }
+            )
+
+        for dependent_id in self.sample(
+            others,
+            self.spec.custom_price_density,
+        ):
+            custom_price: float = float(self.rng.randrange(5, 150, 5))
+            rows[CustomPrice.__table__].append(
+                {
+                    "id": self.uuid(),
+                    "created_at": created_at,
+                    "updated_at": created_at,
+                    "variant_id": variant_id,
+                    "dependent_variant_id": dependent_id,
+                    "custom_price": custom_price,
+                }
+            )
+            product.custom_prices.setdefault(variant_id, []).append(
+                (dependent_id, custom_price)
+            )
+
+    def carts(self, products: List[GeneratedProduct]) -> Iterator[Rows]:
+        """
+        Generate historical carts for the given customisable products.
+
+        Item totals are computed with the same rules as
+        `calculate_total_price`: the base price, plus the price of one
+        variant per part, plus the custom prices whose dependent variant
+        is also selected.
+
+        Args:
+            products (List[GeneratedProduct]): The products to pick from.
+
+        Yields:
+            Rows: The rows of a batch of carts and their items.
+        """
+        total: int = self.spec.carts
+        if not products:
+            return
+
+        for batch_start in range(0, total, CHUNK_SIZE):
+            rows: Rows = {Cart.__table__: [], CartItem.__table__: []}
+            for _ in range(batch_start, min(batch_start + CHUNK_SIZE, total)):
+                self._cart(products, rows)
+
+            yield rows
+
+    def _cart(self, products: List[GeneratedProduct], rows: Rows) -> None:
+        rng: random.Random = self.rng
+        cart_id: UUID = self.uuid()
+        created_at: datetime = self.timestamp()
+        cart_total: float = 0.0
+
+        for _ in range(rng.randint(1, self.spec.max_cart_items)):
+            product: GeneratedProduct = rng.choice(products)
+            selected: List[UUID] = []
+            total: float = product.base_price
+
+            for variants in product.parts:
+                variant_id, price = rng.choice(variants)
+                selected.append(variant_id)
+                total += price
+
+            chosen = set(selected)
+            for variant_id in selected:
+                custom_prices = product.custom_prices.get(variant_id, ())
+                for dependent_id, custom_price in custom_prices:
+                    if dependent_id in chosen:
+                        total += custom_price
+
+            rows[CartItem.__table__].append(
+                {
+                    "id": self.uuid(),
+                    "created_at": created_at,
+                    "updated_at": created_at,
+                    "cart_id": cart_id,
+                    "product_id": product.product_id,
+                    "selected_parts": ",".join(map(str, selected)),
+                    "total_price": total,
+                }
+            )
+            cart_total += total
+
+        rows[Cart.__table__].append(
+            {
+                "id": cart_id,
+                "created_at": created_at,
+                "updated_at": created_at,
+                "purchased": rng.random() < self.spec.purchased_ratio,
+                "total_price": cart_total,
+            }
+        )
+
+
+def _copy_value(value: Any) -> Any:
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, datetime):
+        return value.isoformat()
+
+    return value
+
+
+def write_rows(
+    connection: Connection,
+    table: Table,
+    rows: List[Dict[str, Any]],
+) -> None:
+    """
+    Bulk insert rows into a table.
+
+    On Postgres the rows are streamed with COPY, every other database gets
+    multi-row INSERT statements of `CHUNK_SIZE` rows.
+
+    Args:
+        connection (Connection): The connection of the open transaction.
+        table (Table): The table to write to.
+        rows (List[Dict[str, Any]]): The rows, all with the same keys.
+
+    Returns:
+        None
+    """
+    if not rows:
+        return
+
+    if connection.dialect.name == "postgresql":
+        columns: List[str] = list(rows[0])
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow(_copy_value(row[column]) for column in columns)
+        buffer.seek(0)
+
+        cursor = connection.connection.cursor()
+        cursor.copy_expert(
+            f"COPY {table.name} ({', '.join(columns)}) FROM STDIN CSV",
+            buffer,
+        )
+        return
+
+    for start in range(0, len(rows), CHUNK_SIZE):
+        end: int = start + CHUNK_SIZE
+        connection.execute(table.insert(), rows[start:end])
+
+
+def generate(
+    connection: Connection,
+    spec: CatalogSpec,
+    seed: int = 0,
+) -> Tuple[Dict[str, int], List[GeneratedProduct]]:
+    """
+    Generate a catalog and historical carts into the database.
+
+    Args:
+        connection (Connection): The connection of the open transaction.
+        spec (CatalogSpec): The shape of the catalog.
+        seed (int): The seed of the random generator.
+
+    Returns:
+        Tuple[Dict[str, int], List[GeneratedProduct]]: The number of rows
+            written to each table, and the customisable products.
+    """
+    generator = CatalogGenerator(spec, seed)
+    counts: Dict[str, int] = {}
+    products: List[GeneratedProduct] = []
+
+    def write(batch: Rows) -> None:
+        for table, rows in batch.items():
+            write_rows(connection, table, rows)
+            counts[table.name] = counts.get(table.name, 0) + len(rows)
+
+    for batch, generated in generator.catalog():
+        write(batch)
+        products.extend(generated)
+
+    for batch in generator.carts(products):
+        write(batch)
+
+    return counts, products
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    from app.database import engine
+    from db_seed import delete_all_data
+
+    defaults = CatalogSpec()
+    parser = argparse.ArgumentParser(
+        description="Generate a deterministic catalog for load tests.",
+    )
+    parser.add_argument("--products", type=int, default=defaults.products)
+    parser.add_argument("--parts", type=int, default=defaults.parts)
+    parser.add_argument("--variants", type=int, default=defaults.variants)
+    parser.add_argument(
+        "--restriction-density",
+        type=float,
+        default=defaults.restriction_density,
+    )
+    parser.add_argument(
+        "--custom-price-density",
+        type=float,
+        default=defaults.custom_price_density,
+    )
+    parser.add_argument(
+        "--custom-ratio",
+        type=float,
+        default=defaults.custom_ratio,
+    )
+    parser.add_argument(
+        "--unavailable-ratio",
+        type=float,
+        default=defaults.unavailable_ratio,
+    )
+    parser.add_argument("--carts", type=int, default=defaults.carts)
+    parser.add_argument(
+        "--max-cart-items",
+        type=int,
+        default=defaults.max_cart_items,
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--reset",
+        action="store_true",
+        help="Delete all existing data first. Without it the generator "
+        "refuses to write into a database that already has products.",
+    )
+    args = parser.parse_args(argv)
+
+    spec = CatalogSpec(
+        products=args.products,
+        parts=args.parts,
+        variants=args.variants,
+        restriction_density=args.restriction_density,
+        custom_price_density=args.custom_price_density,
+        custom_ratio=args.custom_ratio,
+        unavailable_ratio=args.unavailable_ratio,
+        carts=args.carts,
+        max_cart_items=args.max_cart_items,
+    )
+
+    # The schema is the one of the migrations, as for the app
+    here: Path = Path(__file__).resolve().parent
+    alembic_config = AlembicConfig(str(here / "alembic.ini"))
+    alembic_config.set_main_option("script_location", str(here / "migrations"))
+    upgrade(alembic_config, "head")
+    with Session(engine) as session:
+        if args.reset:
+            delete_all_data(session)
+        elif session.scalar(select(func.count()).select_from(Product)):
+            raise SystemExit("The database has products, use --reset.")
+
+    start: float = time.perf_counter()
+    with engine.begin() as connection:
+        counts, _ = generate(connection, spec, args.seed)
+
+    for table, count in counts.items():
+        print(f"{table}: {count} rows")
+    print(f"Generated in {time.perf_counter() - start:.2f}s.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,9 @@
 # db_seed.py
 
-from sqlalchemy import delete
+import argparse
+from typing import List, Optional
+
+from sqlalchemy import delete, func, select
 from sqlmodel import Session
 
 from app.database import engine
@@ -8,11 +11,15 @@ from app.database import engine
 from app.api.models import (
     Cart,
     CartItem,
+    CatalogChange,
     CustomPrice,
+    OutboxMessage,
     Product,
     ProductPart,
     PartVariant,
     VariantDependency,
+    WaitingRoomBucket,
+    WaitingRoomTicket,
 )
 
 
@@ -24,6 +31,12 @@ def delete_all_data(session: Session) -> None:
     # keep consistency and prevent duplicated data across deployments.
 
     with session.begin():
+        # They refer to products
+        session.exec(delete(WaitingRoomTicket))  # type: ignore
+        session.exec(delete(WaitingRoomBucket))  # type: ignore
+        # and to carts and rows that no longer exist
+        session.exec(delete(OutboxMessage))  # type: ignore
+        session.exec(delete(CatalogChange))  # type: ignore
         session.exec(delete(CartItem))  # type: ignore
         session.exec(delete(Cart))  # type: ignore
         session.exec(delete(VariantDependency))  # type: ignore
@@ -233,21 +246,48 @@ def seed_data(session: Session) -> None:
     session.commit()
 
 
-def seed() -> None:
+def seed(reset: bool = False) -> bool:
     """
     Seed the database with realistic data for a customisable bike shop.
 
     This function will add products (both customisable and non-customisable),
-    product parts, part variants to the db.
+    product parts, part variants to the db. A database that already has
+    products is left untouched unless `reset` is set, so restarting a
+    container keeps its data. Use `datagen.py` for large catalogs.
+
+    Args:
+        reset (bool): Delete all existing data before seeding.
 
     Returns:
-        None
+        bool: True if the database was seeded.
     """
     with Session(engine) as session:
-        delete_all_data(session)
+        if reset:
+            delete_all_data(session)
+        elif session.scalar(select(func.count()).select_from(Product)):
+            return False
+
         seed_data(session)
 
+    return True
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Seed the database with a small demo catalog.",
+    )
+    parser.add_argument(
+        "--reset",
+        action="store_true",
+        help="Delete all existing data before seeding.",
+    )
+    args = parser.parse_args(argv)
+
+    if seed(reset=args.reset):
+        print("Database seeded successfully.")
+    else:
+        print("Database already has products, skipping seeding.")
+
 
 if __name__ == "__main__":
-    seed()
-    print("Database seeded successfully.")
+    main()
@@ -0,0 +1,35 @@
+"""Add updated_at to variant dependencies
+
+Revision ID: 3b7e52a91f04
+Revises: c1ddc09cc1dd
+Create Date: 2026-10-19 09:12:40.118204
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "3b7e52a91f04"
+down_revision: Union[str, None] = "c1ddc09cc1dd"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "variant_dependencies",
+        sa.Column(
+            "updated_at",
+            sa.DateTime(),
+            nullable=False,
+            server_default=sa.func.now(),
+        ),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("variant_dependencies", "updated_at")
@@ -0,0 +1,37 @@
+"""Add catalog changes table
+
+Revision ID: 5c0a9d8e1b27
+Revises: 3b7e52a91f04
+Create Date: 2026-10-19 10:04:51.402117
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5c0a9d8e1b27"
+down_revision: Union[str, None] = "3b7e52a91f04"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "catalog_changes",
+        sa.Column("seq", sa.Integer(), nullable=False),
+        sa.Column("entity", sa.String(), nullable=False),
+        sa.Column("entity_id", sa.Uuid(), nullable=False),
+        sa.Column("op", sa.String(), nullable=False),
+        sa.Column("data", sa.String(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("seq"),
+        sqlite_autoincrement=True,
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("catalog_changes")
@@ -0,0 +1,63 @@
+"""Add outbox messages table and cart email
+
+Revision ID: a91d3f6c2e48
+Revises: e2b7c4a19d53
+Create Date: 2026-10-19 17:41:05.219360
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "a91d3f6c2e48"
+down_revision: Union[str, None] = "e2b7c4a19d53"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("carts", sa.Column("email", sa.String(), nullable=True))
+    op.create_table(
+        "outbox_messages",
+        sa.Column("seq", sa.Integer(), nullable=False),
+        sa.Column("topic", sa.String(), nullable=False),
+        sa.Column("payload", sa.String(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("available_at", sa.DateTime(), nullable=False),
+        sa.Column("claimed_by", sa.Uuid(), nullable=True),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("last_error", sa.String(), nullable=True),
+        sa.Column("processed_at", sa.DateTime(), nullable=True),
+        sa.Column("failed_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("seq"),
+        sqlite_autoincrement=True,
+    )
+    op.create_index(
+        op.f("ix_outbox_messages_available_at"),
+        "outbox_messages",
+        ["available_at"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_outbox_messages_claimed_by"),
+        "outbox_messages",
+        ["claimed_by"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        op.f("ix_outbox_messages_claimed_by"),
+        table_name="outbox_messages",
+    )
+    op.drop_index(
+        op.f("ix_outbox_messages_available_at"),
+        table_name="outbox_messages",
+    )
+    op.drop_table("outbox_messages")
+    op.drop_column("carts", "email")
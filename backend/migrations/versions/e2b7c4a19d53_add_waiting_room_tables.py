@@ -0,0 +1,75 @@
+"""Add waiting room tables
+
+Revision ID: e2b7c4a19d53
+Revises: 5c0a9d8e1b27
+Create Date: 2026-10-19 15:12:38.528104
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "e2b7c4a19d53"
+down_revision: Union[str, None] = "5c0a9d8e1b27"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "waiting_room_tickets",
+        sa.Column("seq", sa.Integer(), nullable=False),
+        sa.Column("token", sa.Uuid(), nullable=False),
+        sa.Column("product_id", sa.Uuid(), nullable=False),
+        sa.Column("joined_at", sa.DateTime(), nullable=False),
+        sa.Column("admitted_at", sa.DateTime(), nullable=True),
+        sa.Column("expires_at", sa.DateTime(), nullable=True),
+        sa.Column("used_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["product_id"],
+            ["products.id"],
+        ),
+        sa.PrimaryKeyConstraint("seq"),
+        sa.UniqueConstraint("token"),
+        sqlite_autoincrement=True,
+    )
+    op.create_index(
+        op.f("ix_waiting_room_tickets_product_id"),
+        "waiting_room_tickets",
+        ["product_id"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_waiting_room_tickets_admitted_at"),
+        "waiting_room_tickets",
+        ["admitted_at"],
+        unique=False,
+    )
+    op.create_table(
+        "waiting_room_buckets",
+        sa.Column("product_id", sa.Uuid(), nullable=False),
+        sa.Column("tokens", sa.Float(), nullable=False),
+        sa.Column("refilled_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["product_id"],
+            ["products.id"],
+        ),
+        sa.PrimaryKeyConstraint("product_id"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("waiting_room_buckets")
+    op.drop_index(
+        op.f("ix_waiting_room_tickets_admitted_at"),
+        table_name="waiting_room_tickets",
+    )
+    op.drop_index(
+        op.f("ix_waiting_room_tickets_product_id"),
+        table_name="waiting_room_tickets",
+    )
+    op.drop_table("waiting_room_tickets")
@@ -0,0 +1,293 @@
+# tests/api/test_availability.py
+
+import asyncio
+from pathlib import Path
+from typing import Any, Dict, Generator, List, Tuple
+from uuid import UUID, uuid4
+
+import orjson
+import pytest
+from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
+from fastapi.testclient import TestClient
+from sqlalchemy import Engine
+from sqlmodel import Session, SQLModel, create_engine
+
+from app.api.availability import (
+    AvailabilityBroadcaster,
+    AvailabilityUpdate,
+    Subscriber,
+    read_availability,
+)
+from app.api.cache import invalidate_catalog
+from app.api.schemas import PartVariantUpdateSchema
+from app.api.services import update_part_variant
+from app.config import Settings
+from app.database import get_session
+from app.main import create_app
+from datagen import CatalogSpec, generate
+
+SPEC = CatalogSpec(products=2, parts=2, variants=2)
+
+
+@pytest.fixture
+def stream_engine(tmp_path: Path) -> Generator[Engine, Any, None]:
+    # Streams, writers and the broadcaster each use their own connection
+    engine: Engine = create_engine(
+        f"sqlite:///{tmp_path / 'stream.db'}",
+        connect_args={"check_same_thread": False},
+    )
+    SQLModel.metadata.create_all(engine)
+    invalidate_catalog()
+
+    yield engine
+
+    invalidate_catalog()
+    engine.dispose()
+
+
+@pytest.fixture
+def stream_app(stream_engine: Engine) -> FastAPI:
+    app = create_app(Settings())
+    app.state.availability = AvailabilityBroadcaster(
+        stream_engine,
+        coalesce=0.3,
+    )
+
+    def override_get_session() -> Generator[Session, Any, None]:
+        with Session(stream_engine) as session:
+            yield session
+
+    app.dependency_overrides[get_session] = override_get_session
+
+    return app
+
+
+def _event(frame: bytes) -> Dict[str, Dict[str, Any]]:
+    event, data = frame.decode().strip().split("\n")
+    assert event == "event: availability"
+
+    return orjson.loads(data.removeprefix("data: "))
+
+
+async def _stream(
+    app: FastAPI,
+    product_id: UUID,
+    variant_id: UUID,
+) -> Tuple[int, List[bytes]]:
+    disconnected = asyncio.Event()
+    requested: List[bool] = []
+    status: List[int] = []
+    frames: "asyncio.Queue[bytes]" = asyncio.Queue()
+
+    async def receive() -> Dict[str, Any]:
+        if not requested:
+            requested.append(True)
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: Dict[str, Any]) -> None:
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+        elif message.get("body"):
+            await frames.put(message["body"])
+
+    scope: Dict[str, Any] = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/api/v1/availability/stream",
+        "raw_path": b"/api/v1/availability/stream",
+        "query_string": f"product_id={product_id}".encode(),
+        "headers": [(b"host", b"test")],
+        "client": ("test", 1),
+        "server": ("test", 80),
+    }
+
+    def write(stock_quantity: int) -> None:
+        with Session(app.state.availability.engine) as session:
+            update_part_variant(
+                session,
+                variant_id,
+                PartVariantUpdateSchema(stock_quantity=stock_quantity),
+            )
+
+    task = asyncio.create_task(app(scope, receive, send))
+    received: List[bytes] = [await asyncio.wait_for(frames.get(), 5)]
+
+    # A burst of writes is pushed as one event with the latest values
+    await run_in_threadpool(write, 7)
+    await run_in_threadpool(write, 3)
+    received.append(await asyncio.wait_for(frames.get(), 5))
+
+    disconnected.set()
+    await asyncio.wait_for(task, 5)
+    assert frames.empty()
+
+    return status[0], received
+
+
+def test_stream_pushes_coalesced_availability(
+    stream_engine: Engine,
+    stream_app: FastAPI,
+) -> None:
+    with stream_engine.begin() as connection:
+        _, generated = generate(connection, SPEC, seed=3)
+    product = generated[0]
+    variant_id = product.parts[0][0][0]
+
+    status, (first, second) = asyncio.run(
+        _stream(stream_app, product.product_id, variant_id)
+    )
+
+    assert status == 200
+    snapshot = _event(first)
+    assert list(snapshot["products"]) == [str(product.product_id)]
+    assert set(snapshot["variants"]) == {
+        str(variant) for part in product.parts for variant, _ in part
+    }
+    assert _event(second) == {
+        "products": {},
+        "variants": {
+            str(variant_id): {
+                "product_id": str(product.product_id),
+                "is_available": snapshot["variants"][str(variant_id)]["is_available"],
+                "stock_quantity": 3,
+            }
+        },
+    }
+    assert stream_app.state.availability.subscriber_count == 0
+
+
+def test_unknown_products_are_not_found(test_client: TestClient) -> None:
+    response = test_client.get(
+        f"/api/v1/availability/stream?product_id={uuid4()}",
+    )
+
+    assert response.status_code == 404
+    assert test_client.app.state.availability.subscriber_count == 0
+
+
+def test_updates_reach_the_subscribers_of_their_product(
+    test_db: Session,
+) -> None:
+    broadcaster = AvailabilityBroadcaster(test_db.get_bind())
+    followed, other = uuid4(), uuid4()
+    subscriber = Subscriber(frozenset([followed]))
+    broadcaster._subscribers = {followed: {subscriber}}
+    variant_id = uuid4()
+
+    broadcaster.publish(
+        [
+            AvailabilityUpdate(1, "variants", variant_id, followed, True, 5),
+            AvailabilityUpdate(2, "products", other, other, False, 0),
+            AvailabilityUpdate(3, "variants", variant_id, followed, True, 4),
+        ]
+    )
+    assert subscriber.drain() == {
+        "products": {},
+        "variants": {
+            str(variant_id): {
+                "product_id": str(followed),
+                "is_available": True,
+                "stock_quantity": 4,
+            }
+        },
+    }
+
+    # Writes that do not change the availability are not pushed
+    broadcaster.publish(
+        [AvailabilityUpdate(4, "variants", variant_id, followed, True, 4)]
+    )
+    assert not subscriber.ready.is_set()
+
+
+def test_updates_are_skipped_against_what_each_subscriber_got(
+    test_db: Session,
+) -> None:
+    broadcaster = AvailabilityBroadcaster(test_db.get_bind())
+    product_id = uuid4()
+    first = Subscriber(frozenset([product_id]))
+    broadcaster._subscribers = {product_id: {first}}
+    broadcaster.publish(
+        [AvailabilityUpdate(1, "products", product_id, product_id, True, 4)]
+    )
+
+    # Joins after a write the task has not read, with 5 in stock
+    snapshot = {
+        "products": {
+            str(product_id): {"is_available": True, "stock_quantity": 5},
+        },
+        "variants": {},
+    }
+    second = Subscriber(frozenset([product_id]), snapshot, since=2)
+    broadcaster._subscribers[product_id].add(second)
+    broadcaster.publish(
+        [
+            AvailabilityUpdate(2, "products", product_id, product_id, True, 5),
+            AvailabilityUpdate(3, "products", product_id, product_id, True, 4),
+        ]
+    )
+
+    assert first.drain()["products"][str(product_id)]["stock_quantity"] == 4
+    assert second.drain()["products"][str(product_id)]["stock_quantity"] == 4
+
+    # Older than what was sent
+    broadcaster.publish(
+        [AvailabilityUpdate(2, "products", product_id, product_id, True, 5)]
+    )
+    assert not first.ready.is_set() and not second.ready.is_set()
+
+
+def test_writes_before_the_subscription_are_caught_up(
+    stream_engine: Engine,
+) -> None:
+    with stream_engine.begin() as connection:
+        _, generated = generate(connection, SPEC, seed=3)
+    product_id = generated[0].product_id
+    variant_id = generated[0].parts[0][0][0]
+    broadcaster = AvailabilityBroadcaster(stream_engine)
+
+    def write(stock_quantity: int) -> None:
+        with Session(stream_engine) as session:
+            update_part_variant(
+                session,
+                variant_id,
+                PartVariantUpdateSchema(stock_quantity=stock_quantity),
+            )
+
+    async def subscribe() -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        with Session(stream_engine) as session:
+            read = await run_in_threadpool(
+                read_availability,
+                session,
+                frozenset([product_id]),
+            )
+        assert read is not None
+        position, snapshot = read
+
+        # Written, then read by the task of an earlier subscriber, before
+        # this one joins
+        await run_in_threadpool(write, 11)
+        other = await broadcaster.subscribe(frozenset([product_id]))
+        while broadcaster._position == position:
+            await asyncio.sleep(0.01)
+        broadcaster.unsubscribe(other)
+
+        subscriber = await broadcaster.subscribe(
+            frozenset([product_id]),
+            snapshot,
+            since=position,
+        )
+        broadcaster.unsubscribe(subscriber)
+        await broadcaster.close()
+
+        return snapshot, subscriber.drain()
+
+    snapshot, pending = asyncio.run(subscribe())
+
+    assert snapshot["variants"][str(variant_id)]["stock_quantity"] != 11
+    assert pending["variants"][str(variant_id)]["stock_quantity"] == 11
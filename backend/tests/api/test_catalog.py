@@ -0,0 +1,165 @@
+# tests/api/test_catalog.py
+
+from typing import Callable, ContextManager
+from uuid import UUID, uuid4
+
+from fastapi.testclient import TestClient
+from pytest_mock import MockerFixture
+from sqlmodel import Session
+
+from app.api.catalog import Catalog, get_catalog
+from app.api.schemas import (
+    BuilderSchema,
+    PartVariantSchema,
+    ProductPartSchema,
+    ProductSchema,
+)
+from app.api.services import (
+    get_all_part_variants,
+    get_all_product_parts,
+    get_all_products,
+)
+from app.instrumentation import QueryStats
+from datagen import CatalogSpec, generate
+
+SPEC = CatalogSpec(
+    products=6,
+    parts=3,
+    variants=4,
+    restriction_density=0.2,
+    custom_price_density=0.2,
+)
+
+
+def test_read_model_matches_the_schemas(
+    test_db: Session,
+    test_client: TestClient,
+) -> None:
+    generate(test_db.connection(), SPEC, seed=5)
+    test_db.commit()
+
+    products = test_client.get("/api/v1/products?page=2&page_size=4").json()
+    assert products == [
+        ProductSchema.model_validate(p, from_attributes=True).model_dump(mode="json")
+        for p in get_all_products(test_db, page=2, page_size=4)
+    ]
+
+    parts = test_client.get("/api/v1/product-parts").json()
+    assert parts == [
+        ProductPartSchema.model_validate(p, from_attributes=True).model_dump(
+            mode="json"
+        )
+        for p in get_all_product_parts(test_db)
+    ]
+
+    variants = test_client.get("/api/v1/part-variants").json()
+    assert variants == [
+        PartVariantSchema.model_validate(v, from_attributes=True).model_dump(
+            mode="json"
+        )
+        for v in get_all_part_variants(test_db)
+    ]
+    assert any(v["dependencies"] for v in variants)
+    assert any(v["custom_prices"] for v in variants)
+
+
+def test_read_model_is_loaded_once_per_version(
+    test_db: Session,
+    test_client: TestClient,
+    query_budget: Callable[[int], ContextManager[QueryStats]],
+) -> None:
+    generate(test_db.connection(), SPEC, seed=5)
+    test_db.commit()
+
+    # One query per table, whatever the size of the catalog
+    with query_budget(5):
+        test_client.get("/api/v1/product-parts")
+    with query_budget(0):
+        test_client.get("/api/v1/products")
+        test_client.get("/api/v1/part-variants")
+
+
+def test_variants_reference_each_other_by_index(test_db: Session) -> None:
+    _, generated = generate(test_db.connection(), SPEC, seed=5)
+    test_db.commit()
+
+    catalog: Catalog = get_catalog(test_db)
+
+    for product in generated:
+        for variant_id, custom_prices in product.custom_prices.items():
+            variant = catalog.variant(variant_id)
+            assert variant is not None
+            assert sorted(
+                (catalog.variants[index].id, price)
+                for index, price in variant.custom_prices
+            ) == sorted(custom_prices)
+
+
+def test_builder_lookups_match_the_product(
+    test_db: Session,
+    test_client: TestClient,
+) -> None:
+    _, generated = generate(test_db.connection(), SPEC, seed=5)
+    test_db.commit()
+    product = generated[0]
+
+    response = test_client.get(f"/api/v1/products/{product.product_id}/builder")
+    builder = BuilderSchema.model_validate(response.json())
+
+    assert builder.product == ProductSchema.model_validate(
+        test_client.get(f"/api/v1/products/{product.product_id}").json()
+    )
+    assert builder.variant_parts == {
+        variant.id: part.id
+        for part in builder.product.parts
+        for variant in part.variants
+    }
+    assert builder.restrictions and builder.custom_prices
+    for variant_id, restricted in builder.restrictions.items():
+        for other_id in restricted:
+            assert variant_id in builder.restrictions[other_id]
+    for part in builder.product.parts:
+        for variant in part.variants:
+            for dependency in variant.dependencies:
+                for other_id in dependency.restrictions.split(","):
+                    assert variant.id in builder.restrictions[UUID(other_id)]
+    assert {
+        variant_id: sorted(
+            (price.dependent_variant_id, price.custom_price) for price in prices
+        )
+        for variant_id, prices in builder.custom_prices.items()
+    } == {
+        variant_id: sorted(prices)
+        for variant_id, prices in product.custom_prices.items()
+    }
+    for prices in builder.custom_prices.values():
+        for price in prices:
+            assert (
+                builder.variant_parts[price.dependent_variant_id]
+                == price.dependent_part_id
+            )
+
+
+def test_builder_is_rendered_once_per_version(
+    test_db: Session,
+    test_client: TestClient,
+    mocker: MockerFixture,
+) -> None:
+    _, generated = generate(test_db.connection(), SPEC, seed=5)
+    test_db.commit()
+    url = f"/api/v1/products/{generated[0].product_id}/builder"
+    spy = mocker.spy(Catalog, "builder_dict")
+
+    first = test_client.get(url)
+    second = test_client.get(url)
+    assert second.content == first.content
+    assert spy.call_count == 1
+
+    test_client.put(
+        f"/api/v1/products/{generated[0].product_id}",
+        json={"name": "Renamed"},
+    )
+    assert test_client.get(url).json()["product"]["name"] == "Renamed"
+    assert spy.call_count == 2
+
+    assert test_client.get(f"/api/v1/products/{uuid4()}/builder").status_code == 404
@@ -0,0 +1,175 @@
+# tests/api/test_changes.py
+
+import threading
+import time
+from datetime import timedelta
+from uuid import uuid4
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session, select
+
+from app.api.changes import ChangeLogPruner, change_notifier, record_change
+from app.api.models import CatalogChange, Product, utc_now
+from app.config import settings
+
+PRODUCT = {
+    "name": "Test Product",
+    "description": "Test Description",
+    "base_price": 100.0,
+    "category": "Test Category",
+    "is_custom": False,
+    "is_available": True,
+    "stock_quantity": 10,
+}
+
+
+def _log_product(session: Session) -> None:
+    # A write made by another worker: logged, but nobody is notified
+    product = Product(**PRODUCT)
+    session.add(product)
+    record_change(session, product)
+    session.commit()
+
+
+def test_writes_are_logged_in_order(test_client: TestClient) -> None:
+    start = test_client.get("/api/v1/changes").json()
+    assert start == {"seq": 0, "more": False, "changes": []}
+
+    product = test_client.post("/api/v1/products", json=PRODUCT).json()
+    part = test_client.post(
+        "/api/v1/product-parts",
+        json={"product_id": product["id"], "name": "Frame"},
+    ).json()
+    updated = test_client.put(
+        f"/api/v1/products/{product['id']}",
+        json={"stock_quantity": 3},
+    ).json()
+    test_client.delete(f"/api/v1/product-parts/{part['id']}")
+
+    response = test_client.get("/api/v1/changes?since=0").json()
+    changes = response["changes"]
+
+    assert [(c["entity"], c["op"], c["id"]) for c in changes] == [
+        ("products", "upsert", product["id"]),
+        ("product_parts", "upsert", part["id"]),
+        ("products", "upsert", product["id"]),
+        ("product_parts", "delete", part["id"]),
+    ]
+    assert [c["seq"] for c in changes] == [1, 2, 3, 4]
+    assert response["seq"] == 4
+    assert response["more"] is False
+
+    row = changes[2]["data"]
+    assert row["stock_quantity"] == 3
+    assert row["updated_at"] == updated["updated_at"]
+    assert row["updated_at"] > changes[0]["data"]["updated_at"]
+    assert changes[3]["data"] is None
+
+    assert test_client.get("/api/v1/changes").json()["seq"] == 4
+    after = test_client.get("/api/v1/changes?since=2&limit=1").json()
+    assert [c["seq"] for c in after["changes"]] == [3]
+    assert after["seq"] == 3
+    assert after["more"] is True
+
+
+def test_changes_roll_back_with_the_write(test_db: Session) -> None:
+    product = Product(**PRODUCT)
+    test_db.add(product)
+    record_change(test_db, product)
+    test_db.rollback()
+
+    assert test_db.exec(select(CatalogChange)).all() == []
+
+
+def test_long_poll_wakes_up_on_a_write(
+    test_db: Session,
+    test_client: TestClient,
+) -> None:
+    def write() -> None:
+        _log_product(test_db)
+        change_notifier.notify()
+
+    timer = threading.Timer(0.2, write)
+    timer.start()
+    started = time.monotonic()
+    response = test_client.get("/api/v1/changes?since=0&wait=5").json()
+    timer.join()
+
+    # Woken by the notification, before the log is read again
+    assert time.monotonic() - started < settings.CHANGES_POLL_INTERVAL
+    assert [c["op"] for c in response["changes"]] == ["upsert"]
+
+
+def test_long_poll_reads_writes_of_other_workers(
+    test_db: Session,
+    test_client: TestClient,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(settings, "CHANGES_POLL_INTERVAL", 0.05)
+
+    timer = threading.Timer(0.2, _log_product, args=(test_db,))
+    timer.start()
+    response = test_client.get("/api/v1/changes?since=0&wait=5").json()
+    timer.join()
+
+    assert response["seq"] == 1
+
+
+def test_long_poll_times_out(test_client: TestClient) -> None:
+    started = time.monotonic()
+    response = test_client.get("/api/v1/changes?since=0&wait=0.2")
+
+    assert time.monotonic() - started >= 0.2
+    assert response.json() == {"seq": 0, "more": False, "changes": []}
+
+
+def test_clients_behind_the_pruned_changes_resync(
+    test_db: Session,
+    test_client: TestClient,
+) -> None:
+    for _ in range(3):
+        test_client.post("/api/v1/products", json=PRODUCT)
+
+    pruner = ChangeLogPruner(test_db.get_bind(), retention=60.0)
+    assert pruner.prune(now=utc_now() + timedelta(hours=1)) == 2
+    # The latest change is kept, for the position of the log
+    assert pruner.prune(now=utc_now() + timedelta(hours=1)) == 0
+
+    for since in (0, 1):
+        response = test_client.get(f"/api/v1/changes?since={since}")
+        assert response.status_code == 410
+        assert response.json()["seq"] == 3
+
+    response = test_client.get("/api/v1/changes?since=2")
+    assert [c["seq"] for c in response.json()["changes"]] == [3]
+    response = test_client.get("/api/v1/changes?since=3")
+    assert response.json() == {"seq": 3, "more": False, "changes": []}
+
+
+def test_dependencies_are_identified_by_their_variant(
+    test_client: TestClient,
+) -> None:
+    product = test_client.post("/api/v1/products", json=PRODUCT).json()
+    part = test_client.post(
+        "/api/v1/product-parts",
+        json={"product_id": product["id"], "name": "Frame"},
+    ).json()
+    variant = test_client.post(
+        "/api/v1/part-variants",
+        json={
+            "part_id": part["id"],
+            "name": "Full",
+            "price": 10.0,
+            "is_available": True,
+            "stock_quantity": 1,
+        },
+    ).json()
+    test_client.post(
+        "/api/v1/variant-dependencies",
+        json={"variant_id": variant["id"], "restrictions": str(uuid4())},
+    )
+
+    [change] = test_client.get("/api/v1/changes?since=3").json()["changes"]
+    assert change["entity"] == "variant_dependencies"
+    assert change["id"] == variant["id"]
@@ -0,0 +1,124 @@
+# tests/api/test_compact.py
+
+from datetime import datetime
+from uuid import uuid4
+
+import msgpack
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from app.api.catalog import Catalog, PartRecord, ProductRecord, VariantRecord
+from app.api.compact import (
+    MSGPACK_MEDIA_TYPE,
+    MsgPackResponse,
+    decode_products,
+    encode_products,
+    negotiate,
+)
+from app.main import app
+from datagen import CatalogSpec, generate
+
+SPEC = CatalogSpec(
+    products=4,
+    parts=3,
+    variants=4,
+    restriction_density=0.3,
+    custom_price_density=0.3,
+)
+URL = "/api/v1/products?page_size=100"
+
+
+@pytest.mark.parametrize(
+    "accept, expected",
+    [
+        (None, (False, False)),
+        ("*/*", (False, False)),
+        ("application/json", (False, False)),
+        ("application/msgpack", (True, False)),
+        ("application/msgpack; variant-ids=table", (True, True)),
+        ("application/json, application/msgpack;q=0.5", (False, False)),
+        ("application/json;q=0.5, application/msgpack", (True, False)),
+        ("application/msgpack;q=0, */*", (False, False)),
+    ],
+)
+def test_negotiate(accept: str, expected: tuple) -> None:
+    assert negotiate(accept) == expected
+
+
+def test_json_remains_the_default(test_client: TestClient) -> None:
+    response = test_client.get(URL)
+
+    assert response.headers["content-type"] == "application/json"
+    assert response.headers["vary"] == "Accept, Accept-Encoding"
+
+
+@pytest.mark.parametrize(
+    "accept",
+    ["application/msgpack", "application/msgpack; variant-ids=table"],
+)
+def test_msgpack_decodes_to_the_json_response(
+    test_db: Session,
+    test_client: TestClient,
+    accept: str,
+) -> None:
+    generate(test_db.connection(), SPEC, seed=11)
+    test_db.commit()
+
+    as_json = test_client.get(URL)
+    as_msgpack = test_client.get(URL, headers={"Accept": accept})
+
+    assert as_msgpack.headers["content-type"] == accept
+    assert decode_products(as_msgpack.content) == as_json.json()
+    assert len(as_msgpack.content) < len(as_json.content) / 2
+
+
+def test_id_table_lists_each_variant_once(
+    test_db: Session,
+    test_client: TestClient,
+) -> None:
+    generate(test_db.connection(), SPEC, seed=11)
+    test_db.commit()
+
+    response = test_client.get(
+        URL,
+        headers={"Accept": "application/msgpack; variant-ids=table"},
+    )
+    variant_ids = msgpack.unpackb(response.content)["variant_ids"]
+
+    assert len(variant_ids) == len(set(variant_ids))
+    assert all(len(variant_id) == 16 for variant_id in variant_ids)
+
+
+def test_naive_timestamps_keep_no_timezone() -> None:
+    # As read from `timestamp without time zone` columns
+    naive = datetime(2024, 5, 1, 12, 30, 15, 250000)
+    product_id, part_id, variant_id = uuid4(), uuid4(), uuid4()
+    variant = VariantRecord(
+        0, variant_id, part_id, "Full", 10.0, True, 1, naive, naive, (), ()
+    )
+    part = PartRecord(part_id, product_id, "Frame", naive, naive, (0,))
+    product = ProductRecord(
+        product_id, "Bike", None, "bikes", 100.0, False, True, 1, naive, naive, (part,)
+    )
+    catalog = Catalog(1, (product,), (part,), (variant,), naive)
+
+    for id_table in (False, True):
+        content = encode_products(catalog, [product], id_table=id_table)
+        body = MsgPackResponse(content, id_table=id_table).body
+        decoded = decode_products(body)
+
+        assert decoded == [catalog.product_dict(product)]
+        assert decoded[0]["created_at"] == "2024-05-01T12:30:15.250000"
+        assert decoded[0]["parts"][0]["variants"][0]["updated_at"] == (
+            "2024-05-01T12:30:15.250000"
+        )
+
+
+def test_msgpack_is_documented() -> None:
+    responses = app.openapi()["paths"]["/api/v1/products"]["get"]["responses"]
+
+    assert set(responses["200"]["content"]) == {
+        "application/json",
+        MSGPACK_MEDIA_TYPE,
+    }
@@ -0,0 +1,201 @@
+# tests/api/test_conditional.py
+
+from email.utils import format_datetime
+from typing import Callable, ContextManager, Dict
+from uuid import uuid4
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session, select
+
+from app.api.models import CustomPrice, Product, VariantDependency
+from datagen import CatalogSpec, generate
+
+SPEC = CatalogSpec(
+    products=3,
+    parts=3,
+    variants=3,
+    restriction_density=0.5,
+    custom_price_density=0.5,
+)
+
+
+@pytest.fixture
+def catalog(test_db: Session) -> None:
+    generate(test_db.connection(), SPEC, seed=5)
+    test_db.commit()
+
+
+def _urls(test_db: Session) -> Dict[str, str]:
+    product = test_db.exec(select(Product)).first()
+    part = product.parts[0]
+    dependency = test_db.exec(select(VariantDependency)).first()
+    custom_price = test_db.exec(select(CustomPrice)).first()
+
+    return {
+        "product": f"/api/v1/products/{product.id}",
+        "part": f"/api/v1/product-parts/{part.id}",
+        "variant": f"/api/v1/part-variants/{part.variants[0].id}",
+        "dependency": f"/api/v1/variant-dependencies/{dependency.variant_id}",
+        "custom_price": f"/api/v1/custom-prices/{custom_price.id}",
+        "products": "/api/v1/products",
+        "parts": "/api/v1/product-parts",
+        "variants": "/api/v1/part-variants",
+        "dependencies": "/api/v1/variant-dependencies",
+        "custom_prices": "/api/v1/custom-prices",
+    }
+
+
+def test_every_resource_answers_conditional_requests(
+    catalog: None,
+    test_db: Session,
+    test_client: TestClient,
+) -> None:
+    for name, url in _urls(test_db).items():
+        response = test_client.get(url)
+        assert response.status_code == 200, name
+        etag = response.headers["etag"]
+        assert etag.startswith('W/"'), name
+        assert response.headers["cache-control"] == "public, no-cache"
+
+        not_modified = test_client.get(url, headers={"If-None-Match": etag})
+        assert not_modified.status_code == 304, name
+        assert not_modified.content == b""
+        assert not_modified.headers["etag"] == etag
+
+        since = test_client.get(
+            url,
+            headers={"If-Modified-Since": response.headers["last-modified"]},
+        )
+        assert since.status_code == 304, name
+
+        changed = test_client.get(url, headers={"If-None-Match": 'W/"0-0"'})
+        assert changed.status_code == 200, name
+
+
+def test_not_modified_costs_only_the_validator_query(
+    catalog: None,
+    test_db: Session,
+    test_client: TestClient,
+    query_budget: Callable[[int], ContextManager],
+) -> None:
+    url = _urls(test_db)["product"]
+    etag = test_client.get(url).headers["etag"]
+    test_db.expire_all()
+
+    with query_budget(1):
+        response = test_client.get(url, headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+
+
+def test_writes_change_the_validators(
+    catalog: None,
+    test_db: Session,
+    test_client: TestClient,
+) -> None:
+    urls = _urls(test_db)
+    variants = test_client.get(urls["variants"])
+    dependency = test_client.get(urls["dependency"])
+    variant_id = dependency.json()["variant_id"]
+    variant = test_client.get(f"/api/v1/part-variants/{variant_id}")
+
+    # A dependency is part of the representation of its variant
+    test_client.put(
+        f"/api/v1/variant-dependencies/{variant_id}",
+        json={"restrictions": "[]"},
+    )
+    for response in (variant, dependency):
+        url = str(response.url)
+        revalidated = test_client.get(
+            url,
+            headers={"If-None-Match": response.headers["etag"]},
+        )
+        assert revalidated.status_code == 200, url
+        assert revalidated.headers["etag"] != response.headers["etag"]
+
+    variant_id = variants.json()[0]["id"]
+    test_client.put(f"/api/v1/part-variants/{variant_id}", json={"price": 1.0})
+    revalidated = test_client.get(
+        urls["variants"],
+        headers={"If-None-Match": variants.headers["etag"]},
+    )
+    assert revalidated.status_code == 200
+    assert revalidated.json()[0]["price"] == 1.0
+
+
+def test_rows_cached_before_writes_of_other_workers_are_reloaded(
+    catalog: None,
+    test_db: Session,
+    test_client: TestClient,
+) -> None:
+    urls = _urls(test_db)
+    names = ("product", "part", "variant", "dependency", "custom_price")
+    for name in names:
+        assert test_client.get(urls[name]).status_code == 200
+
+    # Written by another worker: the entity cache of this one is kept
+    product = test_db.exec(select(Product)).first()
+    variant = product.parts[0].variants[0]
+    variant.price = 1234.0
+    dependency = test_db.exec(select(VariantDependency)).first()
+    dependency.restrictions = "[]"
+    custom_price = test_db.exec(select(CustomPrice)).first()
+    custom_price.custom_price = 4321.0
+    test_db.add_all([variant, dependency, custom_price])
+    test_db.commit()
+
+    bodies = {name: test_client.get(urls[name]) for name in names}
+    assert bodies["product"].json()["parts"][0]["variants"][0]["price"] == 1234.0
+    assert bodies["part"].json()["variants"][0]["price"] == 1234.0
+    assert bodies["variant"].json()["price"] == 1234.0
+    assert bodies["dependency"].json()["restrictions"] == "[]"
+    assert bodies["custom_price"].json()["custom_price"] == 4321.0
+    # And the ETag sent with them is the one of the fresh rows
+    for name, response in bodies.items():
+        revalidated = test_client.get(
+            urls[name],
+            headers={"If-None-Match": response.headers["etag"]},
+        )
+        assert revalidated.status_code == 304, name
+
+
+def test_updates_move_updated_at_forward(
+    catalog: None,
+    test_db: Session,
+    test_client: TestClient,
+) -> None:
+    product = test_db.exec(select(Product)).first()
+    updated_at = product.updated_at
+
+    test_client.put(f"/api/v1/products/{product.id}", json={"name": "New"})
+    test_db.refresh(product)
+
+    assert product.updated_at > updated_at
+
+
+def test_stale_if_modified_since_gets_the_resource(
+    catalog: None,
+    test_db: Session,
+    test_client: TestClient,
+) -> None:
+    product = test_db.exec(select(Product)).first()
+    url = f"/api/v1/products/{product.id}"
+    stale = format_datetime(product.created_at.replace(year=2000), usegmt=True)
+
+    assert test_client.get(url, headers={"If-Modified-Since": stale}).status_code == 200
+
+
+def test_missing_resources_are_not_found(
+    catalog: None,
+    test_client: TestClient,
+) -> None:
+    for url in (
+        f"/api/v1/products/{uuid4()}",
+        f"/api/v1/product-parts/{uuid4()}",
+        f"/api/v1/part-variants/{uuid4()}",
+        f"/api/v1/variant-dependencies/{uuid4()}",
+        f"/api/v1/custom-prices/{uuid4()}",
+    ):
+        response = test_client.get(url, headers={"If-None-Match": "*"})
+        assert response.status_code == 404, url
@@ -0,0 +1,215 @@
+# tests/api/test_configurator.py
+
+import random
+from typing import Any, Dict, List, Set
+from uuid import UUID, uuid4
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+from starlette.websockets import WebSocketDisconnect
+
+from app.api.cache import catalog_cache
+from app.api.models import PartVariant
+from app.api.utils import calculate_total_price
+from datagen import CatalogSpec, generate
+
+SPEC = CatalogSpec(
+    products=2,
+    parts=4,
+    variants=4,
+    restriction_density=0.2,
+    custom_price_density=0.3,
+    custom_ratio=1.0,
+    unavailable_ratio=0.1,
+)
+
+
+def _price(test_db: Session, product_id: str, selection: Dict[str, str]) -> float:
+    return calculate_total_price(
+        session=test_db,
+        product_id=UUID(product_id),
+        selected_variant_ids=[UUID(v) for v in selection.values()],
+    )
+
+
+def test_selections_are_priced_incrementally(
+    test_db: Session,
+    test_client: TestClient,
+) -> None:
+    generate(test_db.connection(), SPEC, seed=11)
+    test_db.commit()
+    product_id: str = test_client.get("/api/v1/products").json()[0]["id"]
+    builder = test_client.get(f"/api/v1/products/{product_id}/builder").json()
+    parts: Dict[str, str] = builder["variant_parts"]
+    restrictions: Dict[str, List[str]] = builder["restrictions"]
+    unavailable: Set[str] = {
+        variant["id"]
+        for part in builder["product"]["parts"]
+        for variant in part["variants"]
+        if not variant["is_available"] or variant["stock_quantity"] <= 0
+    }
+
+    def expected_disabled(selection: Dict[str, str]) -> Set[str]:
+        restricted = {
+            other
+            for variant_id in selection.values()
+            for other in restrictions.get(variant_id, [])
+        }
+        return unavailable | restricted
+
+    rng = random.Random(3)
+    selection: Dict[str, str] = {}
+    history: List[Dict[str, str]] = []
+    errors: int = 0
+
+    with test_client.websocket_connect(f"/api/v1/configurator/{product_id}") as ws:
+        state: Dict[str, Any] = ws.receive_json()
+        assert state["total"] == builder["product"]["base_price"]
+        assert state["selection"] == {}
+        disabled: Set[str] = set(state["disabled"])
+        assert disabled == unavailable
+
+        for _ in range(60):
+            if history and rng.random() < 0.3:
+                ws.send_json({"type": "undo"})
+                selection = history.pop()
+            else:
+                variant_id = rng.choice(sorted(parts))
+                ws.send_json({"type": "select", "variant_id": variant_id.upper()})
+                if variant_id in disabled - set(selection.values()):
+                    conflicts = set(restrictions.get(variant_id, []))
+                    conflicts.intersection_update(
+                        v for p, v in selection.items() if p != parts[variant_id]
+                    )
+                    if variant_id in unavailable or conflicts:
+                        assert ws.receive_json()["type"] == "error"
+                        errors += 1
+                        continue
+                history.append(dict(selection))
+                selection[parts[variant_id]] = variant_id
+
+            reply: Dict[str, Any] = ws.receive_json()
+            assert reply["type"] == "priced", reply
+            total: float = _price(test_db, product_id, selection)
+            assert reply["total"] == pytest.approx(total)
+            assert selection.get(reply["part_id"]) == reply["variant_id"]
+
+            disabled |= set(reply["disabled"])
+            disabled -= set(reply["enabled"])
+            assert disabled == expected_disabled(selection)
+
+        ws.send_json({"type": "redo"})
+        assert ws.receive_json()["type"] == "error"
+        ws.send_text("not json")
+        assert ws.receive_json()["type"] == "error"
+
+    assert errors
+
+
+def test_catalog_changes_reprice_the_configuration(
+    test_db: Session,
+    test_client: TestClient,
+) -> None:
+    generate(test_db.connection(), SPEC, seed=11)
+    test_db.commit()
+    product = test_client.get("/api/v1/products").json()[0]
+    builder = test_client.get(f"/api/v1/products/{product['id']}/builder").json()
+    variants: List[Dict[str, Any]] = []
+    for part in product["parts"][:2]:
+        variants.append(
+            next(
+                v
+                for v in part["variants"]
+                if v["is_available"]
+                and v["stock_quantity"]
+                and not {s["id"] for s in variants}.intersection(
+                    builder["restrictions"].get(v["id"], [])
+                )
+            )
+        )
+
+    with test_client.websocket_connect(f"/api/v1/configurator/{product['id']}") as ws:
+        ws.receive_json()
+        for variant in variants:
+            ws.send_json({"type": "select", "variant_id": variant["id"]})
+            assert ws.receive_json()["type"] == "priced"
+
+        # One variant gets pricier, the other runs out of stock
+        test_client.put(
+            f"/api/v1/part-variants/{variants[0]['id']}",
+            json={"price": variants[0]["price"] + 100},
+        )
+        test_client.put(
+            f"/api/v1/part-variants/{variants[1]['id']}",
+            json={"stock_quantity": 0},
+        )
+        ws.send_json({"type": "undo"})
+
+        state = ws.receive_json()
+        assert state["type"] == "state"
+        assert state["dropped"] == [variants[1]["id"]]
+        assert state["selection"] == {product["parts"][0]["id"]: variants[0]["id"]}
+        assert variants[1]["id"] in state["disabled"]
+        assert state["total"] == pytest.approx(
+            _price(test_db, product["id"], state["selection"])
+        )
+
+        # The history was cleared with the dropped variant
+        assert ws.receive_json() == {
+            "type": "error",
+            "detail": "Nothing to undo.",
+        }
+
+
+def test_writes_of_other_workers_reprice_once_the_cache_reloads(
+    test_db: Session,
+    test_client: TestClient,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    # Every message finds the catalog expired
+    monkeypatch.setattr(catalog_cache, "ttl", 0.0)
+    generate(test_db.connection(), SPEC, seed=11)
+    test_db.commit()
+    product = test_client.get("/api/v1/products").json()[0]
+    variant = next(
+        v
+        for v in product["parts"][0]["variants"]
+        if v["is_available"] and v["stock_quantity"]
+    )
+
+    with test_client.websocket_connect(f"/api/v1/configurator/{product['id']}") as ws:
+        ws.receive_json()
+        ws.send_json({"type": "select", "variant_id": variant["id"]})
+        assert ws.receive_json()["type"] == "priced"
+
+        # Reloaded with the same prices: nothing to send
+        ws.send_json({"type": "undo"})
+        assert ws.receive_json()["type"] == "priced"
+        ws.send_json({"type": "select", "variant_id": variant["id"]})
+        assert ws.receive_json()["type"] == "priced"
+
+        # Written by another worker: the generation stays the same
+        generation = catalog_cache.generation
+        row = test_db.get(PartVariant, UUID(variant["id"]))
+        row.price += 100
+        test_db.add(row)
+        test_db.commit()
+        assert catalog_cache.generation == generation
+
+        ws.send_json({"type": "undo"})
+        state = ws.receive_json()
+        assert state["type"] == "state"
+        assert state["total"] == pytest.approx(
+            _price(test_db, product["id"], state["selection"])
+        )
+        assert state["selection"] == {product["parts"][0]["id"]: variant["id"]}
+        assert ws.receive_json()["type"] == "error"
+
+
+def test_unknown_products_are_refused(test_client: TestClient) -> None:
+    with pytest.raises(WebSocketDisconnect) as refused:
+        with test_client.websocket_connect(f"/api/v1/configurator/{uuid4()}"):
+            pass
+
+    assert refused.value.code == 1008
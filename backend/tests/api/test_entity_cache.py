@@ -0,0 +1,171 @@
+# tests/api/test_entity_cache.py
+
+import threading
+from pathlib import Path
+from typing import Any, Generator, List
+
+import pytest
+from sqlalchemy import Engine
+from sqlmodel import Session, SQLModel, create_engine
+
+from app.api.cache import entity_cache
+from app.api.models import PartVariant, Product, ProductPart
+from app.api.schemas import (
+    CustomPriceCreateSchema,
+    PartVariantUpdateSchema,
+    ProductPartUpdateSchema,
+)
+from app.api.services import (
+    create_custom_price,
+    delete_part_variant,
+    get_part_variant_by_id,
+    get_product_by_id,
+    get_product_part_by_id,
+    update_part_variant,
+    update_product_part,
+)
+
+
+def _catalog(session: Session) -> List[Any]:
+    product = Product(
+        name="Test Product",
+        category="Bicycle",
+        base_price=100.0,
+        is_custom=True,
+        is_available=True,
+        stock_quantity=10,
+    )
+    other = Product(
+        name="Other Product",
+        category="Bicycle",
+        base_price=200.0,
+        is_custom=True,
+        is_available=True,
+        stock_quantity=10,
+    )
+    part = ProductPart(product_id=product.id, name="Frame")
+    variants = [
+        PartVariant(
+            part_id=part.id,
+            name=name,
+            price=10.0,
+            is_available=True,
+            stock_quantity=5,
+        )
+        for name in ("Full", "Diamond")
+    ]
+    session.add_all([product, other, part, *variants])
+    session.commit()
+
+    return [product, other, part, *variants]
+
+
+@pytest.fixture
+def file_engine(tmp_path: Path) -> Generator[Engine, Any, None]:
+    # Concurrent sessions need connections of their own
+    engine: Engine = create_engine(
+        f"sqlite:///{tmp_path / 'entities.db'}",
+        connect_args={"check_same_thread": False},
+    )
+    SQLModel.metadata.create_all(engine)
+    entity_cache.clear()
+
+    yield engine
+
+    entity_cache.clear()
+    engine.dispose()
+
+
+def test_writes_invalidate_the_rows_rendering_them(test_db: Session) -> None:
+    product, other, part, variant, second = _catalog(test_db)
+
+    cached = get_product_by_id(test_db, product.id)
+    assert cached is not None
+    assert get_product_by_id(test_db, product.id) is cached
+    assert get_part_variant_by_id(test_db, variant.id) is not None
+    hits = entity_cache.hits
+
+    # The product is cached with its parts, variants and custom prices
+    update_part_variant(test_db, variant.id, PartVariantUpdateSchema(price=25))
+    create_custom_price(
+        test_db,
+        CustomPriceCreateSchema(
+            variant_id=variant.id,
+            dependent_variant_id=second.id,
+            custom_price=5.0,
+        ),
+    )
+    fresh = get_product_by_id(test_db, product.id)
+    assert fresh is not None and fresh is not cached
+    prices = {v.name: v.price for v in fresh.parts[0].variants}
+    assert prices == {"Full": 25.0, "Diamond": 10.0}
+    assert [
+        p.custom_price for v in fresh.parts[0].variants for p in v.custom_prices
+    ] == [5.0]
+    refreshed = get_part_variant_by_id(test_db, variant.id)
+    assert refreshed is not None and refreshed.price == 25.0
+    assert entity_cache.hits == hits
+
+    # Moving a part updates the products it leaves and joins
+    get_product_by_id(test_db, other.id)
+    update_product_part(
+        test_db,
+        part.id,
+        ProductPartUpdateSchema(product_id=other.id),
+    )
+    moved = get_product_by_id(test_db, other.id)
+    left = get_product_by_id(test_db, product.id)
+    assert moved is not None and [p.id for p in moved.parts] == [part.id]
+    assert left is not None and left.parts == []
+
+    delete_part_variant(test_db, second.id)
+    assert get_part_variant_by_id(test_db, second.id) is None
+    moved_part = get_product_part_by_id(test_db, part.id)
+    assert moved_part is not None
+    assert [v.id for v in moved_part.variants] == [variant.id]
+
+
+def test_concurrent_reads_never_keep_an_overwritten_row(
+    file_engine: Engine,
+) -> None:
+    with Session(file_engine) as session:
+        product, _, _, variant, _ = _catalog(session)
+        product_id, variant_id = product.id, variant.id
+    errors: List[BaseException] = []
+    done = threading.Event()
+
+    def read() -> None:
+        try:
+            with Session(file_engine) as session:
+                while not done.is_set():
+                    get_product_by_id(session, product_id)
+                    get_part_variant_by_id(session, variant_id)
+                    session.rollback()
+        except BaseException as e:
+            errors.append(e)
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+
+    with Session(file_engine) as session:
+        for stock in range(1, 51):
+            update_part_variant(
+                session,
+                variant_id,
+                PartVariantUpdateSchema(stock_quantity=stock),
+            )
+    done.set()
+    for reader in readers:
+        reader.join()
+
+    assert not errors
+    # Whatever the interleaving, the last write is what is cached
+    with Session(file_engine) as session:
+        cached_variant = get_part_variant_by_id(session, variant_id)
+        cached_product = get_product_by_id(session, product_id)
+        assert get_product_by_id(session, product_id) is cached_product
+    assert cached_variant is not None and cached_variant.stock_quantity == 50
+    assert cached_product is not None
+    stocks = {v.id: v.stock_quantity for v in cached_product.parts[0].variants}
+    assert stocks[variant_id] == 50
@@ -0,0 +1,427 @@
+# tests/api/test_outbox.py
+
+import asyncio
+import socketserver
+import threading
+import time
+from functools import partial
+from datetime import datetime, timedelta
+from email import message_from_bytes
+from email.message import Message
+from pathlib import Path
+from typing import Any, Dict, Generator, List, Tuple
+from uuid import UUID, uuid4
+
+import pytest
+from fastapi.concurrency import run_in_threadpool
+from fastapi.testclient import TestClient
+from sqlalchemy import Engine
+from sqlmodel import Session, SQLModel, col, create_engine, select
+
+from app.api.cache import (
+    DeferredInvalidation,
+    catalog_cache,
+    invalidate_catalog,
+    stock_invalidations,
+)
+from app.api.models import (
+    OutboxMessage,
+    PartVariant,
+    Product,
+    ProductPart,
+    utc_now,
+)
+from app.api.outbox import Handler, OutboxWorker, enqueue
+from app.api.schemas import CartCreateSchema
+from app.api.services import (
+    CART_CONFIRMATION,
+    STOCK_UPDATE,
+    checkout_handlers,
+    create_cart_with_items,
+)
+from app.config import Settings
+from app.database import get_session
+from app.mailer import Mailer
+from app.main import create_app
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: "SmtpStandIn"
+
+    def reply(self, line: bytes) -> None:
+        self.wfile.write(line + b"\r\n")
+
+    def handle(self) -> None:
+        self.reply(b"220 stand-in ready")
+        while True:
+            line: bytes = self.rfile.readline()
+            if not line:
+                return
+            command: bytes = line[:4].upper()
+            if command == b"QUIT":
+                self.reply(b"221 bye")
+                return
+            if command != b"DATA":
+                self.reply(b"250 ok")
+                continue
+
+            self.reply(b"354 go ahead")
+            data: List[bytes] = []
+            while (line := self.rfile.readline()) not in (b".\r\n", b""):
+                data.append(line.removeprefix(b"."))
+            if self.server.failures > 0:
+                self.server.failures -= 1
+                self.reply(b"451 try again later")
+            else:
+                self.server.messages.append(message_from_bytes(b"".join(data)))
+                self.reply(b"250 queued")
+
+
+class SmtpStandIn(socketserver.ThreadingTCPServer):
+    """
+    An SMTP server keeping the emails it receives, enough for the mailer.
+    The next `failures` emails are refused with a temporary error.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.messages: List[Message] = []
+        self.failures: int = 0
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+
+@pytest.fixture
+def smtp() -> Generator[SmtpStandIn, Any, None]:
+    server = SmtpStandIn()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def outbox_engine(tmp_path: Path) -> Generator[Engine, Any, None]:
+    # The routes and the worker use their own connections
+    engine: Engine = create_engine(
+        f"sqlite:///{tmp_path / 'outbox.db'}",
+        connect_args={"check_same_thread": False},
+    )
+    SQLModel.metadata.create_all(engine)
+    invalidate_catalog()
+
+    yield engine
+
+    # Not left for the timer of the interval, during another test
+    stock_invalidations.flush()
+    invalidate_catalog()
+    engine.dispose()
+
+
+def _catalog(engine: Engine) -> Tuple[Product, PartVariant]:
+    product = Product(
+        name="Road Bike",
+        category="bikes",
+        base_price=500.0,
+        is_custom=True,
+        is_available=True,
+        stock_quantity=5,
+    )
+    part = ProductPart(name="Wheels", product_id=product.id)
+    variant = PartVariant(
+        name="Carbon",
+        price=300.0,
+        is_available=True,
+        stock_quantity=3,
+        part_id=part.id,
+    )
+    with Session(engine) as session:
+        session.add_all([product, part, variant])
+        session.commit()
+        session.refresh(product)
+        session.refresh(variant)
+
+    return product, variant
+
+
+def _worker(engine: Engine, smtp: SmtpStandIn, **options: Any) -> OutboxWorker:
+    return OutboxWorker(
+        engine,
+        checkout_handlers(Mailer("127.0.0.1", smtp.port, timeout=5)),
+        **options,
+    )
+
+
+def _messages(engine: Engine) -> Dict[str, OutboxMessage]:
+    # The latest message of each topic
+    with Session(engine) as session:
+        return {
+            message.topic: message
+            for message in session.exec(
+                select(OutboxMessage).order_by(col(OutboxMessage.seq))
+            )
+        }
+
+
+def test_checkout_leaves_the_work_to_the_outbox(
+    outbox_engine: Engine,
+    smtp: SmtpStandIn,
+) -> None:
+    product, variant = _catalog(outbox_engine)
+    app = create_app(Settings())
+
+    def override_get_session() -> Generator[Session, Any, None]:
+        with Session(outbox_engine) as session:
+            yield session
+
+    app.dependency_overrides[get_session] = override_get_session
+    with TestClient(app) as client:
+        response = client.post(
+            "/api/v1/carts",
+            json={
+                "purchased": False,
+                "total_price": 800.0,
+                "email": "rider@example.com",
+                "items": [
+                    {
+                        "product_id": str(product.id),
+                        "selected_parts": str(variant.id),
+                        "total_price": 800.0,
+                    }
+                ],
+            },
+        )
+    assert response.status_code == 200
+    assert response.json()["email"] == "rider@example.com"
+
+    # Committed with the cart, not done yet
+    assert set(_messages(outbox_engine)) == {STOCK_UPDATE, CART_CONFIRMATION}
+    assert smtp.messages == []
+
+    worker = _worker(outbox_engine, smtp)
+    assert worker.run_batch() == 2
+    assert worker.run_batch() == 0
+
+    assert all(m.processed_at for m in _messages(outbox_engine).values())
+    [email] = smtp.messages
+    assert email["To"] == "rider@example.com"
+    assert "Road Bike: 800.00" in email.get_payload()
+    with Session(outbox_engine) as session:
+        assert session.get(Product, product.id).stock_quantity == 4
+        assert session.get(PartVariant, variant.id).stock_quantity == 2
+
+
+def test_failed_messages_are_retried_then_given_up(
+    outbox_engine: Engine,
+    smtp: SmtpStandIn,
+) -> None:
+    product, _ = _catalog(outbox_engine)
+    with Session(outbox_engine) as session:
+        cart_id: UUID = create_cart_with_items(
+            session,
+            CartCreateSchema(
+                purchased=False,
+                total_price=500.0,
+                email="rider@example.com",
+                items=[{"product_id": product.id, "total_price": 500.0}],
+            ),
+        ).id
+        enqueue(session, "unknown", {})
+        session.commit()
+
+    smtp.failures = 1
+    worker = _worker(outbox_engine, smtp, max_attempts=2, backoff=10)
+    now: datetime = utc_now()
+    assert worker.run_batch(now) == 3
+
+    messages: Dict[str, OutboxMessage] = _messages(outbox_engine)
+    assert messages[STOCK_UPDATE].processed_at is not None
+    confirmation: OutboxMessage = messages[CART_CONFIRMATION]
+    assert confirmation.attempts == 1
+    assert confirmation.last_error.startswith("SMTP")
+    assert messages["unknown"].last_error.startswith("LookupError")
+
+    # Not before the backoff
+    assert worker.run_batch(now + timedelta(seconds=5)) == 0
+    assert worker.run_batch(now + timedelta(seconds=11)) == 2
+
+    messages = _messages(outbox_engine)
+    assert messages[CART_CONFIRMATION].processed_at is not None
+    assert messages["unknown"].failed_at is not None
+    assert worker.run_batch(now + timedelta(hours=1)) == 0
+    [email] = smtp.messages
+    assert str(cart_id) in email.get_payload()
+
+
+def test_batches_outliving_their_lease_do_not_send_twice(
+    outbox_engine: Engine,
+    smtp: SmtpStandIn,
+) -> None:
+    product, _ = _catalog(outbox_engine)
+    with Session(outbox_engine) as session:
+        create_cart_with_items(
+            session,
+            CartCreateSchema(
+                purchased=False,
+                total_price=500.0,
+                email="rider@example.com",
+                items=[{"product_id": product.id, "total_price": 500.0}],
+            ),
+        )
+
+    slow, fast = (_worker(outbox_engine, smtp, lease=30) for _ in range(2))
+    update_stock: Handler = slow.handlers[STOCK_UPDATE]
+    taken_over: List[int] = []
+
+    def slow_update(session: Session, payload: Dict[str, Any]) -> Any:
+        # Long enough for the leases of the whole batch to expire
+        later: datetime = utc_now() + timedelta(seconds=31)
+        taken_over.append(fast.run_batch(later))
+        return update_stock(session, payload)
+
+    slow.handlers = {**slow.handlers, STOCK_UPDATE: slow_update}
+    assert slow.run_batch() == 2
+    assert taken_over == [2]
+
+    # Done once, by the batch that took the messages over
+    assert all(m.processed_at for m in _messages(outbox_engine).values())
+    assert len(smtp.messages) == 1
+    with Session(outbox_engine) as session:
+        assert session.get(Product, product.id).stock_quantity == 4
+
+
+def test_concurrent_stock_updates_take_the_stock_of_each_cart(
+    outbox_engine: Engine,
+    smtp: SmtpStandIn,
+) -> None:
+    product, _ = _catalog(outbox_engine)
+    cart_ids: List[UUID] = []
+    for _ in range(2):
+        with Session(outbox_engine) as session:
+            cart_ids.append(
+                create_cart_with_items(
+                    session,
+                    CartCreateSchema(
+                        purchased=False,
+                        total_price=500.0,
+                        items=[{"product_id": product.id, "total_price": 500.0}],
+                    ),
+                ).id
+            )
+    update_stock: Handler = _worker(outbox_engine, smtp).handlers[STOCK_UPDATE]
+
+    def handle(session: Session, cart_id: UUID) -> None:
+        update_stock(session, {"cart_id": str(cart_id)})
+        session.commit()
+
+    # The second message is handled while the first is not committed yet
+    with Session(outbox_engine) as first, Session(outbox_engine) as second:
+        update_stock(first, {"cart_id": str(cart_ids[0])})
+        thread = threading.Thread(target=handle, args=(second, cart_ids[1]))
+        thread.start()
+        time.sleep(0.2)
+        first.commit()
+        thread.join(timeout=5)
+        assert not thread.is_alive()
+
+    with Session(outbox_engine) as session:
+        assert session.get(Product, product.id).stock_quantity == 3
+
+
+def test_stock_updates_rebuild_the_catalog_once_per_interval(
+    outbox_engine: Engine,
+    smtp: SmtpStandIn,
+) -> None:
+    product, _ = _catalog(outbox_engine)
+    invalidations = DeferredInvalidation(interval=0.2)
+    worker = _worker(outbox_engine, smtp)
+    update_stock: Handler = worker.handlers[STOCK_UPDATE]
+
+    def deferred_update(session: Session, payload: Dict[str, Any]) -> Any:
+        after_commit: Any = update_stock(session, payload)
+        return partial(invalidations.add, *after_commit.args)
+
+    worker.handlers = {**worker.handlers, STOCK_UPDATE: deferred_update}
+
+    def checkout() -> None:
+        with Session(outbox_engine) as session:
+            create_cart_with_items(
+                session,
+                CartCreateSchema(
+                    purchased=False,
+                    total_price=500.0,
+                    items=[{"product_id": product.id, "total_price": 500.0}],
+                ),
+            )
+        assert worker.run_batch() == 1
+
+    # The first checkout shows right away
+    generation: int = catalog_cache.generation
+    checkout()
+    assert catalog_cache.generation == generation + 1
+
+    # The next ones together, at the end of the interval
+    for _ in range(3):
+        checkout()
+    assert catalog_cache.generation == generation + 1
+    deadline: float = time.monotonic() + 5
+    while catalog_cache.generation == generation + 1:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    time.sleep(0.3)
+    assert catalog_cache.generation == generation + 2
+    with Session(outbox_engine) as session:
+        assert session.get(Product, product.id).stock_quantity == 1
+
+
+def test_workers_share_the_outbox_and_wake_on_commit(
+    outbox_engine: Engine,
+    smtp: SmtpStandIn,
+) -> None:
+    product, _ = _catalog(outbox_engine)
+
+    def checkout() -> None:
+        with Session(outbox_engine) as session:
+            create_cart_with_items(
+                session,
+                CartCreateSchema(
+                    purchased=False,
+                    total_price=500.0,
+                    items=[{"product_id": product.id, "total_price": 500.0}],
+                ),
+            )
+
+    # A batch holding its message until the lease expires
+    checkout()
+    slow, fast = (_worker(outbox_engine, smtp, lease=30) for _ in range(2))
+    with Session(outbox_engine) as session:
+        [claimed] = slow._claim(session, slow_batch := uuid4(), utc_now())
+    assert fast.run_batch() == 0
+    assert fast.run_batch(utc_now() + timedelta(seconds=31)) == 1
+    # The first batch cannot mark it done a second time
+    slow._process(claimed, slow_batch)
+    with Session(outbox_engine) as session:
+        assert session.get(Product, product.id).stock_quantity == 4
+
+    async def scenario() -> float:
+        # Polls far apart: only the commit wakes the worker up
+        worker = _worker(outbox_engine, smtp, workers=2, poll_interval=30)
+        await worker.start()
+        await asyncio.sleep(0.1)
+        await run_in_threadpool(checkout)
+        start: float = time.monotonic()
+        while _messages(outbox_engine)[STOCK_UPDATE].processed_at is None:
+            await asyncio.sleep(0.01)
+        await worker.close()
+
+        return time.monotonic() - start
+
+    assert asyncio.run(asyncio.wait_for(scenario(), 5)) < 1
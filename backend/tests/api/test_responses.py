@@ -0,0 +1,110 @@
+# tests/api/test_responses.py
+
+import json
+from datetime import datetime, timezone
+from uuid import uuid4
+
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from app.api.models import CustomPrice
+from app.api.responses import FastJSONResponse, dump_trusted
+from app.api.schemas import (
+    CustomPriceSchema,
+    ProductSchema,
+    VariantDependencySchema,
+)
+from app.api.services import (
+    get_all_custom_prices,
+    get_all_products,
+    get_all_variant_dependencies,
+)
+from app.main import app
+from datagen import CatalogSpec, generate
+
+SPEC = CatalogSpec(
+    products=3,
+    parts=3,
+    variants=3,
+    restriction_density=0.3,
+    custom_price_density=0.3,
+)
+
+
+def test_trusted_dump_matches_the_schemas(test_db: Session) -> None:
+    generate(test_db.connection(), SPEC, seed=3)
+    test_db.commit()
+
+    products = get_all_products(test_db, page=1, page_size=10)
+    rendered = json.loads(
+        FastJSONResponse([dump_trusted(ProductSchema, p) for p in products]).body
+    )
+
+    assert rendered == [
+        ProductSchema.model_validate(p, from_attributes=True).model_dump(mode="json")
+        for p in products
+    ]
+
+
+def test_by_id_and_flat_routes_match_the_schemas(
+    test_db: Session,
+    test_client: TestClient,
+) -> None:
+    generate(test_db.connection(), SPEC, seed=3)
+    test_db.commit()
+    [product] = get_all_products(test_db, page=1, page_size=1)
+
+    response = test_client.get(f"/api/v1/products/{product.id}")
+    assert response.json() == ProductSchema.model_validate(
+        product, from_attributes=True
+    ).model_dump(mode="json")
+
+    dependencies = test_client.get("/api/v1/variant-dependencies").json()
+    assert dependencies == [
+        VariantDependencySchema.model_validate(d, from_attributes=True).model_dump(
+            mode="json"
+        )
+        for d in get_all_variant_dependencies(test_db)
+    ]
+
+    custom_prices = test_client.get("/api/v1/custom-prices").json()
+    assert custom_prices == [
+        CustomPriceSchema.model_validate(c, from_attributes=True).model_dump(
+            mode="json"
+        )
+        for c in get_all_custom_prices(test_db)
+    ]
+
+
+def test_floats_and_datetimes_are_encoded_like_pydantic() -> None:
+    custom_price = CustomPrice(
+        variant_id=uuid4(),
+        dependent_variant_id=uuid4(),
+        custom_price=10,
+    )
+    rendered = dump_trusted(CustomPriceSchema, custom_price)
+
+    assert json.loads(FastJSONResponse(rendered).body) == (
+        CustomPriceSchema.model_validate(custom_price, from_attributes=True).model_dump(
+            mode="json"
+        )
+    )
+    assert isinstance(rendered["custom_price"], float)
+    assert (
+        FastJSONResponse(datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)).body
+        == b'"2024-01-02T03:04:05Z"'
+    )
+
+
+def test_response_models_are_still_documented() -> None:
+    paths = app.openapi()["paths"]
+
+    product = paths["/api/v1/products/{product_id}"]["get"]
+    assert product["responses"]["200"]["content"]["application/json"]["schema"] == {
+        "$ref": "#/components/schemas/ProductSchema"
+    }
+
+    custom_prices = paths["/api/v1/custom-prices"]["get"]
+    assert custom_prices["responses"]["200"]["content"]["application/json"]["schema"][
+        "items"
+    ] == {"$ref": "#/components/schemas/CustomPriceSchema"}
@@ -1,5 +1,6 @@
 # tests/api/test_routes.py
 
+from typing import Callable, ContextManager
 from uuid import uuid4
 
 from fastapi.testclient import TestClient
@@ -9,6 +10,7 @@ from sqlmodel import Session
 from app.api.models import Product
 from app.api.services import create_product
 from app.api.schemas import ProductCreateSchema
+from app.instrumentation import QueryStats
 
 
 def test_healthcheck(test_client: TestClient) -> None:
@@ -70,6 +72,33 @@ def test_get_product_by_id(test_db: Session, test_client: TestClient) -> None:
     assert response.json()["name"] == "Test Product"
 
 
+def test_get_product_by_id_query_budget(
+    test_db: Session,
+    test_client: TestClient,
+    query_budget: Callable[[int], ContextManager[QueryStats]],
+) -> None:
+    product: Product = create_product(
+        test_db,
+        ProductCreateSchema(
+            name="Test Product",
+            description="A sample product",
+            category="Bicycle",
+            base_price=100.0,
+            is_custom=False,
+            is_available=True,
+            stock_quantity=10,
+        ),
+    )
+
+    # The validator, the product and its (empty) list of parts
+    with query_budget(3):
+        test_client.get(f"/api/v1/products/{product.id}")
+
+    # Then only the validator, the product is cached
+    with query_budget(1):
+        test_client.get(f"/api/v1/products/{product.id}")
+
+
 def test_get_product_by_non_existent_id(test_client: TestClient) -> None:
     response: Response = test_client.get(f"/api/v1/products/{uuid4()}")
 
@@ -238,6 +267,35 @@ def test_get_all_products_pagination(
     assert len(products_empty_page) == 0
 
 
+def test_get_all_products_cache_invalidated_on_update(
+    test_db: Session,
+    test_client: TestClient,
+) -> None:
+    product: Product = create_product(
+        test_db,
+        ProductCreateSchema(
+            name="Test Product",
+            description="A sample product",
+            category="Bicycle",
+            base_price=100.0,
+            is_custom=False,
+            is_available=True,
+            stock_quantity=10,
+        ),
+    )
+
+    response: Response = test_client.get("/api/v1/products/")
+    assert response.json()[0]["name"] == "Test Product"
+
+    test_client.put(
+        f"/api/v1/products/{product.id}",
+        json={"name": "Updated Name"},
+    )
+
+    response = test_client.get("/api/v1/products/")
+    assert response.json()[0]["name"] == "Updated Name"
+
+
 # Tests for Cart route
 
 
@@ -0,0 +1,231 @@
+# tests/api/test_snapshot.py
+
+from pathlib import Path
+from typing import Any, Generator, List
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from app.api import routes
+from app.api.cache import invalidate_catalog
+from app.api.catalog import Catalog, get_catalog, use_snapshots
+from app.api.snapshot import (
+    SnapshotCatalog,
+    SnapshotStore,
+    encode_catalog,
+    open_snapshot,
+    write_snapshot,
+)
+from app.config import Settings
+from app.database import get_session
+from app.main import create_app
+from datagen import CatalogSpec, generate
+
+SPEC = CatalogSpec(
+    products=5,
+    parts=3,
+    variants=3,
+    restriction_density=0.3,
+    custom_price_density=0.3,
+)
+
+
+@pytest.fixture
+def catalog(test_db: Session) -> Catalog:
+    generate(test_db.connection(), SPEC, seed=7)
+    test_db.commit()
+
+    return Catalog.load(test_db, version=0)
+
+
+@pytest.fixture
+def snapshot_client(
+    test_db: Session,
+    tmp_path: Path,
+) -> Generator[TestClient, Any, None]:
+    app = create_app(Settings(CATALOG_SNAPSHOT_PATH=str(tmp_path / "catalog.snapshot")))
+
+    def override_get_session() -> Generator[Session, Any, None]:
+        yield test_db
+
+    app.dependency_overrides[get_session] = override_get_session
+
+    try:
+        with TestClient(app) as client:
+            yield client
+    finally:
+        use_snapshots(None)
+
+
+def test_snapshot_decodes_to_the_same_catalog(
+    catalog: Catalog,
+    tmp_path: Path,
+) -> None:
+    path = tmp_path / "catalog.snapshot"
+    version = write_snapshot(catalog, str(path))
+
+    snapshot = open_snapshot(str(path))
+
+    assert snapshot.version == version
+    assert snapshot.last_modified == catalog.last_modified
+    assert len(snapshot.variants) == len(catalog.variants)
+    assert [snapshot.product_dict(p) for p in snapshot.page(1, 100)] == [
+        catalog.product_dict(p) for p in catalog.page(1, 100)
+    ]
+    assert [snapshot.part_dict(p) for p in snapshot.parts] == [
+        catalog.part_dict(p) for p in catalog.parts
+    ]
+    assert [snapshot.variant_dict(v) for v in snapshot.variants] == [
+        catalog.variant_dict(v) for v in catalog.variants
+    ]
+
+
+def test_snapshot_finds_records_by_id(
+    catalog: Catalog,
+    tmp_path: Path,
+) -> None:
+    path = tmp_path / "catalog.snapshot"
+    write_snapshot(catalog, str(path))
+    snapshot = open_snapshot(str(path))
+
+    for variant in catalog.variants:
+        found = snapshot.variant(variant.id)
+        assert found is not None
+        assert found.index == variant.index
+        assert found.custom_prices == variant.custom_prices
+    for product in catalog.products:
+        found_product = snapshot.product(product.id)
+        assert found_product is not None
+        assert found_product.name == product.name
+    assert snapshot.product(catalog.variants[0].id) is None
+
+
+def test_invalid_snapshot_is_rejected(catalog: Catalog) -> None:
+    data = bytearray(encode_catalog(catalog, version=1))
+    data[:4] = b"NOPE"
+
+    with pytest.raises(ValueError):
+        SnapshotCatalog(bytes(data))
+
+
+def test_workers_swap_to_a_snapshot_published_by_another(
+    catalog: Catalog,
+    tmp_path: Path,
+) -> None:
+    path = str(tmp_path / "catalog.snapshot")
+    first = SnapshotStore(path)
+    second = SnapshotStore(path)
+
+    def load() -> Catalog:
+        return catalog
+
+    published = first.get(load, generation=0)
+    # A warm start does not rebuild
+    assert second.get(load, generation=0).version == published.version
+    assert (first.builds, second.builds) == (1, 0)
+
+    # A write in the second worker publishes a snapshot the first picks up
+    rebuilt = second.get(load, generation=1)
+    assert rebuilt.version != published.version
+    assert first.get(load, generation=0).version == rebuilt.version
+    assert (first.builds, second.builds) == (1, 1)
+    assert first.swaps == 2
+
+
+def test_older_snapshots_do_not_replace_newer_ones(
+    catalog: Catalog,
+    tmp_path: Path,
+) -> None:
+    path = str(tmp_path / "catalog.snapshot")
+
+    assert write_snapshot(catalog, path, version=2) == 2
+    # Loaded earlier, but done later
+    assert write_snapshot(catalog, path, version=1) == 2
+    assert open_snapshot(path).version == 2
+    assert write_snapshot(catalog, path, version=3) == 3
+    assert open_snapshot(path).version == 3
+    assert [p.name for p in tmp_path.iterdir() if p.name.endswith(".tmp")] == []
+
+
+def test_expired_snapshot_is_rebuilt(
+    catalog: Catalog,
+    tmp_path: Path,
+) -> None:
+    store = SnapshotStore(str(tmp_path / "catalog.snapshot"), max_age=1e-9)
+
+    store.get(lambda: catalog, generation=0)
+    store.get(lambda: catalog, generation=0)
+
+    assert store.builds == 2
+
+
+def test_routes_are_served_from_the_snapshot(
+    test_db: Session,
+    snapshot_client: TestClient,
+    tmp_path: Path,
+) -> None:
+    generate(test_db.connection(), SPEC, seed=7)
+    test_db.commit()
+    invalidate_catalog()
+
+    variants = snapshot_client.get("/api/v1/part-variants")
+    assert variants.status_code == 200
+    assert len(variants.json()) == len(Catalog.load(test_db, 0).variants)
+    assert (tmp_path / "catalog.snapshot").exists()
+
+    product_id = snapshot_client.get("/api/v1/products").json()[0]["id"]
+    response = snapshot_client.delete(f"/api/v1/products/{product_id}")
+    assert response.status_code == 204
+
+    products = snapshot_client.get("/api/v1/products?page_size=100")
+    assert product_id not in {p["id"] for p in products.json()}
+
+
+def test_configurator_keeps_the_snapshot_until_it_changes(
+    test_db: Session,
+    snapshot_client: TestClient,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    generate(test_db.connection(), SPEC, seed=7)
+    test_db.commit()
+    invalidate_catalog()
+    loads: List[Catalog] = []
+
+    def counted_get_catalog(session: Session) -> Catalog:
+        loads.append(get_catalog(session))
+        return loads[-1]
+
+    product, variant = next(
+        (p, v)
+        for p in snapshot_client.get("/api/v1/products").json()
+        if p["parts"]
+        for v in p["parts"][0]["variants"]
+        if v["is_available"] and v["stock_quantity"]
+    )
+    monkeypatch.setattr(routes, "get_catalog", counted_get_catalog)
+
+    with snapshot_client.websocket_connect(
+        f"/api/v1/configurator/{product['id']}"
+    ) as ws:
+        ws.receive_json()
+        for _ in range(3):
+            ws.send_json({"type": "select", "variant_id": variant["id"]})
+            assert ws.receive_json()["type"] == "priced"
+            ws.send_json({"type": "undo"})
+            assert ws.receive_json()["type"] == "priced"
+        assert len(loads) == 1
+
+        # A write publishes a new snapshot, with the new price
+        snapshot_client.put(
+            f"/api/v1/part-variants/{variant['id']}",
+            json={"price": variant["price"] + 100},
+        )
+        ws.send_json({"type": "select", "variant_id": variant["id"]})
+        state = ws.receive_json()
+        assert state["type"] == "state"
+        assert ws.receive_json()["total"] == pytest.approx(
+            product["base_price"] + variant["price"] + 100
+        )
+        assert len(loads) == 2
+        assert loads[1].version != loads[0].version
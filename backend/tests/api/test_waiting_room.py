@@ -0,0 +1,240 @@
+# tests/api/test_waiting_room.py
+
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Generator, List
+from uuid import UUID, uuid4
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import Engine
+from sqlmodel import Session, SQLModel, col, create_engine, select
+
+from app.api.models import (
+    Product,
+    WaitingRoomBucket,
+    WaitingRoomTicket,
+    utc_now,
+)
+from app.api.waiting_room import WaitingRoom
+from app.config import Settings
+from app.database import get_session
+from app.main import create_app
+
+
+@pytest.fixture
+def room_engine(tmp_path: Path) -> Generator[Engine, Any, None]:
+    # Each worker and the routes use their own connection
+    engine: Engine = create_engine(
+        f"sqlite:///{tmp_path / 'room.db'}",
+        connect_args={"check_same_thread": False},
+    )
+    SQLModel.metadata.create_all(engine)
+
+    yield engine
+
+    engine.dispose()
+
+
+def _product(engine: Engine) -> UUID:
+    product = Product(
+        name="Flash Bike",
+        category="bikes",
+        base_price=100.0,
+        is_custom=False,
+        is_available=True,
+        stock_quantity=5,
+    )
+    with Session(engine) as session:
+        session.add(product)
+        session.commit()
+
+        return product.id
+
+
+def test_workers_admit_in_join_order_at_the_rate(room_engine: Engine) -> None:
+    product_id: UUID = _product(room_engine)
+    first, second = (
+        WaitingRoom(room_engine, [product_id], rate=2.0, interval=1.0) for _ in range(2)
+    )
+
+    # Clients joining both workers, alternately
+    tokens: List[UUID] = [
+        UUID((first, second)[i % 2].join(product_id)["token"]) for i in range(5)
+    ]
+    # Positions are local until the tickets are written, the tickets of
+    # the other worker placed by the time their token tells
+    assert first.status(product_id, tokens[4])["position"] == 3
+    assert first.status(product_id, tokens[1])["position"] == 2
+    assert second.status(product_id, tokens[4])["position"] == 3
+    assert first.status(product_id, uuid4()) is None
+
+    now: datetime = utc_now()
+    first.tick(now)
+    second.tick(now)
+    # One second of admissions, shared by the workers
+    second.tick(now + timedelta(seconds=1))
+    first.tick(now + timedelta(seconds=1))
+
+    for room in (first, second):
+        assert [room.status(product_id, t)["status"] for t in tokens] == [
+            "admitted",
+            "admitted",
+            "waiting",
+            "waiting",
+            "waiting",
+        ]
+        status: Dict[str, Any] = room.status(product_id, tokens[3])
+        assert status["position"] == 2
+        assert status["eta"] == 1.0
+        assert status["retry_after"] == 2.0
+
+    # A quiet minute does not admit more than an interval of tickets
+    first.tick(now + timedelta(seconds=60))
+    second.tick(now + timedelta(seconds=60))
+    assert [second.status(product_id, t)["status"] for t in tokens] == [
+        "admitted",
+        "admitted",
+        "admitted",
+        "admitted",
+        "waiting",
+    ]
+    assert second.status(product_id, tokens[4])["position"] == 1
+
+    with Session(room_engine) as session:
+        admitted: List[UUID] = list(
+            session.exec(
+                select(WaitingRoomTicket.token).where(
+                    col(WaitingRoomTicket.admitted_at).is_not(None)
+                )
+            ).all()
+        )
+    assert set(admitted) == set(tokens[:4])
+
+
+def test_carts_of_queued_products_need_an_admitted_ticket(
+    room_engine: Engine,
+) -> None:
+    product_id: UUID = _product(room_engine)
+    other_id: UUID = _product(room_engine)
+    app = create_app(Settings())
+    room = WaitingRoom(room_engine, [product_id], rate=1.0, interval=1.0)
+    app.state.waiting_room = room
+
+    def override_get_session() -> Generator[Session, Any, None]:
+        with Session(room_engine) as session:
+            yield session
+
+    app.dependency_overrides[get_session] = override_get_session
+
+    def cart(item_id: UUID, token: Any = None) -> Any:
+        headers: Dict[str, str] = {}
+        if token is not None:
+            headers["X-Waiting-Room-Token"] = str(token)
+        return client.post(
+            "/api/v1/carts",
+            json={
+                "purchased": False,
+                "total_price": 100.0,
+                "items": [{"product_id": str(item_id), "total_price": 100.0}],
+            },
+            headers=headers,
+        )
+
+    with TestClient(app) as client:
+        assert cart(other_id).status_code == 200
+        assert cart(product_id).status_code == 403
+        assert client.post(f"/api/v1/waiting-room/{other_id}").status_code == 404
+
+        response = client.post(f"/api/v1/waiting-room/{product_id}")
+        assert response.status_code == 201
+        ticket: Dict[str, Any] = response.json()
+        assert ticket["status"] == "waiting" and ticket["position"] == 1
+        url: str = f"/api/v1/waiting-room/{product_id}/{ticket['token']}"
+
+        # Not admitted yet
+        assert cart(product_id, ticket["token"]).status_code == 403
+        now: datetime = utc_now()
+        room.tick(now)
+        room.tick(now + timedelta(seconds=1))
+        assert client.get(url).json()["status"] == "admitted"
+
+        assert cart(product_id, ticket["token"]).status_code == 200
+        # A ticket is used once
+        assert cart(product_id, ticket["token"]).status_code == 403
+        assert client.get(url).json()["status"] == "used"
+
+        unknown: str = f"/api/v1/waiting-room/{product_id}/{uuid4()}"
+        assert client.get(unknown).status_code == 404
+
+
+def test_tickets_are_only_used_once_the_cart_is_committed(
+    room_engine: Engine,
+) -> None:
+    product_id: UUID = _product(room_engine)
+    room = WaitingRoom(room_engine, [product_id], rate=1.0, interval=1.0)
+    token = UUID(room.join(product_id)["token"])
+    now: datetime = utc_now()
+    room.tick(now)
+    room.tick(now + timedelta(seconds=1))
+
+    # The cart fails: the ticket can be used again
+    with Session(room_engine) as session:
+        assert room.consume_ticket(session, product_id, token)
+        session.rollback()
+    assert room.status(product_id, token)["status"] == "admitted"
+    with Session(room_engine) as session:
+        assert room.consume_ticket(session, product_id, token)
+    assert room.status(product_id, token)["status"] == "admitted"
+
+    with Session(room_engine) as session:
+        assert room.consume_ticket(session, product_id, token)
+        assert room.status(product_id, token)["status"] == "admitted"
+        session.commit()
+    assert room.status(product_id, token)["status"] == "used"
+    with Session(room_engine) as session:
+        assert not room.consume_ticket(session, product_id, token)
+
+
+def test_tickets_and_buckets_of_the_past_are_deleted(room_engine: Engine) -> None:
+    product_id: UUID = _product(room_engine)
+    over_id: UUID = _product(room_engine)
+    now: datetime = utc_now()
+    with Session(room_engine) as session:
+        # Left by a sale that is over
+        session.add(
+            WaitingRoomTicket(
+                token=uuid4(),
+                product_id=over_id,
+                joined_at=now,
+            )
+        )
+        session.add(WaitingRoomBucket(product_id=over_id, refilled_at=now))
+        session.commit()
+    room = WaitingRoom(
+        room_engine,
+        [product_id],
+        rate=1.0,
+        ttl=60.0,
+        interval=1.0,
+        retention=600.0,
+    )
+    room.join(product_id)
+    room.tick(now)
+    room.tick(now + timedelta(seconds=1))
+    waiting = UUID(room.join(product_id)["token"])
+    room.tick(now + timedelta(seconds=1))
+
+    def rows() -> Dict[str, List[UUID]]:
+        with Session(room_engine) as session:
+            return {
+                "tickets": list(session.exec(select(WaitingRoomTicket.token))),
+                "buckets": list(session.exec(select(WaitingRoomBucket.product_id))),
+            }
+
+    # Kept for the retention
+    room.tick(now + timedelta(seconds=120))
+    assert len(rows()["tickets"]) == 3
+
+    room.tick(now + timedelta(seconds=120 + 600))
+    assert rows() == {"tickets": [waiting], "buckets": [product_id]}
@@ -0,0 +1,85 @@
+# tests/api/test_warmup.py
+
+import threading
+import time
+from typing import Any, Callable, Generator
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from app.api.catalog import get_catalog
+from app.config import Settings
+from app.database import get_session
+from app.main import create_app
+from datagen import CatalogSpec, generate
+
+SPEC = CatalogSpec(
+    products=12,
+    parts=3,
+    variants=3,
+    restriction_density=0.2,
+    custom_price_density=0.2,
+)
+
+
+def _app(test_db: Session, **settings: Any) -> FastAPI:
+    app = create_app(Settings(WARMUP_ENABLED=True, **settings))
+
+    def override_get_session() -> Generator[Session, Any, None]:
+        yield test_db
+
+    app.dependency_overrides[get_session] = override_get_session
+
+    return app
+
+
+def test_the_first_requests_find_warm_caches(
+    test_db: Session,
+    query_budget: Callable[[int], Any],
+) -> None:
+    generate(test_db.connection(), SPEC, seed=5)
+    test_db.commit()
+
+    with TestClient(_app(test_db, COMPRESSION_MIN_SIZE=1)) as client:
+        assert client.get("/api/v1/readiness").status_code == 200
+        assert client.get("/api/v1/healthchecker").status_code == 200
+
+        with query_budget(0):
+            response = client.get(
+                "/api/v1/products",
+                headers={"Accept-Encoding": "br"},
+            )
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "br"
+        assert len(response.json()) == 10
+
+        catalog = get_catalog(test_db)
+        for product in catalog.products:
+            catalog.memo(("pricing", product.id), lambda: pytest.fail())
+
+
+def test_workers_are_not_ready_until_warmed_up(test_db: Session) -> None:
+    release = threading.Event()
+    app = create_app(Settings(WARMUP_ENABLED=True, WARMUP_TIMEOUT=0.01))
+
+    def slow_session() -> Generator[Session, Any, None]:
+        release.wait(5)
+        yield test_db
+
+    app.dependency_overrides[get_session] = slow_session
+
+    with TestClient(app) as client:
+        # The startup did not wait any longer for the warm-up
+        response = client.get("/api/v1/readiness")
+        assert response.status_code == 503
+        assert response.json() == {"detail": "API is warming up"}
+        assert client.get("/api/v1/healthchecker").status_code == 200
+
+        release.set()
+        deadline: float = time.monotonic() + 5
+        while client.get("/api/v1/readiness").status_code != 200:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        assert app.state.warmup.duration is not None
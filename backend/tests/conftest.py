@@ -1,6 +1,18 @@
 # tests/conftest.py
 
-from typing import Any, Generator
+import os
+
+# Tests write their catalog after the app has started
+os.environ.setdefault("WARMUP_ENABLED", "false")
+# and drain the outbox of their own database themselves
+os.environ.setdefault("OUTBOX_WORKERS", "0")
+# and prune their change log themselves
+os.environ.setdefault("CHANGES_RETENTION", "0")
+# Statements are reported in the headers, as in development
+os.environ.setdefault("QUERY_INSTRUMENTATION", "true")
+
+from contextlib import contextmanager
+from typing import Any, Callable, ContextManager, Generator, Iterator
 
 import pytest
 from fastapi.testclient import TestClient
@@ -8,6 +20,9 @@ from sqlmodel import SQLModel, Session, create_engine
 from sqlalchemy import Engine
 from sqlalchemy.pool import StaticPool
 
+from app.api import models  # noqa: F401 (registers the tables)
+from app.instrumentation import QueryStats, count_queries
+
 
 # Use an in-memory SQLite database for testing
 DATABASE_URL = "sqlite:///:memory:"
@@ -22,6 +37,11 @@ engine: Engine = create_engine(
 
 @pytest.fixture
 def test_db() -> Generator[Session, Any, None]:
+    from app.api.cache import entity_cache, invalidate_catalog
+
+    # Cached catalog pages and rows must not leak between test databases
+    invalidate_catalog()
+    entity_cache.clear()
     SQLModel.metadata.create_all(bind=engine)
 
     with Session(engine) as session:
@@ -43,3 +63,28 @@ def test_client(test_db: Session) -> Generator[TestClient, Any, None]:
 
     with TestClient(app) as client:
         yield client
+
+
+@pytest.fixture
+def query_budget() -> Callable[[int], ContextManager[QueryStats]]:
+    """
+    Assert that a block of code executes at most `budget` statements.
+
+    Example:
+        ```python
+        def test_route(test_client, query_budget):
+            with query_budget(2):
+                test_client.get("/api/v1/products")
+        ```
+    """
+
+    @contextmanager
+    def check(budget: int) -> Iterator[QueryStats]:
+        with count_queries() as stats:
+            yield stats
+
+        assert stats.count <= budget, (
+            f"{stats.count} statements executed, budget is {budget}: " f"{stats.shapes}"
+        )
+
+    return check
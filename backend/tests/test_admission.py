@@ -0,0 +1,128 @@
+# tests/test_admission.py
+
+import asyncio
+import threading
+import time
+from typing import List
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.admission import (
+    ADMISSION_REJECTED,
+    AdmissionLimiter,
+    AdmissionMiddleware,
+    _admission_requests,
+    route_class,
+)
+
+
+def test_route_classes() -> None:
+    assert route_class("POST", "/api/v1/carts") == "checkout"
+    assert route_class("POST", "/api/v1/calculate-price") == "pricing"
+    assert route_class("GET", "/api/v1/products") == "reads"
+    assert route_class("HEAD", "/api/v1/products/1/builder/") == "reads"
+
+    # Writes, streams, probes and routes out of the API are not limited
+    assert route_class("PUT", "/api/v1/products/1") is None
+    assert route_class("GET", "/api/v1/changes") is None
+    assert route_class("GET", "/api/v1/availability/stream") is None
+    assert route_class("GET", "/api/v1/readiness") is None
+    assert route_class("GET", "/metrics") is None
+
+
+def test_waiting_requests_get_freed_slots_in_order() -> None:
+    async def scenario() -> List[str]:
+        limiter = AdmissionLimiter(limit=1, queue_size=2, queue_timeout=0.2)
+        events: List[str] = []
+
+        async def request(name: str, hold: float) -> None:
+            if not await limiter.acquire():
+                events.append(f"{name} refused")
+                return
+            events.append(f"{name} admitted")
+            await asyncio.sleep(hold)
+            limiter.release()
+
+        first = asyncio.create_task(request("first", 0.05))
+        await asyncio.sleep(0)
+        # Queued behind the first, in order
+        second = asyncio.create_task(request("second", 0.5))
+        third = asyncio.create_task(request("third", 0))
+        await asyncio.sleep(0)
+        # The queue is full
+        await request("fourth", 0)
+        await asyncio.gather(first, second, third)
+
+        assert limiter.active == 0 and limiter.queued == 0
+
+        # A cancelled waiter gives its place back
+        await limiter.acquire()
+        cancelled = asyncio.create_task(request("cancelled", 0))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.gather(cancelled, return_exceptions=True)
+        assert limiter.queued == 0
+        limiter.release()
+        assert limiter.active == 0
+
+        return events
+
+    assert asyncio.run(scenario()) == [
+        "first admitted",
+        "fourth refused",
+        "second admitted",
+        # The second holds the slot longer than the third can wait
+        "third refused",
+    ]
+
+
+def test_saturated_checkout_leaves_reads_fast() -> None:
+    checkout_limiter = AdmissionLimiter(1, queue_size=0, queue_timeout=1)
+    app = FastAPI()
+    app.add_middleware(
+        AdmissionMiddleware,
+        limiters={
+            "checkout": checkout_limiter,
+            "reads": AdmissionLimiter(4, queue_size=8, queue_timeout=1),
+        },
+        retry_after=2,
+    )
+    release = threading.Event()
+
+    @app.post("/api/v1/carts")
+    def create_cart() -> dict:
+        release.wait(5)
+        return {"id": 1}
+
+    @app.get("/api/v1/products")
+    def products() -> list:
+        return []
+
+    with TestClient(app) as client:
+        checkout = threading.Thread(target=lambda: client.post("/api/v1/carts"))
+        checkout.start()
+        deadline: float = time.monotonic() + 5
+        while checkout_limiter.active == 0:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+        refused = client.post("/api/v1/carts")
+        assert refused.status_code == 503
+        assert refused.headers["retry-after"] == "2"
+        assert "checkout" in refused.json()["detail"]
+
+        start: float = time.monotonic()
+        for _ in range(10):
+            assert client.get("/api/v1/products").status_code == 200
+        assert time.monotonic() - start < 1
+
+        release.set()
+        checkout.join()
+        assert client.post("/api/v1/carts").status_code == 200
+
+    assert _admission_requests()[("checkout", "limit")] == 1.0
+    assert any(
+        line.startswith('admission_rejected_total{class="checkout"}')
+        for line in ADMISSION_REJECTED.samples()
+    )
@@ -0,0 +1,55 @@
+# tests/test_asgi.py
+
+import logging
+
+import pytest
+
+from asgi import check_shared_caches, server_options
+from app.config import Settings
+
+
+def test_production_serves_with_workers_draining_requests() -> None:
+    options = server_options(
+        Settings(
+            ENV="production",
+            SERVER_WORKERS=4,
+            SERVER_LIMIT_CONCURRENCY=500,
+            SERVER_GRACEFUL_TIMEOUT=15,
+        )
+    )
+
+    assert options["workers"] == 4
+    assert "reload" not in options
+    assert options["limit_concurrency"] == 500
+    assert options["timeout_graceful_shutdown"] == 15
+    assert options["loop"] == "auto" and options["http"] == "auto"
+
+    # One worker per CPU by default, and no concurrency limit
+    options = server_options(Settings(ENV="production"))
+    assert options["workers"] >= 1
+    assert options["limit_concurrency"] is None
+
+
+def test_development_reloads_in_a_single_process() -> None:
+    for options in (
+        server_options(Settings(ENV="development", SERVER_WORKERS=4)),
+        server_options(Settings(ENV="production"), reload=True),
+    ):
+        assert options["reload"] is True
+        assert options["workers"] == 1
+
+
+def test_workers_without_a_cache_backend_are_warned_about(
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    with caplog.at_level(logging.WARNING, logger="asgi"):
+        assert check_shared_caches(Settings(), workers=1)
+        assert check_shared_caches(
+            Settings(CACHE_BACKEND_URL="redis://cache:6379/0"),
+            workers=4,
+        )
+        assert caplog.records == []
+
+        assert not check_shared_caches(Settings(), workers=4)
+    [record] = caplog.records
+    assert "CACHE_BACKEND_URL" in record.getMessage()
@@ -0,0 +1,258 @@
+# tests/test_cache_backend.py
+
+import socket
+import socketserver
+import threading
+import time
+from typing import Any, Dict, Generator, List, Set
+
+import orjson
+import pytest
+from sqlmodel import Session
+
+from app.api.cache import (
+    INVALIDATION_CHANNEL,
+    catalog_cache,
+    entity_cache,
+    invalidate_catalog,
+    use_backend,
+)
+from app.api.models import Product
+from app.api.schemas import ProductUpdateSchema
+from app.api.services import get_product_by_id, update_product
+from app.cache_backend import (
+    RECONNECT_DELAY,
+    CacheBackendError,
+    RedisBackend,
+    RespConnection,
+    backend_from_url,
+    encode_command,
+)
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    server: "RedisStandIn"
+
+    def handle(self) -> None:
+        connection = RespConnection(self.request)
+        self.server.connections.append(connection)
+        subscribed: bool = False
+        while True:
+            try:
+                command: List[bytes] = connection.reply()
+            except OSError:
+                return
+            name: bytes = command[0].upper()
+            if name == b"PING":
+                reply = encode_command(b"pong", b"") if subscribed else b"+PONG\r\n"
+            elif name == b"SUBSCRIBE":
+                subscribed = True
+                for channel in command[1:]:
+                    self.server.subscribe(channel, connection)
+                reply = encode_command(b"subscribe", command[1], b"1")
+            elif name == b"PUBLISH":
+                count: int = self.server.publish(command[1], command[2])
+                reply = b":%d\r\n" % count
+            else:
+                reply = b"-ERR unknown command\r\n"
+            self.server.send(connection, reply)
+
+
+class RedisStandIn(socketserver.ThreadingTCPServer):
+    """
+    The pub/sub commands of a Redis server (PING, SUBSCRIBE, PUBLISH),
+    enough for the cache backend.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.lock = threading.Lock()
+        self.connections: List[RespConnection] = []
+        self.channels: Dict[bytes, Set[RespConnection]] = {}
+
+    def subscribe(self, channel: bytes, connection: RespConnection) -> None:
+        with self.lock:
+            self.channels.setdefault(channel, set()).add(connection)
+
+    def publish(self, channel: bytes, message: bytes) -> int:
+        with self.lock:
+            subscribers = list(self.channels.get(channel, ()))
+        for connection in subscribers:
+            self.send(connection, encode_command(b"message", channel, message))
+
+        return len(subscribers)
+
+    def send(self, connection: RespConnection, data: bytes) -> None:
+        try:
+            with self.lock:
+                connection.sock.sendall(data)
+        except OSError:
+            pass
+
+    def restart(self) -> None:
+        # Drops every connection and subscription, like a restart
+        with self.lock:
+            connections, self.connections = self.connections, []
+            self.channels.clear()
+        for connection in connections:
+            connection.close()
+
+
+@pytest.fixture
+def stand_in() -> Generator[RedisStandIn, Any, None]:
+    server = RedisStandIn()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.restart()
+    server.server_close()
+
+
+def _backend(server: RedisStandIn) -> RedisBackend:
+    host, port = server.server_address[:2]
+    return backend_from_url(f"redis://{host}:{port}/0")
+
+
+def _wait(condition: Any, timeout: float = 2.0) -> bool:
+    deadline: float = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.001)
+
+    return False
+
+
+def _unused_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_messages_reach_the_subscribers_after_a_restart(
+    stand_in: RedisStandIn,
+) -> None:
+    publisher, subscriber = _backend(stand_in), _backend(stand_in)
+    received: List[bytes] = []
+    connects: List[float] = []
+    subscriber.subscribe(
+        "channel",
+        received.append,
+        on_connect=lambda: connects.append(time.monotonic()),
+    )
+    try:
+        assert _wait(lambda: len(connects) == 1)
+        publisher.publish("channel", b"first")
+        assert _wait(lambda: received == [b"first"])
+
+        stand_in.restart()
+        # Messages missed while disconnected are reported by on_connect
+        assert _wait(lambda: len(connects) == 2)
+        publisher.publish("channel", b"second")
+        assert _wait(lambda: received == [b"first", b"second"])
+    finally:
+        publisher.close()
+        subscriber.close()
+
+    unreachable = RedisBackend(port=_unused_port(), timeout=0.1)
+    with pytest.raises(CacheBackendError):
+        unreachable.publish("channel", b"lost")
+
+
+def test_commands_fail_fast_until_the_server_can_be_reached_again(
+    stand_in: RedisStandIn,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    unreachable = RedisBackend(port=_unused_port(), timeout=0.1)
+    connects: List[float] = []
+    connect = unreachable._connect
+
+    def counted_connect() -> Any:
+        connects.append(time.monotonic())
+        return connect()
+
+    monkeypatch.setattr(unreachable, "_connect", counted_connect)
+    for _ in range(3):
+        with pytest.raises(CacheBackendError):
+            unreachable.publish("channel", b"lost")
+    # Not tried again until the backoff is over
+    assert len(connects) == 1
+
+    time.sleep(RECONNECT_DELAY)
+    with pytest.raises(CacheBackendError):
+        unreachable.publish("channel", b"lost")
+    assert len(connects) == 2
+
+    # Back, after a longer backoff
+    host, port = stand_in.server_address[:2]
+    unreachable.host, unreachable.port = host, port
+    time.sleep(3 * RECONNECT_DELAY)
+    try:
+        assert unreachable.command("PUBLISH", "channel", b"found") == 0
+        assert len(connects) == 3
+    finally:
+        unreachable.close()
+
+
+def test_writes_invalidate_the_caches_of_the_other_workers(
+    test_db: Session,
+    stand_in: RedisStandIn,
+) -> None:
+    product = Product(
+        name="Test Product",
+        category="Bicycle",
+        base_price=100.0,
+        is_custom=True,
+        is_available=True,
+        stock_quantity=10,
+    )
+    test_db.add(product)
+    test_db.commit()
+
+    worker = _backend(stand_in)
+    other = _backend(stand_in)
+    received: List[Dict[str, Any]] = []
+    other.subscribe(
+        INVALIDATION_CHANNEL,
+        lambda message: received.append(orjson.loads(message)),
+    )
+    use_backend(worker)
+    try:
+        channel: bytes = INVALIDATION_CHANNEL.encode()
+        assert _wait(lambda: len(stand_in.channels.get(channel, ())) == 2)
+
+        # The writes of this worker are broadcast, with the rows changed
+        update_product(test_db, product.id, ProductUpdateSchema(name="New"))
+        assert _wait(lambda: len(received) == 1)
+        assert ["products", str(product.id)] in received[0]["keys"]
+
+        # The writes of the others drop the rows and the catalog here
+        cached = get_product_by_id(test_db, product.id)
+        generation: int = catalog_cache.generation
+        started: float = time.monotonic()
+        other.publish(
+            INVALIDATION_CHANNEL,
+            orjson.dumps({"origin": "other", "keys": [["products", str(product.id)]]}),
+        )
+        assert _wait(lambda: len(entity_cache) == 0)
+        assert time.monotonic() - started < 1.0
+        assert catalog_cache.generation > generation
+        assert get_product_by_id(test_db, product.id) is not cached
+
+        # Without the backend, writes still invalidate this worker
+        unreachable = RedisBackend(port=_unused_port(), timeout=0.1)
+        use_backend(unreachable)
+        generation = catalog_cache.generation
+        invalidate_catalog()
+        assert catalog_cache.generation == generation + 1
+        unreachable.close()
+    finally:
+        use_backend(None)
+        worker.close()
+        other.close()
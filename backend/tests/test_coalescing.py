@@ -0,0 +1,171 @@
+# tests/test_coalescing.py
+
+import threading
+import time
+from typing import List
+
+import pytest
+
+from app.coalescing import CoalescingCache, LRUCache, SingleFlight
+
+
+def test_single_flight_coalesces_concurrent_calls() -> None:
+    flight = SingleFlight()
+    calls: List[int] = []
+    release = threading.Event()
+    results: List[int] = []
+
+    def slow() -> int:
+        calls.append(1)
+        release.wait(timeout=5)
+        return 42
+
+    def worker() -> None:
+        results.append(flight.do("key", slow))
+
+    threads = [threading.Thread(target=worker) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+
+    # Wait until every follower is parked behind the leader
+    deadline = time.monotonic() + 5
+    while flight.coalesced < 9 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release.set()
+
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [42] * 10
+    assert flight.coalesced == 9
+    assert not flight.is_running("key")
+
+
+def test_single_flight_propagates_errors_and_releases_key() -> None:
+    flight = SingleFlight()
+
+    def failing() -> int:
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        flight.do("key", failing)
+
+    assert flight.do("key", lambda: 1) == 1
+
+
+def test_coalescing_cache_serves_fresh_entries() -> None:
+    cache = CoalescingCache(ttl=60)
+    builds: List[int] = []
+
+    def build() -> str:
+        builds.append(1)
+        return "value"
+
+    assert cache.get_or_build("key", build) == "value"
+    assert cache.get_or_build("key", build) == "value"
+    assert len(builds) == 1
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+
+def test_coalescing_cache_serves_stale_while_rebuilding() -> None:
+    cache = CoalescingCache(ttl=0.01)
+    cache.get_or_build("key", lambda: "old")
+    time.sleep(0.02)
+
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_rebuild() -> str:
+        started.set()
+        release.wait(timeout=5)
+        return "new"
+
+    leader = threading.Thread(
+        target=cache.get_or_build,
+        args=("key", slow_rebuild),
+    )
+    leader.start()
+    started.wait(timeout=5)
+
+    # Followers neither wait nor rebuild while the leader runs
+    assert cache.get_or_build("key", lambda: "unexpected") == "old"
+    assert cache.stale_hits == 1
+
+    release.set()
+    leader.join()
+
+    assert cache.get_or_build("key", lambda: "unexpected") == "new"
+
+
+def test_coalescing_cache_invalidate_discards_in_flight_build() -> None:
+    cache = CoalescingCache(ttl=60)
+
+    def build_then_invalidate() -> str:
+        cache.invalidate()
+        return "outdated"
+
+    assert cache.get_or_build("key", build_then_invalidate) == "outdated"
+    assert len(cache) == 0
+    assert cache.get_or_build("key", lambda: "fresh") == "fresh"
+
+
+def test_coalescing_cache_without_ttl_keeps_nothing() -> None:
+    cache = CoalescingCache(ttl=0)
+    cache.get_or_build("key", lambda: "value")
+
+    assert len(cache) == 0
+
+
+def test_lru_cache_evicts_the_least_recently_used() -> None:
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.get_or_load("a", lambda: "a")
+    cache.get_or_load("b", lambda: "b")
+    cache.get_or_load("a", lambda: "unexpected")
+    cache.get_or_load("c", lambda: "c")
+
+    assert cache.get_or_load("a", lambda: "unexpected") == "a"
+    assert cache.get_or_load("b", lambda: "reloaded") == "reloaded"
+    assert (cache.hits, cache.misses, cache.evictions) == (2, 4, 2)
+    assert len(cache) == 2
+
+
+def test_lru_cache_expires_entries_and_skips_none() -> None:
+    cache = LRUCache(maxsize=10, ttl=0.01)
+    cache.get_or_load("key", lambda: "old")
+    cache.get_or_load("missing", lambda: None)
+    time.sleep(0.02)
+
+    assert cache.get_or_load("key", lambda: "new") == "new"
+    assert cache.get_or_load("missing", lambda: "created") == "created"
+    assert cache.hits == 0
+
+
+def test_lru_cache_invalidate_discards_in_flight_load() -> None:
+    cache = LRUCache(maxsize=10, ttl=60)
+    started = threading.Event()
+    release = threading.Event()
+    results: List[str] = []
+
+    def slow_load() -> str:
+        started.set()
+        release.wait(timeout=5)
+        return "outdated"
+
+    loader = threading.Thread(
+        target=lambda: results.append(cache.get_or_load("key", slow_load)),
+    )
+    loader.start()
+    started.wait(timeout=5)
+
+    # A write commits while the row is being read
+    cache.invalidate("key")
+    # Callers arriving after the write do not wait for the old read
+    assert cache.get_or_load("key", lambda: "fresh") == "fresh"
+
+    release.set()
+    loader.join()
+
+    assert results == ["outdated"]
+    assert cache.get_or_load("key", lambda: "unexpected") == "fresh"
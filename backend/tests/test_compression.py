@@ -0,0 +1,156 @@
+# tests/test_compression.py
+
+import gzip
+from typing import Any, Generator, Iterator
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+from pytest_mock import MockerFixture
+from sqlmodel import Session
+
+from app import compression
+from app.compression import CompressionMiddleware, negotiate_encoding
+from app.config import Settings
+from app.database import get_session
+from app.main import create_app
+from datagen import CatalogSpec, generate
+
+SPEC = CatalogSpec(
+    products=4,
+    parts=3,
+    variants=4,
+    restriction_density=0.3,
+    custom_price_density=0.3,
+)
+
+
+@pytest.fixture
+def catalog(test_db: Session) -> None:
+    generate(test_db.connection(), SPEC, seed=2)
+    test_db.commit()
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, expected",
+    [
+        (None, None),
+        ("identity", None),
+        ("gzip", "gzip"),
+        ("gzip, deflate, br", "br"),
+        ("br;q=0.5, gzip", "gzip"),
+        ("br;q=0, *", "gzip"),
+        ("*;q=0", None),
+    ],
+)
+def test_negotiate_encoding(accept_encoding: str, expected: str) -> None:
+    assert negotiate_encoding(accept_encoding) == expected
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "br"])
+def test_responses_are_compressed(
+    catalog: None,
+    test_client: TestClient,
+    encoding: str,
+) -> None:
+    plain = test_client.get(
+        "/api/v1/custom-prices",
+        headers={"Accept-Encoding": "identity"},
+    )
+    compressed = test_client.get(
+        "/api/v1/custom-prices",
+        headers={"Accept-Encoding": encoding},
+    )
+
+    assert "content-encoding" not in plain.headers
+    assert compressed.headers["content-encoding"] == encoding
+    assert compressed.headers["vary"] == "Accept-Encoding"
+    assert int(compressed.headers["content-length"]) < len(plain.content)
+    assert compressed.json() == plain.json()
+
+
+def test_small_responses_are_not_compressed(test_client: TestClient) -> None:
+    response = test_client.get(
+        "/api/v1/healthchecker",
+        headers={"Accept-Encoding": "gzip"},
+    )
+
+    assert "content-encoding" not in response.headers
+
+
+def test_catalog_is_compressed_once_per_version(
+    catalog: None,
+    test_client: TestClient,
+    mocker: MockerFixture,
+) -> None:
+    spy = mocker.spy(compression, "compress")
+    headers = {"Accept-Encoding": "br"}
+
+    first = test_client.get("/api/v1/part-variants", headers=headers)
+    second = test_client.get("/api/v1/part-variants", headers=headers)
+    assert first.headers["content-encoding"] == "br"
+    assert second.content == first.content
+    assert spy.call_count == 1
+
+    test_client.get("/api/v1/part-variants", headers={"Accept-Encoding": "gzip"})
+    assert spy.call_count == 2
+
+    # A write starts a new catalog version
+    variant_id = first.json()[0]["id"]
+    test_client.put(f"/api/v1/part-variants/{variant_id}", json={"price": 1.0})
+    third = test_client.get("/api/v1/part-variants", headers=headers)
+    assert spy.call_count == 3
+    assert third.json()[0]["price"] == 1.0
+
+
+def test_streamed_responses_are_compressed_per_chunk() -> None:
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, minimum_size=1)
+
+    @app.get("/stream")
+    def stream() -> StreamingResponse:
+        def chunks() -> Iterator[bytes]:
+            for i in range(3):
+                yield f"chunk {i}\n".encode()
+
+        return StreamingResponse(chunks(), media_type="text/plain")
+
+    with TestClient(app) as client:
+        with client.stream(
+            "GET",
+            "/stream",
+            headers={"Accept-Encoding": "gzip"},
+        ) as response:
+            raw = b"".join(response.iter_raw())
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    assert gzip.decompress(raw) == b"chunk 0\nchunk 1\nchunk 2\n"
+
+
+@pytest.fixture
+def uncompressed_client(
+    test_db: Session,
+) -> Generator[TestClient, Any, None]:
+    app = create_app(Settings(COMPRESSION_MIN_SIZE=0))
+
+    def override_get_session() -> Generator[Session, Any, None]:
+        yield test_db
+
+    app.dependency_overrides[get_session] = override_get_session
+
+    with TestClient(app) as client:
+        yield client
+
+
+def test_compression_can_be_disabled(
+    catalog: None,
+    uncompressed_client: TestClient,
+) -> None:
+    for url in ("/api/v1/part-variants", "/api/v1/custom-prices"):
+        response = uncompressed_client.get(
+            url,
+            headers={"Accept-Encoding": "gzip"},
+        )
+        assert "content-encoding" not in response.headers
@@ -0,0 +1,109 @@
+# tests/test_datagen.py
+
+from uuid import UUID, uuid4
+
+from sqlmodel import Session, select
+
+from app.api.changes import record_change
+from app.api.models import (
+    CartItem,
+    CatalogChange,
+    OutboxMessage,
+    PartVariant,
+    Product,
+    WaitingRoomBucket,
+    WaitingRoomTicket,
+    utc_now,
+)
+from app.api.utils import calculate_total_price
+from datagen import CatalogGenerator, CatalogSpec, generate
+from db_seed import delete_all_data
+
+
+def test_catalog_generator_is_deterministic() -> None:
+    spec = CatalogSpec(products=20, carts=10)
+
+    first = list(CatalogGenerator(spec, seed=7).catalog())
+    second = list(CatalogGenerator(spec, seed=7).catalog())
+    other = list(CatalogGenerator(spec, seed=8).catalog())
+
+    assert first == second
+    assert first != other
+
+
+def test_generate_writes_catalog(test_db: Session) -> None:
+    spec = CatalogSpec(products=10, parts=3, variants=4, custom_ratio=1.0)
+
+    counts, products = generate(test_db.connection(), spec, seed=1)
+    test_db.commit()
+
+    assert counts["products"] == 10
+    assert counts["product_parts"] == 30
+    assert counts["part_variants"] == 120
+    assert len(products) == 10
+    assert len(test_db.exec(select(PartVariant)).all()) == 120
+
+
+def test_generated_carts_match_calculated_prices(test_db: Session) -> None:
+    spec = CatalogSpec(
+        products=5,
+        custom_price_density=0.3,
+        unavailable_ratio=0.0,
+        carts=20,
+    )
+
+    counts, _ = generate(test_db.connection(), spec, seed=3)
+    test_db.commit()
+
+    items = test_db.exec(select(CartItem)).all()
+    assert len(items) == counts["cart_items"]
+
+    for item in items:
+        assert test_db.get(Product, item.product_id)
+        total_price: float = calculate_total_price(
+            test_db,
+            product_id=item.product_id,
+            selected_variant_ids=[
+                UUID(variant_id)
+                for variant_id in (item.selected_parts or "").split(",")
+            ],
+        )
+        assert total_price == item.total_price
+
+
+def test_reset_deletes_the_rows_referring_to_products(test_db: Session) -> None:
+    generate(test_db.connection(), CatalogSpec(products=2), seed=1)
+    test_db.commit()
+    product = test_db.exec(select(Product)).first()
+    assert product is not None
+    test_db.add_all(
+        [
+            WaitingRoomTicket(
+                token=uuid4(),
+                product_id=product.id,
+                joined_at=utc_now(),
+            ),
+            WaitingRoomBucket(product_id=product.id),
+            OutboxMessage(topic="stock_update", payload="{}"),
+        ]
+    )
+    record_change(test_db, product)
+    test_db.commit()
+
+    # Postgres refuses to delete products still referred to
+    test_db.connection().exec_driver_sql("PRAGMA foreign_keys = ON")
+    test_db.commit()
+    try:
+        delete_all_data(test_db)
+    finally:
+        test_db.connection().exec_driver_sql("PRAGMA foreign_keys = OFF")
+        test_db.commit()
+
+    for model in (
+        Product,
+        WaitingRoomTicket,
+        WaitingRoomBucket,
+        OutboxMessage,
+        CatalogChange,
+    ):
+        assert test_db.exec(select(model)).all() == []
@@ -0,0 +1,177 @@
+# tests/test_instrumentation.py
+
+import json
+import logging
+from typing import Callable, ContextManager, Generator
+
+import pytest
+from fastapi.testclient import TestClient
+from httpx import Response
+from sqlmodel import Session
+
+from app.api.models import PartVariant, Product, ProductPart
+from app.config import Settings
+from app.instrumentation import (
+    QueryStats,
+    SlowQueryLog,
+    parameter_shape,
+    set_slow_query_log,
+    statement_shape,
+)
+from app.main import create_app
+
+
+def test_statement_shape_collapses_placeholder_lists() -> None:
+    assert statement_shape(
+        "SELECT *\n  FROM parts WHERE id IN (?, ?, ?)"
+    ) == statement_shape("SELECT * FROM parts WHERE id IN (?)")
+    assert statement_shape("SELECT * FROM parts WHERE id IN (%(id_1)s, %(id_2)s)") == (
+        "SELECT * FROM parts WHERE id IN (?)"
+    )
+
+
+def test_query_stats_reports_repeated_shapes() -> None:
+    stats = QueryStats()
+    for _ in range(3):
+        stats.record("SELECT * FROM parts WHERE product_id = ?", 0.001)
+    stats.record("SELECT * FROM products", 0.001)
+
+    assert stats.count == 4
+    assert stats.repeated(2) == {
+        "SELECT * FROM parts WHERE product_id = ?": 3,
+    }
+
+
+def test_response_headers_report_queries(
+    test_db: Session,
+    test_client: TestClient,
+) -> None:
+    response: Response = test_client.get("/api/v1/custom-prices")
+
+    # The validator of the conditional GET, then the rows
+    assert response.headers["X-Query-Count"] == "2"
+    assert response.headers["Server-Timing"].startswith("db;dur=")
+
+
+@pytest.mark.parametrize("env", ["development", "production"])
+def test_queries_are_only_reported_in_development_by_default(env: str) -> None:
+    app = create_app(Settings(ENV=env, QUERY_INSTRUMENTATION=None))
+    with TestClient(app) as client:
+        response: Response = client.get("/api/v1/healthchecker")
+
+    assert ("X-Query-Count" in response.headers) == (env == "development")
+    assert ("Server-Timing" in response.headers) == (env == "development")
+
+
+def test_repeated_statements_are_logged(
+    test_db: Session,
+    test_client: TestClient,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    product = Product(
+        name="Test Product",
+        category="Bicycle",
+        base_price=100.0,
+        is_custom=True,
+        is_available=True,
+        stock_quantity=10,
+    )
+    part = ProductPart(product_id=product.id, name="Frame")
+    variants = [
+        PartVariant(
+            part_id=part.id,
+            name=f"Variant {i}",
+            price=10.0,
+            is_available=True,
+            stock_quantity=1,
+        )
+        for i in range(12)
+    ]
+    test_db.add_all([product, part, *variants])
+    test_db.commit()
+
+    # Each variant, and its custom prices, is read on its own
+    with caplog.at_level(logging.WARNING, logger="app.instrumentation"):
+        test_client.post(
+            f"/api/v1/calculate-price?product_id={product.id}",
+            json=[str(variant.id) for variant in variants],
+        )
+
+    assert "repeated_statements" in caplog.text
+
+
+def test_query_budget(
+    test_db: Session,
+    test_client: TestClient,
+    query_budget: Callable[[int], ContextManager[QueryStats]],
+) -> None:
+    with query_budget(0):
+        test_client.get("/api/v1/healthchecker")
+
+    with pytest.raises(AssertionError):
+        with query_budget(0):
+            test_client.get("/api/v1/product-parts")
+
+
+@pytest.fixture
+def slow_query_log() -> Generator[SlowQueryLog, None, None]:
+    # Every statement is slow, summaries are only flushed explicitly
+    log = SlowQueryLog(threshold=0.0, top_n=2, interval=3600)
+    set_slow_query_log(log)
+    yield log
+    set_slow_query_log(None)
+
+
+def test_parameter_shape_hides_values() -> None:
+    assert parameter_shape(("secret", 3, None)) == ["str", "int", "NoneType"]
+    assert parameter_shape({"name": "secret"}) == {"name": "str"}
+    assert parameter_shape([("a", 1), ("b", 2)], executemany=True) == {
+        "rows": 2,
+        "shape": ["str", "int"],
+    }
+
+
+def test_slow_queries_are_logged_with_route_and_origin(
+    test_db: Session,
+    test_client: TestClient,
+    slow_query_log: SlowQueryLog,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    with caplog.at_level(logging.WARNING, logger="app.slow_queries"):
+        test_client.get("/api/v1/custom-prices")
+
+    validator, record = [json.loads(r.getMessage()) for r in caplog.records]
+    assert validator["origin"] == "app.api.conditional:_validator"
+    assert record["event"] == "slow_query"
+    assert record["route"] == "/api/v1/custom-prices"
+    assert record["method"] == "GET"
+    assert record["origin"] == "app.api.services:get_all_custom_prices"
+    assert record["parameters"] == []
+
+
+def test_summary_ranks_shapes_by_total_time(
+    slow_query_log: SlowQueryLog,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    slow_query_log.threshold = 1.0
+    for n in range(2, 5):
+        placeholders = ", ".join("?" * n)
+        slow_query_log.record(
+            f"SELECT * FROM parts WHERE product_id IN ({placeholders})",
+            (1,) * n,
+            False,
+            0.002,
+        )
+    slow_query_log.record("SELECT * FROM products", (), False, 0.005)
+    slow_query_log.record("SELECT 1", (), False, 0.0001)
+
+    with caplog.at_level(logging.INFO, logger="app.slow_queries"):
+        slow_query_log.flush()
+
+    [record] = [json.loads(r.getMessage()) for r in caplog.records]
+    assert record["event"] == "query_summary"
+    assert [(s["count"], s["max_ms"]) for s in record["top"]] == [
+        (3, 2.0),
+        (1, 5.0),
+    ]
+    assert slow_query_log.summary() == []
@@ -0,0 +1,95 @@
+# tests/test_metrics.py
+
+import threading
+from typing import Any, Generator
+
+from fastapi.testclient import TestClient
+from httpx import Response
+from sqlmodel import Session
+
+from app.config import Settings
+from app.database import get_session
+from app.main import create_app
+from app.metrics import CallbackGauge, Counter, Histogram
+
+
+def test_counter_sums_values_recorded_by_every_thread() -> None:
+    counter = Counter("jobs_total", "Jobs.", labelnames=("queue",))
+
+    def work() -> None:
+        for _ in range(1000):
+            counter.inc("default")
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counter.inc("other", amount=2)
+
+    assert counter.expose().splitlines() == [
+        "# HELP jobs_total Jobs.",
+        "# TYPE jobs_total counter",
+        'jobs_total{queue="default"} 4000.0',
+        'jobs_total{queue="other"} 2.0',
+    ]
+
+
+def test_histogram_buckets_are_cumulative() -> None:
+    histogram = Histogram("latency_seconds", "Latency.", buckets=(0.1, 1))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    assert histogram.expose().splitlines()[2:] == [
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        "latency_seconds_count 3",
+        "latency_seconds_sum 5.55",
+    ]
+
+
+def test_callback_gauge_reads_values_when_exposed() -> None:
+    values = {("a",): 1.0}
+    gauge = CallbackGauge(
+        "items",
+        "Items.",
+        lambda: values,
+        labelnames=("kind",),
+    )
+    values[("a",)] = 3.0
+
+    assert gauge.expose().splitlines()[-1] == 'items{kind="a"} 3.0'
+
+
+def test_metrics_endpoint(test_db: Session) -> None:
+    app = create_app(Settings(METRICS_ENABLED=True, METRICS_TOKEN="s3cret"))
+
+    def override_get_session() -> Generator[Session, Any, None]:
+        yield test_db
+
+    app.dependency_overrides[get_session] = override_get_session
+
+    with TestClient(app) as client:
+        client.get("/api/v1/products")
+
+        assert client.get("/metrics").status_code == 401
+        response: Response = client.get(
+            "/metrics",
+            headers={"Authorization": "Bearer s3cret"},
+        )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert (
+        'http_request_duration_seconds_count{method="GET",'
+        'route="/api/v1/products",status="200"}'
+    ) in response.text
+    assert 'cache_hit_ratio{cache="catalog"}' in response.text
+    assert 'cache_evictions_total{cache="entity"}' in response.text
+    assert 'threadpool_threads{state="limit"}' in response.text
+
+
+def test_metrics_are_off_by_default(test_client: TestClient) -> None:
+    assert test_client.get("/metrics").status_code == 404
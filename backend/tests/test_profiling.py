@@ -0,0 +1,212 @@
+# tests/test_profiling.py
+
+import pstats
+import threading
+import time
+from pathlib import Path
+from typing import Any, Generator, Set
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from app.config import Settings
+from app.database import get_session
+from app.main import create_app
+from app.profiling import (
+    PROFILE_HEADER,
+    StackSampler,
+    _active_threads,
+    sign_profile_request,
+    verify_signature,
+)
+
+SECRET = "s3cret"
+
+
+@pytest.fixture
+def profiling_client(
+    test_db: Session,
+    tmp_path: Path,
+) -> Generator[TestClient, Any, None]:
+    app = create_app(
+        Settings(
+            PROFILING_ENABLED=True,
+            PROFILING_SECRET=SECRET,
+            PROFILE_DIR=str(tmp_path),
+            PROFILE_KEEP=2,
+        )
+    )
+
+    def override_get_session() -> Generator[Session, Any, None]:
+        yield test_db
+
+    app.dependency_overrides[get_session] = override_get_session
+
+    with TestClient(app) as client:
+        yield client
+
+
+PRODUCTS = "/api/v1/products"
+PROFILES = "/debug/profiles"
+
+
+def signed(path: str) -> dict:
+    return {PROFILE_HEADER: sign_profile_request(SECRET, path)}
+
+
+def functions(path: Path) -> Set[str]:
+    stats = pstats.Stats(str(path))
+
+    return {name for (_, _, name) in stats.stats}  # type: ignore
+
+
+def test_verify_signature() -> None:
+    valid = sign_profile_request(SECRET, PRODUCTS)
+    assert verify_signature(valid, SECRET, PRODUCTS)
+    # Not replayable on another route
+    assert not verify_signature(valid, SECRET, PROFILES)
+    assert not verify_signature(valid, "", PRODUCTS)
+    other = sign_profile_request("other", PRODUCTS)
+    assert not verify_signature(other, SECRET, PRODUCTS)
+    assert not verify_signature("not-a-signature", SECRET, PRODUCTS)
+    assert not verify_signature(None, SECRET, PRODUCTS)
+
+    now = int(time.time())
+    expired = sign_profile_request(SECRET, PRODUCTS, now - 1)
+    assert not verify_signature(expired, SECRET, PRODUCTS)
+    # Nor valid for longer than the maximum age
+    lasting = sign_profile_request(SECRET, PRODUCTS, now + 3600)
+    assert not verify_signature(lasting, SECRET, PRODUCTS)
+
+
+def test_unsigned_request_is_not_profiled(
+    profiling_client: TestClient,
+) -> None:
+    response = profiling_client.get(
+        PRODUCTS,
+        headers={PROFILE_HEADER: sign_profile_request("wrong", PRODUCTS)},
+    )
+
+    assert response.status_code == 200
+    assert "X-Profile-Id" not in response.headers
+
+
+def test_signed_request_is_profiled_and_listed(
+    profiling_client: TestClient,
+) -> None:
+    response = profiling_client.get(PRODUCTS, headers=signed(PRODUCTS))
+
+    assert response.status_code == 200
+    profile_id = response.headers["X-Profile-Id"]
+
+    profiles = profiling_client.get(PROFILES, headers=signed(PROFILES))
+    assert profiles.status_code == 200
+    assert profiles.json()[0]["id"] == profile_id
+    assert profiles.json()[0]["route"] == "GET /api/v1/products"
+
+    download = f"{PROFILES}/{profile_id}"
+    response = profiling_client.get(download, headers=signed(download))
+    assert response.status_code == 200
+
+
+def test_sync_route_is_profiled_in_its_worker_thread(
+    profiling_client: TestClient,
+    tmp_path: Path,
+) -> None:
+    # A single profiler per request: Python 3.12 rejects a second one
+    response = profiling_client.get(PRODUCTS, headers=signed(PRODUCTS))
+    assert response.status_code == 200
+    profile_id = response.headers["X-Profile-Id"]
+
+    assert "get_catalog" in functions(tmp_path / f"{profile_id}.prof")
+
+
+def test_async_route_is_profiled_on_the_event_loop(
+    profiling_client: TestClient,
+    tmp_path: Path,
+) -> None:
+    response = profiling_client.get(
+        "/api/v1/changes",
+        headers=signed("/api/v1/changes"),
+    )
+    assert response.status_code == 200
+    profile_id = response.headers["X-Profile-Id"]
+
+    assert "wait_for_changes" in functions(tmp_path / f"{profile_id}.prof")
+
+
+def test_rejected_request_is_not_profiled(
+    profiling_client: TestClient,
+) -> None:
+    path = f"{PRODUCTS}/not-a-uuid"
+    response = profiling_client.get(path, headers=signed(path))
+
+    assert response.status_code == 422
+    assert "X-Profile-Id" not in response.headers
+
+
+def test_oldest_profiles_are_deleted(profiling_client: TestClient) -> None:
+    for _ in range(4):
+        profiling_client.get(PRODUCTS, headers=signed(PRODUCTS))
+
+    profiles = profiling_client.get(PROFILES, headers=signed(PROFILES))
+
+    assert len(profiles.json()) == 2
+
+
+def test_listing_requires_a_signature(profiling_client: TestClient) -> None:
+    assert profiling_client.get(PROFILES).status_code == 403
+    # Signed for another path
+    response = profiling_client.get(PROFILES, headers=signed(PRODUCTS))
+    assert response.status_code == 403
+    path = f"{PROFILES}/../../etc/passwd"
+    assert profiling_client.get(path, headers=signed(path)).status_code == 404
+
+
+def test_listing_is_hidden_when_profiling_is_disabled(
+    test_client: TestClient,
+) -> None:
+    response = test_client.get(PROFILES, headers=signed(PROFILES))
+
+    assert response.status_code == 404
+
+
+def test_stack_sampler_counts_stacks_of_active_threads() -> None:
+    sampler = StackSampler(interval=0.001, max_stacks=10)
+    started = threading.Event()
+    done = threading.Event()
+
+    def busy_endpoint() -> None:
+        _active_threads[threading.get_ident()] = "GET /busy"
+        started.set()
+        done.wait()
+        _active_threads.pop(threading.get_ident(), None)
+
+    thread = threading.Thread(target=busy_endpoint)
+    thread.start()
+    started.wait()
+    for _ in range(5):
+        sampler.sample()
+    done.set()
+    thread.join()
+
+    assert sampler.samples == 5
+    [line] = sampler.folded().splitlines()
+    assert line.startswith("GET /busy;")
+    assert "busy_endpoint" in line
+    assert line.endswith(" 5")
+
+
+def test_stack_sampler_bounds_the_number_of_stacks() -> None:
+    sampler = StackSampler(interval=0.001, max_stacks=1)
+    sampler.stacks["GET /a;main 1"] = 1
+    ident = threading.get_ident()
+    _active_threads[ident] = "GET /b"
+    try:
+        sampler.sample()
+    finally:
+        _active_threads.pop(ident, None)
+
+    assert len(sampler.stacks) == 1
+    assert sampler.dropped == 1
@@ -0,0 +1,180 @@
+# tests/test_tracing.py
+
+import json
+import threading
+from pathlib import Path
+from typing import Any, Dict, Generator, List
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from app.api.models import Product
+from app.config import Settings
+from app.database import get_session
+from app.main import create_app
+from app.tracing import (
+    JsonLinesExporter,
+    Span,
+    Trace,
+    _current_trace,
+    format_trace,
+    span,
+    traced,
+)
+
+
+def tracing_client(
+    test_db: Session,
+    path: Path,
+    **settings: Any,
+) -> TestClient:
+    app = create_app(Settings(TRACING_EXPORT=str(path), **settings))
+
+    def override_get_session() -> Generator[Session, Any, None]:
+        yield test_db
+
+    app.dependency_overrides[get_session] = override_get_session
+
+    return TestClient(app)
+
+
+def read_spans(path: Path) -> List[Dict[str, Any]]:
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+@pytest.fixture
+def product(test_db: Session) -> Product:
+    product = Product(
+        name="Test Product",
+        category="Bicycle",
+        base_price=100.0,
+        is_custom=True,
+        is_available=True,
+        stock_quantity=10,
+    )
+    test_db.add(product)
+    test_db.commit()
+    test_db.refresh(product)
+
+    return product
+
+
+def test_sampled_request_exports_a_span_per_layer(
+    test_db: Session,
+    product: Product,
+    tmp_path: Path,
+) -> None:
+    path = tmp_path / "traces.jsonl"
+    test_db.expunge_all()
+    # Leaving the client writes the traces still queued
+    with tracing_client(test_db, path, TRACING_SAMPLE_RATIO=1.0) as client:
+        response = client.get(f"/api/v1/products/{product.id}")
+
+    spans = read_spans(path)
+    by_kind = {s["kind"]: s for s in spans}
+    assert set(by_kind) == {
+        "server",
+        "route",
+        "endpoint",
+        "service",
+        "sql",
+        "serialize",
+    }
+    assert {s["trace_id"] for s in spans} == {response.headers["X-Trace-Id"]}
+    assert by_kind["server"]["name"] == "GET /api/v1/products/{product_id}"
+    assert by_kind["server"]["attributes"]["http.status"] == 200
+    assert by_kind["service"]["name"] == "services.get_product_by_id"
+    assert by_kind["service"]["span_id"] in {
+        s["parent_id"] for s in spans if s["kind"] == "sql"
+    }
+    assert by_kind["service"]["parent_id"] == by_kind["endpoint"]["span_id"]
+    assert by_kind["serialize"]["parent_id"] == by_kind["route"]["span_id"]
+    assert by_kind["route"]["parent_id"] == by_kind["server"]["span_id"]
+
+    # The parts are loaded with the product, none while rendering it
+    assert by_kind["endpoint"]["span_id"] not in {
+        s["parent_id"] for s in spans if s["kind"] == "sql"
+    }
+    assert "[sql]" in format_trace(spans)
+
+
+def test_unsampled_request_is_not_exported(
+    test_db: Session,
+    tmp_path: Path,
+) -> None:
+    path = tmp_path / "traces.jsonl"
+    with tracing_client(test_db, path, TRACING_SAMPLE_RATIO=0.0) as client:
+        response = client.get("/api/v1/products")
+
+    assert "X-Trace-Id" not in response.headers
+    assert path.read_text() == ""
+
+
+def test_slow_requests_are_exported_even_if_not_sampled(
+    test_db: Session,
+    tmp_path: Path,
+) -> None:
+    path = tmp_path / "traces.jsonl"
+    with tracing_client(
+        test_db,
+        path,
+        TRACING_SAMPLE_RATIO=0.0,
+        TRACING_SLOW_MS=0.001,
+    ) as client:
+        response = client.get("/api/v1/products")
+
+    assert "X-Trace-Id" not in response.headers
+    assert any(s["kind"] == "server" for s in read_spans(path))
+
+
+def test_exporter_writes_off_the_calling_thread(tmp_path: Path) -> None:
+    written = threading.Event()
+    release = threading.Event()
+    writers: List[str] = []
+
+    class SlowExporter(JsonLinesExporter):
+        def _write(self, spans: List[Span]) -> None:
+            writers.append(threading.current_thread().name)
+            written.set()
+            release.wait(5)
+            super()._write(spans)
+
+    exporter = SlowExporter(str(tmp_path / "traces.jsonl"), max_pending=1)
+    trace = Trace()
+    spans = [Span(trace.trace_id, None, "request", "server")]
+
+    exporter.export(spans)
+    assert written.wait(5)
+    # The writer is busy: one trace waits, the next is dropped
+    exporter.export(spans)
+    exporter.export(spans)
+    assert exporter.dropped == 1
+
+    release.set()
+    exporter.close()
+    assert writers == ["trace-exporter", "trace-exporter"]
+    assert len(read_spans(tmp_path / "traces.jsonl")) == 2
+
+
+def test_spans_are_bounded_per_trace() -> None:
+    @traced
+    def service() -> None:
+        pass
+
+    trace = Trace(max_spans=2)
+    token = _current_trace.set(trace)
+    try:
+        with span("outer"):
+            for _ in range(3):
+                service()
+    finally:
+        _current_trace.reset(token)
+
+    assert len(trace.spans) == 2
+    assert trace.dropped == 2
+
+
+def test_spans_are_not_recorded_outside_of_a_trace() -> None:
+    with span("outer") as current:
+        assert current is None